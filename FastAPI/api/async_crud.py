@@ -0,0 +1,132 @@
+# async_crud.py
+# Async variants of the crud functions, taking an AsyncSession instead of a Session.
+# Each one runs its crud counterpart through AsyncSession.run_sync: the queries are written
+# once, in crud, and every database round trip they make is awaited instead of blocking the
+# event loop. Functions without database access (check_boolean_algebra_operation,
+# compute_boolean_algebra, ...) are used from crud directly.
+#
+# Objects returned here are serialized after the call, when lazy loading is no longer
+# possible, so relationships that responses read (GeneSet.unigene, AnalysisRun.result) are
+# loaded up front. Writes made through AsyncSessionLocal sessions are committed by the write
+# queue (see writer.py), whose wait is awaited like any other database call.
+
+from datetime import datetime
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import crud, models, schemas
+from .identifier_map import DEFAULT_NAMESPACE
+
+
+# Loads the genes behind GeneSet.unigene while the session can still query
+def _with_genes(db_geneset: Optional[models.GeneSet]) -> Optional[models.GeneSet]:
+    if db_geneset is not None:
+        db_geneset.genes
+    return db_geneset
+
+# Loads AnalysisRun.result, which AnalysisRunSchema reads
+def _with_result(run: Optional[models.AnalysisRun]) -> Optional[models.AnalysisRun]:
+    if run is not None:
+        run.result
+    return run
+
+
+async def get_geneset(db: AsyncSession, geneset_id: int):
+    return await db.run_sync(lambda session: _with_genes(crud.get_geneset(session, geneset_id)))
+
+async def get_genesets(db: AsyncSession, gene_weaver_ids: List[int]) -> List[models.GeneSet]:
+    return await db.run_sync(crud.get_genesets, gene_weaver_ids)
+
+async def intern_genes(db: AsyncSession, identifiers) -> Dict[str, int]:
+    return await db.run_sync(crud.intern_genes, list(identifiers))
+
+async def add_geneset_genes(db: AsyncSession, members: Dict[int, List[str]]):
+    await db.run_sync(crud.add_geneset_genes, members)
+
+async def create_geneset(db: AsyncSession, geneset: schemas.GeneSetCreate):
+    return await db.run_sync(lambda session: _with_genes(crud.create_geneset(session, geneset)))
+
+async def bulk_create_genesets(db: AsyncSession, genesets: List[schemas.GeneSetCreate], commit: bool = True) -> Tuple[int, List[Tuple[int, str]]]:
+    return await db.run_sync(crud.bulk_create_genesets, genesets, commit)
+
+async def update_geneset(db: AsyncSession, geneset_id: int, geneset: schemas.GeneSetUpdate):
+    return await db.run_sync(lambda session: _with_genes(crud.update_geneset(session, geneset_id, geneset)))
+
+# The deleted geneset is returned with its genes, which crud loads before the delete
+async def delete_geneset(db: AsyncSession, geneset_id: int):
+    return await db.run_sync(crud.delete_geneset, geneset_id)
+
+async def create_analysis_run(db: AsyncSession):
+    return await db.run_sync(lambda session: _with_result(crud.create_analysis_run(session)))
+
+async def get_geneset_unigenes(db: AsyncSession, gene_weaver_id: int) -> FrozenSet[str]:
+    return await db.run_sync(crud.get_geneset_unigenes, gene_weaver_id)
+
+async def get_genesets_unigenes(db: AsyncSession, gene_weaver_ids: List[int]) -> Dict[int, FrozenSet[str]]:
+    return await db.run_sync(crud.get_genesets_unigenes, gene_weaver_ids)
+
+async def query_boolean_algebra(db: AsyncSession, operation: str, gene_weaver_ids: List[int], threshold: Optional[int] = None) -> Dict[str, Any]:
+    return await db.run_sync(crud.query_boolean_algebra, operation, gene_weaver_ids, threshold)
+
+async def get_boolean_algebra_cache_key(db: AsyncSession, operation: str, gene_weaver_ids: List[int], threshold: Optional[int] = None, namespace: str = DEFAULT_NAMESPACE) -> Optional[str]:
+    return await db.run_sync(crud.get_boolean_algebra_cache_key, operation, gene_weaver_ids, threshold, namespace)
+
+async def get_cached_boolean_algebra_result(db: AsyncSession, cache_key: str) -> Optional[bytes]:
+    return await db.run_sync(crud.get_cached_boolean_algebra_result, cache_key)
+
+async def get_gene_genesets(db: AsyncSession, identifier: str, offset: int = 0, limit: int = 100) -> Tuple[int, List[int]]:
+    return await db.run_sync(crud.get_gene_genesets, identifier, offset, limit)
+
+async def load_identifier_map(db: AsyncSession):
+    await db.run_sync(crud.load_identifier_map)
+
+async def load_similarity_index(db: AsyncSession):
+    await db.run_sync(crud.load_similarity_index)
+
+async def load_similar_genesets_indexes(db: AsyncSession):
+    await db.run_sync(crud.load_similar_genesets_indexes)
+
+async def get_genesets_with_gene(db: AsyncSession, identifier: str) -> List[int]:
+    return await db.run_sync(crud.get_genesets_with_gene, identifier)
+
+async def check_run_not_canceled(db: AsyncSession, run_id: int):
+    await db.run_sync(crud.check_run_not_canceled, run_id)
+
+# Runs the whole analysis, computation included, on the event loop; the API hands analyses
+# to the job executor instead, and this variant is meant for short ones
+async def perform_boolean_algebra_analysis(task_id: int, db: AsyncSession, gene_weaver_ids: List[int], operation: str, threshold: Optional[int] = None, namespace: str = DEFAULT_NAMESPACE):
+    await db.run_sync(
+        lambda session: crud.perform_boolean_algebra_analysis(task_id, session, gene_weaver_ids, operation, threshold, namespace)
+    )
+
+async def update_run_status_and_time(db: AsyncSession, run_id: int, status: str, start_time: bool = False, end_time: bool = False):
+    await db.run_sync(crud.update_run_status_and_time, run_id, status, start_time, end_time)
+
+async def get_all_runs(db: AsyncSession):
+    return await db.run_sync(lambda session: [_with_result(run) for run in crud.get_all_runs(session)])
+
+async def get_runs_page(db: AsyncSession, statuses: Optional[List[models.RunStatus]] = None, started_after: Optional[datetime] = None, started_before: Optional[datetime] = None, order: str = "desc", cursor: Optional[int] = None, limit: int = 100) -> Tuple[List[Any], Optional[int]]:
+    return await db.run_sync(crud.get_runs_page, statuses, started_after, started_before, order, cursor, limit)
+
+async def cancel_run(db: AsyncSession, run_id: int):
+    return await db.run_sync(lambda session: _with_result(crud.cancel_run(session, run_id)))
+
+async def save_analysis_result(db: AsyncSession, run_id: int, result_data: List[str], membership_counts: Optional[Dict[str, int]] = None, cache_key: Optional[str] = None):
+    await db.run_sync(crud.save_analysis_result, run_id, result_data, membership_counts, cache_key)
+
+async def get_run_result(db: AsyncSession, run_id: int):
+    return await db.run_sync(crud.get_run_result, run_id)
+
+async def get_run_result_id(db: AsyncSession, run_id: int) -> Optional[int]:
+    return await db.run_sync(crud.get_run_result_id, run_id)
+
+async def get_result_gene_count(db: AsyncSession, result_id: int) -> Optional[int]:
+    return await db.run_sync(crud.get_result_gene_count, result_id)
+
+async def get_result_genes_page(db: AsyncSession, result_id: int, cursor: Optional[str] = None, limit: int = crud.RESULT_CHUNK_SIZE) -> Tuple[List[str], Optional[List[int]], Optional[str]]:
+    return await db.run_sync(crud.get_result_genes_page, result_id, cursor, limit)
+
+async def get_result_chunks(db: AsyncSession, result_id: int, after_chunk: int = -1, count: int = 10) -> List[Tuple[int, List[str], Optional[List[int]]]]:
+    return await db.run_sync(crud.get_result_chunks, result_id, after_chunk, count)
+
+async def get_runstatus(db: AsyncSession, run_id: int) -> str:
+    return await db.run_sync(crud.get_runstatus, run_id)
@@ -0,0 +1,35 @@
+# async_database.py
+# Async counterpart of database.py, used by the API endpoints.
+# Sessions are SQLAlchemy AsyncSessions on the backend's async driver (aiosqlite, which runs
+# each SQLite connection on its own thread, or asyncpg), so a request waiting on the database
+# leaves the event loop free to serve other requests. Background analysis jobs keep using
+# the sync SessionLocal. Reads use the pool of async_engine; writes are committed by
+# database.write_queue when the backend has one.
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from .database import DATABASE_URL, backend, pool_options, write_queue
+
+# The same database as DATABASE_URL, through the backend's async driver
+ASYNC_DATABASE_URL = backend.async_url(DATABASE_URL)
+
+# aiosqlite engines otherwise open a new connection, and its thread, for every session
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, connect_args=backend.connect_args(),
+    **pool_options(ASYNC_DATABASE_URL, poolclass=AsyncAdaptedQueuePool),
+)
+backend.configure(async_engine.sync_engine)
+
+# Objects stay loaded after commit, since responses are serialized after the session is
+# done and an expired attribute cannot be lazy loaded outside of an await. Writes go through
+# the same write queue as SessionLocal's, awaited from the event loop.
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False,
+    info={"write_queue": write_queue},
+)
+
+
+# Dependency to use in FastAPI endpoints to get an async database session
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,280 @@
+# cache.py
+# In-process LRU cache of decoded genesets, so that popular genesets are not re-read from the
+# database for every boolean algebra request.
+#
+# The cache is bounded by the approximate size of its values in bytes rather than by their
+# number, since genesets range from a handful of genes to tens of thousands. Values must be
+# immutable (frozensets of unigenes here; GeneBitmaps would work as well) because they are
+# shared by every request that reads them. crud invalidates entries whenever a geneset is
+# created, updated or deleted. Each worker process holds its own cache.
+#
+# result_cache holds the JSON bodies of recent /boolean-algebra/ responses. Its keys name the
+# content of every input geneset (crud.boolean_algebra_cache_key), so entries never need to be
+# invalidated: a changed geneset simply produces a different key, and old entries age out
+# through the TTL or the size bound.
+#
+# gene_identifier_cache maps interned gene ids back to their identifiers when stored analysis
+# results are decoded. Genes are never renamed or deleted, so its entries never go stale.
+
+import asyncio
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+from sqlalchemy.exc import MissingGreenlet
+from sqlalchemy.util import await_only
+from . import config
+
+# Marks a key that its loader did not return
+_MISSING = object()
+
+
+# A load in progress, of all the keys one caller missed. Callers wanting any of these keys
+# wait for it instead of loading the key again.
+class _Load:
+    __slots__ = ("event", "futures", "values", "error", "stale")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.futures: List[asyncio.Future] = []  # Waiters on an event loop
+        self.values: Dict[Hashable, Any] = {}
+        self.error = None
+        self.stale: Set[Hashable] = set()  # Invalidated while loading: returned but not cached
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+def frozenset_size(value: frozenset) -> int:
+    """Approximate bytes held by a frozenset of strings, members included."""
+    return sys.getsizeof(value) + sum(map(sys.getsizeof, value))
+
+
+class ByteLRUCache:
+    """Thread-safe LRU cache bounded by the total size of its values in bytes.
+
+    Concurrent misses for the same key are collapsed into a single load. Callers running
+    on an event loop (inside AsyncSession.run_sync) wait for another caller's load without
+    blocking the loop. With a ttl (in seconds), entries also expire that long after being
+    stored; a ttl of 0 stores nothing.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        sizeof: Callable[[Any], int] = sys.getsizeof,
+        ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        # key -> (value, size in bytes, expiry time or None)
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, Optional[float]]]" = OrderedDict()
+        self._loading: Dict[Hashable, _Load] = {}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def get_many(self, keys: Iterable[Hashable], load: Callable[[List[Hashable]], Dict[Hashable, Any]]) -> Dict[Hashable, Any]:
+        """Get the values of keys, loading the ones not cached with a single call to load.
+
+        load receives the list of keys to load and returns a dict of the values it found.
+        Keys it does not return are left out of the result and are not cached.
+        """
+        found = {}
+        owned = []
+        own_load = None
+        waiting: Dict[_Load, List[Hashable]] = {}
+        with self._lock:
+            now = self.clock()
+            entries = self._entries
+            for key in dict.fromkeys(keys):
+                # _live_entry, inlined: this loop runs for every key of large batches
+                entry = entries.get(key)
+                if entry is not None and entry[2] is not None and entry[2] <= now:
+                    self._expire(key, entry)
+                    entry = None
+                if entry is not None:
+                    entries.move_to_end(key)
+                    found[key] = entry[0]
+                elif key in self._loading:
+                    waiting.setdefault(self._loading[key], []).append(key)
+                    self._coalesced += 1
+                else:
+                    if own_load is None:
+                        own_load = _Load()
+                    self._loading[key] = own_load
+                    owned.append(key)
+            self._hits += len(found)
+            self._misses += len(owned)
+
+        # Finish our own load before waiting on others, so that two callers each waiting
+        # for a key the other is loading cannot deadlock
+        if owned:
+            found.update(self._load(own_load, owned, load))
+
+        unresolved = []
+        for pending, pending_keys in waiting.items():
+            if not self._wait(pending):
+                unresolved.extend(pending_keys)
+                continue
+            if pending.error is not None:
+                raise pending.error
+            for key in pending_keys:
+                value = pending.values.get(key, _MISSING)
+                if value is not _MISSING:
+                    found[key] = value
+        if unresolved:
+            # Waiting was not possible without blocking the event loop; load these directly
+            found.update((key, value) for key, value in load(unresolved).items())
+        return found
+
+    def get(self, key: Hashable, load: Callable[[Hashable], Any]) -> Any:
+        """Get the value of key, calling load(key) on a miss."""
+        return self.get_many([key], lambda keys: {keys[0]: load(keys[0])})[key]
+
+    def lookup(self, key: Hashable, default: Any = None) -> Any:
+        """Get the value of key if it is cached, without loading it."""
+        with self._lock:
+            entry = self._live_entry(key, self.clock())
+            if entry is None:
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        """Store a value computed outside of get_many."""
+        size = self.sizeof(value)
+        with self._lock:
+            self._store(key, value, size)
+
+    def _live_entry(self, key: Hashable, now: float):
+        # Called with self._lock held. Drops the entry of key if it has expired.
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] is not None and entry[2] <= now:
+            self._expire(key, entry)
+            return None
+        return entry
+
+    def _expire(self, key: Hashable, entry: Tuple[Any, int, Optional[float]]):
+        # Called with self._lock held
+        del self._entries[key]
+        self._bytes -= entry[1]
+        self._expirations += 1
+
+    def _load(self, pending: _Load, owned: List[Hashable], load) -> Dict[Hashable, Any]:
+        try:
+            loaded = load(owned)
+        except BaseException as e:
+            self._finish(pending, owned, {}, e)
+            raise
+        values = {key: loaded[key] for key in owned if key in loaded}
+        self._finish(pending, owned, values, None, {key: self.sizeof(value) for key, value in values.items()})
+        return values
+
+    def _finish(self, pending: _Load, owned: List[Hashable], values: Dict[Hashable, Any], error, sizes=None):
+        with self._lock:
+            for key in owned:
+                if self._loading.get(key) is pending:
+                    del self._loading[key]
+            pending.values = values
+            pending.error = error
+            for key, value in values.items():
+                if key not in pending.stale:
+                    self._store(key, value, sizes[key])
+            pending.event.set()
+            futures = pending.futures
+        for future in futures:
+            future.get_loop().call_soon_threadsafe(_resolve, future)
+
+    def _wait(self, pending: _Load) -> bool:
+        # Returns False if the load cannot be waited for without blocking the event loop
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pending.event.wait()
+            return True
+        # On the event loop thread, blocking would also stop the load being waited for
+        with self._lock:
+            if pending.event.is_set():
+                return True
+            future = loop.create_future()
+            pending.futures.append(future)
+        try:
+            await_only(future)
+        except MissingGreenlet:
+            return False
+        return True
+
+    def _store(self, key: Hashable, value: Any, size: int):
+        # Called with self._lock held
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous[1]
+        if size > self.max_bytes or self.ttl == 0:
+            return
+        expires = None if self.ttl is None else self.clock() + self.ttl
+        self._entries[key] = (value, size, expires)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._evictions += 1
+
+    def invalidate(self, keys: Iterable[Hashable]):
+        """Drop keys from the cache. Loads of these keys already running are not cached."""
+        with self._lock:
+            for key in keys:
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._bytes -= entry[1]
+                    self._invalidations += 1
+                pending = self._loading.get(key)
+                if pending is not None:
+                    pending.stale.add(key)
+
+    def clear(self):
+        """Drop every entry, e.g. after changes made outside of crud."""
+        with self._lock:
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            for key, pending in self._loading.items():
+                pending.stale.add(key)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for sizing the cache: hits, misses, coalesced misses, evictions, ..."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+            }
+
+
+# Unigenes of each geneset as a frozenset, keyed by GeneWeaver ID
+geneset_cache = ByteLRUCache(config.GENESET_CACHE_BYTES, sizeof=frozenset_size)
+
+# JSON bodies (bytes) of boolean algebra results, keyed by crud.boolean_algebra_cache_key
+result_cache = ByteLRUCache(config.RESULT_CACHE_BYTES, sizeof=len, ttl=config.RESULT_CACHE_TTL)
+
+# Identifier of each interned gene (genes.identifier), keyed by genes.id
+gene_identifier_cache = ByteLRUCache(config.GENE_IDENTIFIER_CACHE_BYTES)
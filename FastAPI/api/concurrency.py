@@ -0,0 +1,29 @@
+# concurrency.py
+# Keeps the CPU-bound parts of crud functions off the event loop. async_crud runs crud
+# functions inside AsyncSession.run_sync, on the event loop's thread: their database round
+# trips are awaited, but anything else they compute blocks every other request meanwhile.
+# crud hands such work (building the in-memory indexes, decoding members, computing MinHash
+# signatures) to run_off_loop, which awaits it on a worker thread when called that way, and
+# simply calls it otherwise.
+
+import asyncio
+from typing import Any, Callable
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import MissingGreenlet
+from sqlalchemy.util import await_only
+
+
+def run_off_loop(fn: Callable[..., Any], *args: Any) -> Any:
+    """Call fn(*args), on a worker thread if called inside AsyncSession.run_sync.
+
+    fn must not use the session, which belongs to the event loop's thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return fn(*args)
+    try:
+        return await_only(run_in_threadpool(fn, *args))
+    except MissingGreenlet:
+        # On the event loop but not in a greenlet: there is nothing to await with
+        return fn(*args)
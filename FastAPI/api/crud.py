@@ -4,100 +4,337 @@
 # It serves as a separation layer between the database models and the API endpoints, 
 # encapsulating the logic for database operations.
 
-from typing import List,Set,Dict
-from datetime import datetime
-from sqlalchemy.orm import Session
+from typing import Any,Callable,FrozenSet,Iterable,List,Optional,Set,Dict,Tuple
+from bisect import bisect_right
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+import hashlib
+import time
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from . import models, schemas
 from .schemas import GeneSetCreate
 from uuid import uuid4
-from .models import AnalysisRun,AnalysisResult,RunStatus
-from .database import SessionLocal
+from .models import AnalysisRun,AnalysisResult,ResultBlob,ResultBlobChunk,RunStatus
 from fastapi import HTTPException,HTTPException
-from .models import BooleanAlgebraType
 from .models import GeneSet as SQLAGeneSet
-from sqlalchemy import func # Import JSON from sqlalchemy
+from sqlalchemy import case, func, insert, select, tuple_ # Import JSON from sqlalchemy
+from .models import Gene, geneset_genes
+from .gene_index import gene_index, geneset_identifiers, split_identifiers, INDEXED_COLUMNS
+from .identifier_map import DEFAULT_NAMESPACE, check_namespace, geneset_namespaces, identifier_map
+from .similarity import METRICS as SIMILARITY_METRICS, MissingGenesets, SimilarityBlock, similarity_index, similarity_scores
+from . import minhash
+from .overlap_search import METRICS as OVERLAP_METRICS, TopOverlaps, top_k_overlaps
+from .enrichment import enrichment
+from .minhash import lsh_index
+from .backends import use_sql_set_operations
+from .cache import gene_identifier_cache, geneset_cache, result_cache
+from .concurrency import run_off_loop
+from .result_codec import decode_chunk, encode_chunk
+from . import config
 import json
+import numpy as np
 
 import sys 
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent / "FastAPI"))
-from geneweaver_boolean_algebra.src.tool import BooleanAlgebra
-from geneweaver_boolean_algebra.src.schema import BooleanAlgebraInput
+from geneweaver_boolean_algebra.src.intersection import intersection
+from geneweaver_boolean_algebra.src.membership import membership_counts
+from geneweaver_boolean_algebra.src.symmetric_difference import symmetric_difference
+from geneweaver_boolean_algebra.src.union import union
+
+# Operations accepted by /boolean-algebra/ and /run-boolean-algebra/
+BOOLEAN_ALGEBRA_OPERATIONS = ("intersection", "union", "difference", "threshold")
+
+# Genesets a background run combines between two cancellation checkpoints
+CANCEL_CHECK_GENESETS = 64
+
+# Least time between two reads of a run's status inside its computation, in seconds
+CANCEL_CHECK_INTERVAL = 0.5
 
 # retrieves a single geneset by its geneset_id from the database
 def get_geneset(db: Session, geneset_id: int):
     return db.query(models.GeneSet).filter(models.GeneSet.geneweaver_id == geneset_id).first() 
 
+# Maximum number of bound parameters used in one IN (...) clause, kept below SQLite's limit
+IN_CLAUSE_CHUNK_SIZE = 500
+
+# Splits a collection into lists small enough to be used in an IN (...) clause
+def _chunks(items, size: int = IN_CLAUSE_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+# Runs write(session) and commits it, returning what write returns. Sessions created with a
+# write queue in their info (database.SessionLocal, async_database.AsyncSessionLocal) hand
+# the write to that queue's writer thread; other sessions run and commit it themselves,
+# rolling back if it fails. write must not commit, and must load whatever the caller reads
+# from the objects it returns, which the writer's session no longer holds.
+def _write(db: Session, write: Callable[[Session], Any]) -> Any:
+    write_queue = db.info.get("write_queue")
+    if write_queue is not None:
+        return write_queue.run(write)
+    try:
+        result = write(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return result
+
+# Interns gene identifiers in the genes table, inserting any that are new.
+# Returns a mapping from each identifier to its integer gene id. Does not commit.
+def intern_genes(db: Session, identifiers) -> Dict[str, int]:
+    unique = set(identifiers)
+    gene_ids = {}
+    for chunk in _chunks(unique):
+        gene_ids.update(db.query(Gene.identifier, Gene.id).filter(Gene.identifier.in_(chunk)))
+
+    missing = [identifier for identifier in unique if identifier not in gene_ids]
+    if missing:
+        db.execute(insert(Gene), [{"identifier": identifier} for identifier in missing])
+        for chunk in _chunks(missing):
+            gene_ids.update(db.query(Gene.identifier, Gene.id).filter(Gene.identifier.in_(chunk)))
+    return gene_ids
+
+# Number of membership rows sent in a single executemany call
+MEMBERSHIP_INSERT_CHUNK_SIZE = 5000
+
+# Adds membership rows linking each geneset (by primary key) to its genes. Does not commit.
+def add_geneset_genes(db: Session, members: Dict[int, List[str]]):
+    gene_ids = intern_genes(db, (gene for genes in members.values() for gene in genes))
+    rows = []
+    for geneset_id, genes in members.items():
+        for gene_id in {gene_ids[gene] for gene in genes}:
+            rows.append({"geneset_id": geneset_id, "gene_id": gene_id})
+            if len(rows) >= MEMBERSHIP_INSERT_CHUNK_SIZE:
+                db.execute(insert(geneset_genes), rows)
+                rows = []
+    if rows:
+        db.execute(insert(geneset_genes), rows)
+
+# The unigene members of a geneset as stored: each identifier once, without the "-" that
+# GeneWeaver exports put in place of a missing one. Kept as a member, "-" would be a gene
+# shared by every geneset without unigenes, matching them with one another.
+def unigene_members(unigenes: Iterable[str]) -> List[str]:
+    return list(dict.fromkeys(identifier for unigene in unigenes for identifier in split_identifiers(unigene)))
+
+# The geneset with its unigenes reduced to its members (see unigene_members), so that the
+# memberships, digest, MinHash signature and indexes of a geneset all agree
+def _with_unigene_members(geneset: GeneSetCreate) -> GeneSetCreate:
+    return geneset.copy(update={"unigene": unigene_members(geneset.unigene)})
+
+# Digest of a geneset's unigene members, stored in genesets.content_hash. It only depends on
+# the set of members, so it changes exactly when they do.
+def unigene_content_hash(unigenes: Iterable[str]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for identifier in sorted(set(unigenes)):
+        digest.update(identifier.encode())
+        digest.update(IDENTIFIER_SEPARATOR.encode())
+    return digest.hexdigest()
+
 #creates a new geneset in the database
 def create_geneset(db: Session, geneset: GeneSetCreate):
-    try:
-        unigene_json = json.dumps({"unigene":geneset.unigene})
+    geneset = _with_unigene_members(geneset)
+    # Computed before the write, keeping the writer free of CPU-bound work
+    signature = minhash.encode_signature(minhash.signature(geneset.unigene))
+
+    def write(session: Session):
         db_geneset = models.GeneSet(
             geneweaver_id=geneset.geneweaver_id,
-            entrez=geneset.entrez,
-            ensembl_gene=geneset.ensembl_gene,
-            unigene=unigene_json,
+            **{column: getattr(geneset, column) for column in INDEXED_COLUMNS},
+            content_hash=unigene_content_hash(geneset.unigene),
+            minhash=signature,
         )
-        print(f"Unigene JSON: {unigene_json}")
-        db.add(db_geneset)
-        db.commit()
-        db.refresh(db_geneset)
+        session.add(db_geneset)
+        session.flush()
+        add_geneset_genes(session, {db_geneset.id: geneset.unigene})
+        session.refresh(db_geneset)
+        db_geneset.genes  # Loaded for the caller (see _write)
         return db_geneset
+
+    db_geneset = _write(db, write)
+    gene_index.add(geneset.geneweaver_id, geneset_identifiers(geneset.dict(), geneset.unigene))
+    identifier_map.add(geneset.geneweaver_id, geneset_namespaces(geneset.dict(), geneset.unigene))
+    similarity_index.add(geneset.geneweaver_id, geneset.unigene)
+    lsh_index.add(geneset.geneweaver_id, minhash.decode_signature(signature))
+    geneset_cache.invalidate([geneset.geneweaver_id])
+    return db_geneset
+
+# Re-indexes a stored geneset in the gene -> genesets index, the identifier map and the
+# similarity matrix
+def _reindex_geneset(db_geneset: models.GeneSet):
+    values = {column: getattr(db_geneset, column) for column in INDEXED_COLUMNS}
+    gene_index.add(db_geneset.geneweaver_id, geneset_identifiers(values, db_geneset.unigene["unigene"]))
+    identifier_map.add(db_geneset.geneweaver_id, geneset_namespaces(values, db_geneset.unigene["unigene"]))
+    similarity_index.add(db_geneset.geneweaver_id, db_geneset.unigene["unigene"])
+
+# Inserts the genesets for bulk_create_genesets without committing, with their encoded
+# MinHash signatures. Returns the number inserted, the rejected (index, error message) pairs and the
+# unigenes of each inserted id.
+def _insert_genesets(db: Session, genesets: List[GeneSetCreate], signatures: List[bytes]) -> Tuple[int, List[Tuple[int, str]], Dict[int, List[str]]]:
+    ids = {geneset.geneweaver_id for geneset in genesets}
+    existing = set()
+    if ids:
+        existing = {
+            row[0] for row in
+            db.query(models.GeneSet.geneweaver_id).filter(models.GeneSet.geneweaver_id.in_(ids))
+        }
+
+    rows = []
+    unigenes = {}
+    rejected = []
+    for index, geneset in enumerate(genesets):
+        if geneset.geneweaver_id in existing:
+            rejected.append((index, f"GeneSet with GeneWeaver ID {geneset.geneweaver_id} already exists"))
+            continue
+        existing.add(geneset.geneweaver_id)
+        unigenes[geneset.geneweaver_id] = geneset.unigene
+        rows.append({
+            "geneweaver_id": geneset.geneweaver_id,
+            **{column: getattr(geneset, column) for column in INDEXED_COLUMNS},
+            "content_hash": unigene_content_hash(geneset.unigene),
+            "minhash": signatures[index],
+        })
+
+    if rows:
+        db.execute(insert(models.GeneSet), rows)
+        # Look up the primary keys assigned to the new rows to link their genes
+        members = {}
+        for chunk in _chunks(unigenes):
+            for geneset_id, geneweaver_id in db.query(models.GeneSet.id, models.GeneSet.geneweaver_id).filter(
+                models.GeneSet.geneweaver_id.in_(chunk)
+            ):
+                members[geneset_id] = unigenes[geneweaver_id]
+        add_geneset_genes(db, members)
+    return len(rows), rejected, unigenes
+
+# Adds genesets inserted by _insert_genesets to the gene index, the identifier map, the
+# similarity matrix and the LSH index, and drops them from the cache
+def _index_new_genesets(genesets: List[GeneSetCreate], signatures: List[bytes], rejected: List[Tuple[int, str]], unigenes: Dict[int, List[str]]):
+    rejected_indexes = {index for index, _ in rejected}
+    for index, geneset in enumerate(genesets):
+        if index not in rejected_indexes:
+            gene_index.add(geneset.geneweaver_id, geneset_identifiers(geneset.dict(), geneset.unigene))
+            identifier_map.add(geneset.geneweaver_id, geneset_namespaces(geneset.dict(), geneset.unigene))
+            similarity_index.add(geneset.geneweaver_id, geneset.unigene)
+            lsh_index.add(geneset.geneweaver_id, minhash.decode_signature(signatures[index]))
+    geneset_cache.invalidate(unigenes)
+
+# The genesets as stored (see _with_unigene_members), with their encoded MinHash signatures
+def _prepare_genesets(genesets: List[GeneSetCreate]) -> Tuple[List[GeneSetCreate], List[bytes]]:
+    genesets = [_with_unigene_members(geneset) for geneset in genesets]
+    return genesets, [minhash.encode_signature(minhash.signature(geneset.unigene)) for geneset in genesets]
+
+# Creates many genesets with executemany-style inserts instead of one commit per geneset.
+# Genesets whose GeneWeaver ID already exists (in the database or earlier in the batch) are
+# rejected; returns the number inserted and a list of (index in genesets, error message).
+# With commit=False the genesets are inserted in the caller's transaction instead of being
+# committed (through the write queue, if db has one).
+def bulk_create_genesets(db: Session, genesets: List[GeneSetCreate], commit: bool = True) -> Tuple[int, List[Tuple[int, str]]]:
+    # Computed before the write, keeping the writer (and the event loop) free of CPU-bound work
+    genesets, signatures = run_off_loop(_prepare_genesets, genesets)
+    if commit:
+        created, rejected, unigenes = _write(db, lambda session: _insert_genesets(session, genesets, signatures))
+        _index_new_genesets(genesets, signatures, rejected, unigenes)
+        return created, rejected
+    try:
+        created, rejected, unigenes = _insert_genesets(db, genesets, signatures)
+        _index_new_genesets(genesets, signatures, rejected, unigenes)
     except Exception as e:
         db.rollback()
+        # The indexes may already hold genesets from the rolled back batch
+        gene_index.invalidate()
+        identifier_map.invalidate()
+        similarity_index.invalidate()
+        lsh_index.invalidate()
         raise e
+    return created, rejected
+
 # Get ageneset by its geneweaver_id
 def get_geneset(db: Session, geneset_id: int):
-    db_geneset = db.query(models.GeneSet).filter(models.GeneSet.geneweaver_id == geneset_id).first()
-    if db_geneset:
-        # Convert JSON string back to a list
-        db_geneset.unigene = json.loads(db_geneset.unigene)
-    return db_geneset
+    # The unigene members are exposed through GeneSet.unigene, loaded from geneset_genes
+    return db.query(models.GeneSet).filter(models.GeneSet.geneweaver_id == geneset_id).first()
+
+
+# Raises a single 404 naming every requested GeneWeaver ID that was not found
+def _raise_genesets_not_found(missing: List[int], detail: str = "not found"):
+    if len(missing) == 1:
+        message = f"GeneSet with GeneWeaver ID {missing[0]} {detail}"
+    else:
+        message = f"GeneSets with GeneWeaver IDs {', '.join(map(str, missing))} {detail}"
+    raise HTTPException(status_code=404, detail=message)
+
+# Gets the genesets with the given geneweaver_ids, in the order requested and without duplicates,
+# with their unigene members loaded. Genesets are fetched with one IN (...) query per chunk of
+# IN_CLAUSE_CHUNK_SIZE ids instead of one query per geneset; if any are missing, a single 404
+# lists all of them.
+def get_genesets(db: Session, gene_weaver_ids: List[int]) -> List[models.GeneSet]:
+    requested = list(dict.fromkeys(gene_weaver_ids))
+    genesets = {}
+    for chunk in _chunks(requested):
+        for db_geneset in (
+            db.query(models.GeneSet)
+            .options(selectinload(models.GeneSet.genes))
+            .filter(models.GeneSet.geneweaver_id.in_(chunk))
+        ):
+            genesets[db_geneset.geneweaver_id] = db_geneset
+    missing = [gene_weaver_id for gene_weaver_id in requested if gene_weaver_id not in genesets]
+    if missing:
+        _raise_genesets_not_found(missing)
+    return [genesets[gene_weaver_id] for gene_weaver_id in requested]
 
 
 # Updates an existing geneset identified by geneweaver_id with the data in geneset (an instance of GeneSetUpdate).
 def update_geneset(db: Session, geneset_id: int, geneset: schemas.GeneSetUpdate):
-    db_geneset = get_geneset(db, geneset_id)
-    if db_geneset:
-        update_data = geneset.dict(exclude_unset=True)
-        for key, value in update_data.items():
-            setattr(db_geneset, key, value)
+    def write(session: Session):
+        db_geneset = get_geneset(session, geneset_id)
+        if db_geneset:
+            update_data = geneset.dict(exclude_unset=True)
+            for key, value in update_data.items():
+                setattr(db_geneset, key, value)
 
-        db.commit()
-        db.refresh(db_geneset)
+            session.flush()
+            session.refresh(db_geneset)
+            db_geneset.genes  # Loaded for the caller (see _write)
+        return db_geneset
+
+    db_geneset = _write(db, write)
+    if db_geneset:
+        _reindex_geneset(db_geneset)
+        geneset_cache.invalidate([geneset_id])
     return db_geneset
 
 # Deletes the geneset with the given geneweaver_id from the database.
+# The deleted geneset is returned with its genes loaded.
 def delete_geneset(db: Session, geneset_id: int):
-    db_geneset = get_geneset(db, geneset_id)
-    if db_geneset:
-        db.delete(db_geneset)
-        db.commit()
+    def write(session: Session):
+        db_geneset = get_geneset(session, geneset_id)
+        if db_geneset:
+            db_geneset.genes  # Loaded for the caller (see _write)
+            session.delete(db_geneset)
         return db_geneset
 
-# Performs a boolean algebra operation specified by operation on a list of genesets identified by geneweaver_ids.
-def perform_boolean_algebra(db: Session, operation: str, geneset_ids: List[int]) -> Set[str]:
-    # Fetch gene sets from the database
-    gene_sets = [get_geneset(db,geneset_id) for geneset_id in geneset_ids]
-    
-    # Prepare input for the Boolean Algebra tool
-    tool_input = BooleanAlgebraInput(
-        type=BooleanAlgebraType[operation.upper()],
-        input_genesets=[geneset.genes for geneset in gene_sets]
-    )
-    # Instantiate the tool and run the operation
-    boolean_algebra_tool = BooleanAlgebra()
-    result = boolean_algebra_tool.run(tool_input)
-    
-    return result.result_geneset_ids
+    db_geneset = _write(db, write)
+    if db_geneset:
+        gene_index.remove(geneset_id)
+        identifier_map.remove(geneset_id)
+        similarity_index.remove(geneset_id)
+        lsh_index.remove(geneset_id)
+        geneset_cache.invalidate([geneset_id])
+        return db_geneset
 
 # CRUD functions for analysis runs
 def create_analysis_run(db: Session):
-    new_run = models.AnalysisRun()
-    db.add(new_run)
-    db.commit()
-    db.refresh(new_run)
-    return new_run
+    def write(session: Session):
+        new_run = models.AnalysisRun()
+        session.add(new_run)
+        session.flush()
+        session.refresh(new_run)
+        new_run.result  # Loaded for the caller (see _write)
+        return new_run
+    return _write(db, write)
 
 def extract_genes_from_json(json_data: str) -> Set[str]:
     # Convert JSON string to a Python object (list in this case)
@@ -105,100 +342,728 @@ def extract_genes_from_json(json_data: str) -> Set[str]:
     # Extract the unigene list and convert it to a set
     return set(data['unigene'])
 
-def get_geneset_unigenes(db: Session, gene_weaver_id: int) -> Set[str]:
-    # Fetch the geneset by GeneWeaver ID and extract the unigenes
-    geneset = db.query(SQLAGeneSet).filter(SQLAGeneSet.geneweaver_id == gene_weaver_id).first()
-    if geneset and geneset.unigene:
-        return extract_genes_from_json(geneset.unigene)
+def get_geneset_unigenes(db: Session, gene_weaver_id: int) -> FrozenSet[str]:
+    # Fetch the unigenes of a geneset by GeneWeaver ID through the membership table
+    return get_genesets_unigenes(db, [gene_weaver_id])[gene_weaver_id]
+
+# Separates identifiers concatenated by aggregate_strings (the ASCII unit separator, which
+# never occurs in gene identifiers)
+IDENTIFIER_SEPARATOR = "\x1f"
+
+# Loads the unigenes of the genesets that exist among gene_weaver_ids from the database.
+# One IN (...) query per chunk of IN_CLAUSE_CHUNK_SIZE ids replaces one query per geneset, and
+# each geneset's members come back concatenated in a single row, which is much cheaper to
+# decode than a row per membership. The rows are decoded off the event loop (see concurrency.py).
+def _load_genesets_unigenes(db: Session, gene_weaver_ids: List[int]) -> Dict[int, FrozenSet[str]]:
+    rows = []
+    for chunk in _chunks(gene_weaver_ids):
+        rows.extend(
+            db.query(SQLAGeneSet.geneweaver_id, func.aggregate_strings(Gene.identifier, IDENTIFIER_SEPARATOR))
+            .join(geneset_genes, geneset_genes.c.geneset_id == SQLAGeneSet.id)
+            .join(Gene, Gene.id == geneset_genes.c.gene_id)
+            .filter(SQLAGeneSet.geneweaver_id.in_(chunk))
+            .group_by(SQLAGeneSet.geneweaver_id)
+        )
+    return run_off_loop(_decode_genesets_unigenes, rows)
+
+# The unigenes of each (GeneWeaver ID, concatenated identifiers) row of _load_genesets_unigenes
+def _decode_genesets_unigenes(rows: List[Tuple[int, str]]) -> Dict[int, FrozenSet[str]]:
+    return {gene_weaver_id: frozenset(identifiers.split(IDENTIFIER_SEPARATOR)) for gene_weaver_id, identifiers in rows}
+
+# Fetches the unigenes of many genesets at once, keyed by GeneWeaver ID in the order requested.
+# The sets are shared through geneset_cache and must not be modified. Genesets that are missing
+# or have no unigenes are reported together in one 404.
+def get_genesets_unigenes(db: Session, gene_weaver_ids: List[int]) -> Dict[int, FrozenSet[str]]:
+    requested = list(dict.fromkeys(gene_weaver_ids))
+    cached = geneset_cache.get_many(requested, lambda missing: _load_genesets_unigenes(db, missing))
+    unigenes = {gene_weaver_id: cached[gene_weaver_id] for gene_weaver_id in requested if gene_weaver_id in cached}
+    missing = [gene_weaver_id for gene_weaver_id in requested if gene_weaver_id not in unigenes]
+    if missing:
+        _raise_genesets_not_found(missing, "not found or unigene data is empty")
+    return unigenes
+
+# Returns (total, page of GeneWeaver IDs) of the genesets containing a gene identifier from any
+# indexed column, served from the in-memory gene index
+def get_gene_genesets(db: Session, identifier: str, offset: int = 0, limit: int = 100) -> Tuple[int, List[int]]:
+    gene_index.ensure_loaded(db)
+    return gene_index.count(identifier), gene_index.lookup(identifier, offset, limit)
+
+# Returns the GeneWeaver IDs of all genesets containing the given gene, using the gene_id index
+def get_genesets_with_gene(db: Session, identifier: str) -> List[int]:
+    return [
+        row[0] for row in
+        db.query(SQLAGeneSet.geneweaver_id)
+        .join(geneset_genes, geneset_genes.c.geneset_id == SQLAGeneSet.id)
+        .join(Gene, Gene.id == geneset_genes.c.gene_id)
+        .filter(Gene.identifier == identifier)
+        .order_by(SQLAGeneSet.geneweaver_id)
+    ]
+
+# Most genesets compared by one /genesets/similarity request; its response holds the square
+# of this many scores per metric
+SIMILARITY_MAX_GENESETS = 500
+
+# Raises ValueError if any of metrics is not a similarity metric
+def check_similarity_metrics(metrics: List[str]):
+    unknown = [metric for metric in metrics if metric not in SIMILARITY_METRICS]
+    if unknown:
+        raise ValueError(f"Unsupported metrics: {', '.join(unknown)}; expected {', '.join(SIMILARITY_METRICS)}")
+
+# Raises ValueError if a similarity request names too many genesets or an unknown metric
+def check_similarity_request(gene_weaver_ids: List[int], metrics: List[str]):
+    if len(set(gene_weaver_ids)) > SIMILARITY_MAX_GENESETS:
+        raise ValueError(f"At most {SIMILARITY_MAX_GENESETS} genesets can be compared at once")
+    check_similarity_metrics(metrics)
+
+# Loads the geneset x gene membership matrix used by compute_similarity_block, unless it is
+# already loaded
+def load_similarity_index(db: Session):
+    similarity_index.ensure_loaded(db)
+
+# Computes the intersection counts and similarity scores of every pair of the given genesets
+# (without duplicates, in the order requested) from the membership matrix, which must be
+# loaded. If any geneset is missing, a single 404 lists all of them.
+def compute_similarity_block(gene_weaver_ids: List[int], metrics: Iterable[str] = SIMILARITY_METRICS) -> SimilarityBlock:
+    try:
+        return similarity_index.block(list(dict.fromkeys(gene_weaver_ids)), metrics=metrics)
+    except MissingGenesets as e:
+        _raise_genesets_not_found(e.gene_weaver_ids)
+
+# Serializes a similarity block as the JSON body /genesets/similarity returns
+def encode_similarity_block(gene_weaver_ids: List[int], block: SimilarityBlock) -> bytes:
+    return json.dumps({
+        "gene_weaver_ids": list(dict.fromkeys(gene_weaver_ids)),
+        "sizes": block.row_sizes.tolist(),
+        "intersections": block.intersections.tolist(),
+        "scores": {metric: scores.tolist() for metric, scores in block.scores.items()},
+    }, separators=(",", ":")).encode("utf-8")
+
+# Loads the LSH index and the membership matrix used by find_similar_genesets, unless they
+# are already loaded
+def load_similar_genesets_indexes(db: Session):
+    lsh_index.ensure_loaded(db)
+    similarity_index.ensure_loaded(db)
+
+# Finds the k genesets most similar to a gene list by metric (see similarity.METRICS). The
+# candidates are the genesets sharing an LSH band with the list's MinHash signature; they are
+# re-ranked by their exact scores from the membership matrix, so only the candidate search
+# is approximate. Both must be loaded. Returns the number of candidates and (GeneWeaver ID,
+# score, intersection count, size) of the best genesets with a positive score, best first.
+def find_similar_genesets(genes: List[str], k: int = 10, metric: str = "jaccard") -> Tuple[int, List[Tuple[int, float, int, int]]]:
+    candidates, _ = lsh_index.candidates(minhash.signature(genes))
+    query_size, ids, sizes, intersections = similarity_index.overlaps(genes, candidates)
+    scores = similarity_scores(intersections[None, :], np.array([query_size]), sizes, [metric])[metric][0]
+    # Best scores first, ties broken by GeneWeaver ID
+    best = np.lexsort((ids, -scores))
+    best = best[scores[best] > 0][:k]
+    return len(candidates), [
+        (int(ids[position]), float(scores[position]), int(intersections[position]), int(sizes[position])) for position in best
+    ]
+
+
+# Raises ValueError if metric is not one the overlap search ranks by
+def check_overlap_metric(metric: str):
+    if metric not in OVERLAP_METRICS:
+        raise ValueError(f"Unsupported metric: {metric}; expected {', '.join(OVERLAP_METRICS)}")
+
+# Finds the k stored genesets overlapping a gene list the most by metric (see
+# overlap_search.METRICS), exactly, from the posting lists of the membership matrix, which
+# must be loaded (see load_similarity_index)
+def find_overlapping_genesets(genes: List[str], k: int = 10, metric: str = "jaccard") -> TopOverlaps:
+    check_overlap_metric(metric)
+    query_size, postings, row_sizes, row_ids = similarity_index.postings(genes)
+    return top_k_overlaps(postings, query_size, row_sizes, row_ids, k, metric)
+
+
+# Translates a gene list of namespace into the unigenes that the membership matrix holds,
+# through the identifier map, which must be loaded unless namespace is DEFAULT_NAMESPACE.
+# Genes without a unigene are left out.
+def translate_gene_list(genes: List[str], namespace: str = DEFAULT_NAMESPACE) -> List[str]:
+    check_namespace(namespace)
+    if namespace == DEFAULT_NAMESPACE:
+        return genes
+    return sorted(identifier_map.translate([genes], namespace, DEFAULT_NAMESPACE)[0])
+
+
+# Tests a gene list for enrichment in every stored geneset (see api.enrichment), against the
+# background of the genes found in at least one geneset, with the membership matrix, which
+# must be loaded (see load_similarity_index). Returns the number of distinct genes in the
+# list, how many are in the background, the background size, the number of genesets tested,
+# and (GeneWeaver ID, overlap, size, expected overlap, p-value, q-value) of at most limit
+# overlapping genesets whose q-value is at most max_q, lowest p-value first.
+def enrich_genesets(genes: List[str], limit: int = 100, max_q: float = 1.0) -> Tuple[int, int, int, int, List[Tuple[int, int, int, float, float, float]]]:
+    background, matched, ids, sizes, overlaps = similarity_index.enrichment_counts(genes)
+    tested = enrichment(overlaps, sizes, background, matched)
+    # Lowest p-values first, ties broken by the larger overlap, then by GeneWeaver ID
+    ranked = np.lexsort((ids, -overlaps, tested.p_values))
+    ranked = ranked[(overlaps[ranked] > 0) & (tested.q_values[ranked] <= max_q)][:limit]
+    return len(set(genes)), matched, background, len(ids), [
+        (int(ids[i]), int(overlaps[i]), int(sizes[i]), float(tested.expected[i]), float(tested.p_values[i]), float(tested.q_values[i]))
+        for i in ranked
+    ]
+
+
+# Raises ValueError if operation or namespace is unknown, or operation is missing its parameters
+def check_boolean_algebra_operation(operation: str, threshold: Optional[int] = None, namespace: str = DEFAULT_NAMESPACE):
+    if operation not in BOOLEAN_ALGEBRA_OPERATIONS:
+        raise ValueError(f"Unsupported operation: {operation}")
+    if operation == "threshold" and threshold is None:
+        raise ValueError("threshold is required for the threshold operation")
+    check_namespace(namespace)
+
+
+# Loads the identifiers of every stored geneset used by translate_genesets, unless they are
+# already loaded
+def load_identifier_map(db: Session):
+    identifier_map.ensure_loaded(db)
+
+
+# Translates the unigenes of stored genesets into sets of identifiers of namespace, in the
+# order requested, through the identifier map, which must be loaded. Unigenes without an
+# identifier in namespace are left out. If any geneset is missing, a single 404 lists all of them.
+def translate_genesets(gene_weaver_ids: List[int], namespace: str) -> List[FrozenSet[str]]:
+    try:
+        return identifier_map.translate_genesets(gene_weaver_ids, namespace)
+    except MissingGenesets as e:
+        _raise_genesets_not_found(e.gene_weaver_ids)
+
+
+# Applies a boolean algebra operation to sets of genes, shared by /boolean-algebra/ and the
+# background runs. Returns {"result": [genes]}; the threshold operation also returns
+# "membership_counts", the number of input genesets containing each result gene.
+# If checkpoint is given, it is called between blocks of genesets and raises to stop the
+# computation, e.g. when a background run is canceled.
+def compute_boolean_algebra(geneset_sets: List[Set[str]], operation: str, threshold: Optional[int] = None, checkpoint: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    check_boolean_algebra_operation(operation, threshold)
+    if checkpoint is not None:
+        return _compute_boolean_algebra_in_blocks(geneset_sets, operation, threshold, checkpoint)
+    if operation == "intersection":
+        result = intersection(*geneset_sets)
+    elif operation == "union":
+        result = union(*geneset_sets)
+    elif operation == "difference":
+        result = symmetric_difference(*geneset_sets)
+    else:
+        # Genes in at least threshold genesets, from a single counting pass
+        counts = {gene: count for gene, count in membership_counts(*geneset_sets).items() if count >= threshold}
+        return {"result": list(counts), "membership_counts": counts}
+    return {"result": list(result)}
+
+
+# compute_boolean_algebra, combining CANCEL_CHECK_GENESETS genesets at a time and calling
+# checkpoint after each block. Symmetric differences and thresholds add up the membership
+# counts of the blocks.
+def _compute_boolean_algebra_in_blocks(geneset_sets: List[Set[str]], operation: str, threshold: Optional[int], checkpoint: Callable[[], None]) -> Dict[str, Any]:
+    blocks = [geneset_sets[start:start + CANCEL_CHECK_GENESETS] for start in range(0, len(geneset_sets), CANCEL_CHECK_GENESETS)]
+    if operation == "intersection":
+        result = set(geneset_sets[0])
+        for block in blocks:
+            result.intersection_update(*block)
+            checkpoint()
+    elif operation == "union":
+        result = set()
+        for block in blocks:
+            result.update(*block)
+            checkpoint()
     else:
-        raise HTTPException(status_code=404, detail=f"GeneSet with GeneWeaver ID {gene_weaver_id} not found or unigene data is empty")
+        counts = Counter()
+        for block in blocks:
+            counts.update(membership_counts(*block))
+            checkpoint()
+        if operation == "difference":
+            return {"result": [gene for gene, count in counts.items() if count == 1]}
+        counts = {gene: count for gene, count in counts.items() if count >= threshold}
+        return {"result": list(counts), "membership_counts": counts}
+    return {"result": list(result)}
+
+
+# Applies a boolean algebra operation to stored genesets inside the database, with the result
+# of compute_boolean_algebra over their unigenes. A single GROUP BY over geneset_genes counts
+# the requested genesets containing each gene and HAVING keeps the genes the operation selects,
+# so only result genes are returned. A GeneWeaver ID requested more than once counts once per
+# occurrence, as it does in compute_boolean_algebra. Missing genesets raise a single 404.
+def query_boolean_algebra(db: Session, operation: str, gene_weaver_ids: List[int], threshold: Optional[int] = None) -> Dict[str, Any]:
+    check_boolean_algebra_operation(operation, threshold)
+    occurrences = Counter(gene_weaver_ids)
+    geneset_ids = {}
+    for chunk in _chunks(occurrences):
+        geneset_ids.update(db.query(models.GeneSet.geneweaver_id, models.GeneSet.id).filter(models.GeneSet.geneweaver_id.in_(chunk)))
+    missing = [gene_weaver_id for gene_weaver_id in occurrences if gene_weaver_id not in geneset_ids]
+    if missing:
+        _raise_genesets_not_found(missing)
+
+    if all(count == 1 for count in occurrences.values()):
+        members = func.count()
+    else:
+        weights = {geneset_ids[gene_weaver_id]: count for gene_weaver_id, count in occurrences.items()}
+        members = func.sum(case(weights, value=geneset_genes.c.geneset_id))
+    members = members.label("members")
+    statement = (
+        select(Gene.identifier, members)
+        .join(geneset_genes, geneset_genes.c.gene_id == Gene.id)
+        .where(geneset_genes.c.geneset_id.in_(list(geneset_ids.values())))
+        .group_by(Gene.id, Gene.identifier)
+    )
+    if operation == "intersection":
+        statement = statement.having(members == len(gene_weaver_ids))
+    elif operation == "difference":
+        # Genes in exactly one geneset: the symmetric difference
+        statement = statement.having(members == 1)
+    elif operation == "threshold":
+        statement = statement.having(members >= threshold)
+        counts = {identifier: count for identifier, count in db.execute(statement)}
+        return {"result": list(counts), "membership_counts": counts}
+    return {"result": [identifier for identifier, _ in db.execute(statement)]}
+
+
+# Applies a boolean algebra operation to stored genesets, in SQL (query_boolean_algebra) on
+# backends that push set operations into the database, or else over the cached unigenes of
+# the genesets (compute_boolean_algebra). Genesets are first translated into any other
+# namespace, which only the latter does. checkpoint is passed on to compute_boolean_algebra;
+# a query run by the database cannot be stopped.
+def run_boolean_algebra(db: Session, operation: str, gene_weaver_ids: List[int], threshold: Optional[int] = None, namespace: str = DEFAULT_NAMESPACE, checkpoint: Optional[Callable[[], None]] = None) -> Dict[str, Any]:
+    if namespace == DEFAULT_NAMESPACE and use_sql_set_operations(db.get_bind().url):
+        return query_boolean_algebra(db, operation, gene_weaver_ids, threshold)
+    if namespace != DEFAULT_NAMESPACE:
+        check_namespace(namespace)
+        load_identifier_map(db)
+        geneset_sets = translate_genesets(gene_weaver_ids, namespace)
+    else:
+        unigenes = get_genesets_unigenes(db, gene_weaver_ids)
+        geneset_sets = [unigenes[gene_weaver_id] for gene_weaver_id in gene_weaver_ids]
+    return compute_boolean_algebra(geneset_sets, operation, threshold, checkpoint)
+
+
+# Gets the content_hash of each geneset, keyed by GeneWeaver ID. Missing genesets are reported
+# together in one 404; genesets stored without a hash map to None.
+def get_genesets_content_hashes(db: Session, gene_weaver_ids: List[int]) -> Dict[int, Optional[str]]:
+    requested = list(dict.fromkeys(gene_weaver_ids))
+    hashes = {}
+    for chunk in _chunks(requested):
+        hashes.update(
+            db.query(SQLAGeneSet.geneweaver_id, SQLAGeneSet.content_hash).filter(SQLAGeneSet.geneweaver_id.in_(chunk))
+        )
+    missing = [gene_weaver_id for gene_weaver_id in requested if gene_weaver_id not in hashes]
+    if missing:
+        _raise_genesets_not_found(missing)
+    return hashes
+
+# Key identifying a boolean algebra result: the operation, its threshold, and the sorted input
+# GeneWeaver IDs (duplicates kept, since they count towards thresholds) each paired with the
+# content_hash of its members. Results cached under a key can never be stale, because changing
+# an input geneset changes the key. Results in another namespace than unigene also depend on
+# every stored geneset, through their translation, so their key adds the namespace and the
+# digest of its translation table. Returns None if a geneset has no content_hash.
+def boolean_algebra_cache_key(operation: str, gene_weaver_ids: List[int], content_hashes: Dict[int, Optional[str]], threshold: Optional[int] = None, namespace: str = DEFAULT_NAMESPACE, translation_digest: Optional[str] = None) -> Optional[str]:
+    inputs = [[gene_weaver_id, content_hashes[gene_weaver_id]] for gene_weaver_id in sorted(gene_weaver_ids)]
+    if any(content_hash is None for _, content_hash in inputs):
+        return None
+    threshold = threshold if operation == "threshold" else None
+    key = [operation, threshold, inputs]
+    if namespace != DEFAULT_NAMESPACE:
+        key += [namespace, translation_digest]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+def get_boolean_algebra_cache_key(db: Session, operation: str, gene_weaver_ids: List[int], threshold: Optional[int] = None, namespace: str = DEFAULT_NAMESPACE) -> Optional[str]:
+    translation_digest = None
+    if namespace != DEFAULT_NAMESPACE:
+        load_identifier_map(db)
+        translation_digest = identifier_map.digest(DEFAULT_NAMESPACE, namespace)
+    return boolean_algebra_cache_key(
+        operation, gene_weaver_ids, get_genesets_content_hashes(db, gene_weaver_ids), threshold, namespace, translation_digest
+    )
+
+# Finds a stored result with the given key that is younger than GENEWEAVER_RESULT_CACHE_TTL
+def find_cached_result(db: Session, cache_key: str) -> Optional[AnalysisResult]:
+    if config.RESULT_CACHE_TTL == 0:
+        return None
+    oldest = datetime.utcnow() - timedelta(seconds=config.RESULT_CACHE_TTL)
+    return (
+        db.query(AnalysisResult)
+        .filter(AnalysisResult.cache_key == cache_key, AnalysisResult.created_at >= oldest)
+        .order_by(AnalysisResult.id.desc())
+        .first()
+    )
+
+# Serializes the output of compute_boolean_algebra as the JSON body /boolean-algebra/ returns
+def encode_boolean_algebra_result(output: Dict[str, Any]) -> bytes:
+    return json.dumps(output, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# Gets the JSON body of a cached boolean algebra result from result_cache, or else from a
+# reusable analysis run result, which is then kept in result_cache. Returns None on a miss.
+def get_cached_boolean_algebra_result(db: Session, cache_key: str) -> Optional[bytes]:
+    body = result_cache.lookup(cache_key)
+    if body is None:
+        cached_result = find_cached_result(db, cache_key)
+        if cached_result is not None:
+            body = get_result_data(db, cached_result).encode("utf-8")
+            result_cache.put(cache_key, body)
+    return body
+
+
+# Raised inside an analysis when its run has been canceled, to stop the work early
+class RunCanceled(Exception):
+    pass
+
+
+# Cancellation checkpoint: raises RunCanceled once crud.cancel_run has marked the run canceled.
+# The status is read from the database, so cancellation also reaches runs in worker processes.
+def check_run_not_canceled(db: Session, run_id: int):
+    status = db.query(AnalysisRun.status).filter(AnalysisRun.id == run_id).scalar()
+    if status == RunStatus.CANCELED:
+        raise RunCanceled(run_id)
 
 
-def perform_boolean_algebra_analysis(task_id: int, db: Session, gene_weaver_ids: List[int], operation: str):
-    # Convert GeneWeaver IDs to gene sets (sets of unigene values)
-    update_run_status_and_time(db, task_id, RunStatus.RUNNING)
-    
+# Sets values on a run unless it has been canceled, in a single UPDATE, so that a cancel_run
+# committed after the last checkpoint is never overwritten. Raises RunCanceled instead.
+def _update_run_unless_canceled(session: Session, run_id: int, values: Dict[str, Any]):
+    updated = (
+        session.query(AnalysisRun)
+        .filter(AnalysisRun.id == run_id, AnalysisRun.status != RunStatus.CANCELED)
+        .update(values, synchronize_session=False)
+    )
+    if not updated and session.query(AnalysisRun.status).filter(AnalysisRun.id == run_id).scalar() == RunStatus.CANCELED:
+        raise RunCanceled(run_id)
+
+
+# Cancellation checkpoint for the inner loops of a run's computation, reading the run's status
+# at most once every CANCEL_CHECK_INTERVAL seconds
+def run_cancel_checkpoint(db: Session, run_id: int) -> Callable[[], None]:
+    checked = time.monotonic()
+
+    def checkpoint():
+        nonlocal checked
+        if time.monotonic() - checked >= CANCEL_CHECK_INTERVAL:
+            check_run_not_canceled(db, run_id)
+            checked = time.monotonic()
+
+    return checkpoint
+
+
+def perform_boolean_algebra_analysis(task_id: int, db: Session, gene_weaver_ids: List[int], operation: str, threshold: Optional[int] = None, namespace: str = DEFAULT_NAMESPACE):
     try:
-        geneset_sets = [get_geneset_unigenes(db, gene_weaver_id) for gene_weaver_id in gene_weaver_ids]
-    
-        if operation == "intersection":
-            result = set.intersection(*geneset_sets)
-        elif operation == "union":
-            result = set.union(*geneset_sets)
-        elif operation == "difference":
-            result = set.symmetric_difference(*geneset_sets)
-        else:
-            raise ValueError(f"Unsupported operation: {operation}")
+        # A run canceled while it was queued is never started
+        check_run_not_canceled(db, task_id)
+        update_run_status_and_time(db, task_id, RunStatus.RUNNING, start_time=True)
+
+        # Reuse the result of an earlier run with the same operation and input contents
+        cache_key = get_boolean_algebra_cache_key(db, operation, gene_weaver_ids, threshold, namespace)
+        cached_result = find_cached_result(db, cache_key) if cache_key is not None else None
+        if cached_result is not None:
+            use_cached_result(db, task_id, cached_result.id)
+            return
 
-        # Save the result to the database
-        save_analysis_result(db, task_id, list(result))
+        # Compute the result, in SQL or over the genesets' unigenes depending on the backend.
+        # The latter also stops partway through once the run is canceled.
+        check_run_not_canceled(db, task_id)
+        output = run_boolean_algebra(db, operation, gene_weaver_ids, threshold, namespace, run_cancel_checkpoint(db, task_id))
+
+        # Save the result to the database, without a key for reuse if an input geneset changed
+        # while it was computed
+        check_run_not_canceled(db, task_id)
+        if cache_key is not None and get_boolean_algebra_cache_key(db, operation, gene_weaver_ids, threshold, namespace) != cache_key:
+            cache_key = None
+        save_analysis_result(db, task_id, output["result"], output.get("membership_counts"), cache_key)
         update_run_status_and_time(db, task_id, RunStatus.COMPLETED, end_time=True)
-        
+
+    except RunCanceled:
+        # The run keeps its CANCELED status, and nothing is saved
+        db.rollback()
+
     except Exception as e:
-        # In case of error, set the status to FAILED
-        update_run_status_and_time(db, task_id, RunStatus.FAILED, end_time=True)
+        # In case of error, set the status to FAILED, unless the run was canceled meanwhile
+        db.rollback()
+        try:
+            update_run_status_and_time(db, task_id, RunStatus.FAILED, end_time=True)
+        except RunCanceled:
+            pass
         raise e
-        
-    
+
 
 def update_run_status_and_time(db: Session, run_id: int, status: str, start_time: bool = False, end_time: bool = False):
-    """Update the status and time fields of an analysis run."""
-    run = db.query(AnalysisRun).filter(AnalysisRun.id == run_id).first()
-    if run:
-        run.status = status
+    """Update the status and time fields of an analysis run.
+
+    Raises RunCanceled, and changes nothing, if the run has been canceled.
+    """
+    def write(session: Session):
+        values = {AnalysisRun.status: status}
         if start_time:
-            run.start_time = datetime.utcnow()  # Set start time to the current time
+            values[AnalysisRun.start_time] = datetime.utcnow()  # Set start time to the current time
         if end_time:
-            run.end_time = datetime.utcnow()  # Set end time to the current time
-        db.commit()
+            values[AnalysisRun.end_time] = datetime.utcnow()  # Set end time to the current time
+        _update_run_unless_canceled(session, run_id, values)
+    _write(db, write)
         
 def get_all_runs(db: Session):
     return db.query(models.AnalysisRun).all()
 
+# Start and end times are stored as naive UTC (datetime.utcnow and the database clock)
+def _as_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
 
-def cancel_run(db: Session, run_id: int):
-    # Fetch the analysis run from the database
-    run = db.query(AnalysisRun).filter(AnalysisRun.id == run_id).first()
+# Largest page of runs /analysis-runs/ returns at once
+RUNS_PAGE_LIMIT = 1000
 
-    # Check if the run exists and is in a state that can be canceled
-    if run and run.status in [RunStatus.PENDING, RunStatus.RUNNING]:
-        # Update the status to 'canceled'
-        run.status = RunStatus.CANCELED
-        db.commit()
-        return run
-    elif run is None:
-        # If the run does not exist, return None
-        return None
+# Returns a page of analysis runs and the cursor of the next page (None on the last one).
+# Runs are ordered by (start_time, id), newest first unless order is "asc", so that the
+# ix_analysis_runs_* indexes return them in order and every page costs the same however
+# deep it is. Only runs in statuses (if given) started in [started_after, started_before)
+# are included. cursor is the id of the last run of the previous page; a run that is
+# started meanwhile moves, since its start_time is reset. Each run is a row of id, status,
+# start_time, end_time and result_id (see get_run_result_id); results are not loaded.
+def get_runs_page(
+    db: Session,
+    statuses: Optional[List[RunStatus]] = None,
+    started_after: Optional[datetime] = None,
+    started_before: Optional[datetime] = None,
+    order: str = "desc",
+    cursor: Optional[int] = None,
+    limit: int = 100,
+) -> Tuple[List[Any], Optional[int]]:
+    if order not in ("asc", "desc"):
+        raise ValueError(f"Unsupported order: {order}")
+    # Looked up for the rows of the page only, through the index on analysis_results.run_id
+    own_result_id = select(AnalysisResult.id).where(AnalysisResult.run_id == AnalysisRun.id).limit(1).scalar_subquery()
+    query = db.query(
+        AnalysisRun.id,
+        AnalysisRun.status,
+        AnalysisRun.start_time,
+        AnalysisRun.end_time,
+        func.coalesce(own_result_id, AnalysisRun.cached_result_id).label("result_id"),
+    )
+    if statuses:
+        query = query.filter(AnalysisRun.status.in_(statuses))
+    if started_after is not None:
+        query = query.filter(AnalysisRun.start_time >= _as_utc(started_after))
+    if started_before is not None:
+        query = query.filter(AnalysisRun.start_time < _as_utc(started_before))
+    key = tuple_(AnalysisRun.start_time, AnalysisRun.id)
+    if cursor is not None:
+        if db.query(AnalysisRun.id).filter(AnalysisRun.id == cursor).scalar() is None:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+        # The cursor run's start_time is compared as stored, since SQLite keeps timestamps
+        # as text and those set by the database lack the microseconds of bound values
+        cursor_start_time = select(AnalysisRun.start_time).where(AnalysisRun.id == cursor).scalar_subquery()
+        after = tuple_(cursor_start_time, cursor)
+        query = query.filter(key < after if order == "desc" else key > after)
+    if order == "desc":
+        query = query.order_by(AnalysisRun.start_time.desc(), AnalysisRun.id.desc())
     else:
-        # If the run is in a state that cannot be canceled, raise an exception
-        raise HTTPException(status_code=400, detail="Run cannot be canceled in its current state")
+        query = query.order_by(AnalysisRun.start_time, AnalysisRun.id)
+    # One extra row tells whether there is a next page
+    runs = query.limit(limit + 1).all()
+    if len(runs) > limit:
+        return runs[:limit], runs[limit - 1].id
+    return runs, None
 
 
-def save_analysis_result(db: Session, run_id: int, result_data: List[str]):
-    # Convert the result data to a JSON string
-    result_json = json.dumps({"result":result_data})
+def cancel_run(db: Session, run_id: int):
+    def write(session: Session):
+        # Fetch the analysis run from the database
+        run = session.query(AnalysisRun).filter(AnalysisRun.id == run_id).first()
 
-    # Create a new AnalysisResult instance
-    new_result = AnalysisResult(run_id=run_id,result_data=result_json)
+        # Check if the run exists and is in a state that can be canceled
+        if run and run.status in [RunStatus.PENDING, RunStatus.RUNNING]:
+            # Update the status to 'canceled'
+            run.status = RunStatus.CANCELED
+            run.result  # Loaded for the caller (see _write)
+            return run
+        elif run is None:
+            # If the run does not exist, return None
+            return None
+        else:
+            # If the run is in a state that cannot be canceled, raise an exception
+            raise HTTPException(status_code=400, detail="Run cannot be canceled in its current state")
+    return _write(db, write)
 
-    # Add the new result to the database session
-    db.add(new_result)
 
-    # Update the run status and end_time
-    run = db.query(AnalysisRun).filter(AnalysisRun.id == run_id).first()
-    if run:
-        run.status = RunStatus.COMPLETED
-        run.end_time = func.now()
-        db.commit()
+def save_analysis_result(db: Session, run_id: int, result_data: List[str], membership_counts: Optional[Dict[str, int]] = None, cache_key: Optional[str] = None):
+    def write(session: Session):
+        # Mark the run completed first: if it has been canceled, RunCanceled rolls the write
+        # back before any result is stored
+        _update_run_unless_canceled(session, run_id, {AnalysisRun.status: RunStatus.COMPLETED, AnalysisRun.end_time: func.now()})
+
+        # Store the genes as a compact, deduplicated blob; with a cache_key, later runs can
+        # reuse the result
+        new_result = AnalysisResult(
+            run_id=run_id,
+            blob_id=store_result_blob(session, result_data, membership_counts),
+            cache_key=cache_key,
+            created_at=datetime.utcnow(),
+        )
+
+        # Add the new result to the database session
+        session.add(new_result)
+    _write(db, write)
+
+# Marks a run completed with the result of an earlier run instead of a result of its own
+def use_cached_result(db: Session, run_id: int, result_id: int):
+    def write(session: Session):
+        _update_run_unless_canceled(session, run_id, {
+            AnalysisRun.cached_result_id: result_id,
+            AnalysisRun.status: RunStatus.COMPLETED,
+            AnalysisRun.end_time: datetime.utcnow(),
+        })
+    _write(db, write)
 
 def get_run_result(db: Session, run_id: int):
-    return db.query(models.AnalysisResult).filter(models.AnalysisResult.run_id == run_id).first()
+    result_id = get_run_result_id(db, run_id)
+    if result_id is None:
+        return None
+    result = db.query(models.AnalysisResult).filter(models.AnalysisResult.id == result_id).first()
+    if result is not None and result.result_data is None:
+        # Decode the blob into result_data without marking the result as modified
+        set_committed_value(result, "result_data", get_result_data(db, result))
+    return result
+
+# Gets the id of a run's result without loading it: the run's own result, or the earlier
+# result it reused. Returns None if the run has no result.
+def get_run_result_id(db: Session, run_id: int) -> Optional[int]:
+    result_id = db.query(AnalysisResult.id).filter(AnalysisResult.run_id == run_id).scalar()
+    if result_id is None:
+        # Runs that reused an earlier result point to it instead
+        result_id = db.query(AnalysisRun.cached_result_id).filter(AnalysisRun.id == run_id).scalar()
+    return result_id
+
+# Number of genes in a result, or None if the result does not exist
+def get_result_gene_count(db: Session, result_id: int) -> Optional[int]:
+    return (
+        db.query(ResultBlob.gene_count)
+        .join(AnalysisResult, AnalysisResult.blob_id == ResultBlob.id)
+        .filter(AnalysisResult.id == result_id)
+        .scalar()
+    )
+
+# Number of result genes stored per result_blob_chunks row
+RESULT_CHUNK_SIZE = 1000
+
+# Digest identifying the content of a result blob
+def _result_blob_hash(gene_ids: List[int], membership_counts: Optional[List[int]]) -> str:
+    digest = hashlib.sha256(b"counts" if membership_counts is not None else b"genes")
+    digest.update(json.dumps([gene_ids, membership_counts]).encode())
+    return digest.hexdigest()
+
+# Stores the genes of a result, with each gene's membership count for threshold results, as a
+# blob of compressed chunks (see result_codec) and returns its id. The genes are sorted and
+# chunked by identifier, so that pages follow identifier order; within a chunk they are stored
+# by interned gene id. An existing blob with the same content is reused. Does not commit.
+def store_result_blob(db: Session, genes: List[str], membership_counts: Optional[Dict[str, int]] = None) -> int:
+    genes = sorted(set(genes))
+    gene_ids = intern_genes(db, genes)
+    ids = [gene_ids[gene] for gene in genes]
+    counts = None if membership_counts is None else [membership_counts[gene] for gene in genes]
+    content_hash = _result_blob_hash(ids, counts)
+
+    blob_id = db.query(ResultBlob.id).filter(ResultBlob.content_hash == content_hash).scalar()
+    if blob_id is not None:
+        return blob_id
+    try:
+        with db.begin_nested():
+            blob = ResultBlob(content_hash=content_hash, gene_count=len(genes), has_membership_counts=counts is not None)
+            db.add(blob)
+            db.flush()
+            rows = []
+            for chunk_index, start in enumerate(range(0, len(genes), RESULT_CHUNK_SIZE)):
+                end = start + RESULT_CHUNK_SIZE
+                rows.append({
+                    "blob_id": blob.id,
+                    "chunk_index": chunk_index,
+                    "last_gene": genes[min(end, len(genes)) - 1],
+                    "data": encode_chunk(ids[start:end], None if counts is None else counts[start:end]),
+                })
+            if rows:
+                db.execute(insert(ResultBlobChunk), rows)
+    except IntegrityError:
+        # Stored by a concurrent run in the meantime
+        return db.query(ResultBlob.id).filter(ResultBlob.content_hash == content_hash).scalar()
+    return blob.id
+
+# Gets the identifiers of interned gene ids. Genes are never renamed or deleted, so they are
+# cached for good in gene_identifier_cache.
+def get_gene_identifiers(db: Session, gene_ids: List[int]) -> Dict[int, str]:
+    def load(missing):
+        identifiers = {}
+        for chunk in _chunks(missing):
+            identifiers.update(db.execute(select(Gene.id, Gene.identifier).where(Gene.id.in_(chunk))).all())
+        return identifiers
+    return gene_identifier_cache.get_many(gene_ids, load)
+
+# Decodes result chunks into (chunk_index, genes sorted by identifier, their membership counts
+# or None), looking up the identifiers of all chunks at once
+def _decode_result_chunks(db: Session, chunks: List[ResultBlobChunk]) -> List[Tuple[int, List[str], Optional[List[int]]]]:
+    decoded = [(chunk.chunk_index, *decode_chunk(chunk.data)) for chunk in chunks]
+    identifiers = get_gene_identifiers(db, [gene_id for _, ids, _ in decoded for gene_id in ids.tolist()])
+    sorted_chunks = []
+    for chunk_index, ids, counts in decoded:
+        genes = [identifiers[gene_id] for gene_id in ids.tolist()]
+        order = sorted(range(len(genes)), key=genes.__getitem__)
+        sorted_chunks.append((
+            chunk_index,
+            [genes[i] for i in order],
+            None if counts is None else [int(counts[i]) for i in order],
+        ))
+    return sorted_chunks
+
+# The blob holding a result's genes
+def _result_blob_id(db: Session, result_id: int) -> Optional[int]:
+    return db.query(AnalysisResult.blob_id).filter(AnalysisResult.id == result_id).scalar()
+
+# Gets the JSON string a result was stored as before result blobs existed,
+# {"result": [genes], "membership_counts": {gene: count}} (counts for threshold results only),
+# decoding the result's blob unless the result predates blobs
+def get_result_data(db: Session, result: AnalysisResult) -> Optional[str]:
+    if result.result_data is not None or result.blob_id is None:
+        return result.result_data
+    chunks = (
+        db.query(ResultBlobChunk).filter(ResultBlobChunk.blob_id == result.blob_id)
+        .order_by(ResultBlobChunk.chunk_index).all()
+    )
+    genes, counts = [], []
+    for _, chunk_genes, chunk_counts in _decode_result_chunks(db, chunks):
+        genes.extend(chunk_genes)
+        counts.extend(chunk_counts or ())
+    data = {"result": genes}
+    if db.query(ResultBlob.has_membership_counts).filter(ResultBlob.id == result.blob_id).scalar():
+        data["membership_counts"] = dict(zip(genes, counts))
+    return json.dumps(data)
+
+# Gets up to limit result genes sorted after cursor (a gene, or None to start from the first).
+# Returns (genes, membership counts or None, cursor of the next page or None on the last page).
+# Only the chunks holding the page are read and decoded.
+def get_result_genes_page(db: Session, result_id: int, cursor: Optional[str] = None, limit: int = RESULT_CHUNK_SIZE) -> Tuple[List[str], Optional[List[int]], Optional[str]]:
+    query = db.query(ResultBlobChunk).filter(ResultBlobChunk.blob_id == _result_blob_id(db, result_id))
+    if cursor is not None:
+        query = query.filter(ResultBlobChunk.last_gene > cursor)
+    # One gene more than the page tells whether there is a next page
+    chunks_needed = (limit + 1) // RESULT_CHUNK_SIZE + 2
+    genes, counts = [], None
+    for _, chunk_genes, chunk_counts in _decode_result_chunks(db, query.order_by(ResultBlobChunk.chunk_index).limit(chunks_needed).all()):
+        start = bisect_right(chunk_genes, cursor) if cursor is not None else 0
+        genes.extend(chunk_genes[start:])
+        if chunk_counts is not None:
+            counts = (counts or []) + chunk_counts[start:]
+    next_cursor = genes[limit - 1] if len(genes) > limit else None
+    return genes[:limit], None if counts is None else counts[:limit], next_cursor
+
+# Gets up to count chunks of a result after chunk_index after_chunk, decoded, as
+# (chunk_index, genes, membership counts or None), for streaming a result chunk by chunk
+def get_result_chunks(db: Session, result_id: int, after_chunk: int = -1, count: int = 10) -> List[Tuple[int, List[str], Optional[List[int]]]]:
+    return _decode_result_chunks(db, (
+        db.query(ResultBlobChunk)
+        .filter(ResultBlobChunk.blob_id == _result_blob_id(db, result_id), ResultBlobChunk.chunk_index > after_chunk)
+        .order_by(ResultBlobChunk.chunk_index)
+        .limit(count)
+        .all()
+    ))
 
 
 def get_runstatus(db: Session, run_id: int) -> str:
     """Fetches the status of an analysis run by its ID."""
-    run = db.query(models.AnalysisRun).filter(models.AnalysisRun.id == run_id).first()
-    if run:
-        return run.status.value  # Return the status as a string
+    # Only the status is read, which ix_analysis_runs_id_status holds
+    status = db.query(models.AnalysisRun.status).filter(models.AnalysisRun.id == run_id).scalar()
+    if status is not None:
+        return status.value  # Return the status as a string
     else:
         return "Not Found"  # Or you can raise an HTTPException for a not found error
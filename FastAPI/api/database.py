@@ -2,23 +2,82 @@
 # Here define the database connection and session management. 
 # For SQLAlchemy, this would typically include the engine, session, and base declarative class used to define models.
 
+import logging
+import os
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
-from .models import GeneSet, AnalysisRun, AnalysisResult,Base
+from . import config
+from .backends import get_backend
+from .models import GeneSet, Gene, AnalysisRun, AnalysisResult, ResultBlob, ResultBlobChunk,Base, geneset_genes
+from .writer import WriteQueue
 
-# The database URL for SQLite, it's a local file
-DATABASE_URL = "sqlite:///./geneweaver.db"
+logger = logging.getLogger(__name__)
 
-# An Engine, which the Session will use for connection
-# resources, typically just one instance per application
+# The database URL, a local SQLite file unless GENEWEAVER_DATABASE_URL says otherwise
+DATABASE_URL = config.DATABASE_URL
+
+# The kind of database behind DATABASE_URL (see backends.py)
+backend = get_backend(DATABASE_URL)
+
+
+# Whether url names an in-memory SQLite database, which exists once per connection
+def is_memory_database(url: str) -> bool:
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+# Pool settings for an engine on url: a fixed pool of pool_size connections for databases in
+# a file or on a server, of type poolclass if given. In-memory SQLite databases keep
+# SQLAlchemy's default pool.
+def pool_options(url: str, pool_size: int = config.DB_READ_POOL_SIZE, poolclass=None) -> dict:
+    if is_memory_database(url):
+        return {}
+    options = {"pool_size": pool_size, "max_overflow": 0}
+    if poolclass is not None:
+        options["poolclass"] = poolclass
+    return options
+
+
+# Engine for reads, with a pool of connections; one instance per application
 engine = create_engine(
     DATABASE_URL, 
-    connect_args={"check_same_thread": False}  # Only needed for SQLite
+    connect_args=backend.connect_args(),
+    **pool_options(DATABASE_URL),
 )
+backend.configure(engine)
+
+# Queue of writes made through SessionLocal and AsyncSessionLocal sessions (see writer.py),
+# for backends that allow a single writer. The writer's connection could not see an
+# in-memory database, so those are written directly, as are databases without the limit.
+write_queue = None
+writer_engine = None
+if backend.serialize_writes and not is_memory_database(DATABASE_URL):
+    # Engine of the writer thread: one connection, through which every write is committed
+    writer_engine = create_engine(
+        DATABASE_URL,
+        connect_args=backend.connect_args(),
+        **pool_options(DATABASE_URL, pool_size=1),
+    )
+    backend.configure(writer_engine, writer=True)
+    # Objects stay loaded after commit, since they are handed to the callers of the writes
+    WriterSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=writer_engine)
+    write_queue = WriteQueue(WriterSessionLocal)
+
+# A forked process (e.g. a job worker, see jobs.py) opens connections of its own rather than
+# sharing the pooled connections of its parent
+def _dispose_pools_after_fork():
+    for bind in (engine, writer_engine):
+        if bind is not None:
+            bind.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_dispose_pools_after_fork)
 
 # Each instance of the SessionLocal class will be a database session
-# The class itself is not a database session yet
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# The class itself is not a database session yet. crud commits its writes through write_queue.
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, info={"write_queue": write_queue})
 
 
 # Dependency to use in FastAPI endpoints to get a database session
@@ -29,15 +88,22 @@ def get_db():
     finally:
         db.close()
         
-# Create the tables
-# Base.metadata.create_all(bind=engine)
-Base.metadata.create_all(bind=engine, tables=[GeneSet.__table__, AnalysisRun.__table__, AnalysisResult.__table__])
-print("Tables created successfully.")
+# Creates the tables that do not exist yet, then brings databases created by older versions up
+# to date (e.g. JSON unigene column -> geneset_genes). Nothing is created or migrated on import:
+# the application does this once when it starts (see run.py), or by hand with
+#     python -m api.migrations
+def init_database(bind=None):
+    bind = engine if bind is None else bind
+    Base.metadata.create_all(bind=bind, tables=[GeneSet.__table__, Gene.__table__, geneset_genes, AnalysisRun.__table__, ResultBlob.__table__, ResultBlobChunk.__table__, AnalysisResult.__table__])
+    logger.info("Tables created successfully.")
+
+    from .migrations import run_migrations
+    run_migrations(bind)
 
 
 # Get a test database session
 def get_test_db():
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    engine = create_engine(DATABASE_URL, connect_args=backend.connect_args())
     TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     Base.metadata.create_all(bind=engine)  # Create the tables in the in-memory database
     try:
@@ -2,21 +2,43 @@
 # This file contains the API route definitions. 
 # Each function in this file corresponds to an endpoint in the API, 
 
-from typing import List,Set
-from fastapi import APIRouter, Depends, HTTPException,File,UploadFile,HTTPException,BackgroundTasks
+from datetime import datetime
+from typing import List,Optional,Set
+from fastapi import APIRouter, Depends, HTTPException,File,Form,UploadFile,HTTPException,BackgroundTasks,Query,Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 import json
 # Importing CRUD operations and schema models from the local modules.
 from .crud import get_geneset, create_geneset, delete_geneset,get_run_result,get_runstatus,get_all_runs,create_analysis_run,perform_boolean_algebra_analysis
 from .crud import cancel_run as crud_cancel_run
 from .schemas import GeneSetCreate, GeneSetUpdate, GeneSet,BooleanAlgebraRequest,AnalysisRunSchema,AnalysisResultSchema
+from .schemas import GeneGenesetsPage, GeneLookupRequest, ResultGenesPage, ResultGeneCount
+from .schemas import AnalysisRunsPage, SimilarityRequest
+from .schemas import SimilarGeneset, SimilarGenesetsRequest, SimilarGenesetsResponse, GenesetOverlapsResponse
+from .schemas import EnrichedGeneset, EnrichmentResponse
 from .database import get_db 
 import csv
 import io
-from .database import SessionLocal,get_db
+from .database import SessionLocal,get_db,write_queue
 from pydantic import ValidationError
 from .models import GeneSet as SQLAGeneSet
-from .crud import get_geneset_unigenes,perform_boolean_algebra_analysis
+from .crud import get_geneset_unigenes,perform_boolean_algebra_analysis,get_gene_genesets
+from .crud import check_boolean_algebra_operation, compute_boolean_algebra, encode_boolean_algebra_result, translate_genesets
+from .identifier_map import DEFAULT_NAMESPACE, check_namespace
+from .crud import check_similarity_metrics, check_similarity_request, compute_similarity_block, encode_similarity_block, find_similar_genesets
+from .crud import check_overlap_metric, find_overlapping_genesets, enrich_genesets, translate_gene_list
+from .ingest import ingest_upload, read_upload_genes
+from .jobs import AnalysisJob, JobQueueFull, job_executor
+from .models import RunStatus
+from .crud import RUNS_PAGE_LIMIT
+from .crud import update_run_status_and_time
+# Endpoints use async sessions so that waiting on the database never blocks the event loop
+from . import async_crud
+from .async_database import AsyncSessionLocal, get_async_db
+from .backends import use_sql_set_operations
+from .cache import geneset_cache, result_cache
 
 
 # Adding the path to sys.path allows Python to find modules in a different directory.
@@ -35,104 +57,310 @@ router = APIRouter()
 
 # Defining an endpoint for uploading genesets through a file.
 @router.post("/upload-genesets/", status_code=201)
-async def upload_genesets(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_genesets(file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
     if not file.filename.endswith('.txt'):
         raise HTTPException(status_code=400, detail="Invalid file format. Only .txt files are accepted.")
     
-    content = await file.read()
-    content_str = content.decode("utf-8")
-    reader = csv.DictReader(io.StringIO(content_str), delimiter='\t')
-
-    for row in reader:
-        try:
-            entrez_value = int(row.get('Entrez', '')) if row.get('Entrez', '') else None
-            # Parse the 'Unigene' field and convert it to a list
-            unigene_list = row.get('Unigene', '').split('|') if row.get('Unigene') else []
-            geneset_create = GeneSetCreate(
-                geneweaver_id=int(row.get('GeneWeaver ID', 0)),
-                entrez=entrez_value,
-                ensembl_gene=row.get('Ensembl Gene', ''),
-                ensembl_protein=row.get('Ensembl Protein', ''),
-                ensembl_transcript=row.get('Ensembl Transcript', ''),
-                unigene=unigene_list
-            )
-            create_geneset(db, geneset_create)
-
-        except ValidationError as e:
-            # Handle the validation error
-            print(f"Validation error for row: {row}, Error: {e}")
-
-    return {"status": "success", "filename": file.filename}
+    # The file is streamed in chunks; rows are validated individually and inserted in batches,
+    # each committed on its own, and rows that fail validation are reported back. An upload
+    # that fails part way keeps the batches committed before the failure.
+    report = await ingest_upload(db, file)
+
+    return {
+        "status": "success",
+        "filename": file.filename,
+        "inserted": report["inserted"],
+        "errors": report["errors"],
+    }
+
+# Defining an endpoint to read several genesets at once, e.g. /genesets?ids=65469,65243 or
+# /genesets?ids=65469&ids=65243. Genesets come back in the order requested; if any are
+# missing, a single 404 lists every missing ID.
+@router.get("/genesets", response_model=List[GeneSet])
+async def get_genesets_endpoint(ids: List[str] = Query([]), db: AsyncSession = Depends(get_async_db)):
+    try:
+        gene_weaver_ids = [int(value) for values in ids for value in values.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma separated GeneWeaver IDs")
+    if not gene_weaver_ids:
+        raise HTTPException(status_code=400, detail="ids must list at least one GeneWeaver ID")
+    return await async_crud.get_genesets(db, gene_weaver_ids)
 
 # Defining an endpoint to read a specific geneset by its ID.
 @router.get("/genesets/{geneset_id}", response_model=GeneSet)
-def get_geneset_endpoint(geneset_id: int, db: Session = Depends(get_db)):
-    db_geneset = get_geneset(db, geneset_id)
+async def get_geneset_endpoint(geneset_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_geneset = await async_crud.get_geneset(db, geneset_id)
     if db_geneset is None:
         raise HTTPException(status_code=404, detail="GeneSet not found")
     return db_geneset
 
 # Defining an endpoint to delete a specific geneset by its ID.
 @router.delete("/genesets/{geneset_id}", response_model=GeneSet)
-def delete_geneset_endpoint(geneset_id: int, db: Session = Depends(get_db)):
-    # Attempt to fetch the geneset from the database.
-    db_geneset = get_geneset(db, geneset_id=geneset_id) 
+async def delete_geneset_endpoint(geneset_id: int, db: AsyncSession = Depends(get_async_db)):
+    # Delete the geneset using the CRUD function, which returns None if it doesn't exist.
+    db_geneset = await async_crud.delete_geneset(db, geneset_id=geneset_id)
     # If the geneset doesn't exist, return a 404 error.
     if db_geneset is None:
         raise HTTPException(status_code=404, detail="GeneSet not found")
-    # If the geneset exists, delete it using the CRUD function.
-    return delete_geneset(db, geneset_id=geneset_id)
+    return db_geneset
    
+# Defining an endpoint to find the genesets containing a gene identifier (Unigene, Entrez,
+# Ensembl Gene, Gene Symbol, HGNC or MGI), paginated over ascending GeneWeaver IDs.
+@router.get("/genes/{identifier}/genesets", response_model=GeneGenesetsPage)
+async def get_gene_genesets_endpoint(
+    identifier: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=10000),
+    db: AsyncSession = Depends(get_async_db)):
+    total, geneweaver_ids = await async_crud.get_gene_genesets(db, identifier, offset, limit)
+    return GeneGenesetsPage(identifier=identifier, total=total, offset=offset, limit=limit, geneweaver_ids=geneweaver_ids)
+
+# Defining an endpoint to look up the genesets of several gene identifiers at once.
+@router.post("/genes/genesets", response_model=List[GeneGenesetsPage])
+async def lookup_genes_genesets_endpoint(request: GeneLookupRequest, db: AsyncSession = Depends(get_async_db)):
+    pages = []
+    for identifier in request.identifiers:
+        total, geneweaver_ids = await async_crud.get_gene_genesets(db, identifier, request.offset, request.limit)
+        pages.append(GeneGenesetsPage(
+            identifier=identifier, total=total, offset=request.offset, limit=request.limit, geneweaver_ids=geneweaver_ids
+        ))
+    return pages
+
+# Defining an endpoint for the pairwise overlaps of genesets. Returns their sizes, the
+# intersection count of every pair and the requested scores (jaccard, overlap, dice), as
+# matrices whose row i and column j compare the i-th and j-th of gene_weaver_ids.
+@router.post("/genesets/similarity")
+async def geneset_similarity_endpoint(request: SimilarityRequest, db: AsyncSession = Depends(get_async_db)):
+    try:
+        check_similarity_request(request.gene_weaver_ids, request.metrics)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    await async_crud.load_similarity_index(db)
+    # The matrix products are CPU-bound, so they run on a worker thread
+    body = await run_in_threadpool(
+        lambda: encode_similarity_block(request.gene_weaver_ids, compute_similarity_block(request.gene_weaver_ids, request.metrics))
+    )
+    return Response(body, media_type="application/json")
+
+# Defining an endpoint for the k stored genesets most similar to a gene list, found through
+# the LSH index of MinHash signatures and ranked by their exact scores.
+@router.post("/genesets/similar", response_model=SimilarGenesetsResponse)
+async def similar_genesets_endpoint(request: SimilarGenesetsRequest, db: AsyncSession = Depends(get_async_db)):
+    try:
+        check_similarity_metrics([request.metric])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    await async_crud.load_similar_genesets_indexes(db)
+    candidates, similar = await run_in_threadpool(find_similar_genesets, request.genes, request.k, request.metric)
+    return SimilarGenesetsResponse(candidates=candidates, genesets=[
+        SimilarGeneset(geneweaver_id=geneweaver_id, score=score, intersection=intersection, size=size)
+        for geneweaver_id, score, intersection, size in similar
+    ])
+
+# The gene list of a request sending either repeated genes form fields or an uploaded .txt
+# file in the format of sample_input_data.txt
+async def _read_gene_list(genes: List[str], file: Optional[UploadFile]) -> List[str]:
+    if (file is None) == (not genes):
+        raise HTTPException(status_code=400, detail="Send either genes or a file")
+    if file is None:
+        return genes
+    if not file.filename.endswith('.txt'):
+        raise HTTPException(status_code=400, detail="Invalid file format. Only .txt files are accepted.")
+    return await read_upload_genes(file)
+
+# Defining an endpoint for the k stored genesets overlapping a gene list the most, ranked
+# exactly by metric ("intersection", "jaccard" or "overlap"). The genes are sent either as
+# repeated genes form fields or as an uploaded .txt file in the format of sample_input_data.txt,
+# as identifiers of namespace (e.g. "mgi" for sample_input_data.txt), which are translated
+# into the unigenes the genesets are matched on.
+@router.post("/genesets/overlaps", response_model=GenesetOverlapsResponse)
+async def geneset_overlaps_endpoint(
+    genes: List[str] = Form([]),
+    file: Optional[UploadFile] = File(None),
+    k: int = Form(10, ge=1, le=1000),
+    metric: str = Form("jaccard"),
+    namespace: str = Form(DEFAULT_NAMESPACE),
+    db: AsyncSession = Depends(get_async_db)):
+    try:
+        check_overlap_metric(metric)
+        check_namespace(namespace)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    genes = await _read_gene_list(genes, file)
+
+    if namespace != DEFAULT_NAMESPACE:
+        await async_crud.load_identifier_map(db)
+    await async_crud.load_similarity_index(db)
+    # Translating the genes and walking the posting lists are CPU-bound, so they run on a
+    # worker thread
+    top = await run_in_threadpool(lambda: find_overlapping_genesets(translate_gene_list(genes, namespace), k, metric))
+    return GenesetOverlapsResponse(genes=len(set(genes)), walked=top.walked, probed=top.probed, genesets=[
+        SimilarGeneset(geneweaver_id=geneweaver_id, score=score, intersection=intersection, size=size)
+        for geneweaver_id, score, intersection, size in zip(
+            top.gene_weaver_ids.tolist(), top.scores.tolist(), top.intersections.tolist(), top.sizes.tolist()
+        )
+    ])
+
+# Defining an endpoint for the stored genesets enriched in a gene list: one-sided
+# hypergeometric p-values of its overlap with every geneset, Benjamini-Hochberg adjusted,
+# against the background of the genes in at least one geneset. Returns at most limit
+# genesets with a q-value of at most max_q. The genes are sent as for /genesets/overlaps, in
+# any namespace. A list of which no gene is in the background is rejected, since every
+# p-value would be 1, most often because its genes are not of the namespace given.
+@router.post("/genesets/enrichment", response_model=EnrichmentResponse)
+async def geneset_enrichment_endpoint(
+    genes: List[str] = Form([]),
+    file: Optional[UploadFile] = File(None),
+    limit: int = Form(100, ge=1, le=10000),
+    max_q: float = Form(1.0, ge=0, le=1),
+    namespace: str = Form(DEFAULT_NAMESPACE),
+    db: AsyncSession = Depends(get_async_db)):
+    try:
+        check_namespace(namespace)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    genes = await _read_gene_list(genes, file)
+
+    if namespace != DEFAULT_NAMESPACE:
+        await async_crud.load_identifier_map(db)
+    await async_crud.load_similarity_index(db)
+    # Translating the genes and scoring every geneset are CPU-bound, so they run on a worker thread
+    _, matched, background, tested, enriched = await run_in_threadpool(
+        lambda: enrich_genesets(translate_gene_list(genes, namespace), limit, max_q)
+    )
+    if matched == 0:
+        raise HTTPException(
+            status_code=400,
+            detail=f"None of the {len(set(genes))} genes sent, read as {namespace} identifiers, is in a stored geneset; "
+                   f"set namespace to the namespace of the genes",
+        )
+    return EnrichmentResponse(genes=len(set(genes)), matched=matched, background=background, tested=tested, genesets=[
+        EnrichedGeneset(
+            geneweaver_id=geneweaver_id, overlap=overlap, size=size, expected=expected,
+            fold_enrichment=overlap / expected, p_value=p_value, q_value=q_value,
+        )
+        for geneweaver_id, overlap, size, expected, p_value, q_value in enriched
+    ])
+
 @router.post("/boolean-algebra/")
 async def boolean_algebra_endpoint(
     request: BooleanAlgebraRequest, 
-    db: Session = Depends(get_db)):
+    db: AsyncSession = Depends(get_async_db)):
     
-    # Convert GeneWeaver IDs to gene sets (sets of unigene values)
-    geneset_sets = [get_geneset_unigenes(db, gene_weaver_id) for gene_weaver_id in request.gene_weaver_ids]
-    
-    if request.operation == "intersection":
-        result = set.intersection(*geneset_sets)
-    elif request.operation == "union":
-        result = set.union(*geneset_sets)
-    elif request.operation == "difference":
-        result = set.symmetric_difference(*geneset_sets)
+    try:
+        check_boolean_algebra_operation(request.operation, request.threshold, request.namespace)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Repeated requests are answered from the result cache, keyed by the operation and the
+    # current contents of the input genesets
+    cache_key = await async_crud.get_boolean_algebra_cache_key(
+        db, request.operation, request.gene_weaver_ids, request.threshold, request.namespace
+    )
+    if cache_key is not None:
+        body = await async_crud.get_cached_boolean_algebra_result(db, cache_key)
+        if body is not None:
+            return Response(body, media_type="application/json")
+
+    if request.namespace == DEFAULT_NAMESPACE and use_sql_set_operations(db.bind.url):
+        # The database computes the result and returns only the result genes
+        output = await async_crud.query_boolean_algebra(db, request.operation, request.gene_weaver_ids, request.threshold)
+        body = encode_boolean_algebra_result(output)
+    elif request.namespace != DEFAULT_NAMESPACE:
+        await async_crud.load_identifier_map(db)
+
+        # The genesets are translated from the identifier map, whose unigenes are already coded;
+        # translating and the set operation itself are CPU-bound, so they run on a worker thread
+        def compute() -> bytes:
+            translated = translate_genesets(request.gene_weaver_ids, request.namespace)
+            return encode_boolean_algebra_result(compute_boolean_algebra(translated, request.operation, request.threshold))
+
+        body = await run_in_threadpool(compute)
     else:
-        raise HTTPException(status_code=400, detail="Invalid operation")
+        # Convert GeneWeaver IDs to gene sets (sets of unigene values), fetched in one batch
+        unigenes = await async_crud.get_genesets_unigenes(db, request.gene_weaver_ids)
+        geneset_sets = [unigenes[gene_weaver_id] for gene_weaver_id in request.gene_weaver_ids]
 
-    return {"result": list(result)}
+        # The set operation itself is CPU-bound, so it runs on a worker thread
+        body = await run_in_threadpool(
+            lambda: encode_boolean_algebra_result(compute_boolean_algebra(geneset_sets, request.operation, request.threshold))
+        )
+    # Not cached if an input geneset changed while the result was computed
+    if cache_key is not None and cache_key == await async_crud.get_boolean_algebra_cache_key(
+        db, request.operation, request.gene_weaver_ids, request.threshold, request.namespace
+    ):
+        result_cache.put(cache_key, body)
+    return Response(body, media_type="application/json")
 
 @router.post("/run-boolean-algebra/")
 async def perform_boolean_algebra_endpoint(
-    background_tasks: BackgroundTasks,
     request: BooleanAlgebraRequest, 
-    db: Session = Depends(get_db)):
-    
+    db: AsyncSession = Depends(get_async_db)):
+
+    # Reject invalid requests up front rather than as a failed run
+    try:
+        check_boolean_algebra_operation(request.operation, request.threshold, request.namespace)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     # Create a new analysis run and get its ID
-    new_run = create_analysis_run(db)
+    new_run = await async_crud.create_analysis_run(db)
     run_id = new_run.id
 
-    # Add the analysis task to background tasks
-    background_tasks.add_task(
-        perform_boolean_algebra_analysis, 
-        run_id, 
-        db, 
-        request.gene_weaver_ids, 
-        request.operation
-    )
+    # Queue the analysis; it runs on the job executor with its own database session
+    try:
+        job_executor.submit(AnalysisJob(run_id, request.gene_weaver_ids, request.operation, request.threshold, request.namespace))
+    except JobQueueFull as e:
+        await async_crud.update_run_status_and_time(db, run_id, RunStatus.FAILED, end_time=True)
+        raise HTTPException(status_code=503, detail=f"{e}, try again later")
 
     return {"message": "Analysis started", "run_id": run_id}
 
 
-@router.get("/analysis-runs/", response_model=List[AnalysisRunSchema])
-def read_all_runs(db: Session = Depends(get_db)):
-    return get_all_runs(db)
+# Counters of the in-process geneset and result caches (hits, misses, evictions, size in
+# bytes), for sizing them
+@router.get("/cache/stats")
+def get_cache_stats():
+    return {"genesets": geneset_cache.stats(), "results": result_cache.stats()}
+
+
+# Activity of the database writer: queued writes, and how many commits they took
+@router.get("/database/stats")
+def get_database_stats():
+    return {"writes": write_queue.stats() if write_queue is not None else None}
+
+
+# Load of the analysis job executor: queue depth, running and finished jobs
+@router.get("/analysis-runs/stats")
+def get_job_stats():
+    return job_executor.stats()
 
 
+# Defining an endpoint for a page of analysis runs, newest first unless order=asc, optionally
+# filtered by status (repeatable) and by start time in [started_after, started_before). The
+# first page is requested without a cursor; each page returns the cursor of the next one.
+@router.get("/analysis-runs/", response_model=AnalysisRunsPage)
+async def read_all_runs(
+    status: Optional[List[RunStatus]] = Query(None),
+    started_after: Optional[datetime] = None,
+    started_before: Optional[datetime] = None,
+    order: str = Query("desc", regex="^(asc|desc)$"),
+    cursor: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=RUNS_PAGE_LIMIT),
+    db: AsyncSession = Depends(get_async_db)):
+    runs, next_cursor = await async_crud.get_runs_page(db, status, started_after, started_before, order, cursor, limit)
+    return AnalysisRunsPage(runs=[run._asdict() for run in runs], next_cursor=next_cursor)
+
+
+# Cancels a pending or running analysis run. A running run stops at its next checkpoint:
+# within a fraction of a second while its operation is computed in Python, but only once the
+# query returns when the operation runs in SQL. Nothing is saved for a canceled run.
 @router.delete("/analysis-runs/{run_id}", response_model=AnalysisRunSchema)
-def cancel_run(run_id: int, db: Session = Depends(get_db)):
+async def cancel_run(run_id: int, db: AsyncSession = Depends(get_async_db)):
     try:
-        run_to_cancel = crud_cancel_run(db, run_id)
+        run_to_cancel = await async_crud.cancel_run(db, run_id)
         if run_to_cancel is None:
             raise HTTPException(status_code=404, detail="Run not found")
         return run_to_cancel
@@ -140,9 +368,9 @@ def cancel_run(run_id: int, db: Session = Depends(get_db)):
         raise e
     
 @router.get("/analysis-runs/{run_id}", response_model=AnalysisRunSchema)
-def get_run_status(run_id: int, db: Session = Depends(get_db)):
-    status = get_runstatus(db, run_id)
-    if status == "not Found":
+async def get_run_status(run_id: int, db: AsyncSession = Depends(get_async_db)):
+    status = await async_crud.get_runstatus(db, run_id)
+    if status == "Not Found":
         raise HTTPException(status_code=404, detail="Run not found")
      # Construct a response that matches the AnalysisRunSchema
     response = {
@@ -153,10 +381,84 @@ def get_run_status(run_id: int, db: Session = Depends(get_db)):
     return response
 
 @router.get("/analysis-runs/{run_id}/result", response_model=AnalysisResultSchema)
-def get_result(run_id: int, db: Session = Depends(get_db)):
-    result = get_run_result(db, run_id)
+async def get_result(run_id: int, db: AsyncSession = Depends(get_async_db)):
+    result = await async_crud.get_run_result(db, run_id)
     if result is None:
         raise HTTPException(status_code=404, detail="Result not found for the run")
     return result
 
 
+# Finds the id of a run's result, or raises 404
+async def _get_result_id(db: AsyncSession, run_id: int) -> int:
+    result_id = await async_crud.get_run_result_id(db, run_id)
+    if result_id is None:
+        raise HTTPException(status_code=404, detail="Result not found for the run")
+    return result_id
+
+# Defining an endpoint for the number of genes in a run's result, without transferring them
+@router.get("/analysis-runs/{run_id}/result/count", response_model=ResultGeneCount)
+async def get_result_count(run_id: int, db: AsyncSession = Depends(get_async_db)):
+    result_id = await _get_result_id(db, run_id)
+    return ResultGeneCount(run_id=run_id, total=await async_crud.get_result_gene_count(db, result_id) or 0)
+
+# Defining an endpoint for a page of the sorted genes of a run's result. The first page is
+# requested without a cursor; each page returns the cursor of the next one.
+@router.get("/analysis-runs/{run_id}/result/genes", response_model=ResultGenesPage)
+async def get_result_genes(
+    run_id: int,
+    cursor: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    db: AsyncSession = Depends(get_async_db)):
+    result_id = await _get_result_id(db, run_id)
+    total = await async_crud.get_result_gene_count(db, result_id) or 0
+    genes, membership_counts, next_cursor = await async_crud.get_result_genes_page(db, result_id, cursor, limit)
+    return ResultGenesPage(
+        run_id=run_id, total=total, genes=genes, membership_counts=membership_counts, next_cursor=next_cursor
+    )
+
+
+# Media types of the formats /analysis-runs/{run_id}/result/download can stream
+RESULT_DOWNLOAD_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "tsv": "text/tab-separated-values"}
+
+# Number of stored result chunks read per query while streaming a download
+DOWNLOAD_CHUNK_BATCH = 10
+
+# Formats the genes of one result chunk as NDJSON or TSV lines
+def _format_result_lines(genes: List[str], membership_counts: Optional[List[int]], format: str) -> str:
+    if format == "ndjson":
+        if membership_counts is None:
+            return "".join(json.dumps({"gene": gene}) + "\n" for gene in genes)
+        return "".join(
+            json.dumps({"gene": gene, "membership_count": count}) + "\n" for gene, count in zip(genes, membership_counts)
+        )
+    if membership_counts is None:
+        return "".join(gene + "\n" for gene in genes)
+    return "".join(f"{gene}\t{count}\n" for gene, count in zip(genes, membership_counts))
+
+# Streams a result chunk by chunk, so that neither the server nor the client holds it whole.
+# The stream outlives the request's session, so it reads through a session of its own.
+async def _stream_result(result_id: int, format: str):
+    async with AsyncSessionLocal() as db:
+        after_chunk = -1
+        while True:
+            chunks = await async_crud.get_result_chunks(db, result_id, after_chunk, DOWNLOAD_CHUNK_BATCH)
+            if not chunks:
+                break
+            for chunk_index, genes, membership_counts in chunks:
+                if format == "tsv" and chunk_index == 0:
+                    yield "gene\tmembership_count\n" if membership_counts is not None else "gene\n"
+                yield _format_result_lines(genes, membership_counts, format)
+            after_chunk = chunks[-1][0]
+
+# Defining an endpoint to download a run's result as NDJSON (one {"gene": ...} object per line)
+# or TSV, sorted by gene
+@router.get("/analysis-runs/{run_id}/result/download")
+async def download_result(run_id: int, format: str = "ndjson", db: AsyncSession = Depends(get_async_db)):
+    if format not in RESULT_DOWNLOAD_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(RESULT_DOWNLOAD_MEDIA_TYPES)}")
+    result_id = await _get_result_id(db, run_id)
+    return StreamingResponse(
+        _stream_result(result_id, format),
+        media_type=RESULT_DOWNLOAD_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="run-{run_id}-result.{format}"'},
+    )
@@ -0,0 +1,101 @@
+# enrichment.py
+# Which stored genesets are enriched in a gene list: one-sided hypergeometric tests (the same
+# p-values as a one-sided Fisher's exact test) of the overlap of the list with every geneset,
+# and Benjamini-Hochberg correction of the p-values for the number of genesets tested.
+#
+# With a background of N genes, a list of n of them and a geneset of K, the overlap X is
+# hypergeometric and p = P(X >= observed overlap). The tail sums are computed for all genesets
+# at once with numpy: each starts from the probability of the observed overlap, taken from a
+# table of log factorials, and adds the next terms through their ratio to the previous one,
+# one step for every geneset at a time, until the terms no longer change any sum. The sum
+# always runs away from the mean of X (below the mean, p is 1 minus the lower tail), so the
+# terms shrink quickly and few steps are needed.
+
+from typing import NamedTuple
+import numpy as np
+
+# A tail sum stops once its next term is below this fraction of the sum
+TAIL_TOLERANCE = 1e-16
+
+
+def log_factorials(n: int) -> np.ndarray:
+    """log(i!) for i = 0..n."""
+    table = np.zeros(n + 1, dtype=np.float64)
+    np.cumsum(np.log(np.arange(1, n + 1, dtype=np.float64)), out=table[1:])
+    return table
+
+
+# Sums of the hypergeometric probabilities of i = start, start + step, ... up to the end of the
+# support, as (log of the first term, sum of the terms relative to the first). Terms that
+# are out of the support have a log of -inf. table holds log_factorials(background).
+def _tail_sums(table: np.ndarray, start: np.ndarray, sizes: np.ndarray, background: int, query_size: int, step: int):
+    others = background - sizes
+    lowest = np.maximum(0, query_size - others)
+    highest = np.minimum(sizes, query_size)
+    in_support = (start >= lowest) & (start <= highest)
+    i = np.clip(start, lowest, highest)
+    log_first = np.where(
+        in_support,
+        table[sizes] - table[i] - table[sizes - i]
+        + table[others] - table[query_size - i] - table[others - query_size + i]
+        - (table[background] - table[query_size] - table[background - query_size]),
+        -np.inf,
+    )
+
+    sums = np.ones(len(start), dtype=np.float64)
+    term = np.ones(len(start), dtype=np.float64)
+    active = np.flatnonzero(in_support & (i != (highest if step > 0 else lowest)))
+    while len(active):
+        current, size, other = i[active], sizes[active], others[active]
+        if step > 0:
+            ratio = (size - current) * (query_size - current) / ((current + 1) * (other - query_size + current + 1))
+        else:
+            ratio = current * (other - query_size + current) / ((size - current + 1) * (query_size - current + 1))
+        term[active] *= ratio
+        sums[active] += term[active]
+        i[active] += step
+        end = highest[active] if step > 0 else lowest[active]
+        active = active[(i[active] != end) & (term[active] > sums[active] * TAIL_TOLERANCE)]
+    return log_first, sums
+
+
+def hypergeometric_sf(overlaps: np.ndarray, sizes: np.ndarray, background: int, query_size: int) -> np.ndarray:
+    """P(X >= overlap) for each geneset, X being the overlap of query_size genes drawn at random
+    from background genes with the geneset's size genes."""
+    overlaps = np.asarray(overlaps, dtype=np.int64)
+    sizes = np.asarray(sizes, dtype=np.int64)
+    p_values = np.ones(len(overlaps), dtype=np.float64)
+    table = log_factorials(background)
+    # Above the mean the upper tail is summed; below it, the lower tail up to overlap - 1
+    upper = overlaps * background > query_size * sizes
+    log_first, sums = _tail_sums(table, overlaps[upper], sizes[upper], background, query_size, 1)
+    p_values[upper] = np.exp(log_first + np.log(sums))
+    lower = ~upper & (overlaps > 0)
+    log_first, sums = _tail_sums(table, overlaps[lower] - 1, sizes[lower], background, query_size, -1)
+    p_values[lower] = 1 - np.exp(log_first + np.log(sums))
+    return np.clip(p_values, 0, 1)
+
+
+def benjamini_hochberg(p_values: np.ndarray) -> np.ndarray:
+    """Benjamini-Hochberg adjusted p-values (q-values), in the order of p_values."""
+    order = np.argsort(p_values, kind="stable")
+    ranked = p_values[order] * len(p_values) / np.arange(1, len(p_values) + 1)
+    q_values = np.empty(len(p_values), dtype=np.float64)
+    q_values[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1)
+    return q_values
+
+
+class Enrichment(NamedTuple):
+    """Enrichment of a gene list in every geneset, in the order of the genesets given."""
+
+    expected: np.ndarray  # Mean overlap of a random list of the same size
+    p_values: np.ndarray
+    q_values: np.ndarray
+
+
+def enrichment(overlaps: np.ndarray, sizes: np.ndarray, background: int, query_size: int) -> Enrichment:
+    """Test a gene list of query_size genes, all in a background of background genes, for
+    enrichment in genesets of the given sizes that it overlaps by the given counts."""
+    p_values = hypergeometric_sf(overlaps, sizes, background, query_size)
+    expected = query_size * np.asarray(sizes, dtype=np.float64) / background if background else np.zeros(len(sizes))
+    return Enrichment(expected, p_values, benjamini_hochberg(p_values))
@@ -0,0 +1,153 @@
+# gene_index.py
+# In-memory inverted index from gene identifiers to the genesets that contain them.
+# Every identifier column of a geneset (Unigene members, Entrez, Ensembl, Gene Symbol, MGI,
+# HGNC and the other namespaces of GeneWeaver exports) is indexed, so "which genesets contain
+# Hs.233757?" is a dictionary lookup instead of a scan over every geneset.
+#
+# The index is built and kept up to date as described in lazy_index.py.
+
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from .lazy_index import LazyIndex
+from .models import Gene, GeneSet, geneset_genes
+
+# GeneSet columns whose identifiers are indexed, next to the Unigene members, by the header
+# of the export column they are read from
+EXPORT_COLUMNS = {
+    "entrez": "Entrez",
+    "ensembl_gene": "Ensembl Gene",
+    "ensembl_protein": "Ensembl Protein",
+    "ensembl_transcript": "Ensembl Transcript",
+    "gene_symbol": "Gene Symbol",
+    "unannotated": "Unannotated",
+    "mgi": "MGI",
+    "hgnc": "HGNC",
+    "rgd": "RGD",
+    "zfin": "ZFIN",
+    "flybase": "FlyBase",
+    "wormbase": "Wormbase",
+    "sgd": "SGD",
+    "mirbase": "miRBase",
+    "cgnc": "CGNC",
+}
+INDEXED_COLUMNS = tuple(EXPORT_COLUMNS)
+
+# Placeholder used by GeneWeaver exports for a missing identifier
+MISSING_IDENTIFIER = "-"
+
+
+# Splits a column value into identifiers, skipping empty and placeholder values.
+# Values may hold several identifiers separated by "|".
+def split_identifiers(value: Any) -> List[str]:
+    if value is None:
+        return []
+    return [
+        identifier for identifier in (part.strip() for part in str(value).split("|"))
+        if identifier and identifier != MISSING_IDENTIFIER
+    ]
+
+
+def geneset_identifiers(values: Dict[str, Any], unigenes: Iterable[str] = ()) -> Set[str]:
+    """Collect every indexed identifier of one geneset.
+
+    :param values: The geneset's column values, keyed by GeneSet attribute name.
+    :param unigenes: The geneset's Unigene members.
+    """
+    identifiers = set()
+    for column in INDEXED_COLUMNS:
+        identifiers.update(split_identifiers(values.get(column)))
+    for unigene in unigenes:
+        identifiers.update(split_identifiers(unigene))
+    return identifiers
+
+
+def read_identifier_rows(db: Session) -> Tuple[List[tuple], List[Tuple[int, str]]]:
+    """Read the indexed identifiers of every stored geneset.
+
+    Returns the rows of GeneWeaver ID and INDEXED_COLUMNS values, and the
+    (GeneWeaver ID, Unigene member) pairs.
+    """
+    columns = [getattr(GeneSet, column) for column in INDEXED_COLUMNS]
+    members = (
+        db.query(GeneSet.geneweaver_id, Gene.identifier)
+        .join(geneset_genes, geneset_genes.c.geneset_id == GeneSet.id)
+        .join(Gene, Gene.id == geneset_genes.c.gene_id)
+        .yield_per(10000)
+    )
+    return list(db.query(GeneSet.geneweaver_id, *columns).yield_per(10000)), list(members)
+
+
+class GeneIndex(LazyIndex):
+    """Thread-safe inverted index from gene identifiers to GeneWeaver IDs.
+
+    Each identifier maps to a posting list: a sorted array of the GeneWeaver IDs of the
+    genesets containing it. A forward map from GeneWeaver ID to identifiers makes updates
+    and deletes incremental. Genesets are added with the identifiers they contain.
+    """
+
+    def _clear(self):
+        self._postings: Dict[str, array] = {}
+        self._identifiers: Dict[int, Tuple[str, ...]] = {}
+
+    def _read(self, db: Session) -> Tuple[List[tuple], List[Tuple[int, str]]]:
+        return read_identifier_rows(db)
+
+    def _prepare(self, rows: Tuple[List[tuple], List[Tuple[int, str]]]) -> Tuple[Dict[str, array], Dict[int, Tuple[str, ...]]]:
+        geneset_rows, members = rows
+        identifiers = defaultdict(set)
+        for row in geneset_rows:
+            identifiers[row[0]].update(geneset_identifiers(dict(zip(INDEXED_COLUMNS, row[1:]))))
+        for geneweaver_id, identifier in members:
+            identifiers[geneweaver_id].update(split_identifiers(identifier))
+
+        postings = defaultdict(list)
+        for geneweaver_id, geneset_ids in identifiers.items():
+            for identifier in geneset_ids:
+                postings[identifier].append(geneweaver_id)
+        return (
+            {identifier: array("q", sorted(ids)) for identifier, ids in postings.items()},
+            {geneweaver_id: tuple(ids) for geneweaver_id, ids in identifiers.items()},
+        )
+
+    def _install(self, contents: Tuple[Dict[str, array], Dict[int, Tuple[str, ...]]]):
+        self._postings, self._identifiers = contents
+
+    def _add(self, geneweaver_id: int, identifiers: Iterable[str]):
+        self._remove(geneweaver_id)
+        identifiers = tuple(set(identifiers))
+        for identifier in identifiers:
+            posting = self._postings.setdefault(identifier, array("q"))
+            posting.insert(bisect_left(posting, geneweaver_id), geneweaver_id)
+        self._identifiers[geneweaver_id] = identifiers
+
+    def _remove(self, geneweaver_id: int):
+        for identifier in self._identifiers.pop(geneweaver_id, ()):
+            posting = self._postings[identifier]
+            position = bisect_left(posting, geneweaver_id)
+            if position < len(posting) and posting[position] == geneweaver_id:
+                del posting[position]
+            if not posting:
+                del self._postings[identifier]
+
+    def count(self, identifier: str) -> int:
+        """Number of genesets containing the identifier."""
+        posting = self._postings.get(identifier)
+        return len(posting) if posting is not None else 0
+
+    def lookup(self, identifier: str, offset: int = 0, limit: Optional[int] = None) -> List[int]:
+        """GeneWeaver IDs of the genesets containing the identifier, in ascending order."""
+        posting = self._postings.get(identifier)
+        if posting is None:
+            return []
+        end = len(posting) if limit is None else offset + limit
+        return posting[offset:end].tolist()
+
+    def __len__(self) -> int:
+        return len(self._postings)
+
+
+# Index shared by the application
+gene_index = GeneIndex()
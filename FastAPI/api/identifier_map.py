@@ -0,0 +1,250 @@
+# identifier_map.py
+# Translation of gene identifiers between namespaces: Unigene, Entrez, Ensembl Gene, Protein
+# and Transcript, Gene Symbol, MGI, HGNC, RGD, ZFIN and the other identifier columns of
+# GeneWeaver exports. Each stored geneset row lists identifiers of one gene in several
+# namespaces (its Unigene members and its other columns), so an identifier translates to every
+# identifier of the other namespace found in a row with it.
+#
+# Gene lists are translated through a dictionary from each identifier of the source namespace
+# to the identifiers of the target namespace found with it, built on first use and extended in
+# place as genesets are added. Stored genesets, translated by GeneWeaver ID for boolean algebra,
+# go through precomputed arrays instead: the distinct identifiers of each namespace are held in
+# a sorted numpy array, their codes being their positions in it, and the translation table of a
+# pair of namespaces is a CSR matrix from the codes of one to the codes of the other, so the
+# already coded unigenes of the genesets are translated with one gather of table rows. Tables
+# are built with numpy from the rows the first time a pair is used and kept until rows change.
+#
+# The rows are built and kept up to date as described in lazy_index.py.
+
+import hashlib
+import itertools
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Sequence, Set, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from .gene_index import INDEXED_COLUMNS, read_identifier_rows, split_identifiers
+from .lazy_index import LazyIndex
+from .similarity import MissingGenesets, _take_rows
+
+# Namespace of the geneset members that boolean algebra operates on
+DEFAULT_NAMESPACE = "unigene"
+
+# Every namespace identifiers translate between, named after the GeneSet attribute holding it
+NAMESPACES = (DEFAULT_NAMESPACE,) + INDEXED_COLUMNS
+
+
+# The distinct values of an integer array, sorted. Sorting and dropping repeats is much faster
+# than np.unique, which hashes the values in recent numpy versions.
+def _distinct(values: np.ndarray) -> np.ndarray:
+    values = np.sort(values)
+    keep = np.ones(len(values), dtype=bool)
+    np.not_equal(values[1:], values[:-1], out=keep[1:])
+    return values[keep]
+
+
+# Raises ValueError if namespace is not one of NAMESPACES
+def check_namespace(namespace: str):
+    if namespace not in NAMESPACES:
+        raise ValueError(f"Unsupported namespace: {namespace}; expected one of {', '.join(NAMESPACES)}")
+
+
+def geneset_namespaces(values: Dict[str, Any], unigenes: Iterable[str] = ()) -> Dict[str, Tuple[str, ...]]:
+    """Split the identifiers of one geneset by namespace, leaving out empty namespaces.
+
+    :param values: The geneset's column values, keyed by GeneSet attribute name.
+    :param unigenes: The geneset's Unigene members.
+    """
+    namespaces = {DEFAULT_NAMESPACE: tuple(dict.fromkeys(
+        identifier for unigene in unigenes for identifier in split_identifiers(unigene)
+    ))}
+    for column in INDEXED_COLUMNS:
+        namespaces[column] = tuple(dict.fromkeys(split_identifiers(values.get(column))))
+    return {namespace: identifiers for namespace, identifiers in namespaces.items() if identifiers}
+
+
+class TranslationTable:
+    """Identifiers of a source namespace linked to those of a target namespace.
+
+    Source identifier vocabulary[i] translates to target identifiers
+    targets[indices[indptr[i]:indptr[i + 1]]]. digest identifies the content of the table.
+    """
+
+    __slots__ = ("vocabulary", "targets", "target_objects", "indptr", "indices", "digest")
+
+    def __init__(self, vocabulary: np.ndarray, targets: np.ndarray, indptr: np.ndarray, indices: np.ndarray):
+        self.vocabulary = vocabulary
+        self.targets = targets
+        # The targets as Python strings, gathered without converting each one again
+        self.target_objects = targets.astype(object)
+        self.indptr = indptr
+        self.indices = indices
+        digest = hashlib.blake2b(digest_size=16)
+        for array in (vocabulary, targets, indptr, indices):
+            digest.update(array.dtype.str.encode())
+            digest.update(array.tobytes())
+        self.digest = digest.hexdigest()
+
+
+class IdentifierMap(LazyIndex):
+    """Thread-safe translation tables between identifier namespaces.
+
+    The identifiers of each geneset are kept by namespace, keyed by GeneWeaver ID. Tables are
+    built from them on first use and dropped whenever a geneset is added or removed; the
+    dictionaries of links between identifiers are only rebuilt when one is replaced or removed.
+    """
+
+    def _clear(self):
+        self._rows: Dict[int, Dict[str, Tuple[str, ...]]] = {}
+        self._reset_tables()
+
+    def _reset_tables(self):
+        self._sorted_ids: Optional[np.ndarray] = None
+        self._namespaces: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._tables: Dict[Tuple[str, str], TranslationTable] = {}
+        self._links: Dict[Tuple[str, str], Dict[str, Set[str]]] = {}
+
+    def _read(self, db: Session) -> Tuple[List[tuple], List[Tuple[int, str]]]:
+        return read_identifier_rows(db)
+
+    # The identifiers of each geneset, by namespace
+    def _prepare(self, rows: Tuple[List[tuple], List[Tuple[int, str]]]) -> Dict[int, Dict[str, Tuple[str, ...]]]:
+        geneset_rows, members = rows
+        values = {row[0]: dict(zip(INDEXED_COLUMNS, row[1:])) for row in geneset_rows}
+        unigenes = {geneweaver_id: [] for geneweaver_id in values}
+        for geneweaver_id, identifier in members:
+            unigenes[geneweaver_id].append(identifier)
+        return {
+            geneweaver_id: geneset_namespaces(values[geneweaver_id], unigenes[geneweaver_id])
+            for geneweaver_id in values
+        }
+
+    def _install(self, rows: Dict[int, Dict[str, Tuple[str, ...]]]):
+        self._rows = rows
+        self._reset_tables()
+
+    # Adds the identifiers of a geneset, by namespace, replacing any it had
+    def _add(self, geneweaver_id: int, namespaces: Dict[str, Tuple[str, ...]]):
+        links = {} if geneweaver_id in self._rows else self._links
+        self._rows[geneweaver_id] = namespaces
+        self._reset_tables()
+        for (source, target), pair_links in links.items():
+            _link(pair_links, namespaces, source, target)
+        self._links = links
+
+    def _remove(self, geneweaver_id: int):
+        if self._rows.pop(geneweaver_id, None) is not None:
+            self._reset_tables()
+
+    # GeneWeaver IDs of the genesets in row order, which is ascending
+    def _row_ids(self) -> np.ndarray:
+        if self._sorted_ids is None:
+            self._sorted_ids = np.array(sorted(self._rows), dtype=np.int64)
+        return self._sorted_ids
+
+    # The identifiers of a namespace: (sorted distinct identifiers, and a CSR matrix
+    # (indptr, codes) of the codes of each row's identifiers)
+    def _namespace(self, namespace: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        compiled = self._namespaces.get(namespace)
+        if compiled is None:
+            identifiers = [self._rows[geneweaver_id].get(namespace, ()) for geneweaver_id in self._row_ids().tolist()]
+            indptr = np.zeros(len(identifiers) + 1, dtype=np.int64)
+            np.cumsum(np.fromiter(map(len, identifiers), dtype=np.int64, count=len(identifiers)), out=indptr[1:])
+            vocabulary, codes = np.unique(np.array(list(itertools.chain.from_iterable(identifiers)), dtype=str), return_inverse=True)
+            compiled = self._namespaces[namespace] = (vocabulary, indptr, codes.reshape(-1).astype(np.int64))
+        return compiled
+
+    def table(self, source: str, target: str) -> TranslationTable:
+        """The translation table from identifiers of source to identifiers of target."""
+        check_namespace(source)
+        check_namespace(target)
+        with self._lock:
+            table = self._tables.get((source, target))
+            if table is None:
+                table = self._tables[source, target] = self._build_table(source, target)
+            return table
+
+    # Links every occurrence of a source identifier to the target identifiers of its row
+    def _build_table(self, source: str, target: str) -> TranslationTable:
+        vocabulary, source_indptr, source_codes = self._namespace(source)
+        targets, target_indptr, target_codes = self._namespace(target)
+        source_rows = np.repeat(np.arange(len(source_indptr) - 1, dtype=np.int64), np.diff(source_indptr))
+        links_indptr, linked = _take_rows(target_indptr, target_codes, source_rows)
+        width = max(len(targets), 1)
+        pairs = _distinct(np.repeat(source_codes, np.diff(links_indptr)) * width + linked)
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs // width, minlength=len(vocabulary)), out=indptr[1:])
+        return TranslationTable(vocabulary, targets, indptr, pairs % width)
+
+    def digest(self, source: str, target: str) -> str:
+        """Digest of the translation table from source to target, which changes with it."""
+        return self.table(source, target).digest
+
+    # The target identifiers found in a row with each source identifier
+    def _links_of(self, source: str, target: str) -> Dict[str, Set[str]]:
+        links = self._links.get((source, target))
+        if links is None:
+            links = self._links[source, target] = {}
+            for namespaces in self._rows.values():
+                _link(links, namespaces, source, target)
+        return links
+
+    def translate(self, genesets: Sequence[Iterable[str]], source: str, target: str) -> List[FrozenSet[str]]:
+        """Translate genesets of source identifiers into target identifiers.
+
+        Identifiers without a translation are left out, and an identifier with several
+        translations contributes all of them.
+        """
+        check_namespace(source)
+        check_namespace(target)
+        if source == target:
+            return [frozenset(geneset) for geneset in genesets]
+        with self._lock:
+            links = self._links_of(source, target)
+            return [frozenset(gene for identifier in geneset for gene in links.get(identifier, ())) for geneset in genesets]
+
+    def translate_genesets(self, gene_weaver_ids: Sequence[int], target: str, source: str = DEFAULT_NAMESPACE) -> List[FrozenSet[str]]:
+        """Translate the source identifiers of stored genesets into target identifiers.
+
+        Their identifiers are already coded, so unlike translate, no identifier is looked up.
+        Raises MissingGenesets for GeneWeaver IDs that have no identifiers.
+        """
+        check_namespace(source)
+        check_namespace(target)
+        with self._lock:
+            row_ids = self._row_ids()
+            requested = np.asarray(gene_weaver_ids, dtype=np.int64)
+            rows = np.searchsorted(row_ids, requested)
+            found = rows < len(row_ids)
+            found[found] = row_ids[rows[found]] == requested[found]
+            if not found.all():
+                raise MissingGenesets(list(dict.fromkeys(requested[~found].tolist())))
+            if source == target:
+                return [frozenset(self._rows[gene_weaver_id].get(source, ())) for gene_weaver_id in requested.tolist()]
+            _, indptr, codes = self._namespace(source)
+            table = self.table(source, target)
+        geneset_indptr, codes = _take_rows(indptr, codes, rows)
+        owners = np.repeat(np.arange(len(rows), dtype=np.int64), np.diff(geneset_indptr))
+        return _gather(table, owners, codes, len(rows))
+
+
+# Links the source identifiers of a row to its target identifiers
+def _link(links: Dict[str, Set[str]], namespaces: Dict[str, Tuple[str, ...]], source: str, target: str):
+    targets = namespaces.get(target)
+    if targets:
+        for identifier in namespaces.get(source, ()):
+            links.setdefault(identifier, set()).update(targets)
+
+
+# The target identifiers of source codes, as one set per geneset: owners holds the geneset
+# of each code, in ascending order
+def _gather(table: TranslationTable, owners: np.ndarray, codes: np.ndarray, n_genesets: int) -> List[FrozenSet[str]]:
+    indptr, translated = _take_rows(table.indptr, table.indices, codes)
+    width = max(len(table.targets), 1)
+    # Distinct (geneset, target identifier) pairs, sorted by geneset
+    pairs = _distinct(np.repeat(owners, np.diff(indptr)) * width + translated)
+    bounds = np.searchsorted(pairs // width, np.arange(n_genesets + 1))
+    genes = table.target_objects[pairs % width]
+    return [frozenset(genes[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+# Translation tables shared by the application
+identifier_map = IdentifierMap()
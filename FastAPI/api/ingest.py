@@ -0,0 +1,180 @@
+# ingest.py
+# Parses GeneWeaver export rows and loads them into the database in batches.
+# Rows are validated one at a time, but written with executemany-style inserts
+# and committed a batch at a time instead of one commit per row. Batches go through the
+# session's write queue when it has one, so a large upload does not hold the database's
+# write lock from start to finish; an upload that fails part way keeps the batches
+# committed before the failure.
+
+import codecs
+import csv
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Tuple, Union
+from fastapi import UploadFile
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from . import crud
+from .gene_index import EXPORT_COLUMNS
+from .schemas import GeneSetCreate
+
+# Number of parsed rows sent to the database in a single executemany call
+DEFAULT_BATCH_SIZE = 500
+
+# Number of bytes read from an upload at a time when streaming it
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+# Converts one row of a GeneWeaver export (keyed by column header) into a GeneSetCreate.
+# Raises ValueError or ValidationError when the row cannot be parsed.
+def parse_geneset_row(row: Dict[str, str]) -> GeneSetCreate:
+    geneweaver_id = row.get('GeneWeaver ID') or ''
+    if not geneweaver_id.strip():
+        raise ValueError("Missing 'GeneWeaver ID'")
+    entrez_value = int(row['Entrez']) if row.get('Entrez') else None
+    # Parse the 'Unigene' field and convert it to a list
+    unigene_list = row.get('Unigene', '').split('|') if row.get('Unigene') else []
+    # Every other identifier column is kept as it is, "|"-separated identifiers included
+    identifiers = {column: row.get(header) for column, header in EXPORT_COLUMNS.items() if column not in ('entrez', 'ensembl_gene')}
+    return GeneSetCreate(
+        geneweaver_id=int(geneweaver_id),
+        entrez=entrez_value,
+        ensembl_gene=row.get('Ensembl Gene', ''),
+        unigene=unigene_list,
+        **identifiers,
+    )
+
+
+# Groups an iterable into lists of at most batch_size items.
+def batched(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Parses one row into (line number, GeneSetCreate or None, error message or None).
+def _parse_line(line: int, row: Dict[str, str]) -> Tuple[int, Any, Any]:
+    try:
+        return line, parse_geneset_row(row), None
+    except (ValidationError, ValueError, TypeError) as e:
+        return line, None, str(e)
+
+
+# Parses rows lazily, yielding the result of _parse_line for each.
+# Line numbers are 1-based and account for the header line of the file.
+def parse_rows(rows: Iterable[Dict[str, str]], first_line: int = 2) -> Iterator[Tuple[int, Any, Any]]:
+    for line, row in enumerate(rows, start=first_line):
+        yield _parse_line(line, row)
+
+
+# Inserts and commits the valid genesets of one parsed batch, appending row errors to errors.
+# Returns the number of genesets inserted.
+def _write_batch(db: Session, batch: List[Tuple[int, Any, Any]], errors: List[Dict[str, Any]]) -> int:
+    valid = []
+    for line, geneset, error in batch:
+        if error is not None:
+            errors.append({"line": line, "error": error})
+        else:
+            valid.append((line, geneset))
+
+    created, rejected = crud.bulk_create_genesets(db, [geneset for _, geneset in valid])
+    for index, error in rejected:
+        errors.append({"line": valid[index][0], "error": error})
+    return created
+
+
+def ingest_rows(db: Session, rows: Iterable[Dict[str, str]], batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Any]:
+    """Validate and insert export rows, committing them batch_size rows at a time.
+
+    Rows that fail validation, or whose GeneWeaver ID already exists, are skipped and
+    reported in the returned "errors" list instead of aborting the whole upload.
+    """
+    inserted = 0
+    errors = []
+    for batch in batched(parse_rows(rows), batch_size):
+        inserted += _write_batch(db, batch, errors)
+
+    return {"inserted": inserted, "errors": errors}
+
+
+# Reads an upload chunk by chunk and yields its decoded lines (without line endings).
+# Only one chunk and one partial line are held in memory at a time.
+async def iter_upload_lines(file: UploadFile, chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+# Yields (line number, row) for each data row of a tab separated upload, keyed by the header
+# like csv.DictReader. Blank lines are skipped but still counted.
+async def iter_upload_rows(file: UploadFile, chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[Tuple[int, Dict[str, str]]]:
+    header = None
+    line_number = 0
+    async for line in iter_upload_lines(file, chunk_size):
+        line_number += 1
+        if not line:
+            continue
+        values = next(csv.reader([line], delimiter='\t'))
+        if header is None:
+            header = values
+            continue
+        yield line_number, dict(zip(header, values))
+
+
+# Reads the genes of an uploaded gene list in the format of sample_input_data.txt: a gene
+# identifier per line, optionally followed by tab separated values, which are ignored.
+async def read_upload_genes(file: UploadFile, chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[str]:
+    genes = []
+    async for line in iter_upload_lines(file, chunk_size):
+        identifier = line.split("\t", 1)[0].strip()
+        if identifier:
+            genes.append(identifier)
+    return genes
+
+
+# Calls func(session, *args) with the sync Session behind db. With an AsyncSession the
+# database calls inside func are awaited, so the event loop keeps serving other requests.
+async def _run_sync(db: Union[Session, AsyncSession], func: Callable[..., Any], *args: Any) -> Any:
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(func, *args)
+    return func(db, *args)
+
+
+async def ingest_upload(
+    db: Union[Session, AsyncSession],
+    file: UploadFile,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Dict[str, Any]:
+    """Stream an uploaded export into the database without reading it all into memory.
+
+    The file is decoded incrementally and committed in batches of batch_size rows, so
+    peak memory depends on chunk_size and batch_size only. db may be a Session or an
+    AsyncSession.
+    """
+    inserted = 0
+    errors = []
+    batch = []
+    async for line, row in iter_upload_rows(file, chunk_size):
+        batch.append(_parse_line(line, row))
+        if len(batch) >= batch_size:
+            inserted += await _run_sync(db, _write_batch, batch, errors)
+            batch = []
+    if batch:
+        inserted += await _run_sync(db, _write_batch, batch, errors)
+
+    return {"inserted": inserted, "errors": errors}
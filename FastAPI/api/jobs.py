@@ -0,0 +1,183 @@
+# jobs.py
+# Executes analysis runs submitted through /run-boolean-algebra/ outside of the request.
+# Submitted runs wait in a bounded in-memory queue until one of a fixed number of workers
+# picks them up, so a burst of submissions cannot starve the API of threads or connections.
+# Every job opens and closes its own database session.
+#
+# Workers are threads by default. With GENEWEAVER_JOB_EXECUTOR=process each worker thread
+# hands its job to a process pool instead, which keeps CPU-heavy analyses off the GIL.
+# Canceling a run (crud.cancel_run) is noticed at the checkpoints in
+# crud.perform_boolean_algebra_analysis, in either mode: between its phases, and between
+# blocks of genesets while the operation is computed in Python. An operation running in SQL
+# is not interrupted; the run stops once the query returns.
+
+import logging
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+from sqlalchemy.orm import Session
+from . import config, crud
+from .cache import geneset_cache
+from .identifier_map import DEFAULT_NAMESPACE, identifier_map
+
+logger = logging.getLogger(__name__)
+
+
+# Raised by JobExecutor.submit when the queue of waiting runs is full
+class JobQueueFull(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class AnalysisJob:
+    run_id: int
+    gene_weaver_ids: List[int]
+    operation: str
+    threshold: Optional[int] = None
+    namespace: str = DEFAULT_NAMESPACE
+
+
+def run_analysis_job(job: AnalysisJob, session_factory: Optional[Callable[[], Session]] = None):
+    """Run one analysis in its own session. Failures are recorded on the run by crud."""
+    if session_factory is None:
+        # Imported here so that worker processes set up their own engine
+        from .database import SessionLocal
+        session_factory = SessionLocal
+    db = session_factory()
+    try:
+        crud.perform_boolean_algebra_analysis(
+            job.run_id, db, job.gene_weaver_ids, job.operation, job.threshold, job.namespace
+        )
+    finally:
+        db.close()
+
+
+# Runs a job in a worker process. crud invalidates the geneset cache and the identifier map of
+# the parent process when genesets change, but not the copies of worker processes, so each job
+# starts with an empty geneset cache (a worker runs one job at a time) and a job translating
+# genesets into another namespace reloads the identifier map first. Otherwise a geneset deleted
+# and uploaded again with other genes would be computed on its old genes, and the result saved
+# under the key of its new contents.
+def run_analysis_job_in_process(job: AnalysisJob):
+    geneset_cache.clear()
+    if job.namespace != DEFAULT_NAMESPACE:
+        identifier_map.invalidate()
+    run_analysis_job(job)
+
+
+class JobExecutor:
+    """Bounded queue of analysis jobs served by a fixed pool of workers.
+
+    Worker threads are started on the first submission.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        workers: int = config.JOB_WORKERS,
+        executor: str = config.JOB_EXECUTOR,
+        queue_size: int = config.JOB_QUEUE_SIZE,
+    ):
+        if executor not in config.JOB_EXECUTOR_TYPES:
+            raise ValueError(f"executor must be one of {', '.join(config.JOB_EXECUTOR_TYPES)}")
+        self.session_factory = session_factory
+        self.workers = workers
+        self.executor = executor
+        self._queue: "queue.Queue[Optional[AnalysisJob]]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._threads: List[threading.Thread] = []
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._running = 0
+        self._unfinished = 0
+        self._completed = 0
+        self._failed = 0
+
+    def _start(self):
+        # Called with self._lock held
+        if self._threads:
+            return
+        if self.executor == "process":
+            self._process_pool = ProcessPoolExecutor(max_workers=self.workers)
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"analysis-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job: AnalysisJob):
+        """Queue a job, raising JobQueueFull rather than waiting when the queue is full."""
+        with self._lock:
+            self._start()
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise JobQueueFull(f"{self._queue.maxsize} analysis runs are already waiting")
+            self._unfinished += 1
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                self._running += 1
+            failed = False
+            try:
+                if self._process_pool is not None:
+                    self._process_pool.submit(run_analysis_job_in_process, job).result()
+                else:
+                    run_analysis_job(job, self.session_factory)
+            except Exception:
+                failed = True
+                logger.exception("Analysis run %s failed", job.run_id)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._unfinished -= 1
+                    if failed:
+                        self._failed += 1
+                    else:
+                        self._completed += 1
+                    self._idle.notify_all()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of jobs waiting for a worker."""
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, object]:
+        """Snapshot of the executor's load, for monitoring."""
+        with self._lock:
+            return {
+                "executor": self.executor,
+                "workers": self.workers,
+                "queue_depth": self._queue.qsize(),
+                "queue_size": self._queue.maxsize,
+                "running": self._running,
+                "completed": self._completed,
+                "failed": self._failed,
+            }
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Block until every submitted job has finished. Returns False on timeout."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._unfinished == 0, timeout)
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers once the jobs already queued have run."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=wait)
+            self._process_pool = None
+
+
+# Executor shared by the application
+job_executor = JobExecutor()
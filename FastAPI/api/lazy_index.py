@@ -0,0 +1,136 @@
+# lazy_index.py
+# Base of the in-memory indexes over the stored genesets: the gene -> genesets index
+# (gene_index.py), the identifier map (identifier_map.py), the similarity matrix
+# (similarity.py) and the LSH index (minhash.py).
+#
+# Each index is built from the database on first use and then kept up to date by crud, which
+# adds and removes genesets as it writes them. Changes made before the first build are
+# skipped, since the build reads them from the database. Each worker process holds its own
+# copy of every index.
+#
+# The lock is not held while a build reads the database: inside AsyncSession.run_sync those
+# reads are awaited, and other requests served on the same thread meanwhile would enter the
+# reentrant lock as if they held it. Instead, every change made while a build reads the
+# database is recorded, and applied again to the new contents once they are installed, so a
+# geneset written during a build is indexed whether or not the build read it. Adding a
+# geneset replaces whatever was indexed for it, so applying a change twice does no harm.
+#
+# A build reads the rows it needs from the database, then prepares the new contents from
+# them with run_off_loop: inside AsyncSession.run_sync only the reads happen on the event
+# loop's thread.
+
+import threading
+from typing import Any, Dict, List, Tuple
+from sqlalchemy.orm import Session
+from .concurrency import run_off_loop
+
+# Value recorded for a removed geneset in the changes made during a build
+_REMOVED = object()
+
+
+class LazyIndex:
+    """Thread-safe index of the stored genesets, keyed by GeneWeaver ID, built on first use.
+
+    Subclasses implement _clear, dropping the contents of the index, _read, reading the
+    rows the index is built from, _prepare, computing new contents from those rows without
+    touching the index, _install, replacing the contents with those, and _add and _remove,
+    applying the change of one geneset to loaded contents. _read and _prepare run while
+    genesets may be added and removed; the others are called with the lock held.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._builds: Dict[int, List[Tuple[int, Any]]] = {}  # Changes made during each build in progress
+        self._next_build = 0
+        self._clear()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def invalidate(self):
+        """Drop the contents so that they are rebuilt from the database on next use.
+
+        Builds in progress are discarded rather than installed.
+        """
+        with self._lock:
+            self._clear()
+            self._loaded = False
+            self._builds = {}
+
+    def build(self, db: Session) -> bool:
+        """Rebuild the whole index from the genesets stored in the database.
+
+        Returns False if the index was invalidated meanwhile, leaving it unloaded.
+        """
+        build = self._start_build()
+        try:
+            contents = run_off_loop(self._prepare, self._read(db))
+        except BaseException:
+            with self._lock:
+                self._builds.pop(build, None)
+            raise
+        return self._finish_build(build, contents)
+
+    def ensure_loaded(self, db: Session):
+        """Build the index from the database unless it is already loaded."""
+        while not self._loaded:
+            self.build(db)
+
+    # Starts recording the changes made until _finish_build, returning the build's key
+    def _start_build(self) -> int:
+        with self._lock:
+            build = self._next_build
+            self._next_build += 1
+            self._builds[build] = []
+            return build
+
+    # Installs the contents read by a build and applies the changes made since it started
+    def _finish_build(self, build: int, contents: Any) -> bool:
+        with self._lock:
+            changes = self._builds.pop(build, None)
+            if changes is None:
+                return False
+            self._install(contents)
+            for geneweaver_id, value in changes:
+                if value is _REMOVED:
+                    self._remove(geneweaver_id)
+                else:
+                    self._add(geneweaver_id, value)
+            self._loaded = True
+            return True
+
+    def add(self, geneweaver_id: int, value: Any):
+        """Index a geneset, replacing anything previously indexed for it."""
+        with self._lock:
+            for changes in self._builds.values():
+                changes.append((geneweaver_id, value))
+            if self._loaded:
+                self._add(geneweaver_id, value)
+
+    def remove(self, geneweaver_id: int):
+        """Remove a geneset from the index."""
+        with self._lock:
+            for changes in self._builds.values():
+                changes.append((geneweaver_id, _REMOVED))
+            if self._loaded:
+                self._remove(geneweaver_id)
+
+    def _clear(self):
+        raise NotImplementedError
+
+    def _read(self, db: Session) -> Any:
+        raise NotImplementedError
+
+    def _prepare(self, rows: Any) -> Any:
+        raise NotImplementedError
+
+    def _install(self, contents: Any):
+        raise NotImplementedError
+
+    def _add(self, geneweaver_id: int, value: Any):
+        raise NotImplementedError
+
+    def _remove(self, geneweaver_id: int):
+        raise NotImplementedError
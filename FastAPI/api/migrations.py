@@ -0,0 +1,215 @@
+# migrations.py
+# Upgrades existing geneweaver.db files to the current schema.
+# Older databases stored each geneset's members as a JSON string ({"unigene": [...]}) in the
+# genesets.unigene column; these are copied into the normalized genes/geneset_genes tables.
+# Columns and indexes added to existing tables since a database was created are added in
+# place, and genesets stored before genesets.content_hash or genesets.minhash existed get
+# their digest and MinHash signature computed. Memberships in the "-" placeholder of
+# GeneWeaver exports, stored as a gene by older versions, are removed.
+# Analysis results stored as JSON are moved into compact result blobs.
+#
+# Migrations run when the application starts (database.init_database), and can also be run
+# by hand, which creates any missing tables first:
+#     python -m api.migrations
+
+import json
+from typing import List
+from sqlalchemy import Table, bindparam, delete, inspect, null, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from . import crud, minhash
+from .gene_index import MISSING_IDENTIFIER
+from .models import AnalysisResult, Base, Gene, GeneSet, geneset_genes
+
+# Number of legacy genesets converted per transaction
+MIGRATION_BATCH_SIZE = 500
+
+
+def migrate_unigene_json(engine: Engine) -> int:
+    """Copy memberships out of the legacy genesets.unigene JSON column.
+
+    Only genesets without any membership rows are converted, so the migration can be run
+    repeatedly. The legacy column is left in place. Returns the number of genesets converted.
+    """
+    columns = {column["name"] for column in inspect(engine).get_columns("genesets")}
+    if "unigene" not in columns:
+        return 0
+
+    migrated = 0
+    last_id = 0
+    with Session(engine) as db:
+        while True:
+            rows = db.execute(
+                text(
+                    "SELECT id, unigene FROM genesets "
+                    "WHERE id > :last_id AND unigene IS NOT NULL "
+                    "AND id NOT IN (SELECT geneset_id FROM geneset_genes) "
+                    "ORDER BY id LIMIT :limit"
+                ),
+                {"last_id": last_id, "limit": MIGRATION_BATCH_SIZE},
+            ).all()
+            if not rows:
+                break
+
+            crud.add_geneset_genes(db, {row.id: crud.unigene_members(sorted(crud.extract_genes_from_json(row.unigene))) for row in rows})
+            db.commit()
+            migrated += len(rows)
+            last_id = rows[-1].id
+    return migrated
+
+
+def add_missing_columns(engine: Engine, table: Table) -> List[str]:
+    """Add columns defined on the model but missing from an existing table.
+
+    New columns are added as nullable, without defaults. Returns the names of the added columns.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table(table.name):
+        return []
+    existing = {column["name"] for column in inspector.get_columns(table.name)}
+    added = []
+    with engine.begin() as conn:
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                added.append(column.name)
+    return added
+
+
+def add_missing_indexes(engine: Engine, table: Table) -> List[str]:
+    """Create indexes defined on the model but missing from an existing table.
+
+    Returns the names of the created indexes.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table(table.name):
+        return []
+    existing = {index["name"] for index in inspector.get_indexes(table.name)}
+    added = []
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(engine)
+            added.append(index.name)
+    return added
+
+
+def drop_missing_identifier_members(engine: Engine) -> int:
+    """Remove the "-" placeholder from the members of genesets (see crud.unigene_members).
+
+    The digest and MinHash signature of the genesets that had it are cleared, to be computed
+    again from their remaining members by the backfills. Returns the number of genesets changed.
+    """
+    table = GeneSet.__table__
+    with Session(engine) as db:
+        gene_id = db.query(Gene.id).filter(Gene.identifier == MISSING_IDENTIFIER).scalar()
+        if gene_id is None:
+            return 0
+        geneset_ids = [row[0] for row in db.query(geneset_genes.c.geneset_id).filter(geneset_genes.c.gene_id == gene_id)]
+        db.execute(delete(geneset_genes).where(geneset_genes.c.gene_id == gene_id))
+        db.execute(delete(Gene.__table__).where(Gene.__table__.c.id == gene_id))
+        for chunk in crud._chunks(geneset_ids):
+            db.execute(update(table).where(table.c.id.in_(chunk)).values(content_hash=None, minhash=None))
+        db.commit()
+    return len(geneset_ids)
+
+
+def backfill_content_hashes(engine: Engine) -> int:
+    """Compute genesets.content_hash for genesets stored without one.
+
+    Returns the number of genesets updated.
+    """
+    table = GeneSet.__table__
+    statement = (
+        update(table).where(table.c.id == bindparam("row_id")).values(content_hash=bindparam("content_hash"))
+    )
+    updated = 0
+    with Session(engine) as db:
+        while True:
+            rows = (
+                db.query(GeneSet.id, GeneSet.geneweaver_id).filter(GeneSet.content_hash.is_(None))
+                .order_by(GeneSet.id).limit(MIGRATION_BATCH_SIZE).all()
+            )
+            if not rows:
+                break
+            unigenes = crud._load_genesets_unigenes(db, [row.geneweaver_id for row in rows])
+            db.execute(statement, [
+                {"row_id": row.id, "content_hash": crud.unigene_content_hash(unigenes.get(row.geneweaver_id, ()))}
+                for row in rows
+            ])
+            db.commit()
+            updated += len(rows)
+    return updated
+
+
+def backfill_minhash_signatures(engine: Engine) -> int:
+    """Compute genesets.minhash for genesets stored without a signature.
+
+    Returns the number of genesets updated.
+    """
+    table = GeneSet.__table__
+    statement = update(table).where(table.c.id == bindparam("row_id")).values(minhash=bindparam("signature"))
+    updated = 0
+    with Session(engine) as db:
+        while True:
+            rows = (
+                db.query(GeneSet.id, GeneSet.geneweaver_id).filter(GeneSet.minhash.is_(None))
+                .order_by(GeneSet.id).limit(MIGRATION_BATCH_SIZE).all()
+            )
+            if not rows:
+                break
+            unigenes = crud._load_genesets_unigenes(db, [row.geneweaver_id for row in rows])
+            db.execute(statement, [
+                {"row_id": row.id, "signature": minhash.encode_signature(minhash.signature(unigenes.get(row.geneweaver_id, ())))}
+                for row in rows
+            ])
+            db.commit()
+            updated += len(rows)
+    return updated
+
+
+def migrate_result_blobs(engine: Engine) -> int:
+    """Move the results of analysis runs stored as JSON into compact result blobs.
+
+    The JSON is cleared once its genes are stored in a blob, which frees most of the space
+    results take. Returns the number of results converted.
+    """
+    migrated = 0
+    with Session(engine) as db:
+        while True:
+            results = (
+                db.query(AnalysisResult)
+                .filter(AnalysisResult.blob_id.is_(None), AnalysisResult.result_data.isnot(None))
+                .order_by(AnalysisResult.id).limit(MIGRATION_BATCH_SIZE).all()
+            )
+            if not results:
+                break
+            for result in results:
+                data = result.result_data
+                if isinstance(data, str):
+                    data = json.loads(data)
+                result.blob_id = crud.store_result_blob(db, data.get("result", []), data.get("membership_counts"))
+                # SQL NULL rather than a JSON null, which would still match the query above
+                result.result_data = null()
+            db.commit()
+            migrated += len(results)
+    return migrated
+
+
+def run_migrations(engine: Engine):
+    """Apply every migration to the database behind engine."""
+    for table in Base.metadata.sorted_tables:
+        add_missing_columns(engine, table)
+        add_missing_indexes(engine, table)
+    migrate_unigene_json(engine)
+    drop_missing_identifier_members(engine)
+    backfill_content_hashes(engine)
+    backfill_minhash_signatures(engine)
+    migrate_result_blobs(engine)
+
+
+if __name__ == "__main__":
+    from .database import init_database
+
+    init_database()
+    print("Database schema is up to date.")
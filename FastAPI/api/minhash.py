@@ -0,0 +1,211 @@
+# minhash.py
+# MinHash signatures of genesets and an LSH (locality-sensitive hashing) index over them, to
+# find the genesets most similar to a gene list without comparing it with every geneset.
+#
+# A signature holds, for each of NUM_PERM hash functions, the smallest hash of the geneset's
+# unigene members; two signatures agree at a position with probability equal to the Jaccard
+# similarity of the sets. Signatures are computed when genesets are stored, and kept in
+# genesets.minhash (NUM_PERM little-endian uint32 values), so the index is loaded without
+# reading any members.
+#
+# The index splits each signature into GENEWEAVER_MINHASH_BANDS bands of NUM_PERM // bands
+# values. Genesets sharing a whole band with the query are its candidates: with b bands of r
+# values, a geneset of Jaccard similarity s is a candidate with probability 1 - (1 - s^r)^b.
+# The default of 42 bands of 3 finds 68% of genesets at s = 0.3 and 99.5% at s = 0.5, while
+# genesets at s = 0.05 are candidates 0.5% of the time. crud re-ranks the candidates exactly.
+#
+# The index is built from the stored signatures and kept up to date as described in
+# lazy_index.py.
+
+import hashlib
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from . import config
+from .lazy_index import LazyIndex
+from .models import GeneSet
+
+# Hash functions per signature. Stored signatures are only comparable with signatures of the
+# same NUM_PERM and SEED; changing either requires recomputing genesets.minhash.
+NUM_PERM = 128
+SEED = 1
+
+# Signature values are (a * hash + b) mod MERSENNE_PRIME, truncated to 32 bits
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+_random = np.random.RandomState(SEED)
+_A = _random.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+_B = _random.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+# Signature of an empty geneset, which is never a candidate
+EMPTY_SIGNATURE = np.full(NUM_PERM, 0xFFFFFFFF, dtype=np.uint32)
+
+# Members hashed at once while computing a signature, bounding its temporary arrays
+SIGNATURE_CHUNK_SIZE = 4096
+
+
+# Stable 32-bit hashes of gene identifiers (Python's hash() differs between processes)
+def _gene_hashes(identifiers: Iterable[str]) -> np.ndarray:
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(identifier.encode(), digest_size=4).digest(), "little") for identifier in identifiers),
+        dtype=np.uint64,
+    )
+
+
+def signature(identifiers: Iterable[str]) -> np.ndarray:
+    """MinHash signature of a set of gene identifiers: NUM_PERM uint32 values."""
+    hashes = _gene_hashes(set(identifiers))
+    minimums = EMPTY_SIGNATURE.astype(np.uint64)
+    for start in range(0, len(hashes), SIGNATURE_CHUNK_SIZE):
+        chunk = hashes[start:start + SIGNATURE_CHUNK_SIZE]
+        # a * hash + b < 2^64 for 32-bit a, b and hash, so nothing overflows
+        values = ((_A[:, None] * chunk[None, :] + _B[:, None]) % _MERSENNE_PRIME) & _MAX_HASH
+        minimums = np.minimum(minimums, values.min(axis=1))
+    return minimums.astype(np.uint32)
+
+
+def encode_signature(values: np.ndarray) -> bytes:
+    """The genesets.minhash value of a signature."""
+    return values.astype("<u4").tobytes()
+
+
+def decode_signature(data: Optional[bytes]) -> Optional[np.ndarray]:
+    """A signature stored by encode_signature, or None if it is missing or of another NUM_PERM."""
+    if data is None or len(data) != NUM_PERM * 4:
+        return None
+    return np.frombuffer(data, dtype="<u4").astype(np.uint32)
+
+
+def estimate_jaccard(first: np.ndarray, second: np.ndarray) -> float:
+    """Jaccard similarity estimated from two signatures."""
+    return float(np.mean(first == second))
+
+
+def band_rows(bands: int) -> int:
+    """Signature values per band, raising ValueError if there are more bands than values."""
+    if not 1 <= bands <= NUM_PERM:
+        raise ValueError(f"MinHash bands must be between 1 and {NUM_PERM}, got {bands}")
+    return NUM_PERM // bands
+
+
+# Odd multipliers mixing the values of a band into one 64-bit key
+_BAND_MULTIPLIERS = (_random.randint(0, 1 << 63, size=NUM_PERM, dtype=np.uint64) << np.uint64(1)) | np.uint64(1)
+
+
+# Key of each band of each signature: (signatures x bands) uint64 values, equal for equal
+# bands. Keys are sums of the values times _BAND_MULTIPLIERS, wrapping around modulo 2^64;
+# the rare unequal bands with equal keys only add candidates.
+def _band_keys(signatures: np.ndarray, bands: int) -> np.ndarray:
+    rows = band_rows(bands)
+    values = signatures[:, :bands * rows].astype(np.uint64).reshape(len(signatures), bands, rows)
+    return (values * _BAND_MULTIPLIERS[:rows]).sum(axis=2, dtype=np.uint64)
+
+
+class LSHIndex(LazyIndex):
+    """Thread-safe LSH banding index of MinHash signatures, keyed by GeneWeaver ID.
+
+    For each band, the band keys of all genesets are kept sorted, so the genesets sharing
+    a band with a query are found by binary search. Genesets added since the arrays were
+    last sorted are folded in by the next query; removed ones are skipped until then.
+    """
+
+    def __init__(self, bands: Optional[int] = None):
+        self.bands = config.MINHASH_BANDS if bands is None else bands
+        band_rows(self.bands)
+        super().__init__()
+
+    def _clear(self):
+        self._ids = np.zeros(0, dtype=np.int64)  # GeneWeaver ID of each row
+        self._sorted_keys = np.zeros((self.bands, 0), dtype=np.uint64)  # Band keys, sorted per band
+        self._sorted_rows = np.zeros((self.bands, 0), dtype=np.int64)  # Row of each sorted key
+        self._live: Dict[int, int] = {}  # GeneWeaver ID -> live row
+        self._pending: Dict[int, np.ndarray] = {}
+
+    # The (GeneWeaver ID, genesets.minhash) pairs of the stored genesets
+    def _read(self, db: Session) -> List[Tuple[int, Optional[bytes]]]:
+        return list(db.query(GeneSet.geneweaver_id, GeneSet.minhash).yield_per(10000))
+
+    # Sorts the band keys of the stored signatures in a new LSHIndex
+    def _prepare(self, rows: List[Tuple[int, Optional[bytes]]]) -> "LSHIndex":
+        index = LSHIndex(self.bands)
+        for geneweaver_id, data in rows:
+            values = decode_signature(data)
+            if values is not None:
+                index._pending[geneweaver_id] = values
+        index._assemble()
+        return index
+
+    def _install(self, index: "LSHIndex"):
+        self._clear()
+        self._ids, self._sorted_keys, self._sorted_rows = index._ids, index._sorted_keys, index._sorted_rows
+        self._live = index._live
+
+    # Indexes a geneset's signature, replacing any previous one
+    def _add(self, geneweaver_id: int, values: np.ndarray):
+        self._live.pop(geneweaver_id, None)
+        self._pending[geneweaver_id] = values
+
+    def _remove(self, geneweaver_id: int):
+        self._live.pop(geneweaver_id, None)
+        self._pending.pop(geneweaver_id, None)
+
+    # Drops removed genesets from the sorted band arrays and merges in the pending ones.
+    # Empty genesets are left out, since their signatures would all collide. Must hold the lock.
+    def _assemble(self):
+        if not self._pending and len(self._live) == len(self._ids):
+            return
+        alive = np.zeros(len(self._ids), dtype=bool)
+        alive[np.fromiter(self._live.values(), dtype=np.int64, count=len(self._live))] = True
+        # Every band holds every row once, so each keeps the same number of them, in order
+        kept = alive[self._sorted_rows]
+        new_row = np.cumsum(alive) - 1
+        sorted_rows = new_row[self._sorted_rows[kept]].reshape(self.bands, -1)
+        sorted_keys = self._sorted_keys[kept].reshape(self.bands, -1)
+        ids = self._ids[alive]
+
+        pending = {
+            geneweaver_id: values for geneweaver_id, values in self._pending.items()
+            if not np.array_equal(values, EMPTY_SIGNATURE)
+        }
+        if pending:
+            keys = _band_keys(np.stack(list(pending.values())), self.bands).T
+            rows = np.broadcast_to(np.arange(len(ids), len(ids) + len(pending)), keys.shape)
+            sorted_keys = np.concatenate([sorted_keys, keys], axis=1)
+            sorted_rows = np.concatenate([sorted_rows, rows], axis=1)
+            ids = np.concatenate([ids, np.fromiter(pending, dtype=np.int64, count=len(pending))])
+            # Stable sorting finds the already sorted run, so this costs little more than a merge
+            order = np.argsort(sorted_keys, axis=1, kind="stable")
+            sorted_keys = np.take_along_axis(sorted_keys, order, axis=1)
+            sorted_rows = np.take_along_axis(sorted_rows, order, axis=1)
+
+        self._ids, self._sorted_keys, self._sorted_rows = ids, sorted_keys, sorted_rows
+        self._live = {int(geneweaver_id): row for row, geneweaver_id in enumerate(ids)}
+        self._pending = {}
+
+    def candidates(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """GeneWeaver IDs of the genesets sharing at least one band with a signature, and the
+        number of bands each shares, most shared first."""
+        if np.array_equal(values, EMPTY_SIGNATURE):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        query_keys = _band_keys(values[None, :], self.bands)[0]
+        with self._lock:
+            self._assemble()
+            ids, sorted_keys, sorted_rows = self._ids, self._sorted_keys, self._sorted_rows
+        # The assembled arrays are replaced rather than modified, so they are read unlocked
+        matches = []
+        for band in range(self.bands):
+            keys = sorted_keys[band]
+            first = np.searchsorted(keys, query_keys[band], side="left")
+            last = np.searchsorted(keys, query_keys[band], side="right")
+            matches.append(sorted_rows[band, first:last])
+        rows, shared = np.unique(np.concatenate(matches), return_counts=True)
+        order = np.argsort(-shared, kind="stable")
+        return ids[rows[order]], shared[order]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._live) + len(self._pending)
+
+
+# Index shared by the application
+lsh_index = LSHIndex()
@@ -3,7 +3,7 @@
 # These are typically classes that SQLAlchemy uses to map objects to database tables. 
 # Each class corresponds to a table in the database, and each attribute represents a column.
 
-from sqlalchemy import Column, Integer, String, Enum, DateTime, JSON,ForeignKey
+from sqlalchemy import Column, Integer, String, Enum, DateTime, JSON,ForeignKey, Table, Index, Boolean, LargeBinary
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
@@ -15,7 +15,24 @@ class BooleanAlgebraType(Enum):
     INTERSECTION = "intersection"
     UNION = "union"
     DIFFERENCE = "difference"
+    THRESHOLD = "threshold"
  
+# Association table recording which genes belong to which geneset.
+# The primary key serves lookups by geneset; the gene_id index serves "which genesets contain gene X".
+geneset_genes = Table(
+    "geneset_genes",
+    Base.metadata,
+    Column("geneset_id", Integer, ForeignKey("genesets.id", ondelete="CASCADE"), primary_key=True),
+    Column("gene_id", Integer, ForeignKey("genes.id"), primary_key=True, index=True),
+)
+
+# Gene dictionary: interns each gene identifier (e.g. a Unigene ID) to an integer id
+class Gene(Base):
+    __tablename__ = "genes"
+
+    id = Column(Integer, primary_key=True)
+    identifier = Column(String, unique=True, index=True, nullable=False)
+
 class GeneSet(Base):
     __tablename__ = "genesets"
     
@@ -23,7 +40,31 @@ class GeneSet(Base):
     geneweaver_id = Column(Integer, unique=True, index=True)
     entrez = Column(String)
     ensembl_gene = Column(String)
-    unigene = Column(String)
+    gene_symbol = Column(String)
+    hgnc = Column(String)
+    mgi = Column(String)
+    # The other identifier columns of GeneWeaver exports; like the columns above, a value may
+    # hold several identifiers separated by "|", or "-" for none
+    ensembl_protein = Column(String)
+    ensembl_transcript = Column(String)
+    unannotated = Column(String)
+    rgd = Column(String)
+    zfin = Column(String)
+    flybase = Column(String)
+    wormbase = Column(String)
+    sgd = Column(String)
+    mirbase = Column(String)
+    cgnc = Column(String)
+    # Digest of the unigene members (crud.unigene_content_hash), changing whenever they do
+    content_hash = Column(String)
+    # MinHash signature of the unigene members (minhash.signature), indexed by minhash.lsh_index
+    minhash = Column(LargeBinary)
+    genes = relationship("Gene", secondary=geneset_genes, order_by=Gene.id)
+
+    # Unigene members in the {"unigene": [...]} shape the API has always returned
+    @property
+    def unigene(self):
+        return {"unigene": [gene.identifier for gene in self.genes]}
 
 # Enum for run status
 class RunStatus(enum.Enum):
@@ -40,12 +81,51 @@ class AnalysisRun(Base):
     status = Column(Enum(RunStatus), default=RunStatus.PENDING)
     start_time = Column(DateTime(timezone=True), server_default=func.now())  # Auto-set at creation
     end_time = Column(DateTime(timezone=True))  # Set when analysis completes or fails
-    result = relationship("AnalysisResult", back_populates="run", uselist=False)
-    
+    # Set instead of saving a new result when an earlier run's result was reused
+    cached_result_id = Column(Integer, ForeignKey('analysis_results.id', use_alter=True))
+    result = relationship("AnalysisResult", back_populates="run", uselist=False, foreign_keys="AnalysisResult.run_id")
+    # /analysis-runs/ pages through runs in (start_time, id) order, filtered by status or not;
+    # (id, status) answers status lookups from the index alone
+    __table_args__ = (
+        Index("ix_analysis_runs_status_start_time", "status", "start_time", "id"),
+        Index("ix_analysis_runs_start_time", "start_time", "id"),
+        Index("ix_analysis_runs_id_status", "id", "status"),
+    )
+
 
 class AnalysisResult(Base):
     __tablename__ = 'analysis_results'
     id = Column(Integer, primary_key=True, index=True)
-    run_id = Column(Integer, ForeignKey('analysis_runs.id'))
-    result_data = Column(JSON)  # Store result as JSON
-    run = relationship("AnalysisRun", back_populates="result")
\ No newline at end of file
+    run_id = Column(Integer, ForeignKey('analysis_runs.id'), index=True)
+    # Results saved before result_blobs existed; newer results leave this empty, and
+    # crud.get_run_result decodes their blob into the same JSON shape
+    result_data = Column(JSON)
+    blob_id = Column(Integer, ForeignKey('result_blobs.id'))
+    # Identifies the operation and input contents (crud.boolean_algebra_cache_key), so that
+    # later runs with the same inputs can reuse this result
+    cache_key = Column(String, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    run = relationship("AnalysisRun", back_populates="result", foreign_keys=[run_id])
+
+
+# The genes of an analysis result in compact binary form (see result_codec). Results with the
+# same genes and membership counts share one blob, found by content_hash.
+class ResultBlob(Base):
+    __tablename__ = 'result_blobs'
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String, unique=True, index=True, nullable=False)
+    gene_count = Column(Integer, nullable=False)
+    has_membership_counts = Column(Boolean, nullable=False, default=False)
+
+
+# A blob's genes, sorted and split into chunks of crud.RESULT_CHUNK_SIZE, so that a page of
+# genes can be read without loading and decoding the whole result. last_gene locates the
+# chunk holding the genes after a pagination cursor.
+class ResultBlobChunk(Base):
+    __tablename__ = 'result_blob_chunks'
+    blob_id = Column(Integer, ForeignKey('result_blobs.id', ondelete="CASCADE"), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+    last_gene = Column(String, nullable=False)
+    data = Column(LargeBinary, nullable=False)  # result_codec.encode_chunk of the chunk's genes
+
+    __table_args__ = (Index("ix_result_blob_chunks_last_gene", "blob_id", "last_gene"),)
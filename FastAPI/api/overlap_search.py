@@ -0,0 +1,131 @@
+# overlap_search.py
+# Exact top-k search of the stored genesets that overlap a gene list the most, ranked by raw
+# overlap (intersection count), Jaccard similarity or overlap coefficient.
+#
+# The search walks the posting lists of the query's genes (the rows of the membership matrix
+# of api.similarity that contain each gene), shortest first, adding one to a dense per-row
+# accumulator for every geneset on the list. Common genes have the longest lists, and walking
+# them is most of the work, so the search stops walking once a max-score bound shows that a
+# geneset missing from every list walked so far can no longer make the top k: a geneset
+# matching none of the walked genes shares at most the remaining genes with the query. The
+# remaining lists are then only probed, by binary search, for the genesets already seen that
+# can still make the top k (or walked, when that is cheaper), so the results are the same as
+# scoring every geneset. The bound holds sooner the more the best genesets share with the
+# query; it never holds for the overlap coefficient (see _unseen_bound).
+
+from typing import List, NamedTuple
+import numpy as np
+
+# Scores the search ranks by: "intersection" is the raw overlap, "overlap" the overlap coefficient
+METRICS = ("intersection", "jaccard", "overlap")
+
+# The bound is checked against the k best genesets seen (the leaders) before each posting
+# list. Finding them is a pass over the accumulator, so they are only found again once
+# len(accumulator) / LEADERS_REFRESH_DIVISOR more posting entries have been walked.
+LEADERS_REFRESH_DIVISOR = 1
+
+
+class TopOverlaps(NamedTuple):
+    """The best genesets of a search, best first, and how the posting lists were read."""
+
+    gene_weaver_ids: np.ndarray
+    scores: np.ndarray
+    intersections: np.ndarray
+    sizes: np.ndarray
+    walked: int  # Posting lists walked in full
+    probed: int  # Posting lists only probed for the genesets that could still make the top k
+
+
+# Scores of genesets of the given sizes sharing intersections genes with a query of query_size,
+# as similarity.similarity_scores computes them for a single row
+def _scores(metric: str, intersections: np.ndarray, sizes: np.ndarray, query_size: int) -> np.ndarray:
+    if metric == "intersection":
+        return intersections.astype(np.float64)
+    if metric == "jaccard":
+        denominator = query_size + sizes - intersections
+    else:
+        denominator = np.minimum(sizes, query_size)
+    scores = np.zeros(len(intersections), dtype=np.float64)
+    np.divide(intersections, denominator, out=scores, where=denominator > 0)
+    return scores
+
+
+# Highest score of a geneset that is on none of the posting lists walked so far, and so shares
+# at most remaining genes with the query: jaccard = o / (|q| + |s| - o) <= o / |q| as |s| >= o,
+# and a geneset made of o query genes has an overlap coefficient of 1, so the overlap
+# coefficient never bounds the search.
+def _unseen_bound(metric: str, remaining: int, query_size: int) -> float:
+    if metric == "intersection":
+        return float(remaining)
+    if metric == "jaccard":
+        return remaining / query_size
+    return 1.0 if remaining else 0.0
+
+
+def top_k_overlaps(postings: List[np.ndarray], query_size: int, row_sizes: np.ndarray, row_ids: np.ndarray, k: int, metric: str) -> TopOverlaps:
+    """The k genesets with the best positive scores for a query, ties broken by GeneWeaver ID.
+
+    :param postings: The ascending matrix rows containing each gene of the query.
+    :param query_size: The number of distinct genes in the query, found in the matrix or not.
+    :param row_sizes: The number of genes of every row.
+    :param row_ids: The GeneWeaver ID of every row, -1 for rows without a current geneset.
+    """
+    live = row_ids >= 0
+    postings = sorted((posting for posting in postings if len(posting)), key=len)
+    counts = np.zeros(len(row_sizes), dtype=np.int64)
+    refresh_work = max(len(counts) // LEADERS_REFRESH_DIVISOR, 1)
+    work = 0
+    leaders = None
+    candidates = None
+    walked = 0
+    for walked, posting in enumerate(postings):
+        work += len(posting)
+        remaining = len(postings) - walked
+        bound = _unseen_bound(metric, remaining, query_size)
+        # No geneset seen has a better score than one on every list walked, so the bound
+        # cannot hold before it falls below that
+        if bound < _unseen_bound(metric, walked, query_size):
+            if work >= refresh_work:
+                work = 0
+                seen = np.flatnonzero((counts > 0) & live)
+                if len(seen) >= k:
+                    leaders = seen[np.argpartition(_scores(metric, counts[seen], row_sizes[seen], query_size), -k)[-k:]]
+            if leaders is not None:
+                # Scores from the counts so far are lower bounds, so the top k will score at
+                # least as much as the worst of any k genesets
+                threshold = _scores(metric, counts[leaders], row_sizes[leaders], query_size).min()
+                if bound < threshold:
+                    # Only the genesets seen that could still reach the threshold are kept
+                    seen = np.flatnonzero((counts > 0) & live)
+                    best_case = np.minimum(counts[seen] + remaining, row_sizes[seen])
+                    candidates = seen[_scores(metric, best_case, row_sizes[seen], query_size) >= threshold]
+                    break
+        counts[posting] += 1
+    else:
+        walked = len(postings)
+
+    probed = 0
+    if candidates is None:
+        candidates = np.flatnonzero((counts > 0) & live)
+    else:
+        for position in range(walked, len(postings)):
+            posting = postings[position]
+            remaining = len(postings) - position
+            # As lists run out, candidates that can no longer reach the k-th best are dropped
+            scores = _scores(metric, counts[candidates], row_sizes[candidates], query_size)
+            threshold = np.partition(scores, -k)[-k]
+            best_case = np.minimum(counts[candidates] + remaining, row_sizes[candidates])
+            candidates = candidates[_scores(metric, best_case, row_sizes[candidates], query_size) >= threshold]
+            # A probe is a binary search per candidate, so lists costing less are walked instead
+            if len(posting) <= len(candidates) * len(posting).bit_length():
+                counts[posting] += 1
+                walked += 1
+                continue
+            positions = np.minimum(np.searchsorted(posting, candidates), len(posting) - 1)
+            counts[candidates] += posting[positions] == candidates
+            probed += 1
+
+    scores = _scores(metric, counts[candidates], row_sizes[candidates], query_size)
+    best = np.lexsort((row_ids[candidates], -scores))[:k]
+    rows = candidates[best]
+    return TopOverlaps(row_ids[rows], scores[best], counts[rows], row_sizes[rows], walked, probed)
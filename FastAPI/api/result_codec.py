@@ -0,0 +1,76 @@
+# result_codec.py
+# Compact binary encoding of analysis result chunks.
+# A chunk holds the interned gene ids (genes.id) of up to crud.RESULT_CHUNK_SIZE result genes,
+# and for threshold results the membership count of each. The ids are sorted and stored as
+# deltas from the previous id, and every number is written as a LEB128 varint, so that most
+# take one or two bytes; the varints are then zlib compressed. Encoding and decoding work on
+# whole numpy arrays rather than one number at a time.
+#
+# Layout before compression: varint count, count id deltas, then count membership counts if
+# the chunk has them.
+
+import zlib
+from typing import Optional, Sequence, Tuple
+import numpy as np
+
+# Most bytes a varint of a 64-bit unsigned integer can take
+_MAX_VARINT_BYTES = 10
+
+
+def encode_varints(values: np.ndarray) -> bytes:
+    """Encode non-negative integers as consecutive LEB128 varints."""
+    values = np.asarray(values, dtype=np.uint64)
+    if values.size == 0:
+        return b""
+    # Number of 7-bit groups each value needs
+    lengths = np.ones(values.size, dtype=np.int64)
+    for groups in range(1, _MAX_VARINT_BYTES):
+        lengths += values >= np.uint64(1 << (7 * groups))
+    offsets = np.cumsum(lengths) - lengths
+    out = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for group in range(int(lengths.max())):
+        present = lengths > group
+        byte = (values[present] >> np.uint64(7 * group)) & np.uint64(0x7F)
+        # The high bit marks every byte but the last of a value
+        byte |= np.where(lengths[present] > group + 1, np.uint64(0x80), np.uint64(0))
+        out[offsets[present] + group] = byte.astype(np.uint8)
+    return out.tobytes()
+
+
+def decode_varints(data: bytes) -> np.ndarray:
+    """Decode consecutive LEB128 varints into an array of uint64."""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)
+    if raw.size and (ends.size == 0 or ends[-1] != raw.size - 1):
+        raise ValueError("truncated varint")
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    values = np.zeros(ends.size, dtype=np.uint64)
+    for group in range(int(lengths.max()) if lengths.size else 0):
+        present = lengths > group
+        byte = raw[starts[present] + group].astype(np.uint64) & np.uint64(0x7F)
+        values[present] |= byte << np.uint64(7 * group)
+    return values
+
+
+def encode_chunk(gene_ids: Sequence[int], membership_counts: Optional[Sequence[int]] = None) -> bytes:
+    """Encode a chunk of distinct gene ids, with the membership count of each if given.
+
+    The chunk is stored in ascending id order, so counts are reordered along with the ids.
+    """
+    ids = np.asarray(gene_ids, dtype=np.int64)
+    order = np.argsort(ids, kind="stable")
+    ids = ids[order]
+    parts = [np.array([ids.size]), np.diff(ids, prepend=0)]
+    if membership_counts is not None:
+        parts.append(np.asarray(membership_counts, dtype=np.int64)[order])
+    return zlib.compress(encode_varints(np.concatenate(parts)))
+
+
+def decode_chunk(data: bytes) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Decode a chunk into its gene ids in ascending order and their counts, or None."""
+    values = decode_varints(zlib.decompress(data)).astype(np.int64)
+    count = int(values[0])
+    ids = np.cumsum(values[1:count + 1])
+    counts = values[count + 1:] if values.size > count + 1 else None
+    return ids, counts
@@ -35,6 +35,19 @@ class GeneSetCreate(BaseModel):
     entrez: Optional[int] = Field(alias='Entrez')
     ensembl_gene: Optional[str] = Field(alias='Ensembl Gene')
     unigene: List[str] = Field(default_factory=list, alias='Unigene')
+    gene_symbol: Optional[str] = Field(None, alias='Gene Symbol')
+    hgnc: Optional[str] = Field(None, alias='HGNC')
+    mgi: Optional[str] = Field(None, alias='MGI')
+    ensembl_protein: Optional[str] = Field(None, alias='Ensembl Protein')
+    ensembl_transcript: Optional[str] = Field(None, alias='Ensembl Transcript')
+    unannotated: Optional[str] = Field(None, alias='Unannotated')
+    rgd: Optional[str] = Field(None, alias='RGD')
+    zfin: Optional[str] = Field(None, alias='ZFIN')
+    flybase: Optional[str] = Field(None, alias='FlyBase')
+    wormbase: Optional[str] = Field(None, alias='Wormbase')
+    sgd: Optional[str] = Field(None, alias='SGD')
+    mirbase: Optional[str] = Field(None, alias='miRBase')
+    cgnc: Optional[str] = Field(None, alias='CGNC')
 
     # Method to create a GeneSetCreate instance from GeneSetFileRow
     @classmethod
@@ -51,13 +64,26 @@ class GeneSetCreate(BaseModel):
 
     class Config:
         allow_population_by_field_name = True  # Allows the use of aliases
+        populate_by_name = True  # Same option under its pydantic v2 name
         orm_mode = True
     
 class GeneSetUpdate(BaseModel):
     # geneweaver_id: Optional[int]
-    entrez: Optional[int]
-    ensembl_gene: Optional[str]
-    # gene_symbol: Optional[str]
+    entrez: Optional[int] = None
+    ensembl_gene: Optional[str] = None
+    gene_symbol: Optional[str] = None
+    hgnc: Optional[str] = None
+    mgi: Optional[str] = None
+    ensembl_protein: Optional[str] = None
+    ensembl_transcript: Optional[str] = None
+    unannotated: Optional[str] = None
+    rgd: Optional[str] = None
+    zfin: Optional[str] = None
+    flybase: Optional[str] = None
+    wormbase: Optional[str] = None
+    sgd: Optional[str] = None
+    mirbase: Optional[str] = None
+    cgnc: Optional[str] = None
     # other_fields: Optional[dict]
 
     class Config:
@@ -75,14 +101,90 @@ class GeneSet(BaseModel):
     geneweaver_id: int
     entrez: Optional[int]
     ensembl_gene: Optional[str]
+    gene_symbol: Optional[str] = None
+    hgnc: Optional[str] = None
+    mgi: Optional[str] = None
+    ensembl_protein: Optional[str] = None
+    ensembl_transcript: Optional[str] = None
+    unannotated: Optional[str] = None
+    rgd: Optional[str] = None
+    zfin: Optional[str] = None
+    flybase: Optional[str] = None
+    wormbase: Optional[str] = None
+    sgd: Optional[str] = None
+    mirbase: Optional[str] = None
+    cgnc: Optional[str] = None
     unigene: Optional[dict]
 
     class Config:
         orm_mode = True
        
+# A page of the GeneWeaver IDs of the genesets containing one gene identifier
+class GeneGenesetsPage(BaseModel):
+    identifier: str
+    total: int  # Number of genesets containing the identifier
+    offset: int
+    limit: int
+    geneweaver_ids: List[int]
+
+# Batch lookup of the genesets containing each of several gene identifiers
+class GeneLookupRequest(BaseModel):
+    identifiers: List[str]
+    offset: int = Field(0, ge=0)
+    limit: int = Field(100, ge=1, le=10000)
+
+# Genesets whose pairwise overlaps /genesets/similarity computes, and the scores wanted
+class SimilarityRequest(BaseModel):
+    gene_weaver_ids: List[int]
+    metrics: List[str] = ["jaccard", "overlap", "dice"]
+
+# A gene list whose most similar stored genesets /genesets/similar finds
+class SimilarGenesetsRequest(BaseModel):
+    genes: List[str]
+    k: int = Field(10, ge=1, le=1000)
+    metric: str = "jaccard"  # "jaccard", "overlap" or "dice"
+
+# A stored geneset found by /genesets/similar or /genesets/overlaps, with its exact score
+class SimilarGeneset(BaseModel):
+    geneweaver_id: int
+    score: float
+    intersection: int  # Genes shared with the query
+    size: int
+
+class SimilarGenesetsResponse(BaseModel):
+    candidates: int  # Genesets sharing an LSH band with the query, which were scored exactly
+    genesets: List[SimilarGeneset]  # Best first
+
+# The genesets overlapping a gene list the most, and how /genesets/overlaps read the posting
+# lists of its genes
+class GenesetOverlapsResponse(BaseModel):
+    genes: int  # Distinct genes in the query
+    walked: int  # Genes whose posting lists were walked in full
+    probed: int  # Common genes only looked up for the genesets that could still make the top k
+    genesets: List[SimilarGeneset]  # Best first
+
+# A stored geneset enriched in a gene list, as found by /genesets/enrichment
+class EnrichedGeneset(BaseModel):
+    geneweaver_id: int
+    overlap: int  # Genes shared with the list
+    size: int
+    expected: float  # Mean overlap of a random list of as many background genes
+    fold_enrichment: float  # overlap / expected
+    p_value: float  # One-sided hypergeometric (Fisher's exact) test
+    q_value: float  # Benjamini-Hochberg adjusted over every geneset tested
+
+class EnrichmentResponse(BaseModel):
+    genes: int  # Distinct genes in the list
+    matched: int  # Unigenes of the list, once translated from its namespace, in the background
+    background: int  # Genes in at least one stored geneset
+    tested: int  # Genesets tested, which the q-values correct for
+    genesets: List[EnrichedGeneset]  # Lowest p-value first
+
 class BooleanAlgebraRequest(BaseModel):
-    operation: str  # "intersection", "union", or "difference"
-    gene_weaver_ids: List[int]  # List of GeneWeaver IDs to perform the operation on
+    operation: str  # "intersection", "union", "difference" or "threshold"
+    gene_weaver_ids: List[int] = Field(..., min_length=1)  # List of GeneWeaver IDs to perform the operation on
+    threshold: Optional[int] = Field(None, ge=1)  # For "threshold": minimum number of genesets a gene must be in
+    namespace: str = "unigene"  # Namespace of the genes operated on and returned, e.g. "entrez" or "gene_symbol"
  
 class AnalysisRunSchema(BaseModel):
     id:int
@@ -90,9 +192,36 @@ class AnalysisRunSchema(BaseModel):
     start_time:Optional[datetime] = None
     end_time:Optional[datetime] = None
     result: Optional[str] = None
+    cached_result_id: Optional[int] = None  # Set when the run reused an earlier run's result
     class Config: # set in the Config class to allow ORM models to be parsed automatically by Pydantic
         orm_mode = True
 
+# An analysis run as listed by /analysis-runs/, with the id of its result instead of the result
+class AnalysisRunSummary(BaseModel):
+    id: int
+    status: RunStatus
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    result_id: Optional[int] = None  # The run's own result or the earlier one it reused
+
+# A page of analysis runs; pass next_cursor as cursor for the next page
+class AnalysisRunsPage(BaseModel):
+    runs: List[AnalysisRunSummary]
+    next_cursor: Optional[int] = None  # None on the last page
+
+# A page of the sorted genes of an analysis result; pass next_cursor as cursor for the next page
+class ResultGenesPage(BaseModel):
+    run_id: int
+    total: int  # Number of genes in the whole result
+    genes: List[str]
+    membership_counts: Optional[List[int]] = None  # Threshold results: the count of each gene
+    next_cursor: Optional[str] = None  # None on the last page
+
+# Size of an analysis result, answered without reading its genes
+class ResultGeneCount(BaseModel):
+    run_id: int
+    total: int
+
 class AnalysisResultSchema(BaseModel):
     id: int
     run_id: int
@@ -0,0 +1,346 @@
+# similarity.py
+# Overlap between stored genesets: Jaccard, overlap coefficient and Dice scores for blocks of
+# genesets, computed from their intersection counts.
+#
+# The genesets are held as a sparse geneset x gene membership matrix in CSR form (one row of
+# sorted gene columns per geneset). Intersection counts of a block of rows against a block
+# of columns are the sparse product A[rows] . A[cols]^T, computed with numpy by expanding the
+# products gene by gene, then summing them per (row, column) pair with a bincount, so the
+# work is proportional to the shared memberships rather than to the number of genes.
+#
+# The matrix is built and kept up to date as described in lazy_index.py: created genesets
+# are appended as new rows, and replaced or deleted ones leave dead rows behind until enough
+# accumulate to compact the matrix.
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from .lazy_index import LazyIndex
+from .models import Gene, GeneSet, geneset_genes
+
+# Similarity scores derived from the intersection counts
+METRICS = ("jaccard", "overlap", "dice")
+
+# Most (row, column) products expanded at once while computing intersection counts
+PAIR_CHUNK_SIZE = 1 << 22
+
+
+# Gathers rows of a CSR matrix into a new CSR matrix (indptr, indices)
+def _take_rows(indptr: np.ndarray, indices: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    sub_indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=sub_indptr[1:])
+    # Position of each gathered entry in indices: its row's start plus its offset in the row
+    positions = np.arange(sub_indptr[-1], dtype=np.int64) + np.repeat(starts - sub_indptr[:-1], lengths)
+    return sub_indptr, indices[positions]
+
+
+# The order that sorts gene columns stably, as np.argsort(indices, kind="stable") does, by a
+# radix sort on 16-bit digits, least significant first: numpy sorts 16-bit keys in linear
+# time, and wider ones in n log n.
+def _stable_column_order(indices: np.ndarray, n_columns: int) -> np.ndarray:
+    order = np.argsort((indices & 0xFFFF).astype(np.uint16), kind="stable")
+    shift = 16
+    while n_columns > 1 << shift:
+        digits = ((indices[order] >> shift) & 0xFFFF).astype(np.uint16)
+        order = order[np.argsort(digits, kind="stable")]
+        shift += 16
+    return order
+
+
+def intersection_counts(
+    row_indptr: np.ndarray, row_indices: np.ndarray, col_indptr: np.ndarray, col_indices: np.ndarray
+) -> np.ndarray:
+    """Intersection counts of every row set with every column set, as the sparse product R . C^T.
+
+    Both operands are CSR matrices of sorted, distinct gene columns. Returns a dense
+    (rows x columns) int64 array.
+    """
+    n_rows, n_cols = len(row_indptr) - 1, len(col_indptr) - 1
+    counts = np.zeros(n_rows * n_cols, dtype=np.int64)
+    if n_rows == 0 or n_cols == 0:
+        return counts.reshape(n_rows, n_cols)
+
+    # C^T: the column sets containing each gene, sorted by gene
+    col_of_entry = np.repeat(np.arange(n_cols, dtype=np.int64), np.diff(col_indptr))
+    order = np.argsort(col_indices, kind="stable")
+    genes = col_indices[order]
+    cols_by_gene = col_of_entry[order]
+
+    # Each entry (row, gene) of R multiplies with every column set containing the gene
+    row_of_entry = np.repeat(np.arange(n_rows, dtype=np.int64), np.diff(row_indptr))
+    first = np.searchsorted(genes, row_indices, side="left")
+    products = np.searchsorted(genes, row_indices, side="right") - first
+    shared = products > 0
+    row_of_entry, first, products = row_of_entry[shared], first[shared], products[shared]
+
+    # Expand the products in chunks of about PAIR_CHUNK_SIZE to bound memory
+    ends = np.cumsum(products)
+    boundaries = np.searchsorted(ends, np.arange(PAIR_CHUNK_SIZE, ends[-1] if len(ends) else 0, PAIR_CHUNK_SIZE), side="right")
+    for start, stop in zip(np.r_[0, boundaries], np.r_[boundaries, len(products)]):
+        if start == stop:
+            continue
+        chunk_products = products[start:stop]
+        chunk_starts = np.cumsum(chunk_products) - chunk_products
+        total = int(chunk_products.sum())
+        positions = np.arange(total, dtype=np.int64) + np.repeat(first[start:stop] - chunk_starts, chunk_products)
+        pairs = np.repeat(row_of_entry[start:stop], chunk_products) * n_cols + cols_by_gene[positions]
+        counts += np.bincount(pairs, minlength=n_rows * n_cols)
+    return counts.reshape(n_rows, n_cols)
+
+
+def similarity_scores(
+    intersections: np.ndarray, row_sizes: np.ndarray, col_sizes: np.ndarray, metrics: Iterable[str] = METRICS
+) -> Dict[str, np.ndarray]:
+    """Scores of each metric from intersection counts and set sizes; 0 where both sets are empty.
+
+    jaccard = |A & B| / |A | B|, overlap = |A & B| / min(|A|, |B|), dice = 2 |A & B| / (|A| + |B|)
+    """
+    row_sizes = row_sizes.astype(np.float64)[:, None]
+    col_sizes = col_sizes.astype(np.float64)[None, :]
+    denominators = {
+        "jaccard": lambda: row_sizes + col_sizes - intersections,
+        "overlap": lambda: np.minimum(row_sizes, col_sizes),
+        "dice": lambda: (row_sizes + col_sizes) / 2,
+    }
+    scores = {}
+    for metric in metrics:
+        denominator = np.broadcast_to(denominators[metric](), intersections.shape)
+        score = np.zeros(intersections.shape, dtype=np.float64)
+        np.divide(intersections, denominator, out=score, where=denominator > 0)
+        scores[metric] = score
+    return scores
+
+
+class MissingGenesets(LookupError):
+    """Raised for GeneWeaver IDs that have no row in the matrix."""
+
+    def __init__(self, gene_weaver_ids: List[int]):
+        super().__init__(gene_weaver_ids)
+        self.gene_weaver_ids = gene_weaver_ids
+
+
+class SimilarityBlock(NamedTuple):
+    """Overlap of a block of row genesets with a block of column genesets."""
+
+    row_sizes: np.ndarray
+    col_sizes: np.ndarray
+    intersections: np.ndarray  # (rows x columns) intersection counts
+    scores: Dict[str, np.ndarray]  # (rows x columns) scores of each requested metric
+
+
+class SimilarityIndex(LazyIndex):
+    """Thread-safe geneset x gene membership matrix, keyed by GeneWeaver ID.
+
+    Gene identifiers are interned to matrix columns as they are first seen. Rows live in
+    one CSR matrix plus a list of rows added since it was last assembled; queries fold the
+    pending rows in before reading it.
+    """
+
+    def _clear(self):
+        self._columns: Dict[str, int] = {}
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._indices = np.zeros(0, dtype=np.int32)
+        self._row_of: Dict[int, int] = {}  # GeneWeaver ID -> live row
+        self._rows = 0  # Rows in the assembled matrix, dead ones included
+        self._pending: List[Tuple[int, np.ndarray]] = []
+        self._transposed: Optional[Tuple[np.ndarray, np.ndarray]] = None  # See _posting_lists
+        self._row_ids: Optional[np.ndarray] = None
+        self._background: Optional[np.ndarray] = None  # See _background_genes
+
+    def _intern(self, identifiers: Iterable[str]) -> np.ndarray:
+        columns = self._columns
+        intern = lambda identifier: columns.setdefault(identifier, len(columns))
+        return np.unique(np.fromiter(map(intern, identifiers), dtype=np.int32))
+
+    # The GeneWeaver IDs of the stored genesets, and their (GeneWeaver ID, member) pairs
+    def _read(self, db: Session) -> Tuple[List[int], List[Tuple[int, str]]]:
+        members = (
+            db.query(GeneSet.geneweaver_id, Gene.identifier)
+            .join(geneset_genes, geneset_genes.c.geneset_id == GeneSet.id)
+            .join(Gene, Gene.id == geneset_genes.c.gene_id)
+            .yield_per(10000)
+        )
+        return [geneweaver_id for geneweaver_id, in db.query(GeneSet.geneweaver_id)], list(members)
+
+    # Assembles the matrix of the genesets in a new SimilarityIndex
+    def _prepare(self, rows: Tuple[List[int], List[Tuple[int, str]]]) -> "SimilarityIndex":
+        geneset_ids, pairs = rows
+        members: Dict[int, List[str]] = {geneweaver_id: [] for geneweaver_id in geneset_ids}
+        for geneweaver_id, identifier in pairs:
+            members.setdefault(geneweaver_id, []).append(identifier)
+
+        matrix = SimilarityIndex()
+        matrix._pending = [(geneweaver_id, matrix._intern(genes)) for geneweaver_id, genes in members.items()]
+        matrix._assemble()
+        return matrix
+
+    def _install(self, matrix: "SimilarityIndex"):
+        self._clear()
+        self._columns, self._indptr, self._indices = matrix._columns, matrix._indptr, matrix._indices
+        self._row_of, self._rows = matrix._row_of, matrix._rows
+
+    # Adds a geneset's row, with the columns of its unigenes, replacing any previous one
+    def _add(self, geneweaver_id: int, unigenes: Iterable[str]):
+        self._row_of.pop(geneweaver_id, None)
+        self._row_ids = None
+        self._background = None
+        self._pending.append((geneweaver_id, self._intern(unigenes)))
+
+    def _remove(self, geneweaver_id: int):
+        self._row_of.pop(geneweaver_id, None)
+        self._row_ids = None
+        self._background = None
+        self._pending = [(pending_id, row) for pending_id, row in self._pending if pending_id != geneweaver_id]
+
+    # Appends the pending rows to the CSR matrix, compacting it first if most of its rows
+    # are dead. Must hold the lock.
+    def _assemble(self):
+        if not self._pending:
+            return
+        if len(self._row_of) < self._rows / 2:
+            live = sorted(self._row_of.items(), key=lambda item: item[1])
+            rows = np.array([row for _, row in live], dtype=np.int64)
+            self._indptr, self._indices = _take_rows(self._indptr, self._indices, rows)
+            self._row_of = {geneweaver_id: row for row, (geneweaver_id, _) in enumerate(live)}
+            self._rows = len(live)
+        # A geneset added twice since the last assembly keeps its latest row
+        latest = dict(self._pending)
+        lengths = np.array([len(row) for row in latest.values()], dtype=np.int64)
+        self._indptr = np.concatenate([self._indptr, self._indptr[-1] + np.cumsum(lengths)])
+        self._indices = np.concatenate([self._indices, *latest.values()])
+        for offset, geneweaver_id in enumerate(latest):
+            self._row_of[geneweaver_id] = self._rows + offset
+        self._rows += len(latest)
+        self._pending = []
+        self._transposed = None
+        self._row_ids = None
+        self._background = None
+
+    # The matrix transposed into posting lists (CSC form: the ascending rows containing each
+    # gene column), and the GeneWeaver ID of each row, -1 for dead rows. Both are kept until
+    # the matrix or its live rows change. Must hold the lock, with the matrix assembled.
+    def _posting_lists(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self._transposed is None:
+            col_indptr = np.zeros(len(self._columns) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self._indices, minlength=len(self._columns)), out=col_indptr[1:])
+            # Stable sorting keeps the rows of each column in ascending order
+            row_of_entry = np.repeat(np.arange(self._rows, dtype=np.int64), np.diff(self._indptr))
+            self._transposed = col_indptr, row_of_entry[_stable_column_order(self._indices, len(self._columns))]
+        if self._row_ids is None:
+            row_ids = np.full(self._rows, -1, dtype=np.int64)
+            row_ids[np.fromiter(self._row_of.values(), dtype=np.int64, count=len(self._row_of))] = list(self._row_of)
+            self._row_ids = row_ids
+        return (*self._transposed, self._row_ids)
+
+    # The CSR rows of each list of genesets, read from the same version of the matrix.
+    # Raises MissingGenesets naming every GeneWeaver ID without a row.
+    def _matrix(self, *id_lists: Sequence[int]) -> Tuple[np.ndarray, ...]:
+        with self._lock:
+            self._assemble()
+            missing = [
+                gene_weaver_id for gene_weaver_id in dict.fromkeys(i for ids in id_lists for i in ids)
+                if gene_weaver_id not in self._row_of
+            ]
+            if missing:
+                raise MissingGenesets(missing)
+            rows = [np.array([self._row_of[i] for i in ids], dtype=np.int64) for ids in id_lists]
+            indptr, indices = self._indptr, self._indices
+        # The assembled arrays are replaced rather than modified, so they are read unlocked
+        return tuple(array for row_list in rows for array in _take_rows(indptr, indices, row_list))
+
+    def block(self, row_ids: Sequence[int], col_ids: Optional[Sequence[int]] = None, metrics: Iterable[str] = METRICS) -> SimilarityBlock:
+        """Intersection counts and similarity scores of the row genesets against the column ones.
+
+        col_ids defaults to row_ids (a square block). Raises MissingGenesets naming every
+        requested GeneWeaver ID that has no row.
+        """
+        if col_ids is None:
+            row_indptr, row_indices = col_indptr, col_indices = self._matrix(row_ids)
+        else:
+            row_indptr, row_indices, col_indptr, col_indices = self._matrix(row_ids, col_ids)
+        row_sizes, col_sizes = np.diff(row_indptr), np.diff(col_indptr)
+        intersections = intersection_counts(row_indptr, row_indices, col_indptr, col_indices)
+        return SimilarityBlock(row_sizes, col_sizes, intersections, similarity_scores(intersections, row_sizes, col_sizes, metrics))
+
+    # Which gene columns are in at least one current geneset, kept until the live rows change.
+    # Must hold the lock, with the matrix assembled.
+    def _background_genes(self) -> np.ndarray:
+        if self._background is None:
+            _, _, row_ids = self._posting_lists()
+            background = np.zeros(len(self._columns), dtype=bool)
+            background[self._indices[np.repeat(row_ids >= 0, np.diff(self._indptr))]] = True
+            self._background = background
+        return self._background
+
+    def overlaps(self, identifiers: Iterable[str], gene_weaver_ids: Optional[Iterable[int]] = None) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+        """Overlap of a gene list with each of the given genesets, or with every geneset.
+
+        Returns the number of distinct genes in the list, and the GeneWeaver IDs, sizes and
+        intersection counts of the genesets; requested genesets without a row are skipped.
+        """
+        genes = set(identifiers)
+        with self._lock:
+            self._assemble()
+            in_query = np.zeros(len(self._columns), dtype=bool)
+            in_query[[self._columns[gene] for gene in genes if gene in self._columns]] = True
+            if gene_weaver_ids is None:
+                ids = list(self._row_of)
+            else:
+                ids = [int(gene_weaver_id) for gene_weaver_id in gene_weaver_ids if gene_weaver_id in self._row_of]
+            rows = np.array([self._row_of[gene_weaver_id] for gene_weaver_id in ids], dtype=np.int64)
+            indptr, indices = self._indptr, self._indices
+        if gene_weaver_ids is not None:
+            # Only the members of the requested genesets are scanned
+            indptr, indices = _take_rows(indptr, indices, rows)
+            rows = np.arange(len(rows), dtype=np.int64)
+        # Running count of the members found in the query, read at the bounds of each row
+        hits = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(in_query[indices], out=hits[1:])
+        starts, ends = indptr[rows], indptr[rows + 1]
+        return len(genes), np.array(ids, dtype=np.int64), ends - starts, hits[ends] - hits[starts]
+
+    def enrichment_counts(self, identifiers: Iterable[str]) -> Tuple[int, int, np.ndarray, np.ndarray, np.ndarray]:
+        """Counts for testing a gene list for enrichment in every geneset.
+
+        Returns the number of genes in at least one geneset (the background), how many of the
+        list's distinct genes are among them, and the GeneWeaver IDs, sizes and intersection
+        counts of every geneset, all from the same version of the matrix.
+        """
+        genes = set(identifiers)
+        with self._lock:
+            self._assemble()
+            col_indptr, col_rows, row_ids = self._posting_lists()
+            background = self._background_genes()
+            columns = [self._columns[gene] for gene in genes if gene in self._columns]
+            sizes = np.diff(self._indptr)
+        # The product of the matrix with the list's indicator vector, column by column
+        postings = [col_rows[col_indptr[column]:col_indptr[column + 1]] for column in columns]
+        intersections = np.bincount(np.concatenate([np.zeros(0, dtype=np.int64), *postings]), minlength=len(row_ids))
+        live = np.flatnonzero(row_ids >= 0)
+        matched = int(background[columns].sum())
+        return int(background.sum()), matched, row_ids[live], sizes[live], intersections[live]
+
+    def postings(self, identifiers: Iterable[str]) -> Tuple[int, List[np.ndarray], np.ndarray, np.ndarray]:
+        """Posting lists of a gene list, for searches that walk them gene by gene.
+
+        Returns the number of distinct genes in the list, the ascending rows containing each
+        of its genes found in the matrix, and the size and GeneWeaver ID of every row (-1 for
+        rows of replaced or deleted genesets).
+        """
+        genes = set(identifiers)
+        with self._lock:
+            self._assemble()
+            col_indptr, col_rows, row_ids = self._posting_lists()
+            columns = [self._columns[gene] for gene in genes if gene in self._columns]
+            row_sizes = np.diff(self._indptr)
+        return len(genes), [col_rows[col_indptr[column]:col_indptr[column + 1]] for column in columns], row_sizes, row_ids
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._row_of) + len({geneweaver_id for geneweaver_id, _ in self._pending} - self._row_of.keys())
+
+
+# Matrix shared by the application
+similarity_index = SimilarityIndex()
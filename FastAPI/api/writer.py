@@ -0,0 +1,167 @@
+# writer.py
+# Serializes database writes onto a single connection and commits them in batches.
+# SQLite allows one writer at a time: with every thread and request opening its own write
+# transaction, concurrent uploads and analysis runs wait on each other's locks and give up
+# with "database is locked". Instead, writes are queued and run one after another by a
+# dedicated writer thread. Whatever has queued up while the previous commit was running is
+# committed together, so under load many small writes (run status updates, results) share
+# one transaction and one fsync.
+#
+# A write is a function taking a Session, which must not commit. Each write runs in its own
+# savepoint, so a failing write is rolled back on its own and its error is raised to whoever
+# submitted it, while the rest of the batch is committed. Objects returned by a write are
+# detached once the batch is committed; writes load anything their callers read from them.
+#
+# crud sends its writes here when the session they are given was created with a write queue
+# in Session.info (database.SessionLocal and async_database.AsyncSessionLocal are), and
+# commits them directly otherwise. Each process has its own writer: a process forked from
+# one with a running writer (e.g. a job worker, see jobs.py) starts over with an empty queue
+# and starts its own writer thread on its first write.
+
+import asyncio
+import logging
+import os
+import queue
+import threading
+import weakref
+from concurrent.futures import Future
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from sqlalchemy.exc import MissingGreenlet
+from sqlalchemy.orm import Session
+from sqlalchemy.util import await_only
+from . import config
+
+logger = logging.getLogger(__name__)
+
+Write = Callable[[Session], Any]
+
+
+# Gives a forked process's copy of a write queue a fresh queue, lock and writer
+def _reset_after_fork(queue_ref: "weakref.ref[WriteQueue]"):
+    write_queue = queue_ref()
+    if write_queue is not None:
+        write_queue._reset()
+
+
+class WriteQueue:
+    """Runs submitted writes on one thread, committing up to batch_size of them at a time.
+
+    The writer thread is started on the first submission.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], batch_size: int = config.WRITE_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self._reset()
+        if hasattr(os, "register_at_fork"):
+            # The writer thread does not survive a fork, and the queue and lock may be left
+            # mid-operation by it
+            os.register_at_fork(after_in_child=partial(_reset_after_fork, weakref.ref(self)))
+
+    def _reset(self):
+        self._queue: "queue.Queue[Optional[Tuple[Write, Future]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._writes = 0
+        self._failed = 0
+        self._commits = 0
+        self._largest_batch = 0
+
+    def submit(self, write: Write) -> Future:
+        """Queue a write, returning a Future of its result once it is committed."""
+        future = Future()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name="database-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((write, future))
+        return future
+
+    def run(self, write: Write) -> Any:
+        """Submit a write and wait until it is committed, returning its result.
+
+        Inside AsyncSession.run_sync the wait is awaited, so the event loop keeps running.
+        """
+        future = self.submit(write)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return future.result()
+        try:
+            return await_only(asyncio.wrap_future(future, loop=loop))
+        except MissingGreenlet:
+            # On the event loop but not in a greenlet: the writer does not need the loop
+            return future.result()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch: List[Tuple[Write, Future]]):
+        outcomes = []
+        db = self.session_factory()
+        try:
+            for write, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with db.begin_nested():
+                        outcomes.append((future, write(db), None))
+                except Exception as e:
+                    outcomes.append((future, None, e))
+            db.commit()
+        except Exception as e:
+            # The commit itself failed: none of the batch was written
+            logger.exception("Committing %d writes failed", len(batch))
+            db.rollback()
+            outcomes = [(future, None, error or e) for future, _, error in outcomes]
+        finally:
+            db.close()
+
+        with self._lock:
+            self._writes += len(outcomes)
+            self._failed += sum(error is not None for _, _, error in outcomes)
+            self._commits += 1
+            self._largest_batch = max(self._largest_batch, len(outcomes))
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, int]:
+        """Counts of writes and commits so far, for monitoring."""
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "writes": self._writes,
+                "failed": self._failed,
+                "commits": self._commits,
+                "largest_batch": self._largest_batch,
+            }
+
+    def shutdown(self, wait: bool = True):
+        """Stop the writer once the writes already queued are committed."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            if wait:
+                thread.join()
@@ -0,0 +1,240 @@
+# bench_concurrency.py
+# Measures /boolean-algebra/ latency under many concurrent clients, comparing the blocking
+# handler (an async endpoint calling sync crud, which stalls the event loop on every query)
+# with the async one from api.endpoints (AsyncSession, computation on a worker thread).
+#
+# Each mode seeds a fresh database and serves it from a uvicorn subprocess, and --clients
+# concurrent clients send up to --requests requests within --duration seconds. The report
+# gives throughput, the p50 / p99 latencies seen by clients and the number of requests that
+# failed or took longer than --timeout seconds.
+#
+# The blocking handler stalls as soon as more requests are in flight than the connection pool
+# holds: the next request waits on the event loop for a pooled connection, which only the
+# (loop-scheduled) cleanup of earlier requests would return, until the pool gives up after 30 s.
+#
+# Run from the FastAPI folder: python -m benchmarks.bench_concurrency --clients 200
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+FASTAPI_DIR = Path(__file__).resolve().parents[1]
+MODES = ("blocking", "async")
+
+
+# Builds the application served in one mode; run inside the server subprocess, whose working
+# directory holds the seeded geneweaver.db
+def make_app(mode: str):
+    from fastapi import APIRouter, Depends, FastAPI, HTTPException
+    from sqlalchemy.orm import Session
+    from api.crud import check_boolean_algebra_operation, compute_boolean_algebra, get_geneset_unigenes
+    from api.database import get_db
+    from api.endpoints import router
+    from api.schemas import BooleanAlgebraRequest
+
+    if mode == "blocking":
+        # The handler as it was before the async database layer
+        router = APIRouter()
+
+        @router.post("/boolean-algebra/")
+        async def boolean_algebra_endpoint(request: BooleanAlgebraRequest, db: Session = Depends(get_db)):
+            try:
+                check_boolean_algebra_operation(request.operation, request.threshold)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            geneset_sets = [get_geneset_unigenes(db, gene_weaver_id) for gene_weaver_id in request.gene_weaver_ids]
+            return compute_boolean_algebra(geneset_sets, request.operation, request.threshold)
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    return app
+
+
+# Seeds the database in the working directory with genesets of genes drawn from a shared universe
+def seed_database(genesets: int, genes: int, universe: int):
+    from api import crud
+    from api.database import SessionLocal
+    from api.schemas import GeneSetCreate
+
+    db = SessionLocal()
+    rng = random.Random(0)
+    crud.bulk_create_genesets(db, [
+        GeneSetCreate(
+            geneweaver_id=geneweaver_id, entrez=geneweaver_id, ensembl_gene=f"ENSG{geneweaver_id}",
+            unigene=[f"Hs.{gene}" for gene in rng.sample(range(universe), genes)],
+        )
+        for geneweaver_id in range(1, genesets + 1)
+    ])
+    db.close()
+
+
+def serve(mode: str, args):
+    import uvicorn
+    seed_database(args.genesets, args.genes, args.universe)
+    uvicorn.run(make_app(mode), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# A minimal HTTP/1.1 keep-alive client, one connection per simulated client. General purpose
+# clients spend more CPU per request than the server does, which would dominate the
+# measurement when both share a machine.
+class Connection:
+    def __init__(self, port: int):
+        self.port = port
+        self.reader = self.writer = None
+
+    async def post(self, path: str, body: dict) -> int:
+        """Send a JSON POST request and return the response status."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+        payload = json.dumps(body).encode()
+        self.writer.write(
+            f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+        )
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        headers = dict(line.lower().split(": ", 1) for line in lines[1:] if line)
+        await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection") == "close":
+            self.close()
+        return int(lines[0].split()[1])
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def wait_until_up(port: int, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def make_bodies(requests: int, genesets: int, per_request: int) -> List[dict]:
+    rng = random.Random(1)
+    return [
+        {"operation": "intersection", "gene_weaver_ids": rng.sample(range(1, genesets + 1), per_request)}
+        for _ in range(requests)
+    ]
+
+
+# Sends the request bodies from clients concurrent connections, until all are sent or duration
+# seconds have passed. A request not answered within timeout seconds counts as failed.
+# Returns each request's latency in seconds and the number of requests that failed.
+async def load(port: int, clients: int, bodies: List[dict], timeout: float, duration: float) -> Tuple[List[float], int]:
+    bodies = list(bodies)
+    deadline = time.monotonic() + duration
+    latencies = []
+    failures = 0
+
+    async def client():
+        nonlocal failures
+        connection = Connection(port)
+        while bodies and time.monotonic() < deadline:
+            body = bodies.pop()
+            start = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(connection.post("/api/boolean-algebra/", body), timeout)
+                failed = status != 200
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                connection.close()
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            failures += failed
+        connection.close()
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, failures
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_mode(mode: str, args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [str(FASTAPI_DIR), os.environ.get("PYTHONPATH")])))
+        server = subprocess.Popen(
+            [
+                sys.executable, "-m", "benchmarks.bench_concurrency", "--serve", mode, "--port", str(port),
+                "--genesets", str(args.genesets), "--genes", str(args.genes), "--universe", str(args.universe),
+            ],
+            cwd=tmp, env=env, stdout=subprocess.DEVNULL,
+        )
+        try:
+            async def measure():
+                await wait_until_up(port)
+                # Warm up the server's connections and caches
+                await load(port, args.clients, make_bodies(args.clients, args.genesets, args.per_request), args.timeout, args.duration)
+                start = time.perf_counter()
+                bodies = make_bodies(args.requests, args.genesets, args.per_request)
+                latencies, failures = await load(port, args.clients, bodies, args.timeout, args.duration)
+                return latencies, failures, time.perf_counter() - start
+
+            latencies, failures, elapsed = asyncio.run(measure())
+        finally:
+            # A stalled server does not finish its requests, and so never exits on its own
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+
+    print(
+        f"{mode:>8}: {len(latencies) - failures:5d} ok, {failures:5d} failed or timed out, "
+        f"{(len(latencies) - failures) / elapsed:7.1f} req/s, "
+        f"p50 {percentile(latencies, 0.50) * 1e3:8.1f} ms, p99 {percentile(latencies, 0.99) * 1e3:8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark endpoint latency under concurrent clients")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--genesets", type=int, default=1000)
+    parser.add_argument("--genes", type=int, default=200, help="genes per geneset")
+    parser.add_argument("--universe", type=int, default=20000, help="number of distinct genes")
+    parser.add_argument("--per-request", type=int, default=3, help="genesets per request")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds before a request counts as failed")
+    parser.add_argument("--duration", type=float, default=60, help="seconds after which no new requests are sent")
+    parser.add_argument("--mode", choices=MODES, action="append", help="modes to run (default: both)")
+    parser.add_argument("--serve", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args)
+        return
+    print(f"{args.clients} clients, {args.requests} requests of {args.per_request} genesets")
+    for mode in args.mode or MODES:
+        run_mode(mode, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# bench_enrichment.py
+# Time to test a gene list for enrichment in every geneset of a SimilarityIndex holding
+# --genesets genesets whose genes follow a Zipf-like distribution, as in bench_gene_index:
+# the overlap counts (SimilarityIndex.enrichment_counts) and the hypergeometric p-values and
+# Benjamini-Hochberg correction of api.enrichment. For comparison, the p-values of
+# --python-genesets genesets are also summed term by term in Python with math.lgamma.
+#
+# Run from the FastAPI folder: python -m benchmarks.bench_enrichment --genesets 100000
+
+import argparse
+import math
+import random
+import time
+from api.enrichment import enrichment
+from api.similarity import SimilarityIndex
+
+
+# P(X >= overlap), summing every term of the tail
+def python_sf(overlap, size, background, query_size):
+    def log_choose(n, k):
+        return math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
+    return sum(
+        math.exp(log_choose(size, i) + log_choose(background - size, query_size - i) - log_choose(background, query_size))
+        for i in range(overlap, min(size, query_size) + 1)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark geneset enrichment of a gene list")
+    parser.add_argument("--genesets", type=int, default=100000)
+    parser.add_argument("--universe", type=int, default=30000, help="number of distinct genes")
+    parser.add_argument("--query-genes", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=5)
+    parser.add_argument("--python-genesets", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    genes = [f"Hs.{i}" for i in range(args.universe)]
+
+    def random_genes(count):
+        # Log-uniform ranks approximate a Zipf distribution with exponent 1
+        return {genes[int(args.universe ** rng.random()) - 1] for _ in range(count)}
+
+    index = SimilarityIndex()
+    index._loaded = True
+    for geneweaver_id in range(args.genesets):
+        # Geneset sizes are log-uniform between 10 and 1000 genes
+        index.add(geneweaver_id, random_genes(int(10 * 100 ** rng.random())))
+    queries = [random_genes(args.query_genes) for _ in range(args.queries)]
+    index.block([0])
+    start = time.perf_counter()
+    index.enrichment_counts(["warm up"])
+    print(f"posting lists built in {(time.perf_counter() - start) * 1000:,.0f} ms, once per change to the matrix")
+
+    counting = testing = 0
+    for query in queries:
+        start = time.perf_counter()
+        background, matched, ids, sizes, overlaps = index.enrichment_counts(query)
+        counting += time.perf_counter() - start
+        start = time.perf_counter()
+        tested = enrichment(overlaps, sizes, background, matched)
+        testing += time.perf_counter() - start
+    print(f"{args.genesets} genesets, background of {background} genes, {matched} genes in the last query")
+    print(f"overlap counts:         {counting / len(queries) * 1000:8.1f} ms/query")
+    print(f"p-values and q-values:  {testing / len(queries) * 1000:8.1f} ms/query")
+
+    start = time.perf_counter()
+    sample = range(min(args.python_genesets, len(ids)))
+    for i in sample:
+        python_sf(int(overlaps[i]), int(sizes[i]), background, matched)
+    python = (time.perf_counter() - start) / len(sample) * len(ids)
+    print(f"python p-values:        {python * 1000:8.1f} ms/query (extrapolated from {len(sample)} genesets)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# bench_gene_index.py
+# Measures gene -> genesets lookups on a GeneIndex holding millions of memberships.
+# Genesets draw their genes from a Zipf-like distribution, so a few genes have very long
+# posting lists while most have short ones, as in real GeneWeaver data.
+#
+# Run from the FastAPI folder: python -m benchmarks.bench_gene_index --genesets 100000
+
+import argparse
+import random
+import time
+from api.gene_index import GeneIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark gene index lookups")
+    parser.add_argument("--genesets", type=int, default=100000)
+    parser.add_argument("--genes-per-geneset", type=int, default=40)
+    parser.add_argument("--universe", type=int, default=200000, help="number of distinct genes")
+    parser.add_argument("--lookups", type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    genes = [f"Hs.{i}" for i in range(args.universe)]
+
+    index = GeneIndex()
+    index._loaded = True
+    start = time.perf_counter()
+    for geneweaver_id in range(args.genesets):
+        # Log-uniform ranks approximate a Zipf distribution with exponent 1
+        index.add(geneweaver_id, [genes[int(args.universe ** rng.random()) - 1] for _ in range(args.genes_per_geneset)])
+    elapsed = time.perf_counter() - start
+    memberships = sum(index.count(gene) for gene in genes)
+    print(f"indexed {args.genesets} genesets / {memberships} memberships in {elapsed:.2f}s")
+
+    queries = [rng.choice(genes) for _ in range(args.lookups)]
+    start = time.perf_counter()
+    for gene in queries:
+        index.lookup(gene, 0, 100)
+    elapsed = time.perf_counter() - start
+    print(f"{args.lookups} lookups (first page of 100): {elapsed / args.lookups * 1e6:.2f} us/lookup")
+
+    start = time.perf_counter()
+    longest = index.lookup(genes[0])
+    elapsed = time.perf_counter() - start
+    print(f"full posting list of the most common gene ({len(longest)} ids): {elapsed * 1e3:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
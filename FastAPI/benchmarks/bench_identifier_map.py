@@ -0,0 +1,83 @@
+# bench_identifier_map.py
+# Time to translate genesets of Unigene identifiers into Gene Symbols through an IdentifierMap
+# holding --rows export rows, each listing a few Unigene clusters and symbols of one gene, as
+# in GeneWeaver exports. The genesets are stored in the map too, as rows of Unigene members
+# only, and translated both by GeneWeaver ID (IdentifierMap.translate_genesets, through the CSR
+# translation table) and from their identifiers (IdentifierMap.translate, through a dictionary
+# of links), which is compared with a dictionary walk built outside of the map. Each path's
+# index is built on first use; the time to rebuild it after another geneset is added is shown
+# too.
+#
+# Run from the FastAPI folder: python -m benchmarks.bench_identifier_map --rows 100000
+
+import argparse
+import random
+import time
+from collections import defaultdict
+from api.identifier_map import IdentifierMap
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark identifier translation")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--genesets", type=int, default=100)
+    parser.add_argument("--genes-per-geneset", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    identifier_map = IdentifierMap()
+    identifier_map._loaded = True
+    links = defaultdict(set)
+    unigenes = []
+    for row in range(args.rows):
+        # Most genes have a few Unigene clusters and symbols; clusters are shared by neighbours
+        clusters = tuple({f"Hs.{rng.randrange(args.rows * 3)}" for _ in range(rng.randint(1, 6))})
+        symbols = tuple({f"SYM{row}", *(f"ALIAS{rng.randrange(args.rows)}" for _ in range(rng.randint(0, 2)))})
+        identifier_map.add(row, {"unigene": clusters, "gene_symbol": symbols})
+        for cluster in clusters:
+            links[cluster].update(symbols)
+        unigenes.extend(clusters)
+    genesets = [tuple(dict.fromkeys(rng.sample(unigenes, args.genes_per_geneset))) for _ in range(args.genesets)]
+    geneset_ids = list(range(args.rows, args.rows + args.genesets))
+    for geneweaver_id, geneset in zip(geneset_ids, genesets):
+        identifier_map.add(geneweaver_id, {"unigene": geneset})
+
+    start = time.perf_counter()
+    identifier_map.table("unigene", "gene_symbol")
+    table_build = time.perf_counter() - start
+    start = time.perf_counter()
+    stored = identifier_map.translate_genesets(geneset_ids, "gene_symbol")
+    by_id = time.perf_counter() - start
+
+    start = time.perf_counter()
+    identifier_map.translate([()], "unigene", "gene_symbol")
+    links_build = time.perf_counter() - start
+    start = time.perf_counter()
+    translated = identifier_map.translate(genesets, "unigene", "gene_symbol")
+    by_identifier = time.perf_counter() - start
+
+    start = time.perf_counter()
+    walked = [frozenset(symbol for unigene in geneset for symbol in links.get(unigene, ())) for geneset in genesets]
+    dictionary = time.perf_counter() - start
+    assert stored == translated == walked
+
+    # A new geneset drops the table, while the links are extended in place
+    identifier_map.add(args.rows + args.genesets, {"unigene": ("Hs.0",), "gene_symbol": ("NEW",)})
+    start = time.perf_counter()
+    identifier_map.translate_genesets(geneset_ids[:1], "gene_symbol")
+    table_rebuild = time.perf_counter() - start
+    start = time.perf_counter()
+    identifier_map.translate(genesets[:1], "unigene", "gene_symbol")
+    links_rebuild = time.perf_counter() - start
+
+    memberships = args.genesets * args.genes_per_geneset
+    print(f"{args.rows} rows; {args.genesets} genesets, {memberships} identifiers, {sum(map(len, translated))} symbols")
+    print(f"by GeneWeaver ID:  {by_id * 1000:8.1f} ms (table built in {table_build * 1000:,.0f} ms, "
+          f"{table_rebuild * 1000:,.0f} ms after an added geneset)")
+    print(f"by identifier:     {by_identifier * 1000:8.1f} ms (links built in {links_build * 1000:,.0f} ms, "
+          f"{links_rebuild * 1000:,.0f} ms after an added geneset)")
+    print(f"dictionary walk:   {dictionary * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
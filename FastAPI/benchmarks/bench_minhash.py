@@ -0,0 +1,104 @@
+# bench_minhash.py
+# Recall and latency of "top-k genesets most similar to this gene list" through the LSH index
+# of MinHash signatures (candidates re-ranked exactly, as crud.find_similar_genesets does),
+# against brute force: exact scores of every geneset from the membership matrix, and
+# intersecting Python sets with every geneset. Genesets draw their genes from a Zipf-like
+# distribution as in bench_gene_index. They come in families: copies of a random geneset with
+# part of their genes replaced at random. Each query is one more copy of a family's geneset,
+# so that its closest neighbours are the family.
+#
+# Recall@k is the share of the exact top k (by Jaccard similarity) found by the LSH search;
+# a result tied with the k-th exact score counts as found.
+#
+# Run from the FastAPI folder: python -m benchmarks.bench_minhash --genesets 20000 --replaced 0.3
+
+import argparse
+import random
+import time
+import numpy as np
+from api.minhash import LSHIndex, signature
+from api.similarity import SimilarityIndex, similarity_scores
+
+
+# The k best (GeneWeaver ID, Jaccard score) of the given overlaps, best first
+def top_k(query_size, ids, sizes, intersections, k):
+    scores = similarity_scores(intersections[None, :], np.array([query_size]), sizes, ["jaccard"])["jaccard"][0]
+    best = np.lexsort((ids, -scores))
+    best = best[scores[best] > 0][:k]
+    return list(zip(ids[best].tolist(), scores[best].tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MinHash/LSH nearest-geneset search")
+    parser.add_argument("--genesets", type=int, default=20000)
+    parser.add_argument("--genes-per-geneset", type=int, default=100)
+    parser.add_argument("--universe", type=int, default=30000, help="number of distinct genes")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--family-size", type=int, default=10, help="genesets derived from the same random geneset")
+    parser.add_argument("--replaced", type=float, default=0.2, help="share of genes replaced in each copy")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--bands", type=int, nargs="+", default=[16, 32, 42, 64])
+    parser.add_argument("--python-queries", type=int, default=10, help="queries timed with Python sets")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    genes = [f"Hs.{i}" for i in range(args.universe)]
+
+    def random_genes(count):
+        # Log-uniform ranks approximate a Zipf distribution with exponent 1
+        return {genes[int(args.universe ** rng.random()) - 1] for _ in range(count)}
+
+    def copy(members):
+        kept = rng.sample(sorted(members), int(len(members) * (1 - args.replaced)))
+        return set(kept) | random_genes(len(members) - len(kept))
+
+    families = [random_genes(args.genes_per_geneset) for _ in range(args.genesets // args.family_size)]
+    genesets = {geneweaver_id: copy(families[geneweaver_id // args.family_size]) for geneweaver_id in range(len(families) * args.family_size)}
+    queries = [copy(family) for family in rng.sample(families, args.queries)]
+
+    matrix = SimilarityIndex()
+    matrix._loaded = True
+    for geneweaver_id, members in genesets.items():
+        matrix.add(geneweaver_id, members)
+    start = time.perf_counter()
+    signatures = {geneweaver_id: signature(members) for geneweaver_id, members in genesets.items()}
+    print(f"{args.genesets} genesets, signatures computed in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    exact = [top_k(*matrix.overlaps(query), args.k) for query in queries]
+    brute_force = (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    for query in queries[:args.python_queries]:
+        sorted(((len(query & members) / len(query | members), geneweaver_id) for geneweaver_id, members in genesets.items()), reverse=True)[:args.k]
+    python = (time.perf_counter() - start) / args.python_queries
+
+    print(f"{'search':>14} {'ms/query':>9} {'candidates':>11} {'recall@' + str(args.k):>10}")
+    print(f"{'python sets':>14} {python * 1000:>9.2f} {args.genesets:>11} {1:>10.3f}")
+    print(f"{'brute force':>14} {brute_force * 1000:>9.2f} {args.genesets:>11} {1:>10.3f}")
+    for bands in args.bands:
+        index = LSHIndex(bands=bands)
+        index._loaded = True
+        for geneweaver_id, values in signatures.items():
+            index.add(geneweaver_id, values)
+        index.candidates(signature(["warm up"]))
+
+        found = expected = candidates = 0
+        start = time.perf_counter()
+        results = []
+        for query in queries:
+            ids, _ = index.candidates(signature(query))
+            candidates += len(ids)
+            results.append(top_k(*matrix.overlaps(query, ids), args.k))
+        elapsed = (time.perf_counter() - start) / len(queries)
+        for exact_top, lsh_top in zip(exact, results):
+            if exact_top:
+                kth_score = exact_top[-1][1]
+                expected += len(exact_top)
+                found += min(len(exact_top), sum(score >= kth_score for _, score in lsh_top))
+        print(f"{'lsh ' + str(bands) + 'x' + str(128 // bands):>14} {elapsed * 1000:>9.2f} "
+              f"{candidates / len(queries):>11,.0f} {found / max(expected, 1):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
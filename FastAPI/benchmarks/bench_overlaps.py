@@ -0,0 +1,87 @@
+# bench_overlaps.py
+# Latency of exact top-k overlap queries through the posting lists of a SimilarityIndex
+# (api.overlap_search), with and without its max-score bound, against scoring every geneset
+# with SimilarityIndex.overlaps. Genesets draw their genes from a Zipf-like distribution as in
+# bench_gene_index, so queries hold genes that are in most genesets. As in bench_minhash they
+# come in families of copies of a random geneset with part of their genes replaced, and each
+# query is one more copy, so that it has close neighbours.
+#
+# Run from the FastAPI folder: python -m benchmarks.bench_overlaps --genesets 100000 --k 10
+
+import argparse
+import random
+import time
+from unittest.mock import patch
+import numpy as np
+from api import overlap_search
+from api.similarity import SimilarityIndex, similarity_scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark exact top-k overlap search")
+    parser.add_argument("--genesets", type=int, default=100000)
+    parser.add_argument("--genes-per-geneset", type=int, default=200)
+    parser.add_argument("--universe", type=int, default=30000, help="number of distinct genes")
+    parser.add_argument("--family-size", type=int, default=10, help="genesets derived from the same random geneset")
+    parser.add_argument("--replaced", type=float, default=0.3, help="share of genes replaced in each copy")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    genes = [f"Hs.{i}" for i in range(args.universe)]
+
+    def random_genes(count):
+        # Log-uniform ranks approximate a Zipf distribution with exponent 1
+        return {genes[int(args.universe ** rng.random()) - 1] for _ in range(count)}
+
+    def copy(members):
+        kept = rng.sample(sorted(members), int(len(members) * (1 - args.replaced)))
+        return set(kept) | random_genes(len(members) - len(kept))
+
+    index = SimilarityIndex()
+    index._loaded = True
+    families = [random_genes(args.genes_per_geneset) for _ in range(args.genesets // args.family_size)]
+    for geneweaver_id in range(len(families) * args.family_size):
+        index.add(geneweaver_id, copy(families[geneweaver_id // args.family_size]))
+    queries = [copy(family) for family in rng.sample(families, args.queries)]
+    index.postings(["warm up"])
+
+    def search(metric):
+        results = []
+        for query in queries:
+            query_size, postings, row_sizes, row_ids = index.postings(query)
+            results.append(overlap_search.top_k_overlaps(postings, query_size, row_sizes, row_ids, args.k, metric))
+        return results
+
+    print(f"{'metric':>12} {'scan ms':>8} {'no bound ms':>12} {'bound ms':>9} {'walked':>7} {'probed':>7}")
+    for metric in overlap_search.METRICS:
+        start = time.perf_counter()
+        expected = []
+        for query in queries:
+            query_size, ids, sizes, intersections = index.overlaps(query)
+            if metric == "intersection":
+                scores = intersections.astype(np.float64)
+            else:
+                scores = similarity_scores(intersections[None, :], np.array([query_size]), sizes, [metric])[metric][0]
+            best = np.lexsort((ids, -scores))[:args.k]
+            expected.append(ids[best].tolist())
+        scan = (time.perf_counter() - start) / len(queries)
+
+        # An infinite bound never holds, so every posting list is walked
+        with patch.object(overlap_search, "_unseen_bound", lambda *args: float("inf")):
+            start = time.perf_counter()
+            search(metric)
+            unbounded = (time.perf_counter() - start) / len(queries)
+
+        start = time.perf_counter()
+        results = search(metric)
+        bounded = (time.perf_counter() - start) / len(queries)
+        assert [result.gene_weaver_ids.tolist() for result in results] == expected
+        walked = np.mean([result.walked for result in results])
+        probed = np.mean([result.probed for result in results])
+        print(f"{metric:>12} {scan * 1000:>8.2f} {unbounded * 1000:>12.2f} {bounded * 1000:>9.2f} {walked:>7.1f} {probed:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
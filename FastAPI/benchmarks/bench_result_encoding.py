@@ -0,0 +1,94 @@
+# bench_result_encoding.py
+# Compares analysis results stored as JSON (AnalysisResult.result_data, as results were saved
+# before result blobs) with compact result blobs: bytes stored per result, and the time to
+# decode a whole result or its first page of genes. Result genes are drawn from a universe of
+# interned Unigene-style identifiers, as union results over many genesets are.
+#
+# Run from the FastAPI folder: python -m benchmarks.bench_result_encoding --sizes 1000 10000 100000
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from sqlalchemy import create_engine, func, insert, text
+from sqlalchemy.orm import Session
+from api import crud
+from api.cache import gene_identifier_cache
+from api.models import AnalysisResult, Base, Gene, ResultBlob, ResultBlobChunk
+
+
+# Median wall time of calling func, in milliseconds
+def time_ms(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON against compact result storage")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="genes per result")
+    parser.add_argument("--universe", type=int, default=500000, help="number of interned genes")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "results.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engine)
+        identifiers = [f"Hs.{rng.randrange(10 ** 6)}.{i}" for i in range(args.universe)]
+        with Session(engine) as db:
+            db.execute(insert(Gene), [{"identifier": identifier} for identifier in identifiers])
+            db.commit()
+
+            print(f"{'genes':>8} {'json bytes':>12} {'blob bytes':>12} {'ratio':>6} "
+                  f"{'json full':>10} {'blob cold':>10} {'blob warm':>10} {'json page':>10} {'blob page':>10}")
+            for size in args.sizes:
+                genes = rng.sample(identifiers, size)
+                json_result = AnalysisResult(result_data=json.dumps({"result": genes}))
+                db.add(json_result)
+                db.flush()
+                blob_result = AnalysisResult(blob_id=crud.store_result_blob(db, genes))
+                db.add(blob_result)
+                db.commit()
+
+                json_bytes = db.execute(
+                    text("SELECT length(CAST(result_data AS BLOB)) FROM analysis_results WHERE id = :id"), {"id": json_result.id}
+                ).scalar()
+                blob_bytes = db.query(
+                    func.sum(func.length(ResultBlobChunk.data) + func.length(ResultBlobChunk.last_gene))
+                ).filter(ResultBlobChunk.blob_id == blob_result.blob_id).scalar()
+
+                def decode_json():
+                    db.expire_all()
+                    return json.loads(db.query(AnalysisResult.result_data).filter(AnalysisResult.id == json_result.id).scalar())["result"]
+
+                def decode_blob():
+                    db.expire_all()
+                    return [gene for _, chunk, _ in crud.get_result_chunks(db, blob_result.id, count=size) for gene in chunk]
+
+                def decode_blob_cold():
+                    gene_identifier_cache.clear()
+                    return decode_blob()
+
+                assert sorted(decode_json()) == decode_blob_cold()
+                json_full = time_ms(decode_json, args.repeat)
+                blob_cold = time_ms(decode_blob_cold, args.repeat)
+                blob_warm = time_ms(decode_blob, args.repeat)
+                # The JSON has to be decoded whole (and sorted) to serve its first page
+                json_page = time_ms(lambda: sorted(decode_json())[:crud.RESULT_CHUNK_SIZE], args.repeat)
+                blob_page = time_ms(lambda: crud.get_result_genes_page(db, blob_result.id), args.repeat)
+                print(f"{size:>8} {json_bytes:>12} {blob_bytes:>12} {json_bytes / blob_bytes:>5.1f}x "
+                      f"{json_full:>8.2f}ms {blob_cold:>8.2f}ms {blob_warm:>8.2f}ms {json_page:>8.2f}ms {blob_page:>8.2f}ms")
+            assert db.query(ResultBlob).count() == len(args.sizes)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# bench_similarity.py
+# Measures similarity blocks on a SimilarityIndex holding --genesets genesets whose genes
+# follow a Zipf-like distribution, as in bench_gene_index. Compares the sparse product of
+# api.similarity with intersecting Python sets pair by pair, and times appending genesets
+# to a loaded matrix.
+#
+# Run from the FastAPI folder: python -m benchmarks.bench_similarity --genesets 20000 --block 500
+
+import argparse
+import random
+import time
+import numpy as np
+from api.similarity import SimilarityIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark geneset similarity blocks")
+    parser.add_argument("--genesets", type=int, default=20000)
+    parser.add_argument("--genes-per-geneset", type=int, default=200)
+    parser.add_argument("--universe", type=int, default=30000, help="number of distinct genes")
+    parser.add_argument("--block", type=int, default=500, help="genesets compared pairwise")
+    parser.add_argument("--added", type=int, default=1000, help="genesets appended to the loaded matrix")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    genes = [f"Hs.{i}" for i in range(args.universe)]
+
+    def random_geneset():
+        # Log-uniform ranks approximate a Zipf distribution with exponent 1
+        return {genes[int(args.universe ** rng.random()) - 1] for _ in range(args.genes_per_geneset)}
+
+    genesets = {geneweaver_id: random_geneset() for geneweaver_id in range(args.genesets)}
+    index = SimilarityIndex()
+    index._loaded = True
+    start = time.perf_counter()
+    for geneweaver_id, members in genesets.items():
+        index.add(geneweaver_id, members)
+    index.block([0])
+    print(f"loaded {args.genesets} genesets in {time.perf_counter() - start:.2f}s")
+
+    ids = rng.sample(range(args.genesets), args.block)
+    start = time.perf_counter()
+    block = index.block(ids)
+    sparse = time.perf_counter() - start
+    print(f"{args.block}x{args.block} block, sparse product: {sparse * 1000:,.0f} ms")
+
+    start = time.perf_counter()
+    sets = [genesets[i] for i in ids]
+    expected = np.array([[len(a & b) for b in sets] for a in sets])
+    python = time.perf_counter() - start
+    print(f"{args.block}x{args.block} block, Python sets:    {python * 1000:,.0f} ms ({python / sparse:.1f}x)")
+    assert np.array_equal(block.intersections, expected)
+
+    start = time.perf_counter()
+    for geneweaver_id in range(args.genesets, args.genesets + args.added):
+        index.add(geneweaver_id, random_geneset())
+    index.block([args.genesets])
+    elapsed = time.perf_counter() - start
+    print(f"appended {args.added} genesets in {elapsed * 1000:,.0f} ms ({elapsed / args.added * 1e6:.0f} us/geneset)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# bench_upload.py
+# Compares rows/sec of the per-row create_geneset path against the batched ingest path.
+# The Sampledataset/gene_export_geneset*.txt exports are replicated --scale times, with
+# GeneWeaver IDs shifted on every copy so that each row stays unique.
+#
+# Run from the FastAPI folder: python -m benchmarks.bench_upload --scale 1000
+
+import argparse
+import csv
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from api.models import Base
+from api import crud, ingest
+
+SAMPLE_DIR = Path(__file__).resolve().parents[2] / "Sampledataset"
+
+
+def load_sample_rows() -> List[Dict[str, str]]:
+    rows = []
+    for path in sorted(SAMPLE_DIR.glob("gene_export_geneset*.txt")):
+        with open(path, newline="") as f:
+            rows.extend(csv.DictReader(f, delimiter="\t"))
+    return rows
+
+
+# Yields the sample rows scale times, renumbering GeneWeaver IDs so every row is unique
+def scaled_rows(rows: List[Dict[str, str]], scale: int) -> Iterator[Dict[str, str]]:
+    for copy in range(scale):
+        for index, row in enumerate(rows):
+            yield dict(row, **{"GeneWeaver ID": str(copy * len(rows) + index + 1)})
+
+
+def make_session(path: str):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def bench_per_row(rows: Iterator[Dict[str, str]], path: str) -> int:
+    db = make_session(path)
+    count = 0
+    for row in rows:
+        crud.create_geneset(db, ingest.parse_geneset_row(row))
+        count += 1
+    db.close()
+    return count
+
+
+def bench_bulk(rows: Iterator[Dict[str, str]], path: str) -> int:
+    db = make_session(path)
+    report = ingest.ingest_rows(db, rows)
+    db.close()
+    return report["inserted"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark geneset upload paths")
+    parser.add_argument("--scale", type=int, default=1000, help="times to replicate the sample exports")
+    parser.add_argument(
+        "--per-row-limit", type=int, default=5000,
+        help="rows measured on the per-row path (it commits every row, so the full scale is very slow)",
+    )
+    args = parser.parse_args()
+
+    rows = load_sample_rows()
+    total = len(rows) * args.scale
+    print(f"{len(rows)} sample rows x {args.scale} = {total} rows")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        limit = min(args.per_row_limit, total)
+        start = time.perf_counter()
+        limited = (row for _, row in zip(range(limit), scaled_rows(rows, args.scale)))
+        count = bench_per_row(limited, os.path.join(tmp, "per_row.db"))
+        elapsed = time.perf_counter() - start
+        print(f"per-row create_geneset: {count} rows in {elapsed:.2f}s -> {count / elapsed:,.0f} rows/sec")
+
+        start = time.perf_counter()
+        count = bench_bulk(scaled_rows(rows, args.scale), os.path.join(tmp, "bulk.db"))
+        elapsed = time.perf_counter() - start
+        print(f"bulk ingest_rows:       {count} rows in {elapsed:.2f}s -> {count / elapsed:,.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    main()
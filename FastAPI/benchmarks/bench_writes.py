@@ -0,0 +1,101 @@
+# bench_writes.py
+# Stress test of concurrent writes: --threads threads each create --runs analysis runs and
+# mark them completed (two writes per run, as a job does), while --readers threads keep
+# reading the runs table. Compares the database setup from before the write queue ("direct":
+# default journal, every thread committing its own writes) with the current one ("queue":
+# WAL, tuned pragmas, writes committed in batches by api.writer.WriteQueue). Reports write
+# throughput, the number of writes that failed with "database is locked", and commits made.
+#
+# Run from the FastAPI folder: python -m benchmarks.bench_writes --threads 16 --runs 50
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from api import crud, models
+from api.backends import configure_sqlite
+from api.database import Base
+from api.writer import WriteQueue
+
+MODES = ("direct", "queue")
+
+
+def run_mode(mode: str, path: str, threads: int, runs: int, readers: int):
+    url = f"sqlite:///{path}"
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    write_queue = None
+    if mode == "queue":
+        configure_sqlite(engine)
+        writer_engine = create_engine(url, connect_args={"check_same_thread": False}, pool_size=1, max_overflow=0)
+        configure_sqlite(writer_engine, immediate=True)
+        write_queue = WriteQueue(sessionmaker(autoflush=False, expire_on_commit=False, bind=writer_engine))
+    Base.metadata.create_all(engine)
+    SessionLocal = sessionmaker(autoflush=False, bind=engine, info={"write_queue": write_queue})
+
+    locked = []
+    other_errors = []
+
+    def record(error: Exception):
+        (locked if "database is locked" in str(error) else other_errors).append(error)
+
+    def writer():
+        with SessionLocal() as db:
+            for _ in range(runs):
+                try:
+                    run = crud.create_analysis_run(db)
+                    crud.update_run_status_and_time(db, run.id, models.RunStatus.COMPLETED, end_time=True)
+                except OperationalError as e:
+                    record(e)
+
+    def reader(stop: threading.Event):
+        with SessionLocal() as db:
+            while not stop.wait(0.005):
+                try:
+                    db.query(models.AnalysisRun).count()
+                except OperationalError as e:
+                    record(e)
+
+    stop = threading.Event()
+    reader_threads = [threading.Thread(target=reader, args=(stop,)) for _ in range(readers)]
+    writer_threads = [threading.Thread(target=writer) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in reader_threads + writer_threads:
+        thread.start()
+    for thread in writer_threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in reader_threads:
+        thread.join()
+
+    with SessionLocal() as db:
+        completed = db.query(models.AnalysisRun).filter_by(status=models.RunStatus.COMPLETED).count()
+    commits = write_queue.stats()["commits"] if write_queue is not None else completed * 2
+    if write_queue is not None:
+        write_queue.shutdown()
+        writer_engine.dispose()
+    engine.dispose()
+    print(f"{mode:>8} {completed * 2 / elapsed:>10,.0f}/s {len(locked):>8} {len(other_errors):>8} "
+          f"{completed:>10} {commits:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test concurrent database writes")
+    parser.add_argument("--threads", type=int, default=16, help="writing threads")
+    parser.add_argument("--runs", type=int, default=50, help="analysis runs created by each thread")
+    parser.add_argument("--readers", type=int, default=4, help="reading threads")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'writes':>12} {'locked':>8} {'errors':>8} {'completed':>10} {'commits':>8}")
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            run_mode(mode, os.path.join(tmp, "writes.db"), args.threads, args.runs, args.readers)
+
+
+if __name__ == "__main__":
+    main()
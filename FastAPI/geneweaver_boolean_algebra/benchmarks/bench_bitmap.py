@@ -0,0 +1,89 @@
+"""Compare the set and bitmap engines on large genesets.
+
+Each geneset holds --genes random gene symbols drawn from a universe of --universe
+symbols. Timings are reported for the operations alone, and for the bitmap engine
+including the conversion to bitmaps and back.
+
+Run from the geneweaver_boolean_algebra folder:
+    python -m benchmarks.bench_bitmap --genesets 5 --genes 20000
+"""
+import argparse
+import random
+import sys
+import time
+from functools import partial
+from typing import Callable, List, Set
+
+from geneweaver.tools.boolean_algebra.bitmap import BitmapEngine
+from geneweaver.tools.boolean_algebra.intersection import (
+    combination_intersection,
+    intersection,
+)
+from geneweaver.tools.boolean_algebra.symmetric_difference import symmetric_difference
+from geneweaver.tools.boolean_algebra.union import union
+
+OPERATIONS = {
+    "union": union,
+    "intersection": intersection,
+    "combination_intersection": combination_intersection,
+    "symmetric_difference": symmetric_difference,
+}
+
+
+def make_genesets(count: int, genes: int, universe: int, seed: int) -> List[Set[str]]:
+    """Draw count random genesets of the given size."""
+    rng = random.Random(seed)
+    symbols = [f"GENE{i}" for i in range(universe)]
+    return [set(rng.sample(symbols, genes)) for _ in range(count)]
+
+
+def best_time(func: Callable, repeat: int) -> float:
+    """Best wall time of repeat calls to func, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark the bitmap engine")
+    parser.add_argument("--genesets", type=int, default=5)
+    parser.add_argument("--genes", type=int, default=20000, help="genes per geneset")
+    parser.add_argument("--universe", type=int, default=40000, help="distinct genes")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    genesets = make_genesets(args.genesets, args.genes, args.universe, args.seed)
+    engine = BitmapEngine()
+    bitmaps = engine.to_bitmaps(genesets)
+
+    set_bytes = sum(sys.getsizeof(geneset) for geneset in genesets)
+    bitmap_bytes = sum(bitmap.bits.nbytes for bitmap in bitmaps)
+    print(
+        f"{args.genesets} genesets x {args.genes} genes, universe {args.universe}: "
+        f"sets {set_bytes / 1024:,.0f} KiB, bitmaps {bitmap_bytes / 1024:,.0f} KiB "
+        "(excluding the gene strings, which both share)"
+    )
+
+    def bitmap_round_trip(operation: Callable) -> None:
+        round_trip_engine = BitmapEngine()
+        engine_result = operation(*round_trip_engine.to_bitmaps(genesets))
+        round_trip_engine.materialize(engine_result)
+
+    for name, operation in OPERATIONS.items():
+        set_time = best_time(partial(operation, *genesets), args.repeat)
+        bitmap_time = best_time(partial(operation, *bitmaps), args.repeat)
+        round_trip_time = best_time(partial(bitmap_round_trip, operation), args.repeat)
+        print(
+            f"{name:>26}: sets {set_time * 1000:8.2f} ms, "
+            f"bitmaps {bitmap_time * 1000:8.2f} ms ({set_time / bitmap_time:5.1f}x), "
+            f"with conversion {round_trip_time * 1000:8.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
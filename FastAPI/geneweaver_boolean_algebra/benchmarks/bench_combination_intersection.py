@@ -0,0 +1,76 @@
+"""Compare combination_intersection with intersecting every combination from scratch.
+
+Genesets draw --genes genes each from a universe of --universe genes, so overlaps
+shrink as combinations grow and most large combinations are empty.
+
+Run from the geneweaver_boolean_algebra folder:
+    python -m benchmarks.bench_combination_intersection --sets 8 12 16 20
+"""
+import argparse
+import itertools
+import random
+import time
+from typing import Dict, List, Set, Tuple
+
+from geneweaver.tools.boolean_algebra.intersection import (
+    combination_intersection,
+    iter_combination_intersection,
+)
+
+
+def from_scratch(*args: Set[str]) -> Dict[Tuple[int, ...], Set[str]]:
+    """Intersect each combination independently, as the previous algorithm did."""
+    return {
+        combination: set.intersection(*(args[index] for index in combination))
+        for size in range(2, len(args) + 1)
+        for combination in itertools.combinations(range(len(args)), size)
+    }
+
+
+def make_genesets(count: int, genes: int, universe: int, seed: int) -> List[Set[str]]:
+    """Draw count random genesets of the given size."""
+    rng = random.Random(seed)
+    symbols = [f"GENE{i}" for i in range(universe)]
+    return [set(rng.sample(symbols, genes)) for _ in range(count)]
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark combination_intersection")
+    parser.add_argument("--sets", type=int, nargs="+", default=[8, 12, 16, 20])
+    parser.add_argument("--genes", type=int, default=500, help="genes per geneset")
+    parser.add_argument("--universe", type=int, default=2000, help="distinct genes")
+    parser.add_argument(
+        "--scratch-limit",
+        type=int,
+        default=16,
+        help="largest N measured from scratch (it intersects all 2^N combinations)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for count in args.sets:
+        genesets = make_genesets(count, args.genes, args.universe, args.seed)
+        timings = {}
+
+        if count <= args.scratch_limit:
+            start = time.perf_counter()
+            from_scratch(*genesets)
+            timings["from scratch"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        combination_intersection(*genesets)
+        timings["incremental"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        non_empty = sum(
+            1 for _ in iter_combination_intersection(*genesets, skip_empty=True)
+        )
+        timings["skip_empty stream"] = time.perf_counter() - start
+
+        report = ", ".join(f"{name} {secs:8.3f}s" for name, secs in timings.items())
+        print(f"N={count:>3} ({non_empty} non-empty combinations): {report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Compare set operations on GeneValue schemas and on frozen gene values.
+
+Genesets of GeneValueFullHash (or GeneValue, with --symbol-only) schemas are built
+once, converted with to_frozen_genesets, and union and intersection are timed on
+both. Times are reported per input element.
+
+Run from the geneweaver_boolean_algebra folder:
+    python -m benchmarks.bench_gene_value --genesets 5 --genes 20000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from typing import Callable, List, Set, Type
+
+from geneweaver.tools.boolean_algebra.gene_value import to_frozen_genesets
+from geneweaver.tools.boolean_algebra.intersection import intersection
+from geneweaver.tools.boolean_algebra.schema import GeneValue, GeneValueFullHash
+from geneweaver.tools.boolean_algebra.union import union
+
+
+def make_genesets(
+    schema: Type[GeneValue], count: int, genes: int, universe: int, seed: int
+) -> List[List[GeneValue]]:
+    """Draw count random genesets of GeneValue schemas, as lists."""
+    rng = random.Random(seed)
+    return [
+        [schema(symbol=f"GENE{i}", value=1) for i in rng.sample(range(universe), genes)]
+        for _ in range(count)
+    ]
+
+
+def best_time(func: Callable, repeat: int) -> float:
+    """Best wall time of repeat calls to func, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def traced_size(func: Callable[[], List[Set]]) -> int:
+    """Bytes allocated by func and still held by its result."""
+    tracemalloc.start()
+    result = func()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark frozen gene values")
+    parser.add_argument("--genesets", type=int, default=5)
+    parser.add_argument("--genes", type=int, default=20000, help="genes per geneset")
+    parser.add_argument("--universe", type=int, default=40000, help="distinct genes")
+    parser.add_argument("--symbol-only", action="store_true", help="use GeneValue")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    schema = GeneValue if args.symbol_only else GeneValueFullHash
+    lists = make_genesets(
+        schema, args.genesets, args.genes, args.universe, args.seed
+    )
+    elements = args.genesets * args.genes
+
+    schema_sets = [set(geneset) for geneset in lists]
+    frozen_sets = to_frozen_genesets(lists)
+    timings = {
+        "build sets": (
+            best_time(lambda: [set(geneset) for geneset in lists], args.repeat),
+            best_time(lambda: to_frozen_genesets(lists), args.repeat),
+        ),
+        "union": (
+            best_time(lambda: union(*schema_sets), args.repeat),
+            best_time(lambda: union(*frozen_sets), args.repeat),
+        ),
+        "intersection": (
+            best_time(lambda: intersection(*schema_sets), args.repeat),
+            best_time(lambda: intersection(*frozen_sets), args.repeat),
+        ),
+    }
+
+    print(f"{args.genesets} genesets x {args.genes} {schema.__name__}s")
+    for name, (schema_time, frozen_time) in timings.items():
+        print(
+            f"{name:>13}: schemas {schema_time / elements * 1e9:7.1f} ns/element, "
+            f"frozen {frozen_time / elements * 1e9:7.1f} ns/element "
+            f"({schema_time / frozen_time:4.1f}x)"
+        )
+
+    schema_bytes = traced_size(
+        lambda: [
+            {schema(symbol=gene.symbol, value=gene.value) for gene in geneset}
+            for geneset in lists
+        ]
+    )
+    frozen_bytes = traced_size(lambda: to_frozen_genesets(lists))
+    print(
+        f"memory: schemas {schema_bytes / elements:.0f} B/element, "
+        f"frozen {frozen_bytes / elements:.0f} B/element"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compare permutation_p_values with drawing and intersecting Python sets.
+
+Genesets of between --min-genes and --max-genes genes are drawn from a universe of
+--universe genes, and the p-values of all their combinations are estimated from
+--permutations permutations, in one process and in each number of --processes. The
+Python baseline draws each geneset with random.sample and intersects every
+combination, and is extrapolated from --python-permutations permutations.
+
+Run from the geneweaver_boolean_algebra folder:
+    python -m benchmarks.bench_permutation --sets 6 --processes 2 4
+"""
+import argparse
+import random
+import time
+from typing import Dict, List, Set, Tuple
+
+from geneweaver.tools.boolean_algebra.intersection import combination_intersection
+from geneweaver.tools.boolean_algebra.permutation import permutation_p_values
+
+
+def python_exceedances(
+    genesets: List[Set[int]],
+    intersections: Dict[Tuple[int, ...], Set[int]],
+    universe: int,
+    permutations: int,
+    seed: int,
+) -> Dict[Tuple[int, ...], int]:
+    """Count the permutations reaching each intersection, one set at a time."""
+    rng = random.Random(seed)
+    genes = range(universe)
+    exceedances = dict.fromkeys(intersections, 0)
+    for _ in range(permutations):
+        drawn = [set(rng.sample(genes, len(geneset))) for geneset in genesets]
+        for combination, observed in intersections.items():
+            shared = set.intersection(*(drawn[index] for index in combination))
+            exceedances[combination] += len(shared) >= len(observed)
+    return exceedances
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark permutation_p_values")
+    parser.add_argument("--sets", type=int, default=6)
+    parser.add_argument("--min-genes", type=int, default=100)
+    parser.add_argument("--max-genes", type=int, default=3000)
+    parser.add_argument("--universe", type=int, default=20000, help="distinct genes")
+    parser.add_argument("--permutations", type=int, default=10000)
+    parser.add_argument("--processes", type=int, nargs="*", default=[2, 4])
+    parser.add_argument("--python-permutations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sizes = [rng.randint(args.min_genes, args.max_genes) for _ in range(args.sets)]
+    genesets = [set(rng.sample(range(args.universe), size)) for size in sizes]
+    intersections = combination_intersection(*genesets)
+    print(
+        f"{args.sets} genesets, {len(intersections)} combinations, "
+        f"{args.permutations} permutations"
+    )
+
+    start = time.perf_counter()
+    python_exceedances(
+        genesets, intersections, args.universe, args.python_permutations, args.seed
+    )
+    python = (time.perf_counter() - start) / args.python_permutations
+    print(f"python sets:   {python * args.permutations:8.2f}s (extrapolated)")
+
+    expected = None
+    for processes in [1, *args.processes]:
+        start = time.perf_counter()
+        p_values = permutation_p_values(
+            genesets,
+            intersections,
+            args.universe,
+            args.permutations,
+            seed=args.seed,
+            processes=processes,
+        )
+        elapsed = time.perf_counter() - start
+        assert expected is None or p_values == expected
+        expected = p_values
+        print(f"{processes:>2} processes:  {elapsed:8.2f}s")
+
+
+if __name__ == "__main__":
+    main()
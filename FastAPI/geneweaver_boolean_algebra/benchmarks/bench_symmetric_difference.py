@@ -0,0 +1,71 @@
+"""Compare counting symmetric_difference with the previous pairwise approach.
+
+The pairwise approach subtracts the union of every pairwise intersection from the
+union of the genesets, which takes O(N^2) intersections.
+
+Run from the geneweaver_boolean_algebra folder:
+    python -m benchmarks.bench_symmetric_difference --sets 2 5 10 25 50 100
+"""
+import argparse
+import random
+import time
+from functools import partial
+from typing import Callable, List, Set
+
+from geneweaver.tools.boolean_algebra.bitmap import BitmapEngine
+from geneweaver.tools.boolean_algebra.intersection import combination_intersection
+from geneweaver.tools.boolean_algebra.symmetric_difference import symmetric_difference
+from geneweaver.tools.boolean_algebra.union import union
+
+
+def pairwise_symmetric_difference(*args: Set[str]) -> Set[str]:
+    """Subtract the union of all pairwise intersections, as was done before."""
+    return union(*args) - union(*combination_intersection(*args, max_size=2).values())
+
+
+def make_genesets(count: int, genes: int, universe: int, seed: int) -> List[Set[str]]:
+    """Draw count random genesets of the given size."""
+    rng = random.Random(seed)
+    symbols = [f"GENE{i}" for i in range(universe)]
+    return [set(rng.sample(symbols, genes)) for _ in range(count)]
+
+
+def best_time(func: Callable, repeat: int) -> float:
+    """Best wall time of repeat calls to func, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description="Benchmark symmetric_difference")
+    parser.add_argument("--sets", type=int, nargs="+", default=[2, 5, 10, 25, 50, 100])
+    parser.add_argument("--genes", type=int, default=2000, help="genes per geneset")
+    parser.add_argument("--universe", type=int, default=20000, help="distinct genes")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for count in args.sets:
+        genesets = make_genesets(count, args.genes, args.universe, args.seed)
+        bitmaps = BitmapEngine().to_bitmaps(genesets)
+        assert pairwise_symmetric_difference(*genesets) == symmetric_difference(
+            *genesets
+        )
+
+        pairwise = best_time(partial(pairwise_symmetric_difference, *genesets), 1)
+        counting = best_time(partial(symmetric_difference, *genesets), args.repeat)
+        bitmap = best_time(partial(symmetric_difference, *bitmaps), args.repeat)
+        print(
+            f"N={count:>3}: pairwise {pairwise * 1000:9.2f} ms, "
+            f"counting {counting * 1000:7.2f} ms ({pairwise / counting:6.1f}x), "
+            f"bitmaps {bitmap * 1000:7.2f} ms ({pairwise / bitmap:6.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
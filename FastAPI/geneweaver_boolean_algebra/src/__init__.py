@@ -1,6 +1,19 @@
 """The boolean algebra tool module."""
 # ruff: noqa: F401
-from .intersection import combination_intersection, intersection
+from .bitmap import BitmapEngine, GeneBitmap, GeneInterner
+from .gene_value import (
+    FrozenGeneValue,
+    FrozenGeneValueFullHash,
+    to_frozen_genesets,
+    to_gene_values,
+)
+from .intersection import (
+    combination_intersection,
+    intersection,
+    iter_combination_intersection,
+)
+from .membership import at_least_k, at_most_k, exactly_k, membership_counts
+from .permutation import permutation_p_values
 from .symmetric_difference import symmetric_difference
 from .union import union
 from .utils import iterable_to_sets
@@ -0,0 +1,258 @@
+"""Bitmap representation of genesets for fast boolean algebra.
+
+Gene identifiers are interned to dense integer ids by a GeneInterner, and each geneset
+is stored as a NumPy packed bit array over those ids. Set operations then become
+vectorized bitwise operations instead of hashing every gene.
+
+GeneBitmap implements the set methods used by the boolean algebra functions, so
+union, intersection, combination_intersection and symmetric_difference accept bitmaps
+built by the same BitmapEngine and return bitmaps.
+"""
+from typing import (
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Union,
+)
+
+import numpy as np
+
+# Number of set bits in every possible byte value
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+class GeneInterner:
+    """Assign dense integer ids to hashable gene identifiers."""
+
+    def __init__(self: "GeneInterner", genes: Iterable[Hashable] = ()) -> None:
+        """Create an interner, optionally interning an initial set of genes."""
+        self._ids: Dict[Hashable, int] = {}
+        self._genes: List[Hashable] = []
+        self._gene_array: Optional[np.ndarray] = None
+        self.intern_many(genes)
+
+    def __len__(self: "GeneInterner") -> int:
+        """Get the number of interned genes."""
+        return len(self._genes)
+
+    def intern(self: "GeneInterner", gene: Hashable) -> int:
+        """Get the id of a gene, assigning the next free id if it is new."""
+        gene_id = self._ids.get(gene)
+        if gene_id is None:
+            gene_id = self._ids[gene] = len(self._genes)
+            self._genes.append(gene)
+            self._gene_array = None
+        return gene_id
+
+    def intern_many(self: "GeneInterner", genes: Iterable[Hashable]) -> np.ndarray:
+        """Get the ids of many genes, interning any that are new."""
+        genes = list(genes)
+        ids = self._ids
+        new_genes = list(dict.fromkeys(gene for gene in genes if gene not in ids))
+        if new_genes:
+            first_id = len(self._genes)
+            ids.update(zip(new_genes, range(first_id, first_id + len(new_genes))))
+            self._genes.extend(new_genes)
+            self._gene_array = None
+        return np.fromiter(
+            map(ids.__getitem__, genes), dtype=np.int64, count=len(genes)
+        )
+
+    def lookup(self: "GeneInterner", gene: Hashable) -> Optional[int]:
+        """Get the id of a gene without interning it, or None if it is unknown."""
+        return self._ids.get(gene)
+
+    def genes(self: "GeneInterner", ids: np.ndarray) -> np.ndarray:
+        """Map an array of ids back to their genes, as an object array."""
+        if self._gene_array is None or len(self._gene_array) != len(self._genes):
+            self._gene_array = np.empty(len(self._genes), dtype=object)
+            self._gene_array[:] = self._genes
+        return self._gene_array[ids]
+
+
+class GeneBitmap:
+    """A geneset stored as a packed bitmap over the ids of a GeneInterner.
+
+    Bit i of the bitmap is set when the gene with id i is a member. Bitmaps combined
+    with each other must share the same interner.
+    """
+
+    __slots__ = ("interner", "bits")
+
+    def __init__(self: "GeneBitmap", interner: GeneInterner, bits: np.ndarray) -> None:
+        """Wrap an array of packed bits (little bit order) over interner's ids."""
+        self.interner = interner
+        self.bits = bits
+
+    @classmethod
+    def from_ids(
+        cls: "type[GeneBitmap]", ids: np.ndarray, interner: GeneInterner
+    ) -> "GeneBitmap":
+        """Build a bitmap with the given gene ids set."""
+        members = np.zeros(len(interner), dtype=bool)
+        members[ids] = True
+        return cls(interner, np.packbits(members, bitorder="little"))
+
+    @classmethod
+    def from_mask(
+        cls: "type[GeneBitmap]", mask: np.ndarray, interner: GeneInterner
+    ) -> "GeneBitmap":
+        """Build a bitmap from a boolean array indexed by gene id."""
+        return cls(interner, np.packbits(mask, bitorder="little"))
+
+    @classmethod
+    def from_genes(
+        cls: "type[GeneBitmap]", genes: Iterable[Hashable], interner: GeneInterner
+    ) -> "GeneBitmap":
+        """Build a bitmap from gene identifiers, interning any that are new."""
+        return cls.from_ids(interner.intern_many(genes), interner)
+
+    def _aligned(self: "GeneBitmap", others: Iterable["GeneBitmap"]) -> np.ndarray:
+        """Stack this bitmap and others into one 2D array of equal length rows."""
+        bitmaps = [self, *others]
+        for other in bitmaps:
+            if other.interner is not self.interner:
+                raise ValueError("GeneBitmaps must share the same GeneInterner")
+        width = max(len(bitmap.bits) for bitmap in bitmaps)
+        stacked = np.zeros((len(bitmaps), width), dtype=np.uint8)
+        for row, bitmap in enumerate(bitmaps):
+            stacked[row, : len(bitmap.bits)] = bitmap.bits
+        return stacked
+
+    def ids(self: "GeneBitmap") -> np.ndarray:
+        """Get the sorted ids of the member genes."""
+        return np.flatnonzero(np.unpackbits(self.bits, bitorder="little"))
+
+    def to_set(self: "GeneBitmap") -> Set[Hashable]:
+        """Materialize the bitmap as a set of gene identifiers."""
+        return set(self.interner.genes(self.ids()))
+
+    def union(self: "GeneBitmap", *others: "GeneBitmap") -> "GeneBitmap":
+        """Genes present in this bitmap or any of the others."""
+        return GeneBitmap(self.interner, np.bitwise_or.reduce(self._aligned(others)))
+
+    def intersection(self: "GeneBitmap", *others: "GeneBitmap") -> "GeneBitmap":
+        """Genes present in this bitmap and all of the others."""
+        return GeneBitmap(self.interner, np.bitwise_and.reduce(self._aligned(others)))
+
+    def difference(self: "GeneBitmap", *others: "GeneBitmap") -> "GeneBitmap":
+        """Genes present in this bitmap but in none of the others."""
+        stacked = self._aligned(others)
+        return GeneBitmap(
+            self.interner, stacked[0] & ~np.bitwise_or.reduce(stacked[1:], axis=0)
+        )
+
+    def symmetric_difference(self: "GeneBitmap", other: "GeneBitmap") -> "GeneBitmap":
+        """Genes present in exactly one of this bitmap and other."""
+        stacked = self._aligned([other])
+        return GeneBitmap(self.interner, stacked[0] ^ stacked[1])
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+    __xor__ = symmetric_difference
+
+    def __len__(self: "GeneBitmap") -> int:
+        """Count the member genes."""
+        return int(_POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    def __bool__(self: "GeneBitmap") -> bool:
+        """Check whether any gene is a member."""
+        return bool(self.bits.any())
+
+    def __iter__(self: "GeneBitmap") -> Iterator[Hashable]:
+        """Iterate over the member genes, in id order."""
+        return iter(self.interner.genes(self.ids()))
+
+    def __contains__(self: "GeneBitmap", gene: Hashable) -> bool:
+        """Check whether a gene is a member."""
+        gene_id = self.interner.lookup(gene)
+        if gene_id is None or gene_id >> 3 >= len(self.bits):
+            return False
+        return bool(self.bits[gene_id >> 3] >> (gene_id & 7) & 1)
+
+    def __eq__(self: "GeneBitmap", other: object) -> bool:
+        """Compare membership with another bitmap or with a set of genes."""
+        if isinstance(other, GeneBitmap):
+            if other.interner is not self.interner:
+                return self.to_set() == other.to_set()
+            stacked = self._aligned([other])
+            return bool(np.array_equal(stacked[0], stacked[1]))
+        if isinstance(other, (set, frozenset)):
+            return self.to_set() == other
+        return NotImplemented
+
+    __hash__ = None  # Bitmaps are mutable containers, like sets
+
+    def __repr__(self: "GeneBitmap") -> str:
+        """Show the bitmap's size."""
+        return f"GeneBitmap(<{len(self)} genes>)"
+
+
+def membership_counts(*bitmaps: GeneBitmap) -> np.ndarray:
+    """Count how many of the bitmaps contain each gene id.
+
+    :param bitmaps: Bitmaps sharing one interner.
+    :return: An array of counts indexed by gene id.
+    """
+    stacked = bitmaps[0]._aligned(bitmaps[1:])
+    return np.unpackbits(stacked, axis=1, bitorder="little").sum(axis=0, dtype=np.int64)
+
+
+class BitmapEngine:
+    """Convert genesets to GeneBitmaps over one shared interner, and back.
+
+    Typical use::
+
+        engine = BitmapEngine()
+        bitmaps = engine.to_bitmaps(genesets)
+        result = engine.materialize(union(*bitmaps))
+    """
+
+    def __init__(self: "BitmapEngine", interner: Optional[GeneInterner] = None) -> None:
+        """Create an engine, optionally reusing an existing interner."""
+        self.interner = GeneInterner() if interner is None else interner
+
+    def to_bitmaps(
+        self: "BitmapEngine", genesets: Iterable[Iterable[Hashable]]
+    ) -> List[GeneBitmap]:
+        """Intern the genes of every geneset and build one bitmap per geneset.
+
+        All genes are interned before any bitmap is built, so the bitmaps share one
+        width.
+        """
+        id_arrays = [self.interner.intern_many(geneset) for geneset in genesets]
+        return [GeneBitmap.from_ids(ids, self.interner) for ids in id_arrays]
+
+    def materialize_many(
+        self: "BitmapEngine", bitmaps: Iterable[GeneBitmap]
+    ) -> List[Set[Hashable]]:
+        """Convert many bitmaps back to sets of gene identifiers in one bulk pass."""
+        bitmaps = list(bitmaps)
+        if not bitmaps:
+            return []
+        stacked = bitmaps[0]._aligned(bitmaps[1:])
+        rows, ids = np.nonzero(np.unpackbits(stacked, axis=1, bitorder="little"))
+        genes = self.interner.genes(ids)
+        bounds = np.searchsorted(rows, np.arange(len(bitmaps) + 1))
+        return [set(genes[bounds[i] : bounds[i + 1]]) for i in range(len(bitmaps))]
+
+    def materialize(
+        self: "BitmapEngine",
+        result: Union[GeneBitmap, Mapping[Hashable, GeneBitmap]],
+    ) -> Union[Set[Hashable], Dict[Hashable, Set[Hashable]]]:
+        """Convert a boolean algebra result back to gene identifiers.
+
+        :param result: A single bitmap (e.g. from union) or a mapping of bitmaps
+        (e.g. from combination_intersection).
+        :return: A set of genes, or a dict of sets with the same keys.
+        """
+        if isinstance(result, GeneBitmap):
+            return result.to_set()
+        keys = list(result.keys())
+        return dict(zip(keys, self.materialize_many(result[key] for key in keys)))
@@ -0,0 +1,167 @@
+"""Lightweight gene values for hot set operations.
+
+GeneValue and GeneValueFullHash are pydantic models, which are costly to hash,
+compare and store in the large sets built by the boolean algebra functions.
+FrozenGeneValue and FrozenGeneValueFullHash have the same equality semantics, but
+are immutable __slots__ objects with an interned symbol and a cached hash.
+
+Convert to them with to_frozen_genesets when genesets enter the tool, and back with
+to_gene_values when results leave it, so that pydantic is only used at the boundary.
+"""
+import sys
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple, Type
+
+from .schema import GeneValue, GeneValueFullHash
+
+
+class FrozenGeneValue:
+    """An immutable gene value, hashed and compared by symbol only."""
+
+    __slots__ = ("symbol", "value", "_hash", "_schema")
+
+    schema_class: Type[GeneValue] = GeneValue
+    _hash_with_value = False
+
+    def __init__(
+        self: "FrozenGeneValue",
+        symbol: str,
+        value: float,
+        schema: Optional[GeneValue] = None,
+    ) -> None:
+        """Create a gene value, optionally remembering the schema it came from."""
+        # Slots are set through their descriptors, bypassing __setattr__, which is
+        # noticeably faster than object.__setattr__ when converting large genesets
+        symbol = sys.intern(symbol)
+        _set_symbol(self, symbol)
+        _set_value(self, value)
+        _set_hash(self, hash((symbol, value) if self._hash_with_value else symbol))
+        _set_schema(self, schema)
+
+    @classmethod
+    def from_schema(
+        cls: Type["FrozenGeneValue"], gene_value: GeneValue
+    ) -> "FrozenGeneValue":
+        """Convert a GeneValue schema."""
+        return cls(gene_value.symbol, gene_value.value, gene_value)
+
+    def to_schema(self: "FrozenGeneValue") -> GeneValue:
+        """Convert back to a schema, reusing the original one if there was one."""
+        if self._schema is not None:
+            return self._schema
+        return self.schema_class(symbol=self.symbol, value=self.value)
+
+    def __setattr__(
+        self: "FrozenGeneValue", name: str, value: Any  # noqa: ANN401
+    ) -> None:
+        """Reject changes, the hash depends on the attributes."""
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __hash__(self: "FrozenGeneValue") -> int:
+        """Return the cached hash of the symbol."""
+        return self._hash
+
+    def __eq__(self: "FrozenGeneValue", other: Any) -> bool:  # noqa: ANN401
+        """Compare the gene symbol (without value)."""
+        if other is self:
+            return True
+        if isinstance(other, FrozenGeneValue):
+            return self.symbol is other.symbol or self.symbol == other.symbol
+        return False
+
+    def __reduce__(self: "FrozenGeneValue") -> Tuple[type, Tuple[str, float]]:
+        """Pickle by symbol and value."""
+        return type(self), (self.symbol, self.value)
+
+    def __repr__(self: "FrozenGeneValue") -> str:
+        """Show the symbol and value."""
+        return f"{type(self).__name__}(symbol={self.symbol!r}, value={self.value!r})"
+
+
+class FrozenGeneValueFullHash(FrozenGeneValue):
+    """An immutable gene value, hashed and compared by symbol and value."""
+
+    __slots__ = ()
+
+    schema_class: Type[GeneValue] = GeneValueFullHash
+    _hash_with_value = True
+
+    def __eq__(self: "FrozenGeneValueFullHash", other: Any) -> bool:  # noqa: ANN401
+        """Compare the gene symbol (with value)."""
+        if other is self:
+            return True
+        if isinstance(other, FrozenGeneValue):
+            return self.symbol == other.symbol and self.value == other.value
+        return False
+
+    __hash__ = FrozenGeneValue.__hash__
+
+
+_set_symbol = FrozenGeneValue.symbol.__set__
+_set_value = FrozenGeneValue.value.__set__
+_set_hash = FrozenGeneValue._hash.__set__
+_set_schema = FrozenGeneValue._schema.__set__
+
+# Frozen type for each schema type
+_FROZEN_TYPES = {
+    GeneValue: FrozenGeneValue,
+    GeneValueFullHash: FrozenGeneValueFullHash,
+}
+
+
+def to_frozen_genesets(genesets: Iterable[Iterable[Hashable]]) -> List[Set[Hashable]]:
+    """Convert genesets of GeneValue schemas to sets of frozen gene values.
+
+    Equal genes are converted to one shared object, so set operations across the
+    genesets find matches by identity without calling __eq__. Items that are not
+    GeneValues (e.g. plain symbols) are kept as they are.
+
+    :param genesets: The genesets to convert.
+    :return: One set of frozen gene values per geneset.
+    """
+    # This loop runs once per input gene, so it avoids per-gene function calls
+    converted: Dict[Hashable, FrozenGeneValue] = {}
+    converted_full_hash: Dict[Hashable, FrozenGeneValue] = {}
+    frozen_genesets = []
+    for geneset in genesets:
+        frozen_geneset = set()
+        add = frozen_geneset.add
+        for gene in geneset:
+            # Looking the type up is much cheaper than isinstance on pydantic models
+            frozen_class = _FROZEN_TYPES.get(type(gene))
+            if frozen_class is None:
+                if not isinstance(gene, GeneValue):
+                    add(gene)
+                    continue
+                frozen_class = (
+                    FrozenGeneValueFullHash
+                    if isinstance(gene, GeneValueFullHash)
+                    else FrozenGeneValue
+                )
+            if frozen_class._hash_with_value:
+                cache, key = converted_full_hash, (gene.symbol, gene.value)
+            else:
+                cache, key = converted, gene.symbol
+            frozen = cache.get(key)
+            if frozen is None:
+                frozen = cache[key] = frozen_class(gene.symbol, gene.value, gene)
+            add(frozen)
+        frozen_genesets.append(frozen_geneset)
+    return frozen_genesets
+
+
+def to_gene_values(result: Any) -> Any:  # noqa: ANN401
+    """Convert frozen gene values in a result back to GeneValue schemas.
+
+    :param result: A set of genes, or a dict whose keys or values hold genes, as
+    returned by the boolean algebra functions.
+    :return: The same structure holding GeneValue schemas.
+    """
+    if isinstance(result, FrozenGeneValue):
+        return result.to_schema()
+    if isinstance(result, dict):
+        return {
+            to_gene_values(key): to_gene_values(value) for key, value in result.items()
+        }
+    if isinstance(result, (set, frozenset)):
+        return {to_gene_values(gene) for gene in result}
+    return result
@@ -3,7 +3,7 @@
 The result will contain sets of genes that are shared across the input sets.
 """
 import itertools
-from typing import Dict, Hashable, Optional, Set
+from typing import Dict, Hashable, Iterator, Optional, Sequence, Set, Tuple
 
 
 def intersection(*args: Set[Hashable]) -> Set[Hashable]:
@@ -11,18 +11,60 @@ def intersection(*args: Set[Hashable]) -> Set[Hashable]:
 
     The result will contain sets of genes that are shared across the input sets.
 
+    The genesets may be sets, or GeneBitmaps built by the same BitmapEngine, in which
+    case the result is a GeneBitmap.
+
     :param input_sets: A list of geneset ids to find the intersection of.
     :return: A list of geneset ids that are the intersection of the input sets.
     """
-    return set.intersection(*args)
+    return args[0].intersection(*args[1:])
 
 
 def combination_intersection(
-    *args: Set[Hashable], min_size: int = 2, max_size: Optional[int] = None
-) -> Dict[Hashable, Set[Hashable]]:
-    """Find the intersection of N genesets, across combinations of the input sets."""
-    result = {}
-    arg_indexes = tuple(range(len(args)))
+    *args: Set[Hashable],
+    min_size: int = 2,
+    max_size: Optional[int] = None,
+    skip_empty: bool = False,
+) -> Dict[Tuple[int, ...], Set[Hashable]]:
+    """Find the intersection of N genesets, across combinations of the input sets.
+
+    The result is keyed by tuples of input indexes, ordered by combination size and
+    then lexicographically. See iter_combination_intersection to stream the
+    combinations instead of building the whole dict.
+
+    :param args: The genesets to intersect.
+    :param min_size: The smallest combination to include.
+    :param max_size: The largest combination to include, defaults to all the sets.
+    :param skip_empty: Leave out combinations whose intersection is empty.
+    :return: A dict from combination to the intersection of its genesets.
+    """
+    results = iter_combination_intersection(
+        *args, min_size=min_size, max_size=max_size, skip_empty=skip_empty
+    )
+    # The walk yields combinations in lexicographic order, and the sort is stable
+    return dict(sorted(results, key=lambda item: len(item[0])))
+
+
+def iter_combination_intersection(
+    *args: Set[Hashable],
+    min_size: int = 2,
+    max_size: Optional[int] = None,
+    skip_empty: bool = False,
+) -> Iterator[Tuple[Tuple[int, ...], Set[Hashable]]]:
+    """Lazily yield (combination, intersection) pairs across combinations of the sets.
+
+    Combinations are walked depth first in lexicographic order, so each intersection
+    is computed from the intersection of its prefix with one more set, rather than
+    from scratch. Once a prefix's intersection is empty, every combination extending
+    it is empty too, so that branch is not intersected any further (and is not walked
+    at all with skip_empty).
+
+    :param args: The genesets to intersect.
+    :param min_size: The smallest combination to yield.
+    :param max_size: The largest combination to yield, defaults to all the sets.
+    :param skip_empty: Do not yield combinations whose intersection is empty.
+    :return: An iterator of (combination, intersection) pairs.
+    """
     _max_size = len(args) if max_size is None else max_size
 
     if min_size < 2:
@@ -34,9 +76,38 @@ def combination_intersection(
     if _max_size > len(args):
         raise ValueError("max_size must be less than or equal to the number of sets")
 
-    for i in range(min_size, _max_size + 1):
-        for combination in itertools.combinations(arg_indexes, i):
-            sets = [args[index] for index in combination]
-            result[combination] = intersection(*sets)
+    return itertools.chain.from_iterable(
+        _extend_combination(
+            args, (index,), args[index], min_size, _max_size, skip_empty
+        )
+        for index in range(len(args))
+    )
+
+
+def _extend_combination(
+    args: Sequence[Set[Hashable]],
+    prefix: Tuple[int, ...],
+    prefix_intersection: Set[Hashable],
+    min_size: int,
+    max_size: int,
+    skip_empty: bool,
+) -> Iterator[Tuple[Tuple[int, ...], Set[Hashable]]]:
+    """Yield the intersections of every combination extending prefix."""
+    is_empty = not prefix_intersection
+    if is_empty and skip_empty:
+        return
+
+    for index in range(prefix[-1] + 1, len(args)):
+        combination = (*prefix, index)
+        if is_empty:
+            # Every extension is empty, yield a fresh empty set without intersecting
+            result = intersection(prefix_intersection)
+        else:
+            result = intersection(prefix_intersection, args[index])
 
-    return result
+        if len(combination) >= min_size and (result or not skip_empty):
+            yield combination, result
+        if len(combination) < max_size:
+            yield from _extend_combination(
+                args, combination, result, min_size, max_size, skip_empty
+            )
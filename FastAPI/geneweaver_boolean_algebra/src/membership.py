@@ -0,0 +1,74 @@
+"""Find the genes present in a given number of N genesets.
+
+Each gene is counted once per geneset that contains it, in a single pass over all
+the genes, so these operations cost O(total genes) however many genesets are given.
+The symmetric difference is the special case of genes present in exactly one set.
+"""
+import itertools
+from collections import Counter
+from typing import Callable, Dict, Hashable, Set
+
+import numpy as np
+
+from .bitmap import GeneBitmap
+from .bitmap import membership_counts as bitmap_membership_counts
+
+
+def membership_counts(*args: Set[Hashable]) -> Dict[Hashable, int]:
+    """Count how many of the genesets contain each gene.
+
+    :param args: The genesets to count, as sets or GeneBitmaps from one BitmapEngine.
+    :return: A dict from each gene in the union of the genesets to its count.
+    """
+    if args and isinstance(args[0], GeneBitmap):
+        counts = bitmap_membership_counts(*args)
+        ids = np.flatnonzero(counts)
+        genes = args[0].interner.genes(ids)
+        return dict(zip(genes, counts[ids].tolist()))
+    return Counter(itertools.chain.from_iterable(args))
+
+
+def _select(
+    args: tuple, k: int, keep: Callable[[np.ndarray], np.ndarray]
+) -> Set[Hashable]:
+    """Select the genes whose membership count passes keep."""
+    if k < 1:
+        raise ValueError("k must be at least 1")
+    if args and isinstance(args[0], GeneBitmap):
+        counts = bitmap_membership_counts(*args)
+        return GeneBitmap.from_mask(keep(counts) & (counts > 0), args[0].interner)
+    counts = Counter(itertools.chain.from_iterable(args))
+    genes = np.empty(len(counts), dtype=object)
+    genes[:] = list(counts)
+    values = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+    return set(genes[keep(values)])
+
+
+def exactly_k(k: int, *args: Set[Hashable]) -> Set[Hashable]:
+    """Find the genes present in exactly k of the genesets.
+
+    :param k: The number of genesets a gene must be in.
+    :param args: The genesets, as sets or GeneBitmaps from one BitmapEngine.
+    :return: The selected genes, as a set or a GeneBitmap.
+    """
+    return _select(args, k, lambda counts: counts == k)
+
+
+def at_least_k(k: int, *args: Set[Hashable]) -> Set[Hashable]:
+    """Find the genes present in at least k of the genesets.
+
+    :param k: The smallest number of genesets a gene must be in.
+    :param args: The genesets, as sets or GeneBitmaps from one BitmapEngine.
+    :return: The selected genes, as a set or a GeneBitmap.
+    """
+    return _select(args, k, lambda counts: counts >= k)
+
+
+def at_most_k(k: int, *args: Set[Hashable]) -> Set[Hashable]:
+    """Find the genes present in at least one and at most k of the genesets.
+
+    :param k: The largest number of genesets a gene may be in.
+    :param args: The genesets, as sets or GeneBitmaps from one BitmapEngine.
+    :return: The selected genes, as a set or a GeneBitmap.
+    """
+    return _select(args, k, lambda counts: counts <= k)
@@ -0,0 +1,254 @@
+"""Empirical p-values for the intersections of combinations of genesets.
+
+The null hypothesis is that the genesets were drawn at random, with their sizes, from
+a universe of genes. For each combination, the p-value is the share of permutations
+whose intersection is at least as large as the observed one, counting the observed
+intersection itself so that no p-value is 0: (1 + exceedances) / (1 + permutations).
+
+Only the sizes of the genesets matter under this null, and it is unchanged by
+relabelling the genes, so the largest geneset is fixed to the first genes of the
+universe and only the others are drawn. Each draw is a random subset of exactly the
+geneset's size, taken for a whole chunk of permutations at once from the smallest
+random keys of each row, or by drawing genes until there are enough distinct ones for
+small genesets (drawing the complement, for genesets of more than half of the
+universe), and stored as packed bits. The intersection of every combination is then
+the popcount of the AND of its bitmaps, walked depth first in lexicographic order so
+that each combination reuses the AND of its prefix.
+
+Permutations run in chunks of PERMUTATION_CHUNK, each with its own random stream
+spawned from the seed, so the p-values depend only on the seed and the number of
+permutations, and not on the number of processes they are spread over. With more
+than one process, the inputs are placed in shared memory once, and each chunk writes
+its exceedance counts to its own row of a shared output array.
+"""
+import concurrent.futures
+from multiprocessing import shared_memory
+from typing import Dict, Hashable, List, Mapping, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .bitmap import _POPCOUNT
+
+# Permutations drawn together, and the unit of work sent to a process
+PERMUTATION_CHUNK = 256
+
+# Subsets of at most this fraction of the universe are drawn gene by gene, and larger
+# ones from the smallest of a random key per gene
+SPARSE_DRAW_DIVISOR = 8
+
+# Counts the set bits of each byte; numpy 2 has a ufunc for it
+_bitwise_count = getattr(np, "bitwise_count", _POPCOUNT.__getitem__)
+
+# Arrays of the current task, attached to shared memory once per worker process
+_shared: Dict[str, np.ndarray] = {}
+_shared_blocks: List[shared_memory.SharedMemory] = []
+
+
+def random_subsets(
+    rng: np.random.Generator, count: int, size: int, universe_size: int
+) -> np.ndarray:
+    """Draw count random subsets of size genes out of universe_size, as packed bits.
+
+    :param rng: The random generator to draw from.
+    :param count: The number of subsets, one per row of the result.
+    :param size: The number of genes in each subset.
+    :param universe_size: The number of genes to draw from.
+    :return: A (count, ceil(universe_size / 8)) uint8 array of packed bits.
+    """
+    complement = 2 * size > universe_size
+    drawn = universe_size - size if complement else size
+    members = np.zeros((count, universe_size), dtype=bool)
+    if drawn * SPARSE_DRAW_DIVISOR <= universe_size:
+        # Few genes are drawn twice, so draw until each row has enough distinct genes
+        rows = np.arange(count)
+        missing = np.full(count, drawn)
+        while len(rows):
+            genes = rng.integers(0, universe_size, (len(rows), int(missing.max())))
+            wanted = np.arange(genes.shape[1]) < missing[:, None]
+            drawn_rows = np.broadcast_to(rows[:, None], genes.shape)
+            members[drawn_rows[wanted], genes[wanted]] = True
+            missing = drawn - np.count_nonzero(members[rows], axis=1)
+            rows, missing = rows[missing > 0], missing[missing > 0]
+    else:
+        keys = rng.random((count, universe_size))
+        chosen = np.argpartition(keys, drawn - 1, axis=1)[:, :drawn]
+        members[np.arange(count)[:, None], chosen] = True
+    if complement:
+        np.logical_not(members, out=members)
+    return np.packbits(members, axis=1)
+
+
+def _count_exceedances(
+    sizes: np.ndarray,
+    combinations: np.ndarray,
+    lengths: np.ndarray,
+    observed: np.ndarray,
+    universe_size: int,
+    count: int,
+    seed: np.random.SeedSequence,
+) -> np.ndarray:
+    """Count the permutations of one chunk that reach each observed intersection.
+
+    combinations holds one lexicographically sorted combination of geneset indexes
+    per row, padded after lengths[i] entries, with the rows in lexicographic order.
+    """
+    rng = np.random.default_rng(seed)
+    fixed = int(np.argmax(sizes))
+    width = (universe_size + 7) // 8
+    bitmaps = {
+        fixed: np.broadcast_to(
+            np.packbits(np.arange(universe_size) < sizes[fixed]), (count, width)
+        )
+    }
+    for index in np.unique(combinations[combinations >= 0]):
+        if index != fixed:
+            size = int(sizes[index])
+            bitmaps[index] = random_subsets(rng, count, size, universe_size)
+
+    exceedances = np.zeros(len(observed), dtype=np.int64)
+    prefix: List[int] = []
+    stack: List[np.ndarray] = []
+    for row, length in enumerate(lengths):
+        combination = combinations[row, :length].tolist()
+        shared = 0
+        for depth in range(min(len(prefix), length)):
+            if prefix[depth] != combination[depth]:
+                break
+            shared += 1
+        del prefix[shared:], stack[shared:]
+        for index in combination[shared:]:
+            bits = bitmaps[index]
+            stack.append(bits if not stack else np.bitwise_and(stack[-1], bits))
+            prefix.append(index)
+        counts = _bitwise_count(stack[-1]).sum(axis=1, dtype=np.int64)
+        exceedances[row] = np.count_nonzero(counts >= observed[row])
+    return exceedances
+
+
+def _attach(specs: Mapping[str, Tuple[str, str, Tuple[int, ...]]]) -> None:
+    """Map the shared arrays of a task in a worker process."""
+    _shared.clear()
+    for block in _shared_blocks:
+        block.close()
+    _shared_blocks.clear()
+    for name, (block_name, dtype, shape) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _shared_blocks.append(block)
+        _shared[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _run_chunk(
+    chunk: int, universe_size: int, count: int, seed: np.random.SeedSequence
+) -> None:
+    """Count the exceedances of a chunk from the shared inputs, into its output row."""
+    _shared["exceedances"][chunk] = _count_exceedances(
+        _shared["sizes"],
+        _shared["combinations"],
+        _shared["lengths"],
+        _shared["observed"],
+        universe_size,
+        count,
+        seed,
+    )
+
+
+def permutation_p_values(
+    genesets: Sequence[Set[Hashable]],
+    intersections: Mapping[Tuple[int, ...], Set[Hashable]],
+    universe_size: int,
+    permutations: int = 1000,
+    seed: Optional[int] = 0,
+    processes: int = 1,
+) -> Dict[Tuple[int, ...], float]:
+    """Find how likely each intersection is to be as large among random genesets.
+
+    :param genesets: The genesets that were intersected.
+    :param intersections: Intersections of combinations of the genesets, keyed by
+    tuples of their indexes, such as the output of combination_intersection.
+    :param universe_size: The number of genes the genesets are drawn from.
+    :param permutations: The number of random draws of the genesets.
+    :param seed: The seed of the draws; the same seed gives the same p-values.
+    :param processes: The number of processes to spread the permutations over.
+    :return: A dict from each combination to its empirical p-value.
+    """
+    sizes = np.array([len(geneset) for geneset in genesets], dtype=np.int64)
+    if permutations < 1:
+        raise ValueError("permutations must be at least 1")
+    if processes < 1:
+        raise ValueError("processes must be at least 1")
+    if len(sizes) and sizes.max() > universe_size:
+        raise ValueError("universe_size must be at least the size of every geneset")
+
+    keys = sorted(intersections, key=lambda combination: sorted(combination))
+    if not keys:
+        return {}
+    longest = max(len(combination) for combination in keys)
+    combinations = np.full((len(keys), longest), -1, dtype=np.int64)
+    lengths = np.empty(len(keys), dtype=np.int64)
+    for row, combination in enumerate(keys):
+        if not combination or min(combination) < 0 or max(combination) >= len(sizes):
+            raise ValueError(f"Combination {combination} is not of the genesets given")
+        combinations[row, : len(combination)] = sorted(combination)
+        lengths[row] = len(combination)
+    observed = np.array([len(intersections[key]) for key in keys], dtype=np.int64)
+
+    n_chunks = -(-permutations // PERMUTATION_CHUNK)
+    counts = [PERMUTATION_CHUNK] * (n_chunks - 1)
+    counts.append(permutations - PERMUTATION_CHUNK * (n_chunks - 1))
+    seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+    inputs = (sizes, combinations, lengths, observed, universe_size)
+    if processes == 1 or n_chunks == 1:
+        exceedances = sum(
+            _count_exceedances(*inputs, count, chunk_seed)
+            for count, chunk_seed in zip(counts, seeds)
+        )
+    else:
+        exceedances = _run_in_processes(
+            inputs, counts, seeds, min(processes, n_chunks)
+        )
+
+    p_values = dict(zip(keys, ((1 + exceedances) / (1 + permutations)).tolist()))
+    return {combination: p_values[combination] for combination in intersections}
+
+
+def _run_in_processes(
+    inputs: tuple,
+    counts: List[int],
+    seeds: List[np.random.SeedSequence],
+    processes: int,
+) -> np.ndarray:
+    """Run the chunks on a process pool sharing the inputs, and sum their counts."""
+    sizes, combinations, lengths, observed, universe_size = inputs
+    arrays = {
+        "sizes": sizes,
+        "combinations": combinations,
+        "lengths": lengths,
+        "observed": observed,
+        "exceedances": np.zeros((len(counts), len(observed)), dtype=np.int64),
+    }
+    blocks = []
+    views = {}
+    try:
+        specs = {}
+        for name, array in arrays.items():
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            views[name] = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            views[name][...] = array
+            specs[name] = (block.name, array.dtype.str, array.shape)
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=processes, initializer=_attach, initargs=(specs,)
+        ) as pool:
+            futures = [
+                pool.submit(_run_chunk, chunk, universe_size, count, chunk_seed)
+                for chunk, (count, chunk_seed) in enumerate(zip(counts, seeds))
+            ]
+            for future in futures:
+                future.result()
+        return views["exceedances"].sum(axis=0)
+    finally:
+        # The views must be released before their blocks can be closed
+        views.clear()
+        for block in blocks:
+            block.close()
+            block.unlink()
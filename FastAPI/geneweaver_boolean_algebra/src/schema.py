@@ -3,7 +3,7 @@ import enum
 from typing import Any, Dict, Hashable, List, Optional, Set, Union
 
 from geneweaver_tools.src.schema import ToolInput, ToolOutput
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 
@@ -43,12 +43,12 @@ class GeneValueFullHash(GeneValue):
     def __hash__(self: "GeneValue") -> int:
         """Hash the gene symbol (with value)."""
         # TODO note about hashing collisions
-        return hash(tuple(self.__dict__.values()))
+        return hash((self.symbol, self.value))
 
     def __eq__(self: "GeneValue", other: Any) -> bool:  # noqa: ANN401
         """Compare the gene symbol (with value)."""
         if isinstance(other, GeneValue):
-            return self.__dict__ == other.__dict__
+            return self.symbol == other.symbol and self.value == other.value
         return False
 
 
@@ -58,6 +58,7 @@ class BooleanAlgebraType(enum.Enum):
     UNION = "union"
     INTERSECTION = "intersection"
     DIFFERENCE = "difference"
+    THRESHOLD = "threshold"
 
 
 class BooleanAlgebraInput(ToolInput):
@@ -67,6 +68,8 @@ class BooleanAlgebraInput(ToolInput):
     input_genesets: List[List[GeneValue]]
     intersection_min: int = 2
     intersection_max: Optional[int] = None
+    # Minimum number of input genesets a gene must be in, for THRESHOLD
+    threshold: int = Field(2, ge=1)
 
 
 class BooleanAlgebraMultiSetOutput(BaseModel):
@@ -81,7 +84,16 @@ class BooleanAlgebraSingleSetOutput(BaseModel):
     result_geneset_ids: Union[List[Hashable], Set[Hashable]]
 
 
+class BooleanAlgebraThresholdOutput(BaseModel):
+    """Output schema for the Boolean Algebra tool's THRESHOLD operation."""
+
+    result_geneset_ids: Set[Hashable]
+    membership_counts: Dict[Hashable, int]
+
+
 class BooleanAlgebraOutput(ToolOutput):
     """Output schema for the Boolean Algebra tool."""
 
     result: Union[Union[List[Hashable], Set[Hashable]], Dict[Hashable, Set[Hashable]]]
+    # Number of input genesets containing each result gene, for THRESHOLD
+    membership_counts: Optional[Dict[Hashable, int]] = None
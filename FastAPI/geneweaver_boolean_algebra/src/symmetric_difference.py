@@ -1,24 +1,23 @@
 """Find the symmetric difference of N sets."""
 from typing import Hashable, Set
 
-from .intersection import combination_intersection
-from .union import union
+from .membership import exactly_k
 
 
 def symmetric_difference(*args: Set[Hashable]) -> Set[Hashable]:
     """Find the symmetric difference of N genesets.
 
-    This function works by finding the union of the input genesets, and then
-    subtracting the union of the intersections of the input genesets.
+    The result contains the genes present in exactly one of the input genesets:
 
     Result  = (A U B U C) - ((A N B) U (A N C) U (B N C))
 
+    It is found by counting the genesets containing each gene in a single pass,
+    rather than by intersecting every pair of genesets. Two genesets use their own
+    symmetric_difference method, which is faster still.
+
     :param args: The genesets to find the symmetric difference of.
     :return: A set representing the symmetric difference of the input genesets.
     """
-    union_set = union(*args)
-    union_of_intersections = union(
-        *combination_intersection(*args, max_size=2).values()
-    )
-
-    return union_set - union_of_intersections
+    if len(args) == 2:
+        return args[0].symmetric_difference(args[1])
+    return exactly_k(1, *args)
@@ -13,6 +13,8 @@ sys.path.append(str(Path(__file__).resolve().parent.parent / "FastAPI"))
 from .symmetric_difference import symmetric_difference
 from .union import union
 from .intersection import combination_intersection
+from .gene_value import to_frozen_genesets, to_gene_values
+from .membership import membership_counts
 
 from geneweaver_tools.src.schema import ToolInput, ToolOutput
 from geneweaver_tools.src.abstract import AbstractTool
@@ -35,21 +37,33 @@ class BooleanAlgebra(AbstractTool):
     def run(
         self: BooleanAlgebra, tool_input: BooleanAlgebraInput
     ) -> BooleanAlgebraOutput:
-        genesets = tool_input.input_genesets
-        inputs = tool_input if isinstance(genesets, set) else iterable_to_sets(genesets)
+        # Genes are converted to lightweight frozen values for the set operations, and
+        # back to GeneValue schemas for the output
+        inputs = to_frozen_genesets(tool_input.input_genesets)
+        counts = None
 
         if tool_input.type is BooleanAlgebraType.UNION:
-            return BooleanAlgebraOutput(result=union(*inputs))
+            result = union(*inputs)
         elif tool_input.type is BooleanAlgebraType.INTERSECTION:
-            return BooleanAlgebraOutput(
-                result=combination_intersection(
-                    *inputs,
-                    min_size=tool_input.intersection_min,
-                    max_size=tool_input.intersection_max,
-                )
+            result = combination_intersection(
+                *inputs,
+                min_size=tool_input.intersection_min,
+                max_size=tool_input.intersection_max,
             )
         elif tool_input.type is BooleanAlgebraType.DIFFERENCE:
-            return BooleanAlgebraOutput(result=symmetric_difference(*inputs))
+            result = symmetric_difference(*inputs)
+        elif tool_input.type is BooleanAlgebraType.THRESHOLD:
+            # One counting pass gives both the result and the per-gene counts
+            counts = {
+                gene: count
+                for gene, count in membership_counts(*inputs).items()
+                if count >= tool_input.threshold
+            }
+            result = set(counts)
+
+        return BooleanAlgebraOutput(
+            result=to_gene_values(result), membership_counts=to_gene_values(counts)
+        )
 
     @property
     def workflow_definition(self: BooleanAlgebra) -> Optional[Path]:
@@ -10,9 +10,10 @@ def union(*args: Set[Hashable]) -> Set[Hashable]:
 
     The union will contain one set with all the unique genes in the input sets.
 
-    Pass the genesets as positional arguments.
+    Pass the genesets as positional arguments. They may be sets, or GeneBitmaps built
+    by the same BitmapEngine, in which case the result is a GeneBitmap.
 
     :param args: The sets to find the union of.
     :return: A list of geneset ids that are the union of the input sets.
     """
-    return set.union(*args)
+    return args[0].union(*args[1:])
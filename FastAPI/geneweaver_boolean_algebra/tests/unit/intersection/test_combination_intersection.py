@@ -1,6 +1,13 @@
 """Test that the combination intersection function works as expected."""
+import itertools
+import random
+from typing import Dict, Optional, Set, Tuple
+
 import pytest
-from geneweaver.tools.boolean_algebra.intersection import combination_intersection
+from geneweaver.tools.boolean_algebra.intersection import (
+    combination_intersection,
+    iter_combination_intersection,
+)
 
 from tests.unit.const import (
     BOOLEAN_GENESET_GENES_0,
@@ -114,3 +121,65 @@ def test_combination_intersection_error(
     """Test that the function raises a ValueError when given invalid input."""
     with pytest.raises(ValueError, match=expected_error_msg):
         combination_intersection(*input_sets, min_size=min_size, max_size=max_size)
+
+
+def brute_force_combination_intersection(
+    *args: Set[int], min_size: int = 2, max_size: Optional[int] = None
+) -> Dict[Tuple[int, ...], Set[int]]:
+    """Intersect every combination from scratch, as a reference result."""
+    max_size = len(args) if max_size is None else max_size
+    return {
+        combination: set.intersection(*(args[index] for index in combination))
+        for size in range(min_size, max_size + 1)
+        for combination in itertools.combinations(range(len(args)), size)
+    }
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize(("min_size", "max_size"), [(2, None), (2, 3), (3, 5)])
+def test_combination_intersection_matches_brute_force(seed, min_size, max_size):
+    """Test the incremental walk against intersecting each combination directly."""
+    rng = random.Random(seed)
+    input_sets = [set(rng.sample(range(30), rng.randint(0, 20))) for _ in range(7)]
+    expected = brute_force_combination_intersection(
+        *input_sets, min_size=min_size, max_size=max_size
+    )
+
+    result = combination_intersection(
+        *input_sets, min_size=min_size, max_size=max_size
+    )
+    assert result == expected
+    # Ordered by size, then lexicographically, like itertools.combinations
+    assert list(result) == list(expected)
+
+    assert combination_intersection(
+        *input_sets, min_size=min_size, max_size=max_size, skip_empty=True
+    ) == {combination: genes for combination, genes in expected.items() if genes}
+
+
+def test_combination_intersection_results_are_independent():
+    """Test that empty results below a pruned branch are not shared objects."""
+    result = combination_intersection({1}, {2}, {3})
+    result[(0, 1)].add("x")
+    assert result[(0, 1, 2)] == set()
+
+
+def test_iter_combination_intersection_is_lazy():
+    """Test that the first combinations stream before the rest are computed."""
+    input_sets = [{0, index} for index in range(40)]
+    results = iter_combination_intersection(*input_sets)
+
+    assert next(results) == ((0, 1), {0})
+    assert next(results) == ((0, 1, 2), {0})
+
+
+def test_iter_combination_intersection_skip_empty_prunes():
+    """Test that disjoint inputs yield nothing without walking every combination."""
+    input_sets = [{index} for index in range(40)]
+    assert list(iter_combination_intersection(*input_sets, skip_empty=True)) == []
+
+
+def test_iter_combination_intersection_validates_eagerly():
+    """Test that invalid sizes raise when called, not on first iteration."""
+    with pytest.raises(ValueError, match="min_size must be greater than 2"):
+        iter_combination_intersection({1}, {2}, min_size=1)
@@ -0,0 +1,91 @@
+"""Test the bitmap engine against the set based boolean algebra functions."""
+import pytest
+from geneweaver.tools.boolean_algebra.bitmap import BitmapEngine, GeneBitmap
+from geneweaver.tools.boolean_algebra.intersection import (
+    combination_intersection,
+    intersection,
+)
+from geneweaver.tools.boolean_algebra.symmetric_difference import symmetric_difference
+from geneweaver.tools.boolean_algebra.union import union
+
+from tests.unit.const import (
+    BOOLEAN_GENESET_GENES_0,
+    BOOLEAN_GENESET_GENES_1,
+    BOOLEAN_GENESET_GENES_2,
+)
+
+INPUT_SETS = [
+    ({1, 2, 3}, {4, 5, 6}),
+    ({1, 2, 3}, {3, 4, 5}),
+    ({1, 2}, {2, 3}, {3, 4}),
+    (set(), set()),
+    (set(), {1, 2, 3}),
+    ({"a", "b"}, {"b", "c"}),
+    ({1, "a"}, {2, "b"}),
+    # Enough genes that the bitmaps span many bytes
+    (set(range(0, 300, 2)), set(range(0, 300, 3)), set(range(0, 300, 5))),
+    (BOOLEAN_GENESET_GENES_0, BOOLEAN_GENESET_GENES_1, BOOLEAN_GENESET_GENES_2),
+]
+
+
+@pytest.mark.parametrize("input_sets", INPUT_SETS)
+@pytest.mark.parametrize("operation", [union, intersection, symmetric_difference])
+def test_bitmap_matches_sets(operation, input_sets):
+    """Test that each operation gives the same result on bitmaps as on sets."""
+    engine = BitmapEngine()
+    result = operation(*engine.to_bitmaps(input_sets))
+    assert isinstance(result, GeneBitmap)
+    assert engine.materialize(result) == operation(*input_sets)
+
+
+@pytest.mark.parametrize("input_sets", INPUT_SETS)
+def test_bitmap_combination_intersection_matches_sets(input_sets):
+    """Test that combination_intersection gives the same result on bitmaps."""
+    engine = BitmapEngine()
+    result = combination_intersection(*engine.to_bitmaps(input_sets))
+    assert engine.materialize(result) == combination_intersection(*input_sets)
+
+
+def test_bitmap_set_protocol():
+    """Test the set methods and operators of GeneBitmap."""
+    engine = BitmapEngine()
+    first, second = engine.to_bitmaps([{"a", "b", "c"}, {"c", "d"}])
+
+    assert len(first) == 3
+    assert "a" in first
+    assert "d" not in first
+    assert "unknown" not in first
+    assert first | second == {"a", "b", "c", "d"}
+    assert first & second == {"c"}
+    assert first - second == {"a", "b"}
+    assert first ^ second == {"a", "b", "d"}
+    assert first == engine.to_bitmaps([["c", "b", "a"]])[0]
+    assert not (first & engine.to_bitmaps([{"x"}])[0])
+
+
+def test_bitmaps_of_different_widths_combine():
+    """Test that bitmaps built before new genes were interned still combine."""
+    engine = BitmapEngine()
+    (early,) = engine.to_bitmaps([{"a"}])
+    (late,) = engine.to_bitmaps([{"a"} | {f"g{i}" for i in range(100)}])
+
+    assert early & late == {"a"}
+    assert len(early | late) == 101
+
+
+def test_bitmaps_from_different_engines_do_not_combine():
+    """Test that mixing interners is rejected instead of giving wrong results."""
+    (first,) = BitmapEngine().to_bitmaps([{"a"}])
+    (second,) = BitmapEngine().to_bitmaps([{"a"}])
+
+    with pytest.raises(ValueError, match="same GeneInterner"):
+        first.union(second)
+
+
+def test_materialize_many():
+    """Test bulk conversion of bitmaps back to gene identifiers."""
+    genesets = [{"a", "b"}, set(), {"b", "c", "d"}]
+    engine = BitmapEngine()
+
+    assert engine.materialize_many(engine.to_bitmaps(genesets)) == genesets
+    assert engine.materialize_many([]) == []
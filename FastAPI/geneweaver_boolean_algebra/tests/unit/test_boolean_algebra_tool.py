@@ -78,6 +78,32 @@ def test_boolean_algebra_run(input_value, expected):
         assert item in run_result.result
 
 
+def test_boolean_algebra_run_threshold():
+    """The THRESHOLD operation returns genes in at least k sets, with their counts."""
+    ba = BooleanAlgebra()
+    run_result = ba.run(
+        BooleanAlgebraInput(
+            type=BooleanAlgebraType.THRESHOLD,
+            input_genesets=[
+                BOOLEAN_GENESET_GENES_0,
+                BOOLEAN_GENESET_GENES_1,
+                BOOLEAN_GENESET_GENES_2,
+            ],
+            threshold=2,
+        )
+    )
+    # Every gene shared by sets 1 and 2 is in at least two sets, nothing else is
+    assert run_result.result == INT_BOOLEAN_GENESET_GENES_1_2
+    counts = run_result.membership_counts
+    assert {gene.symbol: count for gene, count in counts.items()} == {
+        "A": 3,
+        "E": 2,
+        "F": 2,
+        "G": 2,
+        "H": 2,
+    }
+
+
 def test_boolean_algebra_properties():
     """The Boolean Algebra tool class has some predictable properties."""
     ba = BooleanAlgebra()
@@ -0,0 +1,92 @@
+"""Tests for the frozen gene value types used inside the tool."""
+import pickle
+
+import pytest
+from geneweaver.tools.boolean_algebra.gene_value import (
+    FrozenGeneValue,
+    FrozenGeneValueFullHash,
+    to_frozen_genesets,
+    to_gene_values,
+)
+from geneweaver.tools.boolean_algebra.schema import GeneValue, GeneValueFullHash
+from geneweaver.tools.boolean_algebra.union import union
+
+from tests.unit.const import (
+    BOOLEAN_GENESET_GENES_0,
+    BOOLEAN_GENESET_GENES_1,
+    UNION_BOOLEAN_GENESET_GENES_0_1,
+)
+
+
+def frozen(gene):
+    """Convert a schema to the matching frozen type."""
+    if isinstance(gene, GeneValueFullHash):
+        return FrozenGeneValueFullHash.from_schema(gene)
+    return FrozenGeneValue.from_schema(gene)
+
+
+@pytest.mark.parametrize(
+    ("gene_value_0", "gene_value_1"),
+    [
+        (GeneValue(symbol="A", value=1), GeneValue(symbol="A", value=1)),
+        (GeneValue(symbol="A", value=1), GeneValue(symbol="A", value=0)),
+        (GeneValue(symbol="A", value=1), GeneValue(symbol="B", value=1)),
+        (
+            GeneValueFullHash(symbol="A", value=1),
+            GeneValueFullHash(symbol="A", value=1),
+        ),
+        (
+            GeneValueFullHash(symbol="A", value=1),
+            GeneValueFullHash(symbol="A", value=0),
+        ),
+        (
+            GeneValueFullHash(symbol="A", value=1),
+            GeneValueFullHash(symbol="B", value=1),
+        ),
+        (GeneValue(symbol="A", value=1), GeneValueFullHash(symbol="A", value=1)),
+        (GeneValue(symbol="A", value=1), GeneValueFullHash(symbol="A", value=0)),
+        (GeneValueFullHash(symbol="A", value=0), GeneValue(symbol="A", value=1)),
+    ],
+)
+def test_frozen_equality_matches_schema(gene_value_0, gene_value_1):
+    """Test that frozen values compare like the schemas they came from."""
+    frozen_0, frozen_1 = (frozen(gene) for gene in (gene_value_0, gene_value_1))
+    assert (frozen_0 == frozen_1) is (gene_value_0 == gene_value_1)
+    if gene_value_0 == gene_value_1 and type(gene_value_0) is type(gene_value_1):
+        assert hash(frozen_0) == hash(frozen_1)
+    assert frozen_0 != gene_value_0.symbol
+
+
+def test_frozen_gene_value_is_immutable():
+    """Test that attributes cannot change, since the hash is cached."""
+    gene = FrozenGeneValue("A", 1.0)
+    with pytest.raises(AttributeError):
+        gene.symbol = "B"
+
+
+def test_frozen_gene_value_pickles():
+    """Test that frozen values survive a pickle round trip."""
+    gene = FrozenGeneValueFullHash("A", 1.0)
+    assert pickle.loads(pickle.dumps(gene)) == gene
+
+
+def test_to_frozen_genesets_shares_equal_genes():
+    """Test that equal genes in different genesets become one object."""
+    first, second = to_frozen_genesets(
+        [[GeneValue(symbol="A", value=1)], [GeneValue(symbol="A", value=0), "B"]]
+    )
+    (gene,) = first
+    assert any(other is gene for other in second)
+    assert "B" in second
+
+
+def test_round_trip_returns_schemas():
+    """Test that results convert back to the original GeneValue schemas."""
+    genesets = to_frozen_genesets([BOOLEAN_GENESET_GENES_0, BOOLEAN_GENESET_GENES_1])
+    result = to_gene_values(union(*genesets))
+
+    assert result == UNION_BOOLEAN_GENESET_GENES_0_1
+    assert all(isinstance(gene, GeneValue) for gene in result)
+    assert to_gene_values({(0, 1): {FrozenGeneValue("A", 1.0)}}) == {
+        (0, 1): {GeneValue(symbol="A", value=1)}
+    }
@@ -0,0 +1,83 @@
+"""Test the k-of-N membership functions."""
+import random
+
+import pytest
+from geneweaver.tools.boolean_algebra.bitmap import BitmapEngine
+from geneweaver.tools.boolean_algebra.membership import (
+    at_least_k,
+    at_most_k,
+    exactly_k,
+    membership_counts,
+)
+
+from tests.unit.const import (
+    BOOLEAN_GENESET_GENES_0,
+    BOOLEAN_GENESET_GENES_1,
+    BOOLEAN_GENESET_GENES_2,
+    INT_BOOLEAN_GENESET_GENES_0_1_2,
+    UNION_BOOLEAN_GENESET_GENES_0_1_2,
+)
+
+INPUT_SETS = ({1, 2, 3}, {2, 3, 4}, {3, 4, 5}, {3, 6})
+
+
+@pytest.mark.parametrize(
+    ("function", "k", "expected"),
+    [
+        (exactly_k, 1, {1, 5, 6}),
+        (exactly_k, 2, {2, 4}),
+        (exactly_k, 3, set()),
+        (exactly_k, 4, {3}),
+        (at_least_k, 1, {1, 2, 3, 4, 5, 6}),
+        (at_least_k, 2, {2, 3, 4}),
+        (at_least_k, 4, {3}),
+        (at_least_k, 5, set()),
+        (at_most_k, 1, {1, 5, 6}),
+        (at_most_k, 2, {1, 2, 4, 5, 6}),
+        (at_most_k, 4, {1, 2, 3, 4, 5, 6}),
+    ],
+)
+def test_k_of_n(function, k, expected):
+    """Test each function on sets and on bitmaps."""
+    assert function(k, *INPUT_SETS) == expected
+
+    engine = BitmapEngine()
+    assert engine.materialize(function(k, *engine.to_bitmaps(INPUT_SETS))) == expected
+
+
+def test_k_of_n_gene_values():
+    """Test the functions on GeneValue genesets."""
+    genesets = (
+        BOOLEAN_GENESET_GENES_0,
+        BOOLEAN_GENESET_GENES_1,
+        BOOLEAN_GENESET_GENES_2,
+    )
+    assert at_least_k(1, *genesets) == UNION_BOOLEAN_GENESET_GENES_0_1_2
+    assert exactly_k(3, *genesets) == INT_BOOLEAN_GENESET_GENES_0_1_2
+
+
+@pytest.mark.parametrize("function", [exactly_k, at_least_k, at_most_k])
+def test_k_must_be_positive(function):
+    """Test that k below one is rejected."""
+    with pytest.raises(ValueError, match="k must be at least 1"):
+        function(0, {1}, {2})
+
+
+def test_membership_counts():
+    """Test per-gene counts on sets and bitmaps."""
+    expected = {1: 1, 2: 2, 3: 4, 4: 2, 5: 1, 6: 1}
+    assert membership_counts(*INPUT_SETS) == expected
+
+    engine = BitmapEngine()
+    assert membership_counts(*engine.to_bitmaps(INPUT_SETS)) == expected
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_exactly_one_matches_pairwise_definition(seed):
+    """Test exactly_k(1) against union minus the union of pairwise intersections."""
+    rng = random.Random(seed)
+    genesets = [set(rng.sample(range(100), 30)) for _ in range(6)]
+    pairwise = set().union(
+        *(a & b for i, a in enumerate(genesets) for b in genesets[i + 1 :])
+    )
+    assert exactly_k(1, *genesets) == set().union(*genesets) - pairwise
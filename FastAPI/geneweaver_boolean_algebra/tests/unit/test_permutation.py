@@ -0,0 +1,118 @@
+"""Test the permutation p-values of combination intersections."""
+import math
+import random
+
+import numpy as np
+import pytest
+from geneweaver.tools.boolean_algebra import permutation
+from geneweaver.tools.boolean_algebra.intersection import combination_intersection
+from geneweaver.tools.boolean_algebra.permutation import (
+    permutation_p_values,
+    random_subsets,
+)
+
+
+def hypergeometric_sf(overlap, size, other, universe_size):
+    """P(X >= overlap) for the intersection X of random sets of size and other."""
+    tail = sum(
+        math.comb(size, i) * math.comb(universe_size - size, other - i)
+        for i in range(overlap, min(size, other) + 1)
+    )
+    return tail / math.comb(universe_size, other)
+
+
+def random_genesets(seed, universe_size=500):
+    """Draw genesets of which the first two share more genes than chance."""
+    rng = random.Random(seed)
+    genesets = [
+        set(rng.sample(range(universe_size), rng.randint(20, 120))) for _ in range(4)
+    ]
+    genesets[1] |= set(sorted(genesets[0])[:15])
+    return genesets
+
+
+@pytest.mark.parametrize("size", [0, 1, 10, 60, 250, 400, 499, 500])
+def test_random_subsets_have_their_size(size):
+    """Test that every subset drawn has size genes, and none past the universe."""
+    bits = random_subsets(np.random.default_rng(0), 64, size, 500)
+    members = np.unpackbits(bits, axis=1)
+    assert members.shape == (64, 504)
+    assert (members[:, :500].sum(axis=1) == size).all()
+    assert not members[:, 500:].any()
+
+
+def test_random_subsets_are_uniform():
+    """Test that each gene is drawn about as often, through both ways of drawing."""
+    rng = np.random.default_rng(0)
+    for size in (5, 30):
+        members = np.unpackbits(random_subsets(rng, 20000, size, 40), axis=1)[:, :40]
+        frequencies = members.mean(axis=0)
+        assert np.allclose(frequencies, size / 40, atol=0.02)
+
+
+def test_p_values_follow_the_hypergeometric_null():
+    """Test that the p-values of pairs are close to the exact hypergeometric ones."""
+    genesets = random_genesets(0)
+    intersections = combination_intersection(*genesets, max_size=2)
+    p_values = permutation_p_values(genesets, intersections, 500, permutations=4000)
+    assert list(p_values) == list(intersections)
+    for (first, second), p_value in p_values.items():
+        expected = hypergeometric_sf(
+            len(intersections[first, second]),
+            len(genesets[first]),
+            len(genesets[second]),
+            500,
+        )
+        assert abs(p_value - expected) < 0.03
+    assert p_values[0, 1] < 0.01
+
+
+def test_p_values_of_every_combination():
+    """Test combinations of more sets, including empty and unsorted ones."""
+    genesets = random_genesets(1)
+    intersections = combination_intersection(*genesets)
+    intersections[3, 1] = intersections.pop((1, 3))
+    p_values = permutation_p_values(genesets, intersections, 500, permutations=300)
+    assert list(p_values) == list(intersections)
+    for combination, genes in intersections.items():
+        if not genes:
+            assert p_values[combination] == 1
+        assert 1 / 301 <= p_values[combination] <= 1
+
+
+def test_p_values_depend_only_on_the_seed(monkeypatch):
+    """Test that the p-values are the same over any number of processes."""
+    monkeypatch.setattr(permutation, "PERMUTATION_CHUNK", 64)
+    genesets = random_genesets(2)
+    intersections = combination_intersection(*genesets)
+    expected = permutation_p_values(genesets, intersections, 500, 300, seed=7)
+    assert permutation_p_values(genesets, intersections, 500, 300, seed=7) == expected
+    assert (
+        permutation_p_values(genesets, intersections, 500, 300, seed=7, processes=3)
+        == expected
+    )
+    assert permutation_p_values(genesets, intersections, 500, 300, seed=8) != expected
+
+
+@pytest.mark.parametrize(
+    ("intersections", "universe_size", "permutations", "processes", "message"),
+    [
+        ({(0, 1): set()}, 500, 0, 1, "permutations must be at least 1"),
+        ({(0, 1): set()}, 500, 10, 0, "processes must be at least 1"),
+        ({(0, 1): set()}, 10, 10, 1, "universe_size must be at least the size"),
+        ({(0, 9): set()}, 500, 10, 1, r"Combination \(0, 9\) is not of the genesets"),
+        ({(): set()}, 500, 10, 1, r"Combination \(\) is not of the genesets"),
+    ],
+)
+def test_invalid_arguments(
+    intersections, universe_size, permutations, processes, message
+):
+    """Test that each invalid argument raises its own ValueError."""
+    with pytest.raises(ValueError, match=message):
+        permutation_p_values(
+            random_genesets(3),
+            intersections,
+            universe_size,
+            permutations=permutations,
+            processes=processes,
+        )
@@ -10,6 +10,8 @@ from fastapi import FastAPI
 from starlette.staticfiles import StaticFiles
 from api import database
 from api.endpoints import router as api_router 
+from api.jobs import job_executor
+from api.async_database import async_engine
 
 app = FastAPI(title='FastAPI Application', version='1.0.0')
 
@@ -37,6 +39,31 @@ app.add_middleware(
 # API routers
 app.include_router(api_router, prefix='/api', tags=['GeneSets'])
 
+
+# Create and migrate the tables before serving requests
+@app.on_event('startup')
+def init_database():
+    database.init_database()
+
+
+# Let queued analysis runs finish before the server exits
+@app.on_event('shutdown')
+def shutdown_job_executor():
+    job_executor.shutdown()
+
+
+# Commit the writes still queued once the analysis runs are done
+@app.on_event('shutdown')
+def shutdown_write_queue():
+    if database.write_queue is not None:
+        database.write_queue.shutdown()
+
+
+# Close the async database connections
+@app.on_event('shutdown')
+async def dispose_async_engine():
+    await async_engine.dispose()
+
 test_list = ['Hs.233757', 'Hs.489142']
 print(json.dumps(test_list))
 
@@ -0,0 +1,5 @@
+# Tests use their own databases. The application's engine is pointed at an in-memory one
+# before api.database is first imported, so that no test touches geneweaver.db.
+import os
+
+os.environ.setdefault("GENEWEAVER_DATABASE_URL", "sqlite://")
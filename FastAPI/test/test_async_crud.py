@@ -0,0 +1,119 @@
+# test_async_crud.py
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from api.database import Base
+from api import async_crud, crud, ingest, models, schemas
+from api.cache import geneset_cache
+from api.similarity import similarity_index
+from test.test_ingest import GeneratedUpload
+
+
+class TestAsyncCRUD(unittest.TestCase):
+
+    def setUp(self):
+        # The tables are created through a sync engine on the same database file
+        self.tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp.name, "async.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(engine)
+        engine.dispose()
+        self.engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        self.SessionLocal = async_sessionmaker(self.engine, autoflush=False, expire_on_commit=False)
+        geneset_cache.clear()
+
+    def tearDown(self):
+        asyncio.run(self.engine.dispose())
+        self.tmp.cleanup()
+
+    def run_with_session(self, func):
+        async def run():
+            async with self.SessionLocal() as db:
+                return await func(db)
+        return asyncio.run(run())
+
+    def create_geneset(self, geneweaver_id, unigene):
+        return self.run_with_session(lambda db: async_crud.create_geneset(db, schemas.GeneSetCreate(
+            geneweaver_id=geneweaver_id, entrez=geneweaver_id, ensembl_gene=f'ENSG{geneweaver_id}', unigene=unigene
+        )))
+
+    def test_genesets_are_returned_with_their_genes(self):
+        created = self.create_geneset(1, ['Hs.1', 'Hs.2'])
+        fetched = self.run_with_session(lambda db: async_crud.get_geneset(db, 1))
+
+        # The sessions are closed, so unigene must not need to lazy load
+        self.assertEqual(sorted(created.unigene["unigene"]), ['Hs.1', 'Hs.2'])
+        self.assertEqual(sorted(fetched.unigene["unigene"]), ['Hs.1', 'Hs.2'])
+        self.assertIsNone(self.run_with_session(lambda db: async_crud.get_geneset(db, 2)))
+
+    def test_delete_geneset_returns_the_deleted_geneset(self):
+        self.create_geneset(1, ['Hs.1'])
+        deleted = self.run_with_session(lambda db: async_crud.delete_geneset(db, 1))
+
+        self.assertEqual(deleted.unigene, {"unigene": ['Hs.1']})
+        self.assertIsNone(self.run_with_session(lambda db: async_crud.get_geneset(db, 1)))
+        self.assertIsNone(self.run_with_session(lambda db: async_crud.delete_geneset(db, 1)))
+
+    def test_unigenes_and_missing_genesets(self):
+        self.create_geneset(1, ['Hs.1', 'Hs.2'])
+
+        self.assertEqual(self.run_with_session(lambda db: async_crud.get_geneset_unigenes(db, 1)), {'Hs.1', 'Hs.2'})
+        with self.assertRaises(HTTPException) as raised:
+            self.run_with_session(lambda db: async_crud.get_geneset_unigenes(db, 2))
+        self.assertEqual(raised.exception.status_code, 404)
+
+    def test_analysis_run_lifecycle(self):
+        run = self.run_with_session(async_crud.create_analysis_run)
+        self.assertEqual(self.run_with_session(lambda db: async_crud.get_runstatus(db, run.id)), "pending")
+
+        canceled = self.run_with_session(lambda db: async_crud.cancel_run(db, run.id))
+        self.assertEqual(canceled.status, models.RunStatus.CANCELED)
+        self.assertIsNone(canceled.result)
+        runs = self.run_with_session(async_crud.get_all_runs)
+        self.assertEqual([(r.id, r.result) for r in runs], [(run.id, None)])
+
+    def test_ingest_upload_with_async_session(self):
+        report = self.run_with_session(lambda db: ingest.ingest_upload(db, GeneratedUpload(1200)))
+
+        self.assertEqual(report, {"inserted": 1200, "errors": []})
+        self.assertEqual(
+            self.run_with_session(lambda db: async_crud.get_geneset_unigenes(db, 1200)),
+            {f"Hs.{i}" for i in range(10)},
+        )
+
+    def test_cpu_bound_work_runs_off_the_event_loop(self):
+        self.create_geneset(1, ['Hs.1', 'Hs.2'])
+        similarity_index.invalidate()
+        self.addCleanup(similarity_index.invalidate)
+        threads = {}
+
+        # Records the thread each CPU-bound step runs on
+        def on_thread(name, fn):
+            def record(*args):
+                threads[name] = threading.current_thread()
+                return fn(*args)
+            return record
+
+        with patch.object(similarity_index, '_prepare', side_effect=on_thread('matrix', similarity_index._prepare)), \
+                patch('api.crud._decode_genesets_unigenes', side_effect=on_thread('unigenes', crud._decode_genesets_unigenes)), \
+                patch('api.crud._prepare_genesets', side_effect=on_thread('signatures', crud._prepare_genesets)):
+            self.run_with_session(async_crud.load_similarity_index)
+            self.run_with_session(lambda db: async_crud.get_geneset_unigenes(db, 1))
+            self.run_with_session(lambda db: async_crud.bulk_create_genesets(db, [schemas.GeneSetCreate(
+                geneweaver_id=2, entrez=2, ensembl_gene='ENSG2', unigene=['Hs.2'],
+            )]))
+
+        self.assertEqual(set(threads), {'matrix', 'unigenes', 'signatures'})
+        for thread in threads.values():
+            self.assertIsNot(thread, threading.main_thread())
+        self.assertEqual(len(similarity_index), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+# test_backends.py
+# The set operation tests run on SQLite, and also on PostgreSQL when
+# GENEWEAVER_TEST_POSTGRES_URL names a scratch database, whose tables they create and drop:
+#     GENEWEAVER_TEST_POSTGRES_URL=postgresql://postgres@localhost/geneweaver_test python -m pytest test/test_backends.py
+import os
+import random
+import tempfile
+import unittest
+from unittest.mock import patch
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from api.backends import get_backend, use_sql_set_operations
+from api.database import Base
+from api import crud, schemas
+from api.cache import geneset_cache
+from api.gene_index import gene_index
+
+POSTGRES_URL = os.environ.get("GENEWEAVER_TEST_POSTGRES_URL")
+
+
+class TestBackends(unittest.TestCase):
+
+    def test_backend_follows_the_url_scheme(self):
+        sqlite = get_backend("sqlite:///./geneweaver.db")
+        postgres = get_backend("postgresql+psycopg2://user@localhost/geneweaver")
+        self.assertTrue(sqlite.serialize_writes)
+        self.assertFalse(postgres.serialize_writes)
+        self.assertEqual(str(sqlite.async_url("sqlite:///./geneweaver.db")), "sqlite+aiosqlite:///./geneweaver.db")
+        self.assertEqual(
+            str(postgres.async_url("postgresql+psycopg2://user@localhost/geneweaver")),
+            "postgresql+asyncpg://user@localhost/geneweaver",
+        )
+        with self.assertRaises(ValueError):
+            get_backend("mysql://user@localhost/geneweaver")
+
+    def test_set_operations_run_in_sql_on_postgresql_by_default(self):
+        with patch("api.config.SET_OPERATIONS", "auto"):
+            self.assertFalse(use_sql_set_operations("sqlite:///./geneweaver.db"))
+            self.assertTrue(use_sql_set_operations("postgresql://user@localhost/geneweaver"))
+        with patch("api.config.SET_OPERATIONS", "sql"):
+            self.assertTrue(use_sql_set_operations("sqlite:///./geneweaver.db"))
+        with patch("api.config.SET_OPERATIONS", "python"):
+            self.assertFalse(use_sql_set_operations("postgresql://user@localhost/geneweaver"))
+
+
+class SetOperationsTests:
+    """Checks query_boolean_algebra against compute_boolean_algebra on the engine of make_engine."""
+
+    def make_engine(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.engine = self.make_engine()
+        Base.metadata.create_all(self.engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)()
+        geneset_cache.clear()
+        rng = random.Random(0)
+        universe = [f"Hs.{i}" for i in range(60)]
+        self.unigenes = {gene_weaver_id: set(rng.sample(universe, rng.randrange(1, 30))) for gene_weaver_id in range(1, 7)}
+        self.unigenes[7] = set()
+        crud.bulk_create_genesets(self.db, [
+            schemas.GeneSetCreate(
+                geneweaver_id=gene_weaver_id, entrez=gene_weaver_id, ensembl_gene=f"ENSG{gene_weaver_id}", unigene=sorted(unigene)
+            )
+            for gene_weaver_id, unigene in self.unigenes.items()
+        ])
+
+    def tearDown(self):
+        self.db.close()
+        Base.metadata.drop_all(self.engine)
+        self.engine.dispose()
+        geneset_cache.clear()
+        gene_index.invalidate()
+
+    def assertSameAsPython(self, operation, gene_weaver_ids, threshold=None):
+        expected = crud.compute_boolean_algebra([self.unigenes[i] for i in gene_weaver_ids], operation, threshold)
+        output = crud.query_boolean_algebra(self.db, operation, gene_weaver_ids, threshold)
+        self.assertEqual(sorted(output["result"]), sorted(expected["result"]), (operation, gene_weaver_ids))
+        self.assertEqual(output.get("membership_counts"), expected.get("membership_counts"))
+
+    def test_operations_match_compute_boolean_algebra(self):
+        for gene_weaver_ids in ([1], [1, 2], [2, 1, 3], [1, 2, 3, 4, 5, 6], [1, 7], [3, 3], [1, 2, 2, 4]):
+            for operation in ("union", "intersection", "difference"):
+                self.assertSameAsPython(operation, gene_weaver_ids)
+            for threshold in (1, 2, 3):
+                self.assertSameAsPython("threshold", gene_weaver_ids, threshold)
+
+    def test_missing_genesets_are_reported_together(self):
+        with self.assertRaises(HTTPException) as raised:
+            crud.query_boolean_algebra(self.db, "union", [1, 98, 99])
+        self.assertEqual(raised.exception.status_code, 404)
+        self.assertIn("98, 99", raised.exception.detail)
+
+    def test_run_boolean_algebra_uses_sql_when_configured(self):
+        with patch("api.config.SET_OPERATIONS", "sql"), patch("api.crud.get_genesets_unigenes") as get_genesets_unigenes:
+            output = crud.run_boolean_algebra(self.db, "intersection", [1, 2])
+        get_genesets_unigenes.assert_not_called()
+        self.assertEqual(set(output["result"]), self.unigenes[1] & self.unigenes[2])
+
+
+class TestSQLiteSetOperations(SetOperationsTests, unittest.TestCase):
+
+    def make_engine(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        return create_engine(f"sqlite:///{os.path.join(self.tmp.name, 'sets.db')}")
+
+
+@unittest.skipUnless(POSTGRES_URL, "GENEWEAVER_TEST_POSTGRES_URL is not set")
+class TestPostgresSetOperations(SetOperationsTests, unittest.TestCase):
+
+    def make_engine(self):
+        return create_engine(POSTGRES_URL)
+
+
+if __name__ == "__main__":
+    unittest.main()
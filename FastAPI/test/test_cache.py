@@ -0,0 +1,157 @@
+# test_cache.py
+import asyncio
+import threading
+import time
+import unittest
+from sqlalchemy.util import await_only, greenlet_spawn
+from api.cache import ByteLRUCache, frozenset_size
+
+
+class TestByteLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        # Every value counts as its own length in bytes
+        self.cache = ByteLRUCache(max_bytes=10, sizeof=len)
+        self.loads = []
+
+    def load(self, keys):
+        self.loads.append(list(keys))
+        return {key: "x" * key for key in keys if key > 0}
+
+    def test_hits_and_misses(self):
+        self.assertEqual(self.cache.get_many([3, 2], self.load), {3: "xxx", 2: "xx"})
+        self.assertEqual(self.cache.get_many([2, 4], self.load), {2: "xx", 4: "xxxx"})
+
+        self.assertEqual(self.loads, [[3, 2], [4]])
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["bytes"]), (1, 3, 9))
+
+    def test_missing_keys_are_not_cached(self):
+        self.assertEqual(self.cache.get_many([0, 1], self.load), {1: "x"})
+        self.assertEqual(self.cache.get_many([0, 1], self.load), {1: "x"})
+        self.assertEqual(self.loads, [[0, 1], [0]])
+
+    def test_evicts_least_recently_used_by_size(self):
+        self.cache.get_many([4, 3], self.load)
+        self.cache.get_many([4], self.load)  # 3 is now least recently used
+        self.cache.get_many([5], self.load)
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["entries"], stats["bytes"], stats["evictions"]), (2, 9, 1))
+        self.cache.get_many([4, 5, 3], self.load)
+        self.assertEqual(self.loads[-1], [3])
+
+    def test_values_larger_than_the_cache_are_not_stored(self):
+        self.assertEqual(self.cache.get(11, lambda key: "x" * key), "x" * 11)
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_invalidate(self):
+        self.cache.get_many([2, 3], self.load)
+        self.cache.invalidate([2, 7])
+        self.cache.get_many([2, 3], self.load)
+
+        self.assertEqual(self.loads, [[2, 3], [2]])
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+
+    def test_concurrent_misses_are_loaded_once(self):
+        release = threading.Event()
+
+        def slow_load(keys):
+            release.wait(timeout=30)
+            return self.load(keys)
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.cache.get_many([2], slow_load)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        # Let every thread reach the cache before the first load completes
+        while self.cache.stats()["misses"] + self.cache.stats()["coalesced"] < 8:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [{2: "xx"}] * 8)
+        self.assertEqual(self.loads, [[2]])
+        self.assertEqual(self.cache.stats()["coalesced"], 7)
+
+    def test_load_invalidated_while_running_is_not_cached(self):
+        def load_then_invalidate(keys):
+            self.cache.invalidate(keys)
+            return self.load(keys)
+
+        self.assertEqual(self.cache.get_many([2], load_then_invalidate), {2: "xx"})
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_load_errors_reach_waiting_callers(self):
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def failing_load(keys):
+            started.set()
+            release.wait(timeout=30)
+            raise RuntimeError("database unavailable")
+
+        def get():
+            try:
+                self.cache.get_many([2], failing_load)
+            except RuntimeError as e:
+                errors.append(e)
+
+        first = threading.Thread(target=get)
+        first.start()
+        started.wait(timeout=30)
+        second = threading.Thread(target=get)
+        second.start()
+        while self.cache.stats()["coalesced"] < 1:
+            time.sleep(0.01)
+        release.set()
+        first.join()
+        second.join()
+
+        self.assertEqual(len(errors), 2)
+        self.assertEqual(self.cache.get_many([2], self.load), {2: "xx"})
+
+    def test_waits_on_the_event_loop_without_blocking_it(self):
+        # Callers inside AsyncSession.run_sync run in greenlets on the event loop thread
+        def async_load(keys):
+            await_only(asyncio.sleep(0.05))
+            return self.load(keys)
+
+        async def main():
+            return await asyncio.gather(*(
+                greenlet_spawn(self.cache.get_many, [2, 3], async_load) for _ in range(5)
+            ))
+
+        self.assertEqual(asyncio.run(main()), [{2: "xx", 3: "xxx"}] * 5)
+        self.assertEqual(self.loads, [[2, 3]])
+
+    def test_entries_expire_after_ttl(self):
+        now = [0.0]
+        cache = ByteLRUCache(max_bytes=10, sizeof=len, ttl=60, clock=lambda: now[0])
+        cache.put("key", "xx")
+        now[0] = 59
+        self.assertEqual(cache.lookup("key"), "xx")
+        now[0] = 60
+        self.assertIsNone(cache.lookup("key"))
+
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["bytes"], stats["expirations"]), (0, 0, 1))
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_zero_ttl_stores_nothing(self):
+        cache = ByteLRUCache(max_bytes=10, sizeof=len, ttl=0)
+        cache.put("key", "xx")
+        self.assertEqual(cache.lookup("key", "default"), "default")
+
+    def test_frozenset_size_counts_members(self):
+        small = frozenset_size(frozenset({"Hs.1"}))
+        self.assertGreater(frozenset_size(frozenset({"Hs.1", "Hs.2" * 100})), small + 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,11 +2,14 @@
 # yet to complete
 import unittest
 from unittest.mock import patch
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
+from pydantic import ValidationError
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from api.database import Base, get_db  
-from api import crud, models
+from api import crud, models, schemas
+from api.cache import gene_identifier_cache, geneset_cache, result_cache
 import json
 
 
@@ -20,19 +23,28 @@ class TestCRUD(unittest.TestCase):
         cls.TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=cls.engine)
 
     def setUp(self):
-        # Create a new session for each test
+        # Create a new session for each test; cached genesets may come from other databases
         self.db = self.TestingSessionLocal()
+        geneset_cache.clear()
+        result_cache.clear()
+        gene_identifier_cache.clear()
         self.load_test_data()
 
     def tearDown(self):
-        # Close the session after each test
+        # Remove this test's data and close the session after each test
+        self.clean_database()
         self.db.close()
         
     def clean_database(self):
-        # Clear all data from the database tables
+        # Clear all data from the database tables, discarding anything a test left pending
+        self.db.rollback()
+        self.db.execute(models.geneset_genes.delete())
+        self.db.query(models.Gene).delete()
         self.db.query(models.GeneSet).delete()
         self.db.query(models.AnalysisRun).delete()
         self.db.query(models.AnalysisResult).delete()
+        self.db.query(models.ResultBlobChunk).delete()
+        self.db.query(models.ResultBlob).delete()
         self.db.commit()
     
     def load_test_data(self):
@@ -54,17 +66,14 @@ class TestCRUD(unittest.TestCase):
         ]
         for record in test_data:
             unigene_list = record["unigene"].split('|')
-            unigene_dict = {"unigene": unigene_list}
-            unigene_json = json.dumps(unigene_dict)
-            test_geneset = models.GeneSet(
+            test_geneset = schemas.GeneSetCreate(
                 geneweaver_id=record["geneweaver_id"],
                 entrez=record["entrez"],
                 ensembl_gene=record["ensembl_gene"],
-                unigene=unigene_json,
+                unigene=unigene_list,
             # ... include other fields as necessary
             )
-            self.db.add(test_geneset)
-        self.db.commit()
+            crud.create_geneset(self.db, test_geneset)
 
 
     # Test cases
@@ -97,15 +106,65 @@ class TestCRUD(unittest.TestCase):
         # Now use assertListEqual to compare the sorted lists
         self.assertListEqual(sorted_unigenes, sorted_expected_unigenes)
 
-    @patch('api.crud.get_geneset_unigenes')
-    def test_perform_boolean_algebra_analysis(self, mock_get_geneset_unigenes):
+    def test_get_genesets_unigenes(self):
+        unigenes = crud.get_genesets_unigenes(self.db, [65243, 65469, 65243])
+
+        self.assertEqual(list(unigenes), [65243, 65469])
+        self.assertEqual(unigenes[65243], {'Hs.720381', 'Hs.75389', 'Hs.726439', 'Hs.728292', 'Hs.40499'})
+        self.assertEqual(len(unigenes[65469]), 7)
+
+    def test_get_genesets_unigenes_reports_every_missing_id(self):
+        with self.assertRaises(HTTPException) as raised:
+            crud.get_genesets_unigenes(self.db, [1, 65243, 2])
+        self.assertEqual(raised.exception.status_code, 404)
+        self.assertIn("GeneWeaver IDs 1, 2 not found", raised.exception.detail)
+
+    def test_get_genesets_unigenes_is_cached_until_geneset_changes(self):
+        crud.get_genesets_unigenes(self.db, [65243, 65469])
+        hits = geneset_cache.stats()["hits"]
+        crud.get_genesets_unigenes(self.db, [65243])
+        self.assertEqual(geneset_cache.stats()["hits"], hits + 1)
+
+        crud.delete_geneset(self.db, 65243)
+        with self.assertRaises(HTTPException):
+            crud.get_genesets_unigenes(self.db, [65243])
+        crud.create_geneset(self.db, schemas.GeneSetCreate(
+            geneweaver_id=65243, entrez=1, ensembl_gene='ENSG1', unigene=['Hs.1']
+        ))
+        self.assertEqual(crud.get_genesets_unigenes(self.db, [65243]), {65243: {'Hs.1'}})
+
+    def test_get_genesets_keeps_requested_order(self):
+        genesets = crud.get_genesets(self.db, [65469, 65243])
+
+        self.assertEqual([geneset.geneweaver_id for geneset in genesets], [65469, 65243])
+        self.assertEqual(len(genesets[1].unigene["unigene"]), 5)
+        with self.assertRaises(HTTPException) as raised:
+            crud.get_genesets(self.db, [65469, 3])
+        self.assertEqual(raised.exception.detail, "GeneSet with GeneWeaver ID 3 not found")
+
+    def test_get_geneset_returns_unigene_dict(self):
+        geneset = crud.get_geneset(self.db, 65243)
+        self.assertEqual(
+            sorted(geneset.unigene["unigene"]),
+            sorted(['Hs.720381', 'Hs.75389', 'Hs.726439', 'Hs.728292', 'Hs.40499'])
+        )
+
+    def test_get_genesets_with_gene(self):
+        crud.create_geneset(self.db, schemas.GeneSetCreate(
+            geneweaver_id=70000, entrez=1, ensembl_gene='ENSG1', unigene=['Hs.75389', 'Hs.1']
+        ))
+        self.assertEqual(crud.get_genesets_with_gene(self.db, 'Hs.75389'), [65243, 70000])
+        self.assertEqual(crud.get_genesets_with_gene(self.db, 'Hs.unknown'), [])
+
+    @patch('api.crud.get_genesets_unigenes')
+    def test_perform_boolean_algebra_analysis(self, mock_get_genesets_unigenes):
     # Mocking the gene sets for the provided GeneWeaver IDs
-        mock_get_geneset_unigenes.side_effect = [
-            {'Hs.59495', 'Hs.55279', 'Hs.387', 'Hs.94960', 'Hs.554190', 'Hs.58230', 'Hs.514912'},  # Genes for GeneWeaver ID 65469
-            {'Hs.720381', 'Hs.75389', 'Hs.726439', 'Hs.728292', 'Hs.40499'}  # Genes for GeneWeaver ID 65243
-        ]
+        mock_get_genesets_unigenes.return_value = {
+            65469: {'Hs.59495', 'Hs.55279', 'Hs.387', 'Hs.94960', 'Hs.554190', 'Hs.58230', 'Hs.514912'},
+            65243: {'Hs.720381', 'Hs.75389', 'Hs.726439', 'Hs.728292', 'Hs.40499'}
+        }
 
-        task_id = 1
+        task_id = crud.create_analysis_run(self.db).id
         gene_weaver_ids = [65469, 65243]
         operation = "union"
         crud.perform_boolean_algebra_analysis(task_id, self.db, gene_weaver_ids, operation)
@@ -113,17 +172,203 @@ class TestCRUD(unittest.TestCase):
         run = self.db.query(models.AnalysisRun).filter_by(id=task_id).first()
         result = self.db.query(models.AnalysisResult).filter_by(run_id=task_id).first()
 
-        self.assertEqual(run.status, models.RunStatus.COMPLETED.value)
+        self.assertEqual(run.status, models.RunStatus.COMPLETED)
         self.assertIsNotNone(result)
 
         # Assuming the analysis is supposed to return a union of the genesets
         expected_result = {'Hs.59495', 'Hs.55279', 'Hs.387', 'Hs.94960', 'Hs.554190', 'Hs.58230', 'Hs.514912', 'Hs.720381', 'Hs.75389', 'Hs.726439', 'Hs.728292', 'Hs.40499'}
     
         # Convert the result to a set for comparison
-        actual_result_set = set(json.loads(result.result_data)['result'])
+        actual_result_set = set(json.loads(crud.get_run_result(self.db, task_id).result_data)['result'])
     
         self.assertEqual(actual_result_set, expected_result)
 
+    def test_compute_boolean_algebra(self):
+        geneset_sets = [{'Hs.1', 'Hs.2', 'Hs.3'}, {'Hs.2', 'Hs.3'}, {'Hs.3', 'Hs.4'}]
+
+        self.assertEqual(set(crud.compute_boolean_algebra(geneset_sets, 'intersection')['result']), {'Hs.3'})
+        self.assertEqual(set(crud.compute_boolean_algebra(geneset_sets, 'difference')['result']), {'Hs.1', 'Hs.4'})
+        output = crud.compute_boolean_algebra(geneset_sets, 'threshold', threshold=2)
+        self.assertEqual(set(output['result']), {'Hs.2', 'Hs.3'})
+        self.assertEqual(output['membership_counts'], {'Hs.2': 2, 'Hs.3': 3})
+        with self.assertRaises(ValueError):
+            crud.compute_boolean_algebra(geneset_sets, 'threshold')
+        with self.assertRaises(ValueError):
+            crud.compute_boolean_algebra(geneset_sets, 'complement')
+
+    @patch('api.crud.CANCEL_CHECK_GENESETS', 2)
+    def test_compute_boolean_algebra_with_checkpoints(self):
+        geneset_sets = [{'Hs.1', 'Hs.2', 'Hs.3'}, {'Hs.2', 'Hs.3'}, {'Hs.3', 'Hs.4'}, {'Hs.3', 'Hs.5'}, {'Hs.3'}]
+        for operation, threshold in (('intersection', None), ('union', None), ('difference', None), ('threshold', 2)):
+            with self.subTest(operation=operation):
+                calls = []
+                output = crud.compute_boolean_algebra(geneset_sets, operation, threshold, checkpoint=lambda: calls.append(1))
+                expected = crud.compute_boolean_algebra(geneset_sets, operation, threshold)
+                self.assertEqual(set(output['result']), set(expected['result']))
+                self.assertEqual(output.get('membership_counts'), expected.get('membership_counts'))
+                self.assertEqual(len(calls), 3)
+
+        # A checkpoint that raises stops the computation after the current block
+        blocks = []
+        def stop():
+            blocks.append(1)
+            raise crud.RunCanceled(1)
+        with self.assertRaises(crud.RunCanceled):
+            crud.compute_boolean_algebra(geneset_sets, 'union', checkpoint=stop)
+        self.assertEqual(len(blocks), 1)
+
+    def test_boolean_algebra_request_needs_a_geneset(self):
+        # Rejected before either backend runs, which FastAPI reports as a 422
+        with self.assertRaises(ValidationError):
+            schemas.BooleanAlgebraRequest(operation='union', gene_weaver_ids=[])
+        self.assertEqual(schemas.BooleanAlgebraRequest(operation='union', gene_weaver_ids=[1]).gene_weaver_ids, [1])
+
+    def test_perform_boolean_algebra_analysis_threshold(self):
+        run = crud.create_analysis_run(self.db)
+        crud.create_geneset(self.db, schemas.GeneSetCreate(
+            geneweaver_id=70000, entrez=1, ensembl_gene='ENSG1', unigene=['Hs.75389', 'Hs.387', 'Hs.1']
+        ))
+        crud.perform_boolean_algebra_analysis(run.id, self.db, [65469, 65243, 70000], 'threshold', threshold=2)
+
+        result = json.loads(crud.get_run_result(self.db, run.id).result_data)
+        self.assertEqual(set(result['result']), {'Hs.75389', 'Hs.387'})
+        self.assertEqual(result['membership_counts'], {'Hs.75389': 2, 'Hs.387': 2})
+
+    def test_boolean_algebra_cache_key_follows_geneset_contents(self):
+        key = crud.get_boolean_algebra_cache_key(self.db, 'union', [65469, 65243])
+
+        self.assertEqual(crud.get_boolean_algebra_cache_key(self.db, 'union', [65243, 65469]), key)
+        self.assertNotEqual(crud.get_boolean_algebra_cache_key(self.db, 'intersection', [65469, 65243]), key)
+        self.assertNotEqual(crud.get_boolean_algebra_cache_key(self.db, 'union', [65469, 65243, 65243]), key)
+        self.assertNotEqual(
+            crud.get_boolean_algebra_cache_key(self.db, 'threshold', [65469, 65243], threshold=1),
+            crud.get_boolean_algebra_cache_key(self.db, 'threshold', [65469, 65243], threshold=2),
+        )
+
+        # Recreating a geneset with other members changes the key, with the same members it does not
+        unigene = crud.get_geneset(self.db, 65243).unigene["unigene"]
+        for members, same_key in [(['Hs.1'], False), (unigene, True)]:
+            crud.delete_geneset(self.db, 65243)
+            crud.create_geneset(self.db, schemas.GeneSetCreate(
+                geneweaver_id=65243, entrez=1, ensembl_gene='ENSG1', unigene=members
+            ))
+            self.assertEqual(crud.get_boolean_algebra_cache_key(self.db, 'union', [65469, 65243]) == key, same_key)
+
+    def test_analysis_runs_reuse_results_with_the_same_key(self):
+        first = crud.create_analysis_run(self.db)
+        crud.perform_boolean_algebra_analysis(first.id, self.db, [65469, 65243], 'union')
+        second = crud.create_analysis_run(self.db)
+        with patch('api.crud.get_genesets_unigenes') as mock_get_genesets_unigenes:
+            crud.perform_boolean_algebra_analysis(second.id, self.db, [65243, 65469], 'union')
+        mock_get_genesets_unigenes.assert_not_called()
+
+        self.db.refresh(second)
+        self.assertEqual(second.status, models.RunStatus.COMPLETED)
+        result = crud.get_run_result(self.db, second.id)
+        self.assertEqual((result.run_id, second.cached_result_id), (first.id, result.id))
+        self.assertEqual(len(json.loads(result.result_data)['result']), 12)
+        body = crud.get_cached_boolean_algebra_result(
+            self.db, crud.get_boolean_algebra_cache_key(self.db, 'union', [65469, 65243])
+        )
+        self.assertEqual(json.loads(body), json.loads(result.result_data))
+
+        # Results older than the TTL are recomputed
+        with patch('api.config.RESULT_CACHE_TTL', 0):
+            third = crud.create_analysis_run(self.db)
+            crud.perform_boolean_algebra_analysis(third.id, self.db, [65469, 65243], 'union')
+        self.assertEqual(crud.get_run_result(self.db, third.id).run_id, third.id)
+
+    @patch('api.crud.RESULT_CHUNK_SIZE', 3)
+    def test_result_genes_are_paged_by_cursor(self):
+        run = crud.create_analysis_run(self.db)
+        crud.perform_boolean_algebra_analysis(run.id, self.db, [65469, 65243], 'union')
+        result_id = crud.get_run_result_id(self.db, run.id)
+        expected = sorted(json.loads(crud.get_run_result(self.db, run.id).result_data)['result'])
+
+        self.assertEqual(crud.get_result_gene_count(self.db, result_id), 12)
+        self.assertEqual(self.db.query(models.ResultBlobChunk).count(), 4)
+        pages, cursor = [], None
+        while True:
+            genes, membership_counts, cursor = crud.get_result_genes_page(self.db, result_id, cursor, limit=5)
+            self.assertIsNone(membership_counts)
+            pages.append(genes)
+            if cursor is None:
+                break
+        self.assertEqual([len(page) for page in pages], [5, 5, 2])
+        self.assertEqual(sum(pages, []), expected)
+        # A page ending on the last gene has no next page
+        self.assertEqual(crud.get_result_genes_page(self.db, result_id, expected[1], limit=10)[2], None)
+
+        chunks = crud.get_result_chunks(self.db, result_id, after_chunk=1, count=10)
+        self.assertEqual([chunk[0] for chunk in chunks], [2, 3])
+        self.assertEqual(chunks[0][1], expected[6:9])
+
+    def test_threshold_result_pages_include_membership_counts(self):
+        run = crud.create_analysis_run(self.db)
+        crud.create_geneset(self.db, schemas.GeneSetCreate(
+            geneweaver_id=70000, entrez=1, ensembl_gene='ENSG1', unigene=['Hs.75389', 'Hs.387', 'Hs.1']
+        ))
+        crud.perform_boolean_algebra_analysis(run.id, self.db, [65469, 65243, 70000], 'threshold', threshold=1)
+        result_id = crud.get_run_result_id(self.db, run.id)
+
+        genes, membership_counts, cursor = crud.get_result_genes_page(self.db, result_id, 'Hs.3', limit=3)
+        self.assertEqual(list(zip(genes, membership_counts)), [('Hs.387', 2), ('Hs.40499', 1), ('Hs.514912', 1)])
+        self.assertEqual(cursor, 'Hs.514912')
+
+    def test_identical_results_share_one_blob(self):
+        runs = [crud.create_analysis_run(self.db) for _ in range(3)]
+        crud.save_analysis_result(self.db, runs[0].id, ['Hs.2', 'Hs.1'])
+        crud.save_analysis_result(self.db, runs[1].id, ['Hs.1', 'Hs.2'])
+        crud.save_analysis_result(self.db, runs[2].id, ['Hs.1', 'Hs.2'], {'Hs.1': 2, 'Hs.2': 1})
+
+        results = [crud.get_run_result(self.db, run.id) for run in runs]
+        self.assertEqual(results[0].blob_id, results[1].blob_id)
+        self.assertNotEqual(results[0].blob_id, results[2].blob_id)
+        self.assertEqual(json.loads(results[1].result_data), {'result': ['Hs.1', 'Hs.2']})
+        self.assertEqual(
+            json.loads(results[2].result_data),
+            {'result': ['Hs.1', 'Hs.2'], 'membership_counts': {'Hs.1': 2, 'Hs.2': 1}},
+        )
+        # The decoded data is not written back
+        self.assertNotIn(results[0], self.db.dirty)
+
+    def test_runs_are_paged_by_start_time_and_id(self):
+        # Runs created within the same second share their start_time, so pages depend on the id
+        runs = [crud.create_analysis_run(self.db) for _ in range(7)]
+        for run in runs[:3]:
+            crud.update_run_status_and_time(self.db, run.id, models.RunStatus.FAILED)
+        crud.save_analysis_result(self.db, runs[3].id, ['Hs.1'])
+        crud.use_cached_result(self.db, runs[4].id, crud.get_run_result_id(self.db, runs[3].id))
+        ids = [run.id for run in runs]
+
+        def page_through(**filters):
+            pages, cursor = [], None
+            while True:
+                page, cursor = crud.get_runs_page(self.db, cursor=cursor, limit=2, **filters)
+                pages.append([run.id for run in page])
+                if cursor is None:
+                    return pages
+
+        self.assertEqual(page_through(), [ids[6:4:-1], ids[4:2:-1], ids[2:0:-1], ids[:1]])
+        self.assertEqual(sum(page_through(order='asc'), []), ids)
+        self.assertEqual(page_through(statuses=[models.RunStatus.FAILED, models.RunStatus.PENDING], order='asc'),
+                         [ids[:2], [ids[2], ids[5]], [ids[6]]])
+        page, _ = crud.get_runs_page(self.db, statuses=[models.RunStatus.COMPLETED], order='asc')
+        result_id = crud.get_run_result_id(self.db, runs[3].id)
+        self.assertEqual([(run.id, run.result_id) for run in page], [(ids[3], result_id), (ids[4], result_id)])
+
+        # Runs started later (start_time set by Python, with microseconds) come first
+        crud.update_run_status_and_time(self.db, runs[0].id, models.RunStatus.RUNNING, start_time=True)
+        self.assertEqual(page_through()[0], [ids[0], ids[6]])
+        started = self.db.query(models.AnalysisRun.start_time).filter_by(id=ids[0]).scalar()
+        self.assertEqual(sum(page_through(started_after=started), []), [ids[0]])
+        self.assertEqual(sum(page_through(started_before=started), []), ids[:0:-1])
+        self.assertEqual(crud.get_runstatus(self.db, ids[0]), 'running')
+
+        with self.assertRaises(HTTPException) as raised:
+            crud.get_runs_page(self.db, cursor=max(ids) + 1)
+        self.assertEqual(raised.exception.status_code, 400)
+
     # def test_update_run_status_and_time(self):
     #     run_id = 1
     #     status = models.RunStatus.RUNNING
@@ -0,0 +1,95 @@
+# test_enrichment.py
+import math
+import random
+import unittest
+from fractions import Fraction
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from api.database import Base
+from api import crud, schemas
+from api.enrichment import benjamini_hochberg, hypergeometric_sf
+from api.identifier_map import identifier_map
+from api.similarity import similarity_index
+
+
+# P(X >= overlap) from the exact hypergeometric probabilities
+def exact_sf(overlap, size, background, query_size):
+    tail = sum(math.comb(size, i) * math.comb(background - size, query_size - i) for i in range(overlap, min(size, query_size) + 1))
+    return float(Fraction(tail, math.comb(background, query_size)))
+
+
+class TestHypergeometric(unittest.TestCase):
+
+    def test_p_values_match_exact_sums(self):
+        rng = random.Random(0)
+        for _ in range(50):
+            background = rng.randint(1, 400)
+            query_size = rng.randint(0, background)
+            sizes = np.array([rng.randint(0, background) for _ in range(40)])
+            overlaps = np.array([rng.randint(max(0, query_size + size - background), min(size, query_size)) for size in sizes])
+            p_values = hypergeometric_sf(overlaps, sizes, background, query_size)
+            for p_value, overlap, size in zip(p_values, overlaps, sizes):
+                expected = exact_sf(int(overlap), int(size), background, query_size)
+                self.assertLessEqual(abs(p_value - expected), 1e-9 * max(expected, 1e-3), (overlap, size, background, query_size))
+
+    def test_tiny_p_values_keep_their_precision(self):
+        p_value = hypergeometric_sf(np.array([40]), np.array([50]), 20000, 60)[0]
+        self.assertAlmostEqual(p_value / exact_sf(40, 50, 20000, 60), 1, places=9)
+
+    def test_benjamini_hochberg(self):
+        p_values = np.array([0.04, 0.001, 0.03, 0.5, 0.03])
+        # Sorted: 0.001, 0.03, 0.03, 0.04, 0.5 times 5 / rank, then made monotone from the end
+        self.assertTrue(np.allclose(benjamini_hochberg(p_values), [0.05, 0.005, 0.05, 0.5, 0.05]))
+        self.assertTrue(np.allclose(benjamini_hochberg(np.array([0.9, 0.8])), [0.9, 0.9]))
+
+
+class TestEnrichmentCrud(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        similarity_index.invalidate()
+        identifier_map.invalidate()
+        crud.bulk_create_genesets(self.db, [
+            schemas.GeneSetCreate(geneweaver_id=1, entrez=1, ensembl_gene='ENSG1', unigene=[f"Hs.{i}" for i in range(10)]),
+            schemas.GeneSetCreate(geneweaver_id=2, entrez=2, ensembl_gene='ENSG2', unigene=[f"Hs.{i}" for i in range(5, 40)]),
+            schemas.GeneSetCreate(geneweaver_id=3, entrez=3, ensembl_gene='ENSG3', unigene=[f"Hs.{i}" for i in range(40, 100)]),
+        ])
+        crud.load_similarity_index(self.db)
+
+    def tearDown(self):
+        self.db.close()
+        similarity_index.invalidate()
+        identifier_map.invalidate()
+
+    def test_genesets_ranked_by_p_value(self):
+        genes = [f"Hs.{i}" for i in range(8)] + ["Hs.50", "not stored"]
+        n_genes, matched, background, tested, enriched = crud.enrich_genesets(genes)
+        self.assertEqual((n_genes, matched, background, tested), (10, 9, 100, 3))
+        self.assertEqual([row[:3] for row in enriched], [(1, 8, 10), (2, 3, 35), (3, 1, 60)])
+        geneweaver_id, overlap, size, expected, p_value, q_value = enriched[0]
+        self.assertAlmostEqual(expected, 9 * 10 / 100)
+        self.assertAlmostEqual(p_value, exact_sf(8, 10, 100, 9))
+        self.assertAlmostEqual(q_value, p_value * 3)
+
+        self.assertEqual([row[0] for row in crud.enrich_genesets(genes, limit=1)[4]], [1])
+        self.assertEqual([row[0] for row in crud.enrich_genesets(genes, max_q=0.01)[4]], [1])
+
+    def test_genes_of_another_namespace(self):
+        crud.create_geneset(self.db, schemas.GeneSetCreate(geneweaver_id=4, entrez=None, ensembl_gene=None, gene_symbol='A|B', unigene=['Hs.1', 'Hs.2']))
+        crud.load_identifier_map(self.db)
+        n_genes, matched, background, tested, enriched = crud.enrich_genesets(crud.translate_gene_list(['A', 'C'], 'gene_symbol'))
+        self.assertEqual((n_genes, matched, background, tested), (2, 2, 100, 4))
+        self.assertEqual([row[:3] for row in enriched], [(4, 2, 2), (1, 2, 10)])
+
+    def test_background_follows_deleted_genesets(self):
+        crud.delete_geneset(self.db, 3)
+        n_genes, matched, background, tested, enriched = crud.enrich_genesets(["Hs.1", "Hs.50"])
+        self.assertEqual((matched, background, tested), (1, 40, 2))
+        self.assertEqual([row[0] for row in enriched], [1])
+
+
+if __name__ == "__main__":
+    unittest.main()
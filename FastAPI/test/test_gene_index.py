@@ -0,0 +1,73 @@
+# test_gene_index.py
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from api.database import Base
+from api import crud, schemas
+from api.gene_index import GeneIndex, gene_index, geneset_identifiers
+
+
+class TestGeneIndex(unittest.TestCase):
+
+    def test_geneset_identifiers_skips_placeholders(self):
+        values = {"entrez": 1278, "ensembl_gene": "ENSG1", "hgnc": "HGNC:2198", "mgi": "-", "gene_symbol": None}
+        self.assertEqual(
+            geneset_identifiers(values, ["Hs.1", "Hs.2|Hs.3"]),
+            {"1278", "ENSG1", "HGNC:2198", "Hs.1", "Hs.2", "Hs.3"},
+        )
+
+    def test_add_replace_and_remove(self):
+        index = GeneIndex()
+        index._loaded = True
+        index.add(30, ["Hs.1", "Hs.2"])
+        index.add(10, ["Hs.1"])
+        index.add(20, ["Hs.1", "Hs.3"])
+        self.assertEqual(index.lookup("Hs.1"), [10, 20, 30])
+        self.assertEqual(index.lookup("Hs.1", offset=1, limit=1), [20])
+
+        # Adding a geneset again replaces its previous identifiers
+        index.add(30, ["Hs.3"])
+        self.assertEqual(index.lookup("Hs.1"), [10, 20])
+        self.assertEqual(index.lookup("Hs.2"), [])
+        self.assertEqual(index.lookup("Hs.3"), [20, 30])
+
+        index.remove(20)
+        self.assertEqual(index.count("Hs.3"), 1)
+        self.assertEqual(index.lookup("Hs.missing"), [])
+
+
+class TestGeneIndexCrud(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        crud.create_geneset(self.db, schemas.GeneSetCreate(
+            geneweaver_id=65243, entrez=22943, ensembl_gene='ENSG00000107984', hgnc='HGNC:2891',
+            unigene=['Hs.720381', 'Hs.75389'],
+        ))
+        gene_index.invalidate()
+
+    def tearDown(self):
+        self.db.close()
+        gene_index.invalidate()
+
+    def test_index_follows_create_update_and_delete(self):
+        # The first lookup builds the index from the database
+        self.assertEqual(crud.get_gene_genesets(self.db, 'HGNC:2891'), (1, [65243]))
+
+        crud.bulk_create_genesets(self.db, [schemas.GeneSetCreate(
+            geneweaver_id=65469, entrez=5268, ensembl_gene='ENSG00000206075', unigene=['Hs.75389'],
+        )])
+        self.assertEqual(crud.get_gene_genesets(self.db, 'Hs.75389'), (2, [65243, 65469]))
+
+        crud.update_geneset(self.db, 65243, schemas.GeneSetUpdate(entrez=1))
+        self.assertEqual(crud.get_gene_genesets(self.db, '22943'), (0, []))
+        self.assertEqual(crud.get_gene_genesets(self.db, '1'), (1, [65243]))
+
+        crud.delete_geneset(self.db, 65469)
+        self.assertEqual(crud.get_gene_genesets(self.db, 'Hs.75389'), (1, [65243]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+# test_identifier_map.py
+import csv
+import random
+import unittest
+from collections import defaultdict
+from pathlib import Path
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from api.database import Base
+from api import crud, ingest, schemas
+from api.identifier_map import IdentifierMap, geneset_namespaces, identifier_map
+from api.similarity import MissingGenesets
+
+EXPORT = Path(__file__).resolve().parents[2] / "gene_export_geneset_227303_2023-11-27.txt"
+
+
+class TestIdentifierMap(unittest.TestCase):
+
+    def setUp(self):
+        self.map = IdentifierMap()
+        self.map._loaded = True
+        rng = random.Random(0)
+        self.rows = {}
+        for gene_weaver_id in range(1, 301):
+            self.rows[gene_weaver_id] = geneset_namespaces(
+                {"entrez": gene_weaver_id, "gene_symbol": "|".join(f"SYM{rng.randrange(400)}" for _ in range(rng.randrange(4))), "mgi": "-"},
+                [f"Hs.{rng.randrange(500)}" for _ in range(rng.randrange(6))],
+            )
+            self.map.add(gene_weaver_id, self.rows[gene_weaver_id])
+
+    # Translations by walking dictionaries, one identifier at a time
+    def expected(self, genesets, source, target):
+        links = defaultdict(set)
+        for namespaces in self.rows.values():
+            for identifier in namespaces.get(source, ()):
+                links[identifier].update(namespaces.get(target, ()))
+        return [frozenset(gene for identifier in geneset for gene in links.get(identifier, ())) for geneset in genesets]
+
+    def test_geneset_namespaces_skips_placeholders(self):
+        self.assertEqual(
+            geneset_namespaces({"entrez": 1278, "gene_symbol": "EDSCV|COL1A2", "hgnc": "HGNC:2198", "mgi": "-"}, ["Hs.1", "Hs.2|Hs.3"]),
+            {"unigene": ("Hs.1", "Hs.2", "Hs.3"), "entrez": ("1278",), "gene_symbol": ("EDSCV", "COL1A2"), "hgnc": ("HGNC:2198",)},
+        )
+
+    def test_translations_match_dictionary_walks(self):
+        rng = random.Random(1)
+        genesets = [{f"Hs.{rng.randrange(520)}" for _ in range(rng.randrange(30))} for _ in range(50)] + [set()]
+        for source, target, queries in (
+            ("unigene", "gene_symbol", genesets),
+            ("unigene", "entrez", genesets),
+            ("gene_symbol", "unigene", [{f"SYM{i}" for i in range(start, start + 20)} for start in range(0, 400, 40)]),
+            ("entrez", "hgnc", [{"1", "2", "3"}]),
+        ):
+            with self.subTest(source=source, target=target):
+                self.assertEqual(self.map.translate(queries, source, target), self.expected(queries, source, target))
+        self.assertEqual(self.map.translate([{"Hs.1", "unknown"}], "unigene", "unigene"), [frozenset({"Hs.1", "unknown"})])
+
+    def test_stored_genesets_translate_like_their_identifiers(self):
+        ids = [5, 300, 5, 17]
+        for target in ("gene_symbol", "entrez", "unigene"):
+            with self.subTest(target=target):
+                unigenes = [self.rows[gene_weaver_id].get("unigene", ()) for gene_weaver_id in ids]
+                self.assertEqual(self.map.translate_genesets(ids, target), self.map.translate(unigenes, "unigene", target))
+        with self.assertRaises(MissingGenesets) as missing:
+            self.map.translate_genesets([5, 400, 0, 400], "gene_symbol")
+        self.assertEqual(missing.exception.gene_weaver_ids, [400, 0])
+
+    def test_added_and_removed_genesets(self):
+        digest = self.map.digest("unigene", "gene_symbol")
+        # Builds the links that the new geneset extends
+        self.map.translate([{"Hs.1"}], "unigene", "gene_symbol")
+        self.rows[301] = {"unigene": ("Hs.new", "Hs.1"), "gene_symbol": ("NEW",)}
+        self.map.add(301, self.rows[301])
+        self.assertIn("NEW", self.map.translate([{"Hs.new"}], "unigene", "gene_symbol")[0])
+        self.assertNotEqual(self.map.digest("unigene", "gene_symbol"), digest)
+
+        self.map.remove(301)
+        del self.rows[301]
+        self.assertEqual(self.map.translate([{"Hs.new"}], "unigene", "gene_symbol"), [frozenset()])
+        with self.assertRaises(MissingGenesets):
+            self.map.translate_genesets([301], "gene_symbol")
+        self.assertEqual(self.map.digest("unigene", "gene_symbol"), digest)
+        queries = [{"Hs.1", "Hs.2"}]
+        self.assertEqual(self.map.translate(queries, "unigene", "gene_symbol"), self.expected(queries, "unigene", "gene_symbol"))
+
+        # A replaced geneset loses the links of its former identifiers
+        self.map.translate([{"Hs.1"}], "unigene", "gene_symbol")
+        self.rows[1] = {"unigene": ("Hs.replaced",), "gene_symbol": ("REPLACED",)}
+        self.map.add(1, self.rows[1])
+        queries = [{"Hs.1", "Hs.replaced"}] + [set(namespaces.get("unigene", ())) for namespaces in self.rows.values()]
+        self.assertEqual(self.map.translate(queries, "unigene", "gene_symbol"), self.expected(queries, "unigene", "gene_symbol"))
+
+    def test_unknown_namespace(self):
+        with self.assertRaises(ValueError):
+            self.map.translate([{"Hs.1"}], "unigene", "symbol")
+
+
+class TestIdentifierMapCrud(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        with open(EXPORT, newline="") as export:
+            report = ingest.ingest_rows(self.db, csv.DictReader(export, delimiter="\t"))
+        self.assertEqual(report["errors"], [])
+        identifier_map.invalidate()
+
+    def tearDown(self):
+        self.db.close()
+        identifier_map.invalidate()
+
+    def test_every_identifier_column_is_stored(self):
+        db_geneset = crud.get_geneset(self.db, 65243)
+        self.assertEqual(
+            (db_geneset.entrez, db_geneset.ensembl_gene, db_geneset.gene_symbol, db_geneset.hgnc, db_geneset.ensembl_protein, db_geneset.cgnc),
+            ("22943", "ENSG00000107984", "DKK-1|SK|DKK1", "HGNC:2891", "-", "-"),
+        )
+
+    def test_boolean_algebra_in_another_namespace(self):
+        ids = [65066, 65243]
+        union = crud.run_boolean_algebra(self.db, "union", ids, namespace="gene_symbol")
+        self.assertEqual(set(union["result"]), {"EDSARTH2", "EDSCV", "COL1A2", "DKK-1", "SK", "DKK1"})
+        self.assertEqual(crud.run_boolean_algebra(self.db, "intersection", ids, namespace="hgnc"), {"result": []})
+        threshold = crud.run_boolean_algebra(self.db, "threshold", ids + [65066], threshold=2, namespace="entrez")
+        self.assertEqual(threshold["membership_counts"], {"1278": 2})
+
+    def test_missing_genesets_are_not_found(self):
+        with self.assertRaises(HTTPException) as missing:
+            crud.run_boolean_algebra(self.db, "union", [65066, 1, 2], namespace="gene_symbol")
+        self.assertEqual(missing.exception.status_code, 404)
+
+    def test_cache_keys_follow_the_translations(self):
+        key = crud.get_boolean_algebra_cache_key(self.db, "union", [65066], namespace="gene_symbol")
+        self.assertNotEqual(key, crud.get_boolean_algebra_cache_key(self.db, "union", [65066]))
+        self.assertNotEqual(key, crud.get_boolean_algebra_cache_key(self.db, "union", [65066], namespace="hgnc"))
+        self.assertEqual(key, crud.get_boolean_algebra_cache_key(self.db, "union", [65066], namespace="gene_symbol"))
+
+        # A new geneset sharing a unigene adds a translation of geneset 65066
+        crud.create_geneset(self.db, schemas.GeneSetCreate(geneweaver_id=1, entrez=None, ensembl_gene=None, gene_symbol="NEW", unigene=["Hs.233757"]))
+        self.assertNotEqual(key, crud.get_boolean_algebra_cache_key(self.db, "union", [65066], namespace="gene_symbol"))
+        self.assertIn("NEW", crud.run_boolean_algebra(self.db, "union", [65066], namespace="gene_symbol")["result"])
+
+    def test_unknown_namespace_is_rejected(self):
+        with self.assertRaises(ValueError):
+            crud.check_boolean_algebra_operation("union", namespace="symbol")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+# test_ingest.py
+import asyncio
+import csv
+import io
+import subprocess
+import sys
+import tracemalloc
+import unittest
+from pathlib import Path
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from api.database import Base
+from api import ingest, models
+
+
+HEADER = "GeneWeaver ID\tEntrez\tEnsembl Gene\tUnigene\n"
+
+
+# Minimal stand-in for fastapi.UploadFile that generates an export of n_rows on the fly,
+# so the test itself never holds the whole file in memory.
+class GeneratedUpload:
+
+    def __init__(self, n_rows):
+        self.lines = self.generate(n_rows)
+        self.buffer = b""
+        self.size = 0
+
+    def generate(self, n_rows):
+        yield HEADER.encode()
+        unigenes = "|".join(f"Hs.{i}" for i in range(10))
+        for i in range(1, n_rows + 1):
+            yield f"{i}\t{i}\tENSG{i:011d}\t{unigenes}\r\n".encode()
+
+    async def read(self, size):
+        for line in self.lines:
+            self.buffer += line
+            if len(self.buffer) >= size:
+                break
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        self.size += len(chunk)
+        return chunk
+
+
+class TestIngest(unittest.TestCase):
+
+    def setUp(self):
+        # Every test gets its own in-memory database
+        self.engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(self.engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)()
+
+    def tearDown(self):
+        self.db.close()
+
+    def reader(self, body):
+        return csv.DictReader(io.StringIO(HEADER + body), delimiter='\t')
+
+    def test_ingest_rows_inserts_all_valid_rows(self):
+        body = "".join(f"{i}\t{i}\tENSG{i}\tHs.{i}|Hs.{i + 1}\n" for i in range(1, 1201))
+        report = ingest.ingest_rows(self.db, self.reader(body), batch_size=500)
+
+        self.assertEqual(report, {"inserted": 1200, "errors": []})
+        self.assertEqual(self.db.query(models.GeneSet).count(), 1200)
+
+    def test_ingest_rows_reports_row_errors(self):
+        body = (
+            "1\t10\tENSG1\tHs.1\n"
+            "not-a-number\t11\tENSG2\tHs.2\n"
+            "2\tabc\tENSG3\tHs.3\n"
+            "1\t12\tENSG4\tHs.4\n"
+        )
+        report = ingest.ingest_rows(self.db, self.reader(body))
+
+        self.assertEqual(report["inserted"], 1)
+        self.assertEqual([error["line"] for error in report["errors"]], [3, 4, 5])
+        self.assertIn("already exists", report["errors"][2]["error"])
+
+    def test_iter_upload_rows_handles_split_lines_and_multibyte_text(self):
+        upload = GeneratedUpload(0)
+        upload.lines = iter([(HEADER + "1\t2\tENSG1\tHs.\u00e9|Hs.2\n\n3\t4\tENSG3\tHs.3").encode()])
+
+        async def collect():
+            return [item async for item in ingest.iter_upload_rows(upload, chunk_size=7)]
+
+        rows = asyncio.run(collect())
+        self.assertEqual([line for line, _ in rows], [2, 4])
+        self.assertEqual(rows[0][1]["Unigene"], "Hs.\u00e9|Hs.2")
+        self.assertEqual(rows[1][1]["GeneWeaver ID"], "3")
+
+    def test_ingest_upload_peak_memory_is_bounded(self):
+        # Measured in a fresh interpreter, so that caches warmed by earlier tests neither
+        # count against the peaks nor make them depend on the order tests run in
+        result = subprocess.run(
+            [sys.executable, "-c", "from test.test_ingest import print_peak_memory; print_peak_memory(1000, 8000)"],
+            cwd=Path(__file__).resolve().parents[1], capture_output=True, text=True, check=True,
+        )
+        small_peak, large_peak = map(int, result.stdout.split()[-2:])
+
+        # Eight times more rows must not need meaningfully more memory: the peak is set by
+        # the chunk, batch and membership insert buffers, not by the size of the upload
+        self.assertLess(large_peak, 1.25 * small_peak)
+
+
+# Prints the peak memory growth of ingesting uploads of each number of rows into a new
+# in-memory database, after a first upload that warms SQLAlchemy's statement caches
+def print_peak_memory(*n_rows):
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    peaks = []
+    for rows in (500,) + n_rows:
+        upload = GeneratedUpload(rows)
+        tracemalloc.start()
+        report = asyncio.run(ingest.ingest_upload(db, upload))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert report["inserted"] == rows, report
+        db.execute(models.geneset_genes.delete())
+        db.query(models.GeneSet).delete()
+        db.commit()
+        peaks.append(peak)
+    print(*peaks[1:])
+
+
+if __name__ == "__main__":
+    unittest.main()
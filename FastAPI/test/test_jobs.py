@@ -0,0 +1,224 @@
+# test_jobs.py
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from api.backends import configure_sqlite
+from api.database import Base
+from api import crud, models, schemas
+from api.jobs import AnalysisJob, JobExecutor, JobQueueFull, run_analysis_job_in_process
+from api.cache import gene_identifier_cache, geneset_cache
+from api.writer import WriteQueue
+
+
+class TestJobExecutor(unittest.TestCase):
+
+    def setUp(self):
+        # Jobs use their own sessions on worker threads, so the database lives in a file
+        # shared by every connection rather than in memory
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = create_engine(
+            f"sqlite:///{os.path.join(self.tmp.name, 'jobs.db')}", connect_args={"check_same_thread": False}
+        )
+        Base.metadata.create_all(self.engine)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.db = self.SessionLocal()
+        geneset_cache.clear()
+        gene_identifier_cache.clear()
+        for geneweaver_id, unigene in [(1, ['Hs.1', 'Hs.2']), (2, ['Hs.2', 'Hs.3'])]:
+            crud.create_geneset(self.db, schemas.GeneSetCreate(
+                geneweaver_id=geneweaver_id, entrez=geneweaver_id, ensembl_gene=f'ENSG{geneweaver_id}', unigene=unigene
+            ))
+        self.executor = JobExecutor(self.SessionLocal, workers=2, executor="thread", queue_size=50)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.db.close()
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    def run_status(self, run_id):
+        self.db.expire_all()
+        return self.db.query(models.AnalysisRun).filter_by(id=run_id).one().status
+
+    def test_jobs_complete_with_their_own_sessions(self):
+        run_ids = [crud.create_analysis_run(self.db).id for _ in range(20)]
+        for run_id in run_ids:
+            self.executor.submit(AnalysisJob(run_id, [1, 2], "union"))
+        self.assertTrue(self.executor.wait_idle(timeout=30))
+
+        for run_id in run_ids:
+            self.assertEqual(self.run_status(run_id), models.RunStatus.COMPLETED)
+            result = json.loads(crud.get_run_result(self.db, run_id).result_data)
+            self.assertEqual(set(result["result"]), {"Hs.1", "Hs.2", "Hs.3"})
+        stats = self.executor.stats()
+        self.assertEqual((stats["queue_depth"], stats["running"], stats["completed"]), (0, 0, 20))
+
+    def test_failed_job_marks_run_failed(self):
+        run_id = crud.create_analysis_run(self.db).id
+        self.executor.submit(AnalysisJob(run_id, [1, 404], "union"))
+        self.assertTrue(self.executor.wait_idle(timeout=30))
+
+        self.assertEqual(self.run_status(run_id), models.RunStatus.FAILED)
+        self.assertEqual(self.executor.stats()["failed"], 1)
+
+    def test_run_canceled_while_queued_never_starts(self):
+        run_id = crud.create_analysis_run(self.db).id
+        crud.cancel_run(self.db, run_id)
+        self.executor.submit(AnalysisJob(run_id, [1, 2], "union"))
+        self.assertTrue(self.executor.wait_idle(timeout=30))
+
+        self.assertEqual(self.run_status(run_id), models.RunStatus.CANCELED)
+        self.assertIsNone(crud.get_run_result(self.db, run_id))
+
+    def test_cancel_stops_in_flight_run(self):
+        run_id = crud.create_analysis_run(self.db).id
+        get_genesets_unigenes = crud.get_genesets_unigenes
+
+        # Cancel the run from another session while it is fetching its genesets
+        def fetch_then_cancel(db, gene_weaver_ids):
+            cancel_db = self.SessionLocal()
+            crud.cancel_run(cancel_db, run_id)
+            cancel_db.close()
+            return get_genesets_unigenes(db, gene_weaver_ids)
+
+        with patch('api.crud.get_genesets_unigenes', side_effect=fetch_then_cancel) as fetch:
+            self.executor.submit(AnalysisJob(run_id, [1, 2], "union"))
+            self.assertTrue(self.executor.wait_idle(timeout=30))
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(self.run_status(run_id), models.RunStatus.CANCELED)
+        self.assertIsNone(crud.get_run_result(self.db, run_id))
+
+    @patch('api.crud.CANCEL_CHECK_INTERVAL', 0)
+    @patch('api.crud.CANCEL_CHECK_GENESETS', 1)
+    def test_cancel_stops_run_inside_its_computation(self):
+        run_id = crud.create_analysis_run(self.db).id
+        membership_counts = crud.membership_counts
+
+        # Cancel the run while it counts the genes of its first geneset
+        def count_then_cancel(*geneset_sets):
+            cancel_db = self.SessionLocal()
+            crud.cancel_run(cancel_db, run_id)
+            cancel_db.close()
+            return membership_counts(*geneset_sets)
+
+        with patch('api.crud.membership_counts', side_effect=count_then_cancel) as count:
+            self.executor.submit(AnalysisJob(run_id, [1, 2, 1, 2], "threshold", threshold=2))
+            self.assertTrue(self.executor.wait_idle(timeout=30))
+
+        self.assertEqual(count.call_count, 1)
+        self.assertEqual(self.run_status(run_id), models.RunStatus.CANCELED)
+        self.assertIsNone(crud.get_run_result(self.db, run_id))
+
+    def test_cancel_after_last_checkpoint_is_not_overwritten(self):
+        run_id = crud.create_analysis_run(self.db).id
+        save_analysis_result = crud.save_analysis_result
+
+        # Cancel the run after its last cancellation check, just before its result is saved
+        def cancel_then_save(*args, **kwargs):
+            cancel_db = self.SessionLocal()
+            crud.cancel_run(cancel_db, run_id)
+            cancel_db.close()
+            return save_analysis_result(*args, **kwargs)
+
+        with patch('api.crud.save_analysis_result', side_effect=cancel_then_save) as save:
+            self.executor.submit(AnalysisJob(run_id, [1, 2], "union"))
+            self.assertTrue(self.executor.wait_idle(timeout=30))
+
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual(self.run_status(run_id), models.RunStatus.CANCELED)
+        self.assertIsNone(crud.get_run_result(self.db, run_id))
+        self.assertEqual(self.db.query(models.AnalysisResult).count(), 0)
+
+    def test_process_jobs_do_not_reuse_cached_genesets(self):
+        # A worker process is not told about genesets changed in the parent process
+        crud.get_genesets_unigenes(self.db, [1])
+        geneset_cache.get_many([1], lambda missing: self.fail("geneset 1 should be cached"))
+        job = AnalysisJob(1, [1, 2], "union")
+        with patch('api.jobs.run_analysis_job') as run:
+            run_analysis_job_in_process(job)
+        run.assert_called_once_with(job)
+        self.assertEqual(geneset_cache.get_many([1], lambda missing: {}), {})
+
+    def test_full_queue_refuses_submissions(self):
+        executor = JobExecutor(self.SessionLocal, workers=1, executor="thread", queue_size=2)
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocked(job, session_factory):
+            started.set()
+            release.wait(timeout=30)
+
+        with patch('api.jobs.run_analysis_job', side_effect=blocked):
+            executor.submit(AnalysisJob(1, [1], "union"))
+            self.assertTrue(started.wait(timeout=30))
+            executor.submit(AnalysisJob(2, [1], "union"))
+            executor.submit(AnalysisJob(3, [1], "union"))
+            self.assertEqual(executor.queue_depth, 2)
+            with self.assertRaises(JobQueueFull):
+                executor.submit(AnalysisJob(4, [1], "union"))
+            release.set()
+            self.assertTrue(executor.wait_idle(timeout=30))
+        executor.shutdown()
+
+
+@unittest.skipUnless(multiprocessing.get_start_method() == "fork", "worker processes are not forked")
+class TestProcessJobExecutor(unittest.TestCase):
+
+    def setUp(self):
+        # Writes go through a write queue whose writer is running when the worker processes are
+        # forked, as with the application's SQLite database. Worker processes open their own
+        # connections, so the engines do not pool them.
+        self.tmp = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(self.tmp.name, 'jobs.db')}"
+        self.engine = create_engine(url, connect_args={"check_same_thread": False}, poolclass=NullPool)
+        configure_sqlite(self.engine)
+        Base.metadata.create_all(self.engine)
+        self.writer_engine = create_engine(url, connect_args={"check_same_thread": False}, poolclass=NullPool)
+        configure_sqlite(self.writer_engine, immediate=True)
+        self.write_queue = WriteQueue(sessionmaker(autoflush=False, expire_on_commit=False, bind=self.writer_engine))
+        self.SessionLocal = sessionmaker(autoflush=False, bind=self.engine, info={"write_queue": self.write_queue})
+        self.db = self.SessionLocal()
+        geneset_cache.clear()
+        gene_identifier_cache.clear()
+        for geneweaver_id, unigene in [(1, ['Hs.1', 'Hs.2']), (2, ['Hs.2', 'Hs.3'])]:
+            crud.create_geneset(self.db, schemas.GeneSetCreate(
+                geneweaver_id=geneweaver_id, entrez=geneweaver_id, ensembl_gene=f'ENSG{geneweaver_id}', unigene=unigene
+            ))
+        # Worker processes take their sessions from api.database
+        session_local = patch('api.database.SessionLocal', self.SessionLocal)
+        session_local.start()
+        self.addCleanup(session_local.stop)
+        self.executor = JobExecutor(workers=1, executor="process", queue_size=50)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.db.close()
+        self.write_queue.shutdown()
+        self.engine.dispose()
+        self.writer_engine.dispose()
+        self.tmp.cleanup()
+
+    def test_jobs_complete_in_worker_processes(self):
+        run_ids = [crud.create_analysis_run(self.db).id for _ in range(3)]
+        for run_id in run_ids:
+            self.executor.submit(AnalysisJob(run_id, [1, 2], "union"))
+        self.assertTrue(self.executor.wait_idle(timeout=60))
+
+        self.assertEqual(self.executor.stats()["completed"], 3)
+        self.db.expire_all()
+        for run_id in run_ids:
+            self.assertEqual(self.db.query(models.AnalysisRun).filter_by(id=run_id).one().status, models.RunStatus.COMPLETED)
+            result = json.loads(crud.get_run_result(self.db, run_id).result_data)
+            self.assertEqual(set(result["result"]), {"Hs.1", "Hs.2", "Hs.3"})
+
+
+if __name__ == "__main__":
+    unittest.main()
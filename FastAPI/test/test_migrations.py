@@ -0,0 +1,103 @@
+# test_migrations.py
+import json
+import unittest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from api.database import Base
+from api import crud, migrations, minhash, models
+from api.cache import gene_identifier_cache, geneset_cache
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        # The geneset cache is shared by every database in the process
+        geneset_cache.clear()
+        gene_identifier_cache.clear()
+        # Build a database the way older versions did, with members stored as JSON
+        self.engine = create_engine("sqlite:///:memory:")
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE genesets (id INTEGER PRIMARY KEY, geneweaver_id INTEGER UNIQUE, "
+                "entrez VARCHAR, ensembl_gene VARCHAR, unigene VARCHAR)"
+            ))
+            conn.execute(
+                text("INSERT INTO genesets (geneweaver_id, entrez, ensembl_gene, unigene) VALUES (:g, '1', 'E', :u)"),
+                [
+                    {"g": 65243, "u": json.dumps({"unigene": ["Hs.1", "Hs.2"]})},
+                    {"g": 65469, "u": json.dumps({"unigene": ["Hs.2", "Hs.3"]})},
+                ],
+            )
+        Base.metadata.create_all(self.engine)
+
+    def test_migrate_unigene_json(self):
+        self.assertEqual(migrations.migrate_unigene_json(self.engine), 2)
+        # Running it again finds nothing left to convert
+        self.assertEqual(migrations.migrate_unigene_json(self.engine), 0)
+
+        with Session(self.engine) as db:
+            self.assertEqual(crud.get_geneset_unigenes(db, 65243), {"Hs.1", "Hs.2"})
+            self.assertEqual(crud.get_genesets_with_gene(db, "Hs.2"), [65243, 65469])
+
+    def test_run_migrations_backfills_content_hashes(self):
+        migrations.run_migrations(self.engine)
+
+        with Session(self.engine) as db:
+            self.assertEqual(
+                crud.get_genesets_content_hashes(db, [65243, 65469]),
+                {65243: crud.unigene_content_hash(["Hs.2", "Hs.1"]), 65469: crud.unigene_content_hash(["Hs.2", "Hs.3"])},
+            )
+        self.assertEqual(migrations.backfill_content_hashes(self.engine), 0)
+
+    def test_run_migrations_backfills_minhash_signatures(self):
+        migrations.run_migrations(self.engine)
+
+        with Session(self.engine) as db:
+            stored = dict(db.query(models.GeneSet.geneweaver_id, models.GeneSet.minhash))
+        self.assertEqual(stored[65243], minhash.encode_signature(minhash.signature(["Hs.1", "Hs.2"])))
+        self.assertEqual(stored[65469], minhash.encode_signature(minhash.signature(["Hs.2", "Hs.3"])))
+        self.assertEqual(migrations.backfill_minhash_signatures(self.engine), 0)
+
+    def test_missing_identifier_placeholder_is_dropped_from_members(self):
+        # Genesets stored by versions that kept "-" as a member, with its digest and signature
+        migrations.run_migrations(self.engine)
+        placeholder_members = {66775: ["-"], 69976: ["-", "Hs.4"]}
+        with Session(self.engine) as db:
+            for geneweaver_id, members in placeholder_members.items():
+                geneset = models.GeneSet(
+                    geneweaver_id=geneweaver_id, entrez="1", ensembl_gene="E",
+                    content_hash=crud.unigene_content_hash(members),
+                    minhash=minhash.encode_signature(minhash.signature(members)),
+                )
+                db.add(geneset)
+                db.flush()
+                crud.add_geneset_genes(db, {geneset.id: members})
+            db.commit()
+        geneset_cache.clear()
+
+        migrations.run_migrations(self.engine)
+        with Session(self.engine) as db:
+            self.assertEqual(db.query(models.Gene).filter_by(identifier="-").count(), 0)
+            self.assertEqual(crud.get_geneset_unigenes(db, 69976), {"Hs.4"})
+            self.assertEqual(crud.get_geneset_unigenes(db, 65243), {"Hs.1", "Hs.2"})
+            stored = dict(db.query(models.GeneSet.geneweaver_id, models.GeneSet.minhash))
+            hashes = crud.get_genesets_content_hashes(db, [66775, 69976])
+        self.assertEqual(stored[66775], minhash.encode_signature(minhash.EMPTY_SIGNATURE))
+        self.assertEqual(stored[69976], minhash.encode_signature(minhash.signature(["Hs.4"])))
+        self.assertEqual(hashes, {66775: crud.unigene_content_hash([]), 69976: crud.unigene_content_hash(["Hs.4"])})
+        self.assertEqual(migrations.drop_missing_identifier_members(self.engine), 0)
+
+    def test_json_results_are_moved_into_blobs(self):
+        migrations.run_migrations(self.engine)
+        with Session(self.engine) as db:
+            db.add(models.AnalysisResult(id=1, result_data=json.dumps({"result": ["Hs.2", "Hs.9"]})))
+            db.commit()
+
+            self.assertEqual(migrations.migrate_result_blobs(self.engine), 1)
+            self.assertEqual(migrations.migrate_result_blobs(self.engine), 0)
+            self.assertIsNone(db.execute(text("SELECT result_data FROM analysis_results")).scalar())
+            self.assertEqual(crud.get_result_gene_count(db, 1), 2)
+            self.assertEqual(crud.get_result_genes_page(db, 1), (["Hs.2", "Hs.9"], None, None))
+
+if __name__ == "__main__":
+    unittest.main()
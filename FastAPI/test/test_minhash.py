@@ -0,0 +1,97 @@
+# test_minhash.py
+import random
+import unittest
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from api.database import Base
+from api import crud, schemas
+from api.minhash import (
+    EMPTY_SIGNATURE, NUM_PERM, LSHIndex, decode_signature, encode_signature, estimate_jaccard, lsh_index, signature,
+)
+from api.similarity import similarity_index
+
+
+class TestMinHash(unittest.TestCase):
+
+    def test_signatures_estimate_jaccard_similarity(self):
+        genes = [f"Hs.{i}" for i in range(400)]
+        first, second = signature(genes[:300]), signature(genes[100:])
+        self.assertEqual(first.shape, (NUM_PERM,))
+        # True similarity 200 / 400; the estimate has a standard error of about 0.044
+        self.assertAlmostEqual(estimate_jaccard(first, second), 0.5, delta=0.15)
+        self.assertTrue(np.array_equal(signature(reversed(genes[:300])), first))
+        self.assertTrue(np.array_equal(signature([]), EMPTY_SIGNATURE))
+
+    def test_signatures_round_trip_through_bytes(self):
+        values = signature(["Hs.1", "Hs.2"])
+        self.assertEqual(len(encode_signature(values)), NUM_PERM * 4)
+        self.assertTrue(np.array_equal(decode_signature(encode_signature(values)), values))
+        self.assertIsNone(decode_signature(None))
+        self.assertIsNone(decode_signature(b"\0" * 8))
+
+    def test_candidates_share_a_band(self):
+        rng = random.Random(0)
+        universe = [f"Hs.{i}" for i in range(5000)]
+        query = rng.sample(universe, 100)
+        index = LSHIndex(bands=32)
+        index._loaded = True
+        index.add(1, signature(query[:90] + rng.sample(universe, 10)))  # Jaccard about 0.8
+        for geneweaver_id in range(2, 50):
+            index.add(geneweaver_id, signature(rng.sample(universe, 100)))
+        index.add(50, signature([]))
+        ids, shared = index.candidates(signature(query))
+        self.assertEqual(ids[0], 1)
+        self.assertGreater(shared[0], 8)
+        self.assertLess(len(ids), 5)
+
+        # Removed and replaced genesets are dropped from the sorted bands
+        index.remove(1)
+        index.add(2, signature(query))
+        ids, shared = index.candidates(signature(query))
+        self.assertEqual((ids[0], shared[0]), (2, 32))
+        self.assertNotIn(1, ids)
+        # The empty geneset is not indexed
+        self.assertEqual(len(index), 48)
+        self.assertEqual(len(index.candidates(EMPTY_SIGNATURE)[0]), 0)
+
+
+class TestSimilarGenesets(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        self.genes = [f"Hs.{i}" for i in range(40)]
+        crud.create_geneset(self.db, schemas.GeneSetCreate(
+            geneweaver_id=1, entrez=1, ensembl_gene='ENSG1', unigene=self.genes[:20],
+        ))
+        lsh_index.invalidate()
+        similarity_index.invalidate()
+
+    def tearDown(self):
+        self.db.close()
+        lsh_index.invalidate()
+        similarity_index.invalidate()
+
+    def find(self, genes, k=10, metric="jaccard"):
+        crud.load_similar_genesets_indexes(self.db)
+        return crud.find_similar_genesets(genes, k, metric)
+
+    def test_candidates_are_ranked_by_exact_scores(self):
+        crud.bulk_create_genesets(self.db, [
+            schemas.GeneSetCreate(geneweaver_id=2, entrez=2, ensembl_gene='ENSG2', unigene=self.genes[:18]),
+            schemas.GeneSetCreate(geneweaver_id=3, entrez=3, ensembl_gene='ENSG3', unigene=self.genes[20:]),
+        ])
+        candidates, similar = self.find(self.genes[:19] + ["Hs.unknown"])
+        self.assertGreaterEqual(candidates, 2)
+        self.assertEqual(similar, [(1, 19 / 21, 19, 20), (2, 18 / 20, 18, 18)])
+        # Equal scores are ordered by GeneWeaver ID
+        self.assertEqual(self.find(self.genes[:19], k=1, metric="overlap")[1], [(1, 1.0, 19, 20)])
+
+        crud.delete_geneset(self.db, 1)
+        self.assertEqual([geneweaver_id for geneweaver_id, *_ in self.find(self.genes[:19])[1]], [2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+# test_overlap_search.py
+import asyncio
+import io
+import random
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+from fastapi import UploadFile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from api.database import Base
+from api import crud, schemas
+from api.identifier_map import identifier_map
+from api.ingest import read_upload_genes
+from api.overlap_search import top_k_overlaps
+from api.similarity import SimilarityIndex, similarity_index
+
+
+class TestTopKOverlaps(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SimilarityIndex()
+        self.index._loaded = True
+        rng = random.Random(0)
+        # Common genes are in most genesets, so the search stops walking before reaching them
+        universe = [f"Hs.{i}" for i in range(300)]
+        weights = [1 / (rank + 1) for rank in range(len(universe))]
+        self.genesets = {
+            gene_weaver_id: set(rng.choices(universe, weights, k=rng.randrange(1, 60))) for gene_weaver_id in range(1, 401)
+        }
+        for gene_weaver_id, genes in self.genesets.items():
+            self.index.add(gene_weaver_id, genes)
+        self.queries = [set(rng.choices(universe, weights, k=40)) | {"not stored"} for _ in range(20)]
+        self.queries += [self.genesets[7] | {"Hs.299"}, set(universe[:10])]
+
+    # The top k by scoring every geneset with set operations
+    def expected(self, query, k, metric):
+        scored = []
+        for gene_weaver_id, genes in self.genesets.items():
+            shared = len(query & genes)
+            score = {
+                "intersection": shared, "jaccard": shared / len(query | genes), "overlap": shared / min(len(query), len(genes)),
+            }[metric]
+            if shared:
+                scored.append((-score, gene_weaver_id, shared))
+        return sorted(scored)[:k]
+
+    def assertExact(self, k, metric):
+        probed = 0
+        for query in self.queries:
+            top = self.search(query, k, metric)
+            expected = self.expected(query, k, metric)
+            self.assertEqual(top.gene_weaver_ids.tolist(), [gene_weaver_id for _, gene_weaver_id, _ in expected])
+            self.assertEqual(top.intersections.tolist(), [shared for _, _, shared in expected])
+            for score, (negative_score, _, _) in zip(top.scores, expected):
+                self.assertAlmostEqual(score, -negative_score)
+            probed += top.probed
+        return probed
+
+    def search(self, query, k, metric):
+        query_size, postings, row_sizes, row_ids = self.index.postings(query)
+        return top_k_overlaps(postings, query_size, row_sizes, row_ids, k, metric)
+
+    def test_results_match_scoring_every_geneset(self):
+        for metric in ("intersection", "jaccard", "overlap"):
+            for k in (1, 5, 50):
+                with self.subTest(metric=metric, k=k):
+                    probed = self.assertExact(k, metric)
+                    if metric != "overlap" and k < 50:
+                        # The bound let the search skip walking some common genes
+                        self.assertGreater(probed, 0)
+
+    def test_leaders_found_before_every_list(self):
+        with patch("api.overlap_search.LEADERS_REFRESH_DIVISOR", 10 ** 6):
+            self.assertExact(3, "jaccard")
+
+    def test_replaced_and_removed_genesets(self):
+        self.search(self.queries[0], 5, "jaccard")
+        self.genesets[3] = set(self.queries[0])
+        self.index.add(3, self.genesets[3])
+        self.index.remove(4)
+        del self.genesets[4]
+        self.assertEqual(self.search(self.queries[0], 1, "jaccard").gene_weaver_ids.tolist(), [3])
+        self.assertExact(10, "intersection")
+
+    def test_query_without_stored_genes(self):
+        top = self.search({"not stored"}, 5, "jaccard")
+        self.assertEqual(top.gene_weaver_ids.tolist(), [])
+        self.assertEqual((top.walked, top.probed), (0, 0))
+
+
+class TestOverlapCrud(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        similarity_index.invalidate()
+        identifier_map.invalidate()
+        crud.bulk_create_genesets(self.db, [
+            schemas.GeneSetCreate(geneweaver_id=1, entrez=1, ensembl_gene='ENSG1', unigene=['MGI:1920900', 'MGI:5456278', 'Hs.1']),
+            schemas.GeneSetCreate(geneweaver_id=2, entrez=2, ensembl_gene='ENSG2', unigene=['MGI:1920900', 'Hs.2']),
+            schemas.GeneSetCreate(geneweaver_id=3, entrez=3, ensembl_gene='ENSG3', unigene=['Hs.3']),
+        ])
+
+    def tearDown(self):
+        self.db.close()
+        similarity_index.invalidate()
+        identifier_map.invalidate()
+
+    def test_genes_of_an_uploaded_sample_file(self):
+        sample = Path(__file__).resolve().parents[2] / "sample_input_data.txt"
+        genes = asyncio.run(read_upload_genes(UploadFile(filename="sample_input_data.txt", file=io.BytesIO(sample.read_bytes())), chunk_size=100))
+        self.assertEqual(len(genes), len(sample.read_text().splitlines()))
+        self.assertEqual(genes[:2], ["MGI:1920900", "MGI:5456278"])
+
+        crud.load_similarity_index(self.db)
+        top = crud.find_overlapping_genesets(genes, 5, "intersection")
+        self.assertEqual(top.gene_weaver_ids.tolist(), [1, 2])
+        self.assertEqual(top.intersections.tolist(), [2, 1])
+        self.assertEqual(top.sizes.tolist(), [3, 2])
+
+        crud.delete_geneset(self.db, 1)
+        self.assertEqual(crud.find_overlapping_genesets(genes, 5, "overlap").gene_weaver_ids.tolist(), [2])
+
+    def test_genes_of_another_namespace(self):
+        crud.create_geneset(self.db, schemas.GeneSetCreate(geneweaver_id=4, entrez=None, ensembl_gene=None, mgi='MGI:1', unigene=['Hs.2', 'Hs.3']))
+        crud.load_identifier_map(self.db)
+        self.assertEqual(crud.translate_gene_list(['MGI:1', 'MGI:2'], 'mgi'), ['Hs.2', 'Hs.3'])
+        self.assertEqual(crud.translate_gene_list(['MGI:1'], 'unigene'), ['MGI:1'])
+
+        crud.load_similarity_index(self.db)
+        top = crud.find_overlapping_genesets(crud.translate_gene_list(['MGI:1'], 'mgi'), 5, 'intersection')
+        self.assertEqual(top.gene_weaver_ids.tolist(), [4, 2, 3])
+        self.assertEqual(top.intersections.tolist(), [2, 1, 1])
+        with self.assertRaises(ValueError):
+            crud.translate_gene_list(['MGI:1'], 'symbol')
+
+    def test_metric_is_checked(self):
+        with self.assertRaises(ValueError):
+            crud.check_overlap_metric("dice")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+# test_result_codec.py
+import unittest
+import numpy as np
+from api.result_codec import decode_chunk, decode_varints, encode_chunk, encode_varints
+
+
+class TestResultCodec(unittest.TestCase):
+
+    def test_varints_round_trip(self):
+        values = [0, 1, 127, 128, 300, 2 ** 35, 2 ** 64 - 1]
+        data = encode_varints(np.array(values, dtype=np.uint64))
+
+        self.assertEqual(data[:5], bytes([0, 1, 127, 0x80, 0x01]))
+        self.assertEqual(decode_varints(data).tolist(), values)
+        self.assertEqual(decode_varints(b"").tolist(), [])
+        with self.assertRaises(ValueError):
+            decode_varints(data[:-1])
+
+    def test_chunks_are_sorted_by_gene_id(self):
+        gene_ids, counts = decode_chunk(encode_chunk([900, 3, 70000], [1, 2, 3]))
+
+        self.assertEqual(gene_ids.tolist(), [3, 900, 70000])
+        self.assertEqual(counts.tolist(), [2, 1, 3])
+        self.assertIsNone(decode_chunk(encode_chunk([5]))[1])
+        self.assertEqual(decode_chunk(encode_chunk([]))[0].tolist(), [])
+
+    def test_dense_ids_take_about_a_byte_each(self):
+        gene_ids = np.arange(1, 100001, 3)
+        self.assertLess(len(encode_chunk(gene_ids)), gene_ids.size // 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+# test_similarity.py
+import random
+import unittest
+from unittest.mock import patch
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from api.database import Base
+from api import crud, models, schemas
+from api.similarity import MissingGenesets, SimilarityIndex, similarity_index
+
+
+class TestSimilarityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SimilarityIndex()
+        self.index._loaded = True
+        rng = random.Random(0)
+        universe = [f"Hs.{i}" for i in range(50)]
+        self.genesets = {gene_weaver_id: set(rng.sample(universe, rng.randrange(0, 25))) for gene_weaver_id in range(1, 13)}
+        for gene_weaver_id, genes in self.genesets.items():
+            self.index.add(gene_weaver_id, genes)
+
+    def assertMatchesSets(self, row_ids, col_ids=None):
+        col_ids = row_ids if col_ids is None else col_ids
+        block = self.index.block(row_ids, col_ids)
+        for i, row_id in enumerate(row_ids):
+            for j, col_id in enumerate(col_ids):
+                a, b = self.genesets[row_id], self.genesets[col_id]
+                shared = len(a & b)
+                self.assertEqual(block.intersections[i, j], shared)
+                self.assertAlmostEqual(block.scores["jaccard"][i, j], shared / len(a | b) if a | b else 0)
+                self.assertAlmostEqual(block.scores["overlap"][i, j], shared / min(len(a), len(b)) if a and b else 0)
+                self.assertAlmostEqual(block.scores["dice"][i, j], 2 * shared / (len(a) + len(b)) if a or b else 0)
+        self.assertEqual(block.row_sizes.tolist(), [len(self.genesets[i]) for i in row_ids])
+
+    def test_scores_match_set_operations(self):
+        self.assertMatchesSets(list(self.genesets))
+        self.assertMatchesSets([3, 1, 3], [12, 2])
+
+    def test_products_are_expanded_in_chunks(self):
+        with patch("api.similarity.PAIR_CHUNK_SIZE", 7):
+            self.assertMatchesSets(list(self.genesets))
+
+    def test_added_replaced_and_removed_rows(self):
+        self.index.block([1])
+        self.genesets[1] = {"Hs.1", "Hs.new"}
+        self.index.add(1, self.genesets[1])
+        self.index.remove(2)
+        self.assertEqual(len(self.index), 11)
+        self.assertMatchesSets([1, 3, 4])
+        with self.assertRaises(MissingGenesets) as raised:
+            self.index.block([2, 1, 99])
+        self.assertEqual(raised.exception.gene_weaver_ids, [2, 99])
+
+        # Replacing most rows compacts the matrix instead of growing it further
+        for gene_weaver_id in range(3, 13):
+            self.index.add(gene_weaver_id, self.genesets[gene_weaver_id])
+        self.assertMatchesSets([1, 3, 12])
+        self.assertEqual(self.index._rows, 11)
+        self.assertEqual(self.index._indptr[-1], sum(len(self.genesets[i]) for i in self.genesets if i != 2))
+
+    def test_only_requested_metrics_are_computed(self):
+        block = self.index.block([1, 2], metrics=["dice"])
+        self.assertEqual(list(block.scores), ["dice"])
+        self.assertTrue(np.array_equal(block.scores["dice"], block.scores["dice"].T))
+
+
+class TestSimilarityCrud(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+        crud.create_geneset(self.db, schemas.GeneSetCreate(
+            geneweaver_id=65243, entrez=22943, ensembl_gene='ENSG00000107984', unigene=['Hs.1', 'Hs.2', 'Hs.3'],
+        ))
+        similarity_index.invalidate()
+
+    def tearDown(self):
+        self.db.close()
+        similarity_index.invalidate()
+
+    def block(self, gene_weaver_ids):
+        crud.load_similarity_index(self.db)
+        return crud.compute_similarity_block(gene_weaver_ids)
+
+    def test_matrix_follows_create_update_and_delete(self):
+        crud.bulk_create_genesets(self.db, [schemas.GeneSetCreate(
+            geneweaver_id=65469, entrez=5268, ensembl_gene='ENSG00000206075', unigene=['Hs.2', 'Hs.3', 'Hs.4', 'Hs.5'],
+        )])
+        block = self.block([65243, 65469, 65243])
+        self.assertEqual(block.intersections.tolist(), [[3, 2], [2, 4]])
+        self.assertAlmostEqual(block.scores["jaccard"][0, 1], 2 / 5)
+        self.assertAlmostEqual(block.scores["overlap"][0, 1], 2 / 3)
+
+        crud.create_geneset(self.db, schemas.GeneSetCreate(
+            geneweaver_id=70000, entrez=1, ensembl_gene='ENSG1', unigene=['Hs.5'],
+        ))
+        self.assertEqual(self.block([70000, 65469]).intersections.tolist(), [[1, 1], [1, 4]])
+
+        crud.delete_geneset(self.db, 65469)
+        with self.assertRaises(HTTPException) as raised:
+            self.block([65243, 65469])
+        self.assertEqual(raised.exception.status_code, 404)
+
+    def test_missing_identifier_placeholder_is_not_a_gene(self):
+        crud.bulk_create_genesets(self.db, [
+            schemas.GeneSetCreate(geneweaver_id=66775, entrez=1, ensembl_gene='ENSG1', unigene=['-']),
+            schemas.GeneSetCreate(geneweaver_id=69976, entrez=2, ensembl_gene='ENSG2', unigene=['-']),
+        ])
+        crud.create_geneset(self.db, schemas.GeneSetCreate(
+            geneweaver_id=87425, entrez=3, ensembl_gene='ENSG3', unigene=['-', 'Hs.1', ''],
+        ))
+        block = self.block([66775, 69976, 87425])
+        self.assertEqual(block.intersections.tolist(), [[0, 0, 0], [0, 0, 0], [0, 0, 1]])
+        self.assertEqual(block.scores["jaccard"][0, 1], 0)
+        self.assertEqual(crud.get_geneset_unigenes(self.db, 87425), {'Hs.1'})
+        self.assertEqual(self.db.query(models.Gene).filter_by(identifier='-').count(), 0)
+
+    def test_genesets_written_during_a_build_are_indexed(self):
+        crud.create_geneset(self.db, schemas.GeneSetCreate(
+            geneweaver_id=65469, entrez=5268, ensembl_gene='ENSG00000206075', unigene=['Hs.2', 'Hs.3', 'Hs.4'],
+        ))
+        read = similarity_index._read
+
+        # Write genesets after the build has read the database, but before it is installed
+        def read_then_write(db):
+            rows = read(db)
+            crud.create_geneset(self.db, schemas.GeneSetCreate(
+                geneweaver_id=70000, entrez=1, ensembl_gene='ENSG1', unigene=['Hs.3', 'Hs.4'],
+            ))
+            crud.delete_geneset(self.db, 65469)
+            return rows
+
+        with patch.object(similarity_index, '_read', side_effect=read_then_write):
+            similarity_index.ensure_loaded(self.db)
+        self.assertEqual(crud.compute_similarity_block([65243, 70000]).intersections.tolist(), [[3, 1], [1, 2]])
+        with self.assertRaises(HTTPException):
+            crud.compute_similarity_block([65469])
+
+    def test_build_invalidated_while_reading_is_redone(self):
+        read = similarity_index._read
+        reads = []
+
+        def read_then_invalidate(db):
+            reads.append(db)
+            rows = read(db)
+            if len(reads) == 1:
+                similarity_index.invalidate()
+            return rows
+
+        with patch.object(similarity_index, '_read', side_effect=read_then_invalidate):
+            similarity_index.ensure_loaded(self.db)
+        self.assertEqual(len(reads), 2)
+        self.assertTrue(similarity_index.loaded)
+        self.assertEqual(len(similarity_index), 1)
+
+    def test_requests_are_checked(self):
+        with self.assertRaises(ValueError):
+            crud.check_similarity_request([1, 2], ["cosine"])
+        with patch("api.crud.SIMILARITY_MAX_GENESETS", 2):
+            with self.assertRaises(ValueError):
+                crud.check_similarity_request([1, 2, 3], ["jaccard"])
+            crud.check_similarity_request([1, 2, 2], ["jaccard"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+# test_writer.py
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from api.backends import configure_sqlite
+from api.database import Base
+from api import async_crud, crud, models
+from api.writer import WriteQueue
+
+
+class TestWriteQueue(unittest.TestCase):
+
+    def setUp(self):
+        # The writer has its own connection, so the database lives in a file
+        self.tmp = tempfile.TemporaryDirectory()
+        self.url = f"sqlite:///{os.path.join(self.tmp.name, 'writes.db')}"
+        self.engine = create_engine(self.url, connect_args={"check_same_thread": False})
+        configure_sqlite(self.engine)
+        Base.metadata.create_all(self.engine)
+        self.writer_engine = create_engine(self.url, connect_args={"check_same_thread": False}, pool_size=1, max_overflow=0)
+        configure_sqlite(self.writer_engine, immediate=True)
+        self.write_queue = WriteQueue(
+            sessionmaker(autoflush=False, expire_on_commit=False, bind=self.writer_engine), batch_size=100
+        )
+        self.SessionLocal = sessionmaker(autoflush=False, bind=self.engine, info={"write_queue": self.write_queue})
+
+    def tearDown(self):
+        self.write_queue.shutdown()
+        self.engine.dispose()
+        self.writer_engine.dispose()
+        self.tmp.cleanup()
+
+    def count_runs(self):
+        with self.SessionLocal() as db:
+            return db.query(models.AnalysisRun).count()
+
+    # Holds the writer inside a write until the returned event is set, so that the writes
+    # submitted meanwhile are committed as one batch
+    def block_writer(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def wait(session):
+            started.set()
+            release.wait(timeout=30)
+        self.write_queue.submit(wait)
+        started.wait(timeout=30)
+        return release
+
+    def add_run(self, session):
+        run = models.AnalysisRun()
+        session.add(run)
+        session.flush()
+        return run.id
+
+    def test_queued_writes_are_committed_together(self):
+        release = self.block_writer()
+        futures = [self.write_queue.submit(self.add_run) for _ in range(30)]
+        release.set()
+
+        self.assertEqual(sorted(future.result(timeout=30) for future in futures), list(range(1, 31)))
+        self.assertEqual(self.count_runs(), 30)
+        stats = self.write_queue.stats()
+        self.assertEqual((stats["writes"], stats["commits"], stats["largest_batch"]), (31, 2, 30))
+
+    def test_failing_write_is_rolled_back_alone(self):
+        def fail(session):
+            self.add_run(session)
+            raise ValueError("rejected")
+
+        release = self.block_writer()
+        first = self.write_queue.submit(self.add_run)
+        failing = self.write_queue.submit(fail)
+        last = self.write_queue.submit(self.add_run)
+        release.set()
+
+        self.assertEqual((first.result(timeout=30), last.result(timeout=30)), (1, 2))
+        with self.assertRaises(ValueError):
+            failing.result(timeout=30)
+        self.assertEqual(self.count_runs(), 2)
+        self.assertEqual(self.write_queue.stats()["failed"], 1)
+
+    def test_crud_writes_go_through_the_session_write_queue(self):
+        with self.SessionLocal() as db:
+            run = crud.create_analysis_run(db)
+            crud.update_run_status_and_time(db, run.id, models.RunStatus.RUNNING, start_time=True)
+            self.assertIsNone(run.result)
+            self.assertEqual(crud.get_runstatus(db, run.id), "running")
+        self.assertEqual(self.write_queue.stats()["writes"], 2)
+
+    def test_concurrent_writers_and_readers_do_not_hit_lock_errors(self):
+        errors = []
+
+        def writer():
+            try:
+                with self.SessionLocal() as db:
+                    for _ in range(25):
+                        run = crud.create_analysis_run(db)
+                        crud.update_run_status_and_time(db, run.id, models.RunStatus.COMPLETED, end_time=True)
+            except Exception as e:
+                errors.append(e)
+
+        def reader(stop):
+            try:
+                with self.SessionLocal() as db:
+                    while not stop.wait(0.005):
+                        db.query(models.AnalysisRun).count()
+            except Exception as e:
+                errors.append(e)
+
+        stop = threading.Event()
+        readers = [threading.Thread(target=reader, args=(stop,)) for _ in range(4)]
+        writers = [threading.Thread(target=writer) for _ in range(16)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        stop.set()
+        for thread in readers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with self.SessionLocal() as db:
+            statuses = [status for status, in db.query(models.AnalysisRun.status)]
+        self.assertEqual(statuses, [models.RunStatus.COMPLETED] * 400)
+        stats = self.write_queue.stats()
+        self.assertEqual(stats["writes"], 800)
+        self.assertLess(stats["commits"], stats["writes"])
+
+    def test_async_sessions_await_their_writes(self):
+        engine = create_async_engine(self.url.replace("sqlite://", "sqlite+aiosqlite://", 1))
+        SessionLocal = async_sessionmaker(engine, expire_on_commit=False, info={"write_queue": self.write_queue})
+
+        async def create_run():
+            async with SessionLocal() as db:
+                return await async_crud.create_analysis_run(db)
+
+        async def main():
+            try:
+                return await asyncio.gather(*(create_run() for _ in range(20)))
+            finally:
+                await engine.dispose()
+
+        runs = asyncio.run(main())
+        self.assertEqual(sorted(run.id for run in runs), list(range(1, 21)))
+        self.assertEqual(self.count_runs(), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()